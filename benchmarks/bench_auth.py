@@ -0,0 +1,86 @@
+"""Microbenchmark for webhook signature verification.
+
+Compares the precomputed keyed-HMAC ``copy()`` used by
+:class:`webhook_bluefly.auth.SignatureVerifier` with building a fresh
+``hmac.new`` per request, and measures thread-pool offload for large bodies.
+
+Run from the repository root::
+
+    python benchmarks/bench_auth.py
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hmac
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from webhook_bluefly.auth import SignatureVerifier  # noqa: E402
+
+SECRET = b"whsec_benchmark_secret_0123456789"
+SIZES = (512, 4 * 1024, 64 * 1024, 1024 * 1024)
+
+
+def _per_op_us(stmt, number: int) -> float:
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def bench_sync() -> list[str]:
+    verifier = SignatureVerifier({"seller": SECRET}, offload_threshold=1 << 62)
+    lines = [f"{'body':>10} {'fresh hmac.new':>16} {'keyed copy':>12} {'speedup':>8}"]
+    for size in SIZES:
+        body = os.urandom(size)
+        signature = verifier.sign("seller", body)
+        number = max(10, 2_000_000 // (size + 512))
+
+        def fresh() -> bool:
+            expected = bytes.fromhex(signature[7:])
+            return hmac.compare_digest(hmac.new(SECRET, body, "sha256").digest(), expected)
+
+        def keyed() -> bool:
+            return verifier.verify("seller", body, signature)
+
+        fresh_us = _per_op_us(fresh, number)
+        keyed_us = _per_op_us(keyed, number)
+        lines.append(
+            f"{size:>10} {fresh_us:>13.2f} us {keyed_us:>9.2f} us {fresh_us / keyed_us:>7.2f}x"
+        )
+    return lines
+
+
+async def _verify_many(verifier: SignatureVerifier, body: bytes, signature: str, n: int) -> float:
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(verifier.verify_async("seller", body, signature) for _ in range(n))
+    )
+    assert all(results)
+    return n / (time.perf_counter() - start)
+
+
+def bench_offload(size: int = 4 * 1024 * 1024, n: int = 64) -> list[str]:
+    body = os.urandom(size)
+    inline = SignatureVerifier({"seller": SECRET}, offload_threshold=1 << 62)
+    offloaded = SignatureVerifier({"seller": SECRET}, offload_threshold=0)
+    signature = inline.sign("seller", body)
+    inline_rate = asyncio.run(_verify_many(inline, body, signature, n))
+    offload_rate = asyncio.run(_verify_many(offloaded, body, signature, n))
+    return [
+        f"{size // 1024} KiB bodies: inline {inline_rate:.1f}/s, "
+        f"thread pool {offload_rate:.1f}/s ({os.cpu_count()} CPUs)"
+    ]
+
+
+def main() -> list[str]:
+    lines = ["== auth: signature verification =="]
+    lines += bench_sync()
+    lines += bench_offload()
+    return lines
+
+
+if __name__ == "__main__":
+    print("\n".join(main()))
@@ -0,0 +1,175 @@
+"""Cold-start benchmark: import time and time until a receiver is ready.
+
+Measures, in fresh interpreters, how long ``import webhook_bluefly`` and
+the command-line module take to import, and how long ``webhook-bluefly
+serve`` takes from process start until ``/healthz`` answers. The boot
+scenarios use a generated handler package whose import pulls in a set of
+heavyweight standard-library modules, standing in for a real application's
+dependencies:
+
+``--handler``
+    the handler module is imported before the receiver starts
+``--routes``, cold cache
+    routed handlers are imported on first use; the routes file is checked
+``--routes``, warm cache
+    as above, with the checked routes reused from the cache
+``--routes --preload``
+    routed handlers are imported before the receiver starts
+
+Run from the repository root::
+
+    python benchmarks/bench_startup.py
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+RUNS = 7
+BOOT_TIMEOUT = 30.0
+
+# Imports standing in for an application's dependencies.
+HANDLER_IMPORTS = (
+    "decimal",
+    "email.mime.multipart",
+    "http.cookiejar",
+    "sqlite3",
+    "tarfile",
+    "unittest",
+    "xml.dom.minidom",
+    "zipfile",
+)
+HANDLER_SOURCE = """\
+{imports}
+
+
+async def on_order(event):
+    return None
+
+
+async def on_other(event):
+    return None
+"""
+_LISTENING = re.compile(r"listening on [^:]+:(\d+)")
+
+
+def _env(path: str) -> dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.abspath(ROOT), path])
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def _median_ms(samples: list[float]) -> str:
+    return f"{statistics.median(samples) * 1e3:7.1f} ms"
+
+
+def bench_imports(env: dict[str, str]) -> list[str]:
+    lines = []
+    for module in ("webhook_bluefly", "webhook_bluefly.cli"):
+        code = (
+            "import time; started = time.perf_counter(); "
+            f"import {module}; print(time.perf_counter() - started)"
+        )
+        samples = []
+        for _ in range(RUNS):
+            result = subprocess.run(
+                [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True
+            )
+            samples.append(float(result.stdout))
+        lines.append(f"import {module:<22} {_median_ms(samples)}")
+    return lines
+
+
+def boot_seconds(args: list[str], env: dict[str, str]) -> float:
+    """Start ``serve`` with ``args`` and return the seconds until /healthz answers."""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "webhook_bluefly", "serve", "--port", "0", *args],
+        env=env,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert process.stderr is not None
+        for line in process.stderr:
+            match = _LISTENING.search(line)
+            if match:
+                port = int(match.group(1))
+                break
+            if time.perf_counter() - started > BOOT_TIMEOUT:
+                raise RuntimeError("receiver did not start")
+        else:
+            raise RuntimeError(f"receiver exited with status {process.wait()}")
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1):
+                    return time.perf_counter() - started
+            except OSError:
+                if time.perf_counter() - started > BOOT_TIMEOUT:
+                    raise
+                time.sleep(0.001)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_boot(directory: str, env: dict[str, str]) -> list[str]:
+    package = os.path.join(directory, "benchapp")
+    os.makedirs(package)
+    with open(os.path.join(package, "__init__.py"), "w"):
+        pass
+    imports = "\n".join(f"import {module}  # noqa: F401" for module in HANDLER_IMPORTS)
+    with open(os.path.join(package, "handlers.py"), "w") as out:
+        out.write(HANDLER_SOURCE.format(imports=imports))
+    routes = os.path.join(directory, "routes.json")
+    config = {
+        "routes": {"order.*": "benchapp.handlers:on_order"},
+        "default": "benchapp.handlers:on_other",
+    }
+    with open(routes, "w") as out:
+        json.dump(config, out)
+    cache = os.path.join(directory, "cache")
+    routed = ["--routes", routes, "--routes-cache", cache]
+    common = ["--log-level", "INFO"]
+
+    def cold() -> list[str]:
+        for name in os.listdir(cache) if os.path.isdir(cache) else ():
+            os.remove(os.path.join(cache, name))
+        return routed
+
+    scenarios = (
+        ("--handler", lambda: ["--handler", "benchapp.handlers:on_order"]),
+        ("--routes, cold cache", cold),
+        ("--routes, warm cache", lambda: routed),
+        ("--routes --preload", lambda: [*routed, "--preload"]),
+    )
+    # Compile bytecode once so every run measures a warm .pyc cache.
+    boot_seconds(["--handler", "benchapp.handlers:on_order", *common], env)
+    lines = []
+    for name, make_args in scenarios:
+        samples = [boot_seconds([*make_args(), *common], env) for _ in range(RUNS)]
+        lines.append(f"boot {name:<26} {_median_ms(samples)}")
+    return lines
+
+
+def main() -> list[str]:
+    lines = [f"== startup: median of {RUNS} cold starts =="]
+    with tempfile.TemporaryDirectory(prefix="bluefly-startup-") as directory:
+        env = _env(directory)
+        lines += bench_imports(env)
+        lines += bench_boot(directory, env)
+    return lines
+
+
+if __name__ == "__main__":
+    print("\n".join(main()))
@@ -0,0 +1,87 @@
+"""asyncio HTTP/1.1 load generator for the webhook receiver.
+
+Each connection keeps its socket alive and sends ``depth`` pipelined
+requests at a time, timing every request from write to the end of its
+response.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+
+@dataclass
+class LoadResult:
+    elapsed: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    errors: int = 0
+
+    @property
+    def count(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def throughput(self) -> float:
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head[9:12])
+    marker = head.find(b"Content-Length: ")
+    if marker >= 0:
+        length = int(head[marker + 16 : head.index(b"\r\n", marker)])
+        if length:
+            await reader.readexactly(length)
+    return status
+
+
+async def run_load(
+    host: str,
+    port: int,
+    requests: list[bytes],
+    *,
+    connections: int = 32,
+    depth: int = 1,
+    duration: float = 5.0,
+) -> LoadResult:
+    """Replay ``requests`` round-robin for ``duration`` seconds."""
+    result = LoadResult()
+    next_index = 0
+    deadline = 0.0
+
+    async def connection() -> None:
+        nonlocal next_index
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                batch = []
+                for _ in range(depth):
+                    batch.append(requests[next_index % len(requests)])
+                    next_index += 1
+                sent = time.perf_counter()
+                writer.write(b"".join(batch))
+                for _ in batch:
+                    status = await _read_response(reader)
+                    result.latencies.append(time.perf_counter() - sent)
+                    result.statuses[status] += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            result.errors += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(connection() for _ in range(connections)))
+    result.elapsed = time.perf_counter() - start
+    return result
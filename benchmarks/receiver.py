@@ -0,0 +1,173 @@
+"""Instrumented receiver process for the load benchmark.
+
+Starts a :class:`webhook_bluefly.WebhookServer` on an ephemeral port with the
+benchmark's seller secrets, prints ``READY <port>`` and serves until a line
+arrives on stdin. It then stops and prints one JSON object with the CPU time
+spent in each stage of the accept path:
+
+``verify``
+    signature checks
+``dedup``
+    duplicate lookups
+``persist``
+    framing appends on the event loop plus the write-ahead log thread's CPU
+    time (fsync waits are not CPU and are excluded)
+``dispatch``
+    partition routing, queueing and running the (no-op) handler
+``receive``
+    the rest of the event loop thread: socket I/O, HTTP parsing, envelope
+    decoding, writing acks and loop overhead
+
+Loop-side stages are timed with ``perf_counter`` around synchronous calls,
+which never yield, so they measure CPU on the loop thread.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from webhook_bluefly import (  # noqa: E402
+    DedupStore,
+    ServerConfig,
+    SignatureVerifier,
+    WebhookServer,
+    WriteAheadLog,
+)
+
+STAGES = ("receive", "verify", "dedup", "persist", "dispatch")
+
+
+class StageClock:
+    def __init__(self) -> None:
+        self.seconds: dict[str, float] = defaultdict(float)
+
+    def wrap(self, stage: str, func):
+        seconds = self.seconds
+        clock = time.perf_counter
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds[stage] += clock() - start
+
+        return timed
+
+    def wrap_async(self, stage: str, func):
+        seconds = self.seconds
+        clock = time.perf_counter
+
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                seconds[stage] += clock() - start
+
+        return timed
+
+    def wrap_thread(self, stage: str, func):
+        seconds = self.seconds
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds[stage] += time.thread_time() - start
+
+        return timed
+
+
+async def _noop_handler(event) -> None:
+    return None
+
+
+async def serve(args: argparse.Namespace) -> dict:
+    secrets = json.loads(args.secrets) if args.secrets else {}
+    clock = StageClock()
+    verifier = SignatureVerifier(secrets) if secrets else None
+    dedup = DedupStore(max_entries=args.dedup_entries) if args.dedup else None
+    wal = None
+    if args.wal:
+        wal = WriteAheadLog(args.wal, fsync=not args.no_fsync)
+    config = ServerConfig(
+        host="127.0.0.1", port=0, mode=args.mode, workers=args.workers, queue_size=100_000
+    )
+    server = WebhookServer(_noop_handler, config, verifier=verifier, dedup=dedup, wal=wal)
+    pipeline = server.pipeline
+    if verifier is not None:
+        verifier.verify = clock.wrap("verify", verifier.verify)
+    if dedup is not None:
+        dedup.check_and_add = clock.wrap("dedup", dedup.check_and_add)
+    if wal is not None:
+        wal.append = clock.wrap("persist_loop", wal.append)
+        wal._write_sync = clock.wrap_thread("persist_thread", wal._write_sync)
+    dispatcher = pipeline.dispatcher
+    dispatcher.submit = clock.wrap("dispatch", dispatcher.submit)
+    dispatcher.handler = clock.wrap_async("dispatch", dispatcher.handler)
+
+    await server.start()
+    print(f"READY {server.port}", flush=True)
+    loop = asyncio.get_running_loop()
+    loop_cpu = time.thread_time()
+    wall = time.perf_counter()
+    await loop.run_in_executor(None, sys.stdin.readline)
+    loop_cpu = time.thread_time() - loop_cpu
+    wall = time.perf_counter() - wall
+    await server.stop()
+
+    seconds = dict(clock.seconds)
+    persist_loop = seconds.pop("persist_loop", 0.0)
+    seconds["persist"] = persist_loop + seconds.pop("persist_thread", 0.0)
+    loop_stages = persist_loop + sum(seconds.get(s, 0.0) for s in ("verify", "dedup", "dispatch"))
+    seconds["receive"] = max(0.0, loop_cpu - loop_stages)
+    stats = pipeline.stats
+    return {
+        "wall": wall,
+        "loop_cpu": loop_cpu,
+        "stages": {stage: seconds.get(stage, 0.0) for stage in STAGES},
+        "accepted": stats.accepted,
+        "duplicates": stats.duplicates,
+        "unauthorized": stats.unauthorized,
+        "overloaded": stats.overloaded,
+        "handled": stats.handled,
+        "commits": wal.commits if wal is not None else 0,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", default="fast")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--secrets", help="JSON object of seller id to secret")
+    parser.add_argument("--dedup", action="store_true")
+    parser.add_argument("--dedup-entries", type=int, default=1_000_000)
+    parser.add_argument("--wal", nargs="?", const="", default=None, help="WAL directory")
+    parser.add_argument("--no-fsync", action="store_true")
+    args = parser.parse_args(argv)
+    if args.wal == "":
+        with tempfile.TemporaryDirectory(prefix="bluefly-bench-") as directory:
+            args.wal = directory
+            report = asyncio.run(serve(args))
+    else:
+        report = asyncio.run(serve(args))
+    print(json.dumps(report), flush=True)
+
+
+if __name__ == "__main__":
+    main()
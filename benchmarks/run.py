@@ -0,0 +1,174 @@
+"""End-to-end receiver benchmark.
+
+Replays synthetic Bluefly traffic (see :mod:`traffic`) against a receiver
+started in a child process (see :mod:`receiver`) and reports, per scenario,
+throughput, p50/p99/p99.9 ack latency and CPU time per delivery in each
+stage of the accept path. The signature microbenchmark from
+:mod:`bench_auth` and the cold-start benchmark from :mod:`bench_startup` are
+appended. Results are printed and written to
+``bench_output.txt`` in the repository root.
+
+Run from the repository root::
+
+    python benchmarks/run.py
+    python benchmarks/run.py --duration 10 --connections 64 --depth 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import bench_auth  # noqa: E402
+import bench_startup  # noqa: E402
+from loadgen import LoadResult, run_load  # noqa: E402
+from receiver import STAGES  # noqa: E402
+from traffic import TrafficGenerator  # noqa: E402
+
+
+@dataclass
+class Scenario:
+    name: str
+    mode: str
+    verify: bool = False
+    dedup: bool = False
+    wal: bool = False
+    fsync: bool = True
+
+    def receiver_args(self, secrets: dict[str, str], workers: int) -> list[str]:
+        args = ["--mode", self.mode, "--workers", str(workers)]
+        if self.verify:
+            args += ["--secrets", json.dumps(secrets)]
+        if self.dedup:
+            args.append("--dedup")
+        if self.wal:
+            args.append("--wal")
+            if not self.fsync:
+                args.append("--no-fsync")
+        return args
+
+
+SCENARIOS = (
+    Scenario("stream, bare", "stream"),
+    Scenario("fast, bare", "fast"),
+    Scenario("fast, verify+dedup", "fast", verify=True, dedup=True),
+    Scenario("fast, verify+dedup+wal", "fast", verify=True, dedup=True, wal=True),
+    Scenario("stream, verify+dedup+wal", "stream", verify=True, dedup=True, wal=True),
+)
+
+
+async def run_scenario(
+    scenario: Scenario, generator: TrafficGenerator, requests: list[bytes], args
+) -> tuple[LoadResult, dict]:
+    receiver = await asyncio.create_subprocess_exec(
+        sys.executable,
+        os.path.join(HERE, "receiver.py"),
+        *scenario.receiver_args(generator.secrets, args.workers),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    assert receiver.stdin is not None and receiver.stdout is not None
+    try:
+        ready = (await receiver.stdout.readline()).decode().split()
+        if not ready or ready[0] != "READY":
+            raise RuntimeError(f"receiver failed to start for {scenario.name!r}")
+        result = await run_load(
+            "127.0.0.1",
+            int(ready[1]),
+            requests,
+            connections=args.connections,
+            depth=args.depth,
+            duration=args.duration,
+        )
+        receiver.stdin.write(b"stop\n")
+        await receiver.stdin.drain()
+        report = json.loads(await receiver.stdout.readline())
+    finally:
+        if receiver.returncode is None:
+            receiver.stdin.close()
+            await receiver.wait()
+    return result, report
+
+
+def format_scenario(scenario: Scenario, result: LoadResult, report: dict) -> list[str]:
+    statuses = ", ".join(f"{status}: {n}" for status, n in sorted(result.statuses.items()))
+    lines = [
+        f"-- {scenario.name} --",
+        f"deliveries   {result.count} in {result.elapsed:.2f}s = {result.throughput:,.0f}/s"
+        f" ({statuses}; {result.errors} connection errors)",
+        "ack latency  p50 {:.2f} ms, p99 {:.2f} ms, p99.9 {:.2f} ms".format(
+            result.percentile(50) * 1e3,
+            result.percentile(99) * 1e3,
+            result.percentile(99.9) * 1e3,
+        ),
+    ]
+    per_delivery = max(1, result.count)
+    stages = report["stages"]
+    lines.append(
+        "cpu/delivery "
+        + ", ".join(f"{stage} {stages[stage] / per_delivery * 1e6:.1f} us" for stage in STAGES)
+    )
+    if report["commits"]:
+        lines.append(
+            f"wal          {report['commits']} group commits,"
+            f" {report['accepted'] / report['commits']:.1f} events per fsync"
+        )
+    return lines
+
+
+async def run_all(args) -> list[str]:
+    generator = TrafficGenerator(seed=args.seed, duplicate_rate=args.duplicate_rate)
+    requests = generator.requests(args.requests)
+    size = sum(len(request) for request in requests) / len(requests)
+    lines = [
+        "== receiver: synthetic Bluefly traffic ==",
+        f"{time.strftime('%Y-%m-%d %H:%M:%S')}, Python {sys.version.split()[0]},"
+        f" {os.cpu_count()} CPUs",
+        f"{args.connections} connections x depth {args.depth}, {args.duration:.0f}s per scenario,"
+        f" {args.workers} workers, {len(requests)} distinct requests averaging {size:.0f} bytes,"
+        f" {args.duplicate_rate:.0%} redeliveries",
+    ]
+    for scenario in SCENARIOS:
+        if args.only and args.only not in scenario.name:
+            continue
+        result, report = await run_scenario(scenario, generator, requests, args)
+        lines += format_scenario(scenario, result, report)
+    return lines
+
+
+def main(argv: list[str] | None = None) -> list[str]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--depth", type=int, default=1, help="pipelined requests per connection")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="run scenarios whose name contains this")
+    parser.add_argument("--skip-auth", action="store_true")
+    parser.add_argument("--skip-startup", action="store_true")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench_output.txt"))
+    args = parser.parse_args(argv)
+
+    lines = asyncio.run(run_all(args))
+    if not args.skip_auth:
+        lines += [""] + bench_auth.main()
+    if not args.skip_startup:
+        lines += [""] + bench_startup.main()
+    with open(args.output, "w") as out:
+        out.write("\n".join(lines) + "\n")
+    return lines
+
+
+if __name__ == "__main__":
+    print("\n".join(main()))
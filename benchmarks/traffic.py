@@ -0,0 +1,180 @@
+"""Synthetic Bluefly webhook traffic.
+
+Generates signed HTTP requests carrying realistic order, inventory and
+product payloads: orders move through their lifecycle, inventory updates
+cluster on a hot set of SKUs, product events carry attribute and image
+arrays, and a configurable share of deliveries are redeliveries of earlier
+event ids.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import uuid
+from dataclasses import dataclass, field
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from webhook_bluefly.auth import SignatureVerifier  # noqa: E402
+
+ORDER_LIFECYCLE = ("created", "acknowledged", "shipped")
+WAREHOUSES = ("NJ-01", "CA-02", "TX-03")
+CDN = "https://cdn.bluefly.example"
+
+
+@dataclass
+class TrafficMix:
+    order: float = 0.3
+    inventory: float = 0.6
+    product: float = 0.1
+
+
+@dataclass
+class TrafficGenerator:
+    sellers: int = 20
+    skus: int = 5_000
+    duplicate_rate: float = 0.05
+    mix: TrafficMix = field(default_factory=TrafficMix)
+    path: str = "/webhooks/bluefly"
+    seed: int = 1
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+        self.secrets = {
+            f"seller-{i:03d}": f"whsec_{i:03d}_{self.seed}" for i in range(self.sellers)
+        }
+        self.verifier = SignatureVerifier(self.secrets)
+        self._seller_ids = list(self.secrets)
+        self._open_orders: list[tuple[str, str, int]] = []
+        self._recent: list[bytes] = []
+        self._event_counter = 0
+
+    def requests(self, count: int) -> list[bytes]:
+        """Pre-render ``count`` complete HTTP requests."""
+        return [self.next_request() for _ in range(count)]
+
+    def next_request(self) -> bytes:
+        rng = self._rng
+        if self._recent and rng.random() < self.duplicate_rate:
+            return rng.choice(self._recent)
+        roll = rng.random()
+        if roll < self.mix.order:
+            seller_id, event_type, data = self._order()
+        elif roll < self.mix.order + self.mix.inventory:
+            seller_id, event_type, data = self._inventory()
+        else:
+            seller_id, event_type, data = self._product()
+        self._event_counter += 1
+        event_id = f"evt_{self.seed}_{self._event_counter:010d}"
+        body = json.dumps(
+            {
+                "id": event_id,
+                "type": event_type,
+                "seller_id": seller_id,
+                "occurred_at": "2026-10-18T12:00:00Z",
+                "data": data,
+            },
+            separators=(",", ":"),
+        ).encode()
+        request = self._render(event_id, event_type, seller_id, body)
+        if len(self._recent) < 1000:
+            self._recent.append(request)
+        else:
+            self._recent[rng.randrange(1000)] = request
+        return request
+
+    def _render(self, event_id: str, event_type: str, seller_id: str, body: bytes) -> bytes:
+        head = (
+            f"POST {self.path} HTTP/1.1\r\n"
+            "Host: receiver\r\n"
+            "User-Agent: Bluefly-Webhooks/2.0\r\n"
+            "Content-Type: application/json\r\n"
+            f"X-Bluefly-Event-Id: {event_id}\r\n"
+            f"X-Bluefly-Event-Type: {event_type}\r\n"
+            f"X-Bluefly-Seller-Id: {seller_id}\r\n"
+            f"X-Bluefly-Signature: {self.verifier.sign(seller_id, body)}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        )
+        return head.encode() + body
+
+    def _sku(self) -> str:
+        # A hot 5% of SKUs receives half of the updates.
+        rng = self._rng
+        if rng.random() < 0.5:
+            return f"SKU-{rng.randrange(max(1, self.skus // 20)):06d}"
+        return f"SKU-{rng.randrange(self.skus):06d}"
+
+    def _order(self) -> tuple[str, str, dict]:
+        rng = self._rng
+        if self._open_orders and rng.random() < 0.6:
+            i = rng.randrange(len(self._open_orders))
+            seller_id, order_id, stage = self._open_orders[i]
+            stage += 1
+            if stage + 1 >= len(ORDER_LIFECYCLE):
+                self._open_orders[i] = self._open_orders[-1]
+                self._open_orders.pop()
+            else:
+                self._open_orders[i] = (seller_id, order_id, stage)
+            return seller_id, f"order.{ORDER_LIFECYCLE[stage]}", {
+                "order_id": order_id,
+                "status": ORDER_LIFECYCLE[stage],
+                "sequence": stage,
+                "tracking_number": f"1Z{rng.randrange(10**12):012d}" if stage == 2 else None,
+            }
+        seller_id = rng.choice(self._seller_ids)
+        order_id = f"BF-{uuid.UUID(int=rng.getrandbits(128)).hex[:12].upper()}"
+        if len(self._open_orders) < 10_000:
+            self._open_orders.append((seller_id, order_id, 0))
+        lines = [
+            {
+                "sku": self._sku(),
+                "quantity": rng.randint(1, 3),
+                "unit_price": round(rng.uniform(20, 900), 2),
+                "currency": "USD",
+            }
+            for _ in range(rng.randint(1, 4))
+        ]
+        return seller_id, "order.created", {
+            "order_id": order_id,
+            "status": "created",
+            "sequence": 0,
+            "lines": lines,
+            "shipping_address": {
+                "name": "Jordan Example",
+                "line1": f"{rng.randint(1, 999)} Madison Ave",
+                "city": "New York",
+                "region": "NY",
+                "postal_code": f"{rng.randint(10001, 10299)}",
+                "country": "US",
+            },
+            "total": round(sum(line["unit_price"] * line["quantity"] for line in lines), 2),
+        }
+
+    def _inventory(self) -> tuple[str, str, dict]:
+        rng = self._rng
+        return rng.choice(self._seller_ids), "inventory.updated", {
+            "sku": self._sku(),
+            "quantity": rng.randint(0, 250),
+            "warehouse": rng.choice(WAREHOUSES),
+            "price": round(rng.uniform(20, 900), 2),
+            "version": self._event_counter,
+        }
+
+    def _product(self) -> tuple[str, str, dict]:
+        rng = self._rng
+        sku = self._sku()
+        return rng.choice(self._seller_ids), "product.updated", {
+            "sku": sku,
+            "product_id": f"P-{sku[4:]}",
+            "title": f"Designer item {sku}",
+            "brand": rng.choice(("Acme", "Maison", "Nord", "Vela")),
+            "description": "Lorem ipsum dolor sit amet. " * rng.randint(5, 40),
+            "attributes": {f"attr_{i}": f"value_{rng.randrange(100)}" for i in range(30)},
+            "images": [
+                {"url": f"{CDN}/{sku}/{i}.jpg", "width": 1200, "height": 1600}
+                for i in range(rng.randint(3, 12))
+            ],
+        }
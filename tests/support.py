@@ -0,0 +1,115 @@
+"""Helpers shared by the tests."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any
+
+from webhook_bluefly import BlueflyClient
+from webhook_bluefly.client import LocalTransport
+from webhook_bluefly.httputil import parse_head
+
+
+def make_delivery(
+    event_id: str = "evt_1",
+    event_type: str = "order.created",
+    seller_id: str = "seller-1",
+    data: dict[str, Any] | None = None,
+    **extra: Any,
+) -> tuple[dict[str, str], bytes]:
+    """Headers and body of a delivery as Bluefly would send it."""
+    envelope = {
+        "id": event_id,
+        "type": event_type,
+        "seller_id": seller_id,
+        "occurred_at": "2024-05-01T12:00:00Z",
+        "data": data if data is not None else {"order_id": "o-1"},
+        **extra,
+    }
+    headers = {
+        "x-bluefly-event-id": event_id,
+        "x-bluefly-event-type": event_type,
+        "x-bluefly-seller-id": seller_id,
+    }
+    return headers, json.dumps(envelope).encode()
+
+
+def encode_request(
+    method: str, path: str, headers: dict[str, str] | None = None, body: bytes = b""
+) -> bytes:
+    lines = [f"{method} {path} HTTP/1.1", "Host: test"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    if body or method == "POST":
+        lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple[int, dict[str, str], bytes]:
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) != b"\r\n":
+        name, _, value = line.decode().partition(":")
+        headers[name.lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", "0")))
+    return status, headers, body
+
+
+class StubAPI:
+    """A local server answering each request with ``respond(request)``.
+
+    ``respond`` may be a coroutine function and returns the raw response, or
+    a list of parts written with short pauses in between. A None part, or a
+    None response, closes the connection.
+    """
+
+    def __init__(self, respond) -> None:
+        self.respond = respond
+        self.requests: list[tuple[str, str, dict[str, str], bytes]] = []
+        self.connections = 0
+        self.open = 0
+        self.peak = 0
+        self._server: asyncio.AbstractServer | None = None
+
+    async def __aenter__(self) -> StubAPI:
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    def client(self, **kwargs) -> BlueflyClient:
+        return BlueflyClient(transport=LocalTransport(self.port), **kwargs)
+
+    async def _serve(self, reader, writer) -> None:
+        self.connections += 1
+        self.open += 1
+        self.peak = max(self.peak, self.open)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                method, target, _, headers = parse_head(head[:-4])
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                request = (method, target, headers, body)
+                self.requests.append(request)
+                response = self.respond(request)
+                if asyncio.iscoroutine(response):
+                    response = await response
+                for part in response if isinstance(response, list) else [response]:
+                    if part is None:
+                        return
+                    writer.write(part)
+                    await writer.drain()
+                    await asyncio.sleep(0.01)
+        finally:
+            self.open -= 1
+            writer.close()
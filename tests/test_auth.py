@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+
+from webhook_bluefly import DedupStore, Pipeline, SignatureVerifier
+
+from .support import make_delivery
+
+BODY = b'{"id": "evt_1", "data": {"order_id": "o-1"}}'
+
+
+def reference(secret: bytes, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+def test_signatures_match_a_plain_hmac():
+    verifier = SignatureVerifier({"seller-1": "secret", "seller-2": b"other"})
+    assert verifier.sign("seller-1", BODY) == reference(b"secret", BODY)
+    assert verifier.verify("seller-1", BODY, reference(b"secret", BODY))
+    assert verifier.verify("seller-2", BODY, reference(b"other", BODY))
+    # The keyed object is copied, so verifying twice gives the same answer.
+    assert verifier.verify("seller-1", BODY, reference(b"secret", BODY))
+
+
+@pytest.mark.parametrize(
+    "signature",
+    [
+        None,
+        "",
+        "sha1=" + "0" * 40,
+        "sha256=",
+        "sha256=zz",
+        "sha256=" + "0" * 62,
+        "sha256=" + "0" * 64,
+        reference(b"secret", BODY)[:-2],
+        reference(b"secret", BODY + b" "),
+        reference(b"wrong", BODY),
+    ],
+)
+def test_bad_signatures_are_refused(signature):
+    verifier = SignatureVerifier({"seller-1": "secret"})
+    assert not verifier.verify("seller-1", BODY, signature)
+
+
+def test_unknown_sellers_and_rotation():
+    verifier = SignatureVerifier({"seller-1": "secret"})
+    signature = reference(b"secret", BODY)
+    assert not verifier.verify("seller-9", BODY, signature)
+    assert "seller-1" in verifier and "seller-9" not in verifier
+    verifier.set_secret("seller-1", "rotated")
+    assert not verifier.verify("seller-1", BODY, signature)
+    assert verifier.verify("seller-1", BODY, reference(b"rotated", BODY))
+    verifier.remove_secret("seller-1")
+    verifier.remove_secret("seller-1")
+    assert "seller-1" not in verifier
+    assert verifier.begin("seller-1") is None
+
+
+def test_streamed_bodies_verify_in_chunks():
+    verifier = SignatureVerifier({"seller-1": "secret"})
+    mac = verifier.begin("seller-1")
+    for i in range(0, len(BODY), 7):
+        mac.update(BODY[i : i + 7])
+    assert verifier.verify_digest(mac, reference(b"secret", BODY))
+    assert not verifier.verify_digest(verifier.begin("seller-1"), reference(b"secret", BODY))
+    assert not verifier.verify_digest(mac, "sha256=abcd")
+    assert not verifier.verify_digest(mac, None)
+
+
+async def test_large_bodies_are_hashed_off_the_event_loop():
+    verifier = SignatureVerifier({"seller-1": "secret"}, offload_threshold=1024)
+    small, large = b"x" * 1023, b"x" * 4096
+    assert not verifier.needs_offload(small)
+    assert verifier.needs_offload(large)
+    assert await verifier.verify_async("seller-1", small, reference(b"secret", small))
+    assert await verifier.verify_async("seller-1", large, reference(b"secret", large))
+    assert not await verifier.verify_async("seller-1", large, reference(b"secret", small))
+
+
+@pytest.mark.parametrize("threshold", [1 << 20, 0])
+async def test_pipeline_acks_only_signed_deliveries(threshold):
+    handled = []
+
+    async def handler(event):
+        handled.append(event.event_id)
+
+    verifier = SignatureVerifier({"seller-1": "secret"}, offload_threshold=threshold)
+    pipeline = Pipeline(handler, verifier=verifier)
+    await pipeline.start()
+
+    async def accept(headers, body):
+        status = pipeline.accept(headers, body)
+        return status if isinstance(status, int) else await status
+
+    headers, body = make_delivery("evt_ok")
+    headers["x-bluefly-signature"] = verifier.sign("seller-1", body)
+    assert await accept(headers, body) == 202
+    headers, body = make_delivery("evt_forged")
+    headers["x-bluefly-signature"] = reference(b"guess", body)
+    assert await accept(headers, body) == 401
+    headers, body = make_delivery("evt_unsigned")
+    assert await accept(headers, body) == 401
+    headers, body = make_delivery("evt_stranger", seller_id="seller-9")
+    headers["x-bluefly-signature"] = reference(b"secret", body)
+    assert await accept(headers, body) == 401
+    await asyncio.sleep(0)
+    await pipeline.stop()
+    assert handled == ["evt_ok"]
+    assert pipeline.stats.unauthorized == 3
+
+
+@pytest.mark.parametrize("threshold", [1 << 20, 0])
+async def test_pipeline_refuses_signed_bodies_under_other_headers(threshold):
+    handled = []
+
+    async def handler(event):
+        handled.append(event.event_id)
+
+    verifier = SignatureVerifier({"seller-1": "secret"}, offload_threshold=threshold)
+    pipeline = Pipeline(handler, verifier=verifier, dedup=DedupStore())
+    await pipeline.start()
+
+    async def accept(headers, body):
+        status = pipeline.accept(headers, body)
+        return status if isinstance(status, int) else await status
+
+    headers, body = make_delivery("evt_1")
+    headers["x-bluefly-signature"] = verifier.sign("seller-1", body)
+    assert await accept(headers, body) == 202
+    # A replay of the signed body must not pass as a new event or another type.
+    for name, value in (
+        ("x-bluefly-event-id", "evt_2"),
+        ("x-bluefly-event-type", "order.cancelled"),
+    ):
+        assert await accept({**headers, name: value}, body) == 400
+    assert await accept(headers, body) == 200
+    await asyncio.sleep(0)
+    await pipeline.stop()
+    assert handled == ["evt_1"]
+    assert pipeline.stats.rejected == 2
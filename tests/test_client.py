@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from webhook_bluefly import BlueflyClient
+from webhook_bluefly.client import LocalTransport
+from webhook_bluefly.errors import APIError, ClientError
+from webhook_bluefly.httputil import encode_response
+
+from .support import StubAPI
+
+
+def ok(request):
+    return encode_response(200, b'{"ok": true}', content_type="application/json")
+
+
+async def test_connections_are_reused_and_requests_are_well_formed():
+    async with StubAPI(ok) as api:
+        async with api.client(token="tok") as client:
+            assert await client.acknowledge_order("BF 1/2") == {"ok": True}
+            assert await client.get_order("BF-2") == {"ok": True}
+            await client.confirm_shipment("BF-2", "1Z", carrier="UPS")
+            [stats] = client.stats().values()
+            assert (stats.opened, stats.reused, stats.in_use, stats.idle) == (1, 2, 0, 1)
+        assert stats.closed == 1
+        with pytest.raises(ClientError, match="closed"):
+            await client.get_order("BF-3")
+    assert api.connections == 1
+    (method, target, headers, body), _, shipment = api.requests
+    assert (method, target, body) == ("POST", "/v1/orders/BF%201%2F2/acknowledge", b"")
+    assert headers["authorization"] == "Bearer tok"
+    assert headers["content-length"] == "0"
+    assert headers["host"] == "api.bluefly.example"
+    assert shipment[2]["content-type"] == "application/json"
+    assert json.loads(shipment[3]) == {"tracking_number": "1Z", "carrier": "UPS"}
+
+
+async def test_response_framing():
+    responses = {
+        "/chunked": [
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5;ext=1\r\nhello\r\n",
+            b"6\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n",
+        ],
+        "/head": b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n",
+        "/empty": b"HTTP/1.1 204 No Content\r\n\r\n",
+        # The body ends where the connection does.
+        "/close": [b"HTTP/1.1 200 OK\r\n\r\nfirst ", b"second ", b"third", None],
+    }
+    async with StubAPI(lambda request: responses[request[1]]) as api:
+        client = api.client()
+        response = await client.request("GET", "/chunked")
+        assert (response.status, response.body) == (200, b"hello world")
+        response = await client.request("HEAD", "/head")
+        assert response.body == b""
+        response = await client.request("GET", "/empty")
+        assert (response.status, response.body, response.json()) == (204, b"", None)
+        # Regression: a close-delimited body was cut off at the first read.
+        response = await client.request("GET", "/close")
+        assert response.body == b"first second third"
+        [stats] = client.stats().values()
+        assert (stats.opened, stats.closed, stats.idle) == (1, 1, 0)
+        await client.close()
+
+
+@pytest.mark.parametrize(
+    "response, message",
+    [
+        (b"HTTP/2 200 OK\r\n\r\n", "malformed status line"),
+        (b"HTTP/1.1 OK\r\n\r\n", "malformed status line"),
+        (b"HTTP/1.1 \xb2\xb2\xb2 OK\r\n\r\n", "malformed status line"),
+        (b"HTTP/1.1 200 OK\r\nbad header\r\n\r\n", "malformed header"),
+        (b"HTTP/1.1 200 OK\r\nContent-Length: x\r\n\r\n", "content-length"),
+        (b"HTTP/1.1 200 OK\r\nContent-Length: \xb2\r\n\r\n", "content-length"),
+        (b"HTTP/1.1 200 OK\r\nContent-Length: 101\r\n\r\n", "too large"),
+        (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n", "chunk size"),
+        (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n65\r\n", "too large"),
+        ([b"HTTP/1.1 200 OK\r\n\r\n" + b"x" * 101, None], "too large"),
+        ([b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nabc", None], "failed"),
+        ([None], "failed"),
+    ],
+)
+async def test_bad_responses_raise_client_errors(response, message):
+    async with StubAPI(lambda request: response) as api:
+        client = api.client(max_response_size=100)
+        with pytest.raises(ClientError, match=message):
+            await client.request("POST", "/v1/orders")
+        await client.close()
+
+
+async def test_stale_pooled_connections_are_retried_only_when_idempotent():
+    served = 0
+
+    def respond(request):
+        nonlocal served
+        served += 1
+        # Answer, then drop the connection without saying so.
+        return [encode_response(200, b"{}"), None]
+
+    async with StubAPI(respond) as api:
+        client = api.client()
+        await client.request("GET", "/v1/orders/1")
+        await asyncio.sleep(0.05)
+        # A connection already at EOF is noticed when it is checked out.
+        await client.request("GET", "/v1/orders/1")
+        [stats] = client.stats().values()
+        assert (stats.opened, stats.reused) == (2, 0)
+
+        # One whose close has not been seen yet fails on use.
+        pool = next(iter(client._pools.values()))
+        await asyncio.sleep(0.05)
+        pool.idle[-1].reader.at_eof = lambda: False
+        assert (await client.request("PUT", "/v1/orders/1")).status == 200
+        assert (stats.opened, stats.reused, served) == (3, 1, 3)
+        await asyncio.sleep(0.05)
+        pool.idle[-1].reader.at_eof = lambda: False
+        with pytest.raises(ClientError, match="failed"):
+            await client.request("POST", "/v1/orders/1/acknowledge")
+        await client.close()
+    assert served == 3
+
+
+async def test_idle_connections_expire():
+    async with StubAPI(ok) as api:
+        client = api.client(idle_timeout=0.0)
+        await client.request("GET", "/a")
+        await client.request("GET", "/b")
+        await client.close()
+    assert api.connections == 2
+
+
+async def test_connections_per_host_are_limited():
+    async def slow(request):
+        await asyncio.sleep(0.02)
+        return ok(request)
+
+    async with StubAPI(slow) as api:
+        client = api.client(max_connections_per_host=2)
+        results = await asyncio.gather(*(client.get_order(f"BF-{i}") for i in range(8)))
+        await client.close()
+    assert results == [{"ok": True}] * 8
+    assert api.peak == 2
+    with pytest.raises(ValueError):
+        BlueflyClient(max_concurrency=0)
+
+
+async def test_timeouts_and_errors():
+    async def hang(request):
+        await asyncio.sleep(5)
+
+    async with StubAPI(hang) as api:
+        client = api.client(timeout=0.05)
+        with pytest.raises(ClientError, match="timed out"):
+            await client.request("GET", "/slow")
+        await client.close()
+
+    def not_found(request):
+        return encode_response(404, b'{"error": "no order"}')
+
+    async with StubAPI(not_found) as api:
+        client = api.client()
+        with pytest.raises(APIError) as info:
+            await client.get_order("BF-9")
+        assert (info.value.status, info.value.body) == (404, b'{"error": "no order"}')
+        with pytest.raises(ClientError, match="unsupported URL"):
+            await client.request("GET", "ftp://example.com/file")
+        await client.close()
+
+    client = BlueflyClient(transport=LocalTransport(1))
+    with pytest.raises(ClientError, match="could not connect"):
+        await client.request("GET", "/")
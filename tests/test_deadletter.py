@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from webhook_bluefly import DeadLetterStore, Pipeline, RetryPolicy
+from webhook_bluefly.deadletter import FILE_MAGIC
+from webhook_bluefly.events import decode_event
+from webhook_bluefly.fileutil import MappedFile, write_all
+from webhook_bluefly.wal import WALError
+
+from .support import make_delivery
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def event(event_id: str, event_type: str = "order.created", seller_id: str = "seller-1"):
+    headers, body = make_delivery(event_id, event_type, seller_id)
+    return decode_event(headers, body, 1.0)
+
+
+def fill(store: DeadLetterStore, clock: FakeClock) -> None:
+    for i, (event_type, seller, error) in enumerate(
+        [
+            ("order.created", "seller-1", TimeoutError("slow")),
+            ("order.shipped", "seller-1", TimeoutError("slow")),
+            ("order.created", "seller-2", ValueError("bad")),
+            ("inventory.updated", "seller-2", TimeoutError("slow")),
+        ]
+    ):
+        clock.now = 1000.0 + i * 10
+        store.add(event(f"evt_{i}", event_type, seller), error)
+
+
+def ids(letters) -> list[str]:
+    return [letter.event_id for letter in letters]
+
+
+def test_select_by_index_time_and_glob():
+    clock = FakeClock()
+    store = DeadLetterStore(clock=clock)
+    fill(store, clock)
+    assert ids(store) == ["evt_0", "evt_1", "evt_2", "evt_3"]
+    assert ids(store.select(event_type="order.*")) == ["evt_0", "evt_1", "evt_2"]
+    assert ids(store.select(event_type="order.*", error="TimeoutError")) == ["evt_0", "evt_1"]
+    assert ids(store.select(seller_id="seller-2", error="TimeoutError")) == ["evt_3"]
+    assert ids(store.select(since=1010.0, until=1030.0)) == ["evt_1", "evt_2"]
+    assert ids(store.select(error="TimeoutError", limit=2)) == ["evt_0", "evt_1"]
+    assert store.select(event_type="refund.*") == []
+    assert store.counts("error") == {"TimeoutError": 3, "ValueError": 1}
+    with pytest.raises(ValueError):
+        store.counts("message")
+
+
+def test_remove_updates_the_indexes():
+    clock = FakeClock()
+    store = DeadLetterStore(clock=clock)
+    fill(store, clock)
+    letter = store.select(seller_id="seller-2", error="ValueError")[0]
+    store.remove(letter)
+    store.remove(letter)  # already gone
+    assert letter not in store
+    assert store.counts("error") == {"TimeoutError": 3}
+    assert ids(store.select(event_type="order.created")) == ["evt_0"]
+    assert store.total == 4
+    assert len(store) == 3
+
+
+def test_letters_survive_a_reopen(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / "dead.log"
+    store = DeadLetterStore(path, clock=clock)
+    fill(store, clock)
+    store.remove(store.get(2))
+    store.close()
+
+    store = DeadLetterStore(path, clock=clock)
+    assert ids(store) == ["evt_0", "evt_2", "evt_3"]
+    letter = store.select(event_type="inventory.*")[0]
+    assert (letter.error, letter.message, letter.dead_at) == ("TimeoutError", "slow", 1030.0)
+    loaded = store.load(letter)
+    assert loaded.event_id == "evt_3"
+    assert loaded.body == event("evt_3", "inventory.updated", "seller-2").body
+    # Ids keep counting up after a reopen.
+    assert store.add(event("evt_4"), RuntimeError()).id == 5
+    store.close()
+    with pytest.raises(WALError):
+        store.load(letter)
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / "dead.log"
+    store = DeadLetterStore(path, clock=clock)
+    fill(store, clock)
+    store.close()
+    size = path.stat().st_size
+    with open(path, "ab") as f:
+        f.write(b"\x05\x00\x00")
+    store = DeadLetterStore(path, clock=clock)
+    assert len(store) == 4
+    assert path.stat().st_size == size
+    store.close()
+
+
+def test_file_is_compacted_when_mostly_removed(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / "dead.log"
+    store = DeadLetterStore(path, clock=clock)
+    for i in range(10):
+        store.add(event(f"evt_{i}"), TimeoutError())
+    for letter in store.select()[:8]:
+        store.remove(letter)
+    store.close()
+    size = path.stat().st_size
+
+    store = DeadLetterStore(path, clock=clock)
+    assert path.stat().st_size < size / 3
+    assert [store.load(letter).event_id for letter in store] == ["evt_8", "evt_9"]
+    store.close()
+    assert ids(DeadLetterStore(path)) == ["evt_8", "evt_9"]
+
+
+def test_corruption_is_detected(tmp_path):
+    path = tmp_path / "dead.log"
+    path.write_bytes(b"not a dead-letter file")
+    with pytest.raises(WALError):
+        DeadLetterStore(path)
+
+    path.unlink()
+    store = DeadLetterStore(path)
+    letter = store.add(event("evt_1"), TimeoutError())
+    with open(path, "r+b") as f:
+        f.seek(-5, os.SEEK_END)
+        f.write(b"XXXXX")
+    with pytest.raises(WALError, match="corrupt"):
+        store.load(letter)
+    store.close()
+
+
+def test_file_helpers(tmp_path, monkeypatch):
+    empty = tmp_path / "empty"
+    empty.write_bytes(b"")
+    with MappedFile(empty) as data:
+        assert data == b""
+    full = tmp_path / "full"
+    full.write_bytes(FILE_MAGIC)
+    with MappedFile(full) as data:
+        assert data[:] == FILE_MAGIC
+
+    real_write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: real_write(fd, bytes(data[:3])))
+    fd = os.open(tmp_path / "out", os.O_WRONLY | os.O_CREAT)
+    try:
+        write_all(fd, b"0123456789")
+    finally:
+        os.close(fd)
+    assert (tmp_path / "out").read_bytes() == b"0123456789"
+
+
+async def wait_for(predicate) -> None:
+    while not predicate():
+        await asyncio.sleep(0.005)
+
+
+async def test_redrive_resubmits_at_the_given_rate():
+    healthy = False
+    handled = []
+
+    async def handler(event):
+        if not healthy:
+            raise ConnectionError("dependency down")
+        handled.append(event.event_id)
+
+    store = DeadLetterStore()
+    pipeline = Pipeline(handler, retry_policy=RetryPolicy(max_attempts=1), dead_letters=store)
+    await pipeline.start()
+    for i in range(20):
+        assert pipeline.accept(*make_delivery(f"evt_{i}")) == 202
+    await wait_for(lambda: len(store) == 20)
+    assert store.counts("error") == {"ConnectionError": 20}
+
+    healthy = True
+    started = time.monotonic()
+    stats = await pipeline.redrive(store.select(limit=10), rate=100.0)
+    assert time.monotonic() - started >= 0.05
+    assert (stats.submitted, stats.succeeded, stats.failed) == (10, 10, 0)
+    assert sorted(handled) == sorted(f"evt_{i}" for i in range(10))
+    assert len(store) == 10
+    await pipeline.stop()
+    assert pipeline.stats.redriven == 10
+
+
+@pytest.mark.parametrize("drain", [True, False])
+async def test_stopping_the_pipeline_ends_a_redrive(drain):
+    # Regression: redrive waited for a free slot with no regard for stop().
+    healthy = False
+    release = asyncio.Event()
+
+    async def handler(event):
+        if not healthy:
+            raise ConnectionError("dependency down")
+        await release.wait()
+
+    store = DeadLetterStore()
+    pipeline = Pipeline(handler, retry_policy=RetryPolicy(max_attempts=1), dead_letters=store)
+    await pipeline.start()
+    for i in range(5):
+        assert pipeline.accept(*make_delivery(f"evt_{i}")) == 202
+    await wait_for(lambda: len(store) == 5)
+
+    healthy = True
+    redrive = asyncio.create_task(pipeline.redrive(max_in_flight=1))
+    await wait_for(lambda: pipeline.stats.redriven == 1)
+    stopping = asyncio.create_task(pipeline.stop(drain=drain))
+    await asyncio.sleep(0.01)
+    release.set()
+    stats = await asyncio.wait_for(redrive, 5)
+    await asyncio.wait_for(stopping, 5)
+    assert stats.submitted == 1
+    assert len(store) == 5 - stats.succeeded
+
+
+async def test_redriven_events_that_fail_again_are_dead_lettered_anew():
+    async def handler(event):
+        raise ConnectionError("still down")
+
+    store = DeadLetterStore()
+    pipeline = Pipeline(handler, retry_policy=RetryPolicy(max_attempts=1), dead_letters=store)
+    with pytest.raises(RuntimeError):
+        await pipeline.redrive()
+    await pipeline.start()
+    pipeline.accept(*make_delivery("evt_1"))
+    await wait_for(lambda: len(store) == 1)
+    first = store.select()[0]
+    stats = await pipeline.redrive()
+    assert (stats.submitted, stats.failed) == (1, 1)
+    assert first not in store
+    assert ids(store) == ["evt_1"]
+    assert store.select()[0].id != first.id
+    await pipeline.stop()
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import fcntl
+import os
+import threading
+
+import pytest
+
+from webhook_bluefly import dedup
+from webhook_bluefly.dedup import BloomFilter, DedupStore, SharedDedupStore
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [f"evt_{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other_{i}" in bloom for i in range(10_000))
+    assert false_positives < 300
+    bloom.clear()
+    assert "evt_1" not in bloom
+
+
+def test_detects_redeliveries():
+    store = DedupStore(100, ttl=60)
+    assert not store.check_and_add("evt_1")
+    assert store.check_and_add("evt_1")
+    assert not store.check_and_add("evt_2")
+    assert store.stats.hits == 1
+    assert store.stats.misses == 2
+    assert len(store) == 2
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    store = DedupStore(100, ttl=60, clock=clock)
+    store.check_and_add("evt_1")
+    clock.now += 59
+    assert "evt_1" in store
+    clock.now += 2
+    assert "evt_1" not in store
+    assert not store.check_and_add("evt_1")
+    assert store.stats.expirations == 1
+
+
+def test_least_recently_seen_id_is_evicted():
+    store = DedupStore(3, ttl=60)
+    for event_id in ("a", "b", "c"):
+        store.check_and_add(event_id)
+    assert store.check_and_add("a")
+    store.check_and_add("d")
+    assert "b" not in store
+    assert "a" in store
+    assert store.stats.evictions == 1
+
+
+def test_ids_survive_bloom_rotation_while_in_the_set():
+    store = DedupStore(100, ttl=60)
+    store.check_and_add("keep")
+    for i in range(1000):
+        store.check_and_add(f"evt_{i}")
+        if i % 50 == 0:
+            assert store.check_and_add("keep")
+    assert "keep" in store
+
+
+def test_discarded_ids_do_not_age_out_live_bloom_bits():
+    # Regression: discards shrank the set without uncounting the insertion,
+    # so the Bloom generations rotated away the bits of ids still in the set.
+    store = DedupStore(100, ttl=60)
+    store.check_and_add("A")
+    for i in range(300):
+        store.check_and_add(f"overloaded_{i}")
+        store.discard(f"overloaded_{i}")
+    assert "A" in store
+    assert store.check_and_add("A")
+
+
+def test_discard_lets_a_redelivery_through():
+    store = DedupStore(100, ttl=60)
+    store.check_and_add("evt_1")
+    store.discard("evt_1")
+    store.discard("never_seen")
+    assert not store.check_and_add("evt_1")
+
+
+def test_preload_does_not_count_misses():
+    store = DedupStore(100, ttl=60)
+    assert store.preload(["a", "b", "a"]) == 2
+    assert store.stats.misses == 0
+    assert store.check_and_add("b")
+
+
+def test_for_memory_budget():
+    store = DedupStore.for_memory_budget(10 * 1024 * 1024)
+    assert 10_000 < store.max_entries
+    assert store.memory_estimate <= 10 * 1024 * 1024
+
+
+def test_clear():
+    store = DedupStore(10)
+    store.check_and_add("a")
+    store.clear()
+    assert len(store) == 0
+    assert not store.check_and_add("a")
+
+
+def test_rejects_zero_capacity():
+    with pytest.raises(ValueError):
+        DedupStore(0)
+
+
+def test_shared_store_detects_redeliveries_and_expires():
+    clock = FakeClock()
+    store = SharedDedupStore(1000, ttl=60, clock=clock)
+    assert not store.check_and_add("evt_1")
+    assert store.check_and_add("evt_1")
+    assert "evt_1" in store and "evt_2" not in store
+    assert (store.stats.hits, store.stats.misses) == (1, 1)
+    clock.now += 61
+    assert "evt_1" not in store
+    assert not store.check_and_add("evt_1")
+    assert store.stats.expirations == 1
+    store.discard("evt_1")
+    assert not store.check_and_add("evt_1")
+    assert store.preload(["evt_1", "evt_2"]) == 1
+    store.clear()
+    assert len(store) == 0
+
+
+def test_shared_store_evicts_when_a_bucket_is_full():
+    store = SharedDedupStore(16, ttl=60, clock=FakeClock())
+    for i in range(200):
+        store.check_and_add(f"evt_{i}")
+    assert len(store) <= store.slots
+    assert store.stats.evictions >= 200 - store.slots
+
+
+def fork(child) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child()
+        finally:
+            os._exit(1)  # child() exits with its own status unless it raised
+    return pid
+
+
+def exit_status(pid: int) -> int:
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+def test_shared_store_is_shared_with_forked_workers():
+    store = SharedDedupStore(1000, ttl=60)
+    store.check_and_add("evt_parent")
+
+    def child():
+        seen = store.check_and_add("evt_parent") and not store.check_and_add("evt_child")
+        # Stats are per process: the parent's miss is not counted here.
+        os._exit(0 if seen and store.stats.misses == 1 else 2)
+
+    assert exit_status(fork(child)) == 0
+    assert "evt_child" in store
+    assert store.stats.misses == 1
+
+
+def test_stripe_lock_excludes_other_processes_until_released_or_dead():
+    # Regression: the stripe owner was recorded after taking the lock, so a
+    # worker killed in between left the stripe locked for good.
+    store = SharedDedupStore(1000, ttl=60, stripes=4)
+    ready_r, ready_w = os.pipe()
+    go_r, go_w = os.pipe()
+
+    def child():
+        store._acquire(2)
+        os.write(ready_w, b"x")
+        os.read(go_r, 1)
+        os._exit(0)  # dies holding the stripe
+
+    pid = fork(child)
+    try:
+        assert os.read(ready_r, 1) == b"x"
+        with pytest.raises(OSError):
+            fcntl.lockf(store._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, 2)
+    finally:
+        os.write(go_w, b"x")
+        status = exit_status(pid)
+        for fd in (ready_r, ready_w, go_r, go_w):
+            os.close(fd)
+    assert status == 0
+
+    clearing = threading.Thread(target=store.clear, daemon=True)
+    clearing.start()
+    clearing.join(5)
+    assert not clearing.is_alive()
+
+
+def test_threads_wait_only_for_their_own_stripe():
+    store = SharedDedupStore(1000, ttl=60, stripes=4)
+
+    def run(stripe):
+        thread = threading.Thread(
+            target=lambda: (store._acquire(stripe), store._release(stripe)), daemon=True
+        )
+        thread.start()
+        thread.join(0.2)
+        return thread
+
+    store._acquire(1)
+    try:
+        waiting = run(1)
+        assert waiting.is_alive()
+        assert not run(2).is_alive()
+    finally:
+        store._release(1)
+    waiting.join(5)
+    assert not waiting.is_alive()
+
+
+def test_stores_share_one_fork_hook(monkeypatch):
+    registered = []
+    monkeypatch.setattr(os, "register_at_fork", lambda **hooks: registered.append(hooks))
+    stores = [SharedDedupStore(100) for _ in range(3)]
+    assert registered == []
+    assert all(store in dedup._stores for store in stores)
+    stores[0].stats.misses = 5
+    dedup._after_fork_in_child()
+    assert stores[0].stats.misses == 0
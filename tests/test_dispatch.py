@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from webhook_bluefly import Dispatcher
+from webhook_bluefly.dispatch import partition_key
+from webhook_bluefly.events import decode_event
+
+from .support import make_delivery
+
+_counter = 0
+
+
+async def _noop(event):
+    pass
+
+
+def event(event_type: str = "order.created", **data):
+    global _counter
+    _counter += 1
+    headers, body = make_delivery(f"evt_{_counter}", event_type, data=data)
+    return decode_event(headers, body, 0.0)
+
+
+def test_partition_key_by_topic():
+    assert partition_key(event(order_id="o-1")) == "o-1"
+    assert partition_key(event("inventory.updated", sku="SKU-9")) == "SKU-9"
+    assert partition_key(event("product.updated", product_id=42)) == "42"
+    assert partition_key(event("product.updated", sku="S", product_id=42)) == "S"
+    # No key field: every event stands alone.
+    missing = event(note="x")
+    assert partition_key(missing) == missing.event_id
+    other = event("refund.created", order_id="o-1")
+    assert partition_key(other) == other.event_id
+
+
+async def test_events_for_one_key_run_in_order_and_keys_run_in_parallel():
+    running = 0
+    peak = 0
+    seen: dict[str, list[int]] = {}
+
+    async def handler(event):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        fields = event.data_fields(("order_id", "n"))
+        seen.setdefault(fields["order_id"], []).append(fields["n"])
+        running -= 1
+
+    dispatcher = Dispatcher(handler, workers=4)
+    await dispatcher.start()
+    for n in range(20):
+        for order in range(8):
+            await dispatcher.put(event(order_id=f"o-{order}", n=n))
+    await dispatcher.stop()
+    assert all(ns == list(range(20)) for ns in seen.values())
+    assert len(seen) == 8
+    assert peak > 1
+
+
+async def test_topics_get_their_own_workers():
+    dispatcher = Dispatcher(_noop, workers={"order": 3, "inventory": 2})
+    assert dispatcher.workers == {"order": 3, "inventory": 2, "*": 1}
+    await dispatcher.start()
+    order, inventory = event(order_id="o-1"), event("inventory.updated", sku="A")
+    refund = event("refund.created")
+    assert dispatcher.route(order) in dispatcher._groups["order"].queues
+    assert dispatcher.route(inventory) in dispatcher._groups["inventory"].queues
+    assert dispatcher.route(refund) is dispatcher._default.queues[0]
+    for e in (order, inventory, refund):
+        dispatcher.submit(e)
+    await dispatcher.join()
+    stats = dispatcher.stats()
+    assert [len(stats[name]) for name in ("order", "inventory", "*")] == [3, 2, 1]
+    assert sum(p.dispatched for group in stats.values() for p in group) == 3
+    await dispatcher.stop()
+    assert not dispatcher.running
+
+
+async def test_full_partitions_refuse_submissions():
+    release = asyncio.Event()
+
+    async def handler(event):
+        await release.wait()
+
+    dispatcher = Dispatcher(handler, queue_size=2)
+    with pytest.raises(RuntimeError):
+        dispatcher.route(event())
+    await dispatcher.start()
+    await dispatcher.start()  # already running
+    accepted = [dispatcher.submit(event()) for _ in range(5)]
+    await asyncio.sleep(0)
+    accepted.append(dispatcher.submit(event()))
+    # One event is being handled, two wait, the rest are refused.
+    assert accepted.count(True) == 3
+    release.set()
+    await dispatcher.stop()
+
+
+async def test_handler_errors_do_not_stop_the_worker():
+    handled = []
+
+    async def handler(event):
+        if event.data_fields(("n",))["n"] == 1:
+            raise ValueError("bad")
+        handled.append(event.event_id)
+
+    dispatcher = Dispatcher(handler)
+    await dispatcher.start()
+    events = [event(n=n) for n in range(3)]
+    for e in events:
+        dispatcher.submit(e)
+    await dispatcher.stop()
+    assert handled == [events[0].event_id, events[2].event_id]
+
+
+async def test_stop_without_draining_drops_queued_events():
+    handled = []
+
+    async def handler(event):
+        await asyncio.sleep(0.01)
+        handled.append(event)
+
+    dispatcher = Dispatcher(handler)
+    await dispatcher.start()
+    for _ in range(5):
+        dispatcher.submit(event())
+    await asyncio.sleep(0)
+    await dispatcher.stop(drain=False)
+    assert handled == []
+
+
+def test_worker_counts_must_be_positive():
+    dispatcher = Dispatcher(_noop, workers={"order": 0})
+    with pytest.raises(ValueError):
+        asyncio.run(dispatcher.start())
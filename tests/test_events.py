@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from webhook_bluefly.errors import EnvelopeError
+from webhook_bluefly.events import (
+    MAX_FIELD_BYTES,
+    SCAN_THRESHOLD,
+    WebhookEvent,
+    decode_event,
+    scan_json,
+)
+
+from .support import make_delivery
+
+PADDING = {"description": "x" * SCAN_THRESHOLD}
+
+
+def large(payload: dict) -> bytes:
+    body = json.dumps(payload).encode()
+    assert len(body) >= SCAN_THRESHOLD
+    return body
+
+
+@pytest.mark.parametrize("pad", [False, True])
+def test_scan_picks_wanted_members(pad):
+    payload = {
+        "id": "evt_1",
+        "note": "a \"quoted\" } brace",
+        "data": {"items": [1, {"sku": "nested"}], "sku": "A-1", "qty": 3},
+        "type": "order.created",
+    }
+    if pad:
+        payload = {**payload, **PADDING}
+    body = json.dumps(payload, indent=2).encode()
+    wanted = {"id": None, "type": None, "data": {"sku": None, "missing": None}, "absent": None}
+    assert scan_json(body, wanted) == {
+        "id": "evt_1",
+        "type": "order.created",
+        "data": {"sku": "A-1"},
+    }
+    assert scan_json(body.decode(), {"data": None})["data"]["qty"] == 3
+
+
+def test_scan_stops_after_the_last_wanted_member():
+    # Everything after the wanted members is never read, so it may be malformed.
+    body = b'{"id": "evt_1", "type": "t", "data": ' + b"[1, 2" * SCAN_THRESHOLD
+    assert scan_json(body, {"id": None, "type": None}) == {"id": "evt_1", "type": "t"}
+    with pytest.raises(ValueError):
+        scan_json(body, {"id": None, "data": None})
+
+
+@pytest.mark.parametrize("depth", [100, 100_000])
+def test_deep_nesting_is_malformed_not_a_crash(depth):
+    # Regression: the JSON scanner's RecursionError escaped decode_event.
+    body = b'{"data": ' + b"[" * depth + b"]" * depth + b', "id": "evt_1"}'
+    if depth > 1000:
+        with pytest.raises(ValueError, match="too deeply"):
+            scan_json(body, {"id": None})
+        with pytest.raises(EnvelopeError):
+            decode_event({}, body, 0.0)
+    else:
+        assert scan_json(body, {"id": None}) == {"id": "evt_1"}
+
+
+def test_scan_reads_escaped_member_names_and_first_occurrence():
+    body = large({"\\u0069d": 1, **PADDING}).replace(b'"\\\\u0069d"', b'"\\u0069d"')
+    assert scan_json(body, {"id": None}) == {"id": 1}
+    body = b'{"id": 1, ' + large(PADDING)[1:-1] + b', "id": 2}'
+    assert scan_json(body, {"id": None}) == {"id": 1}
+
+
+def test_nested_scan_skips_to_the_end_of_an_object():
+    body = large({"data": {"a": 1, "b": {"c": [2]}}, "id": "evt_1", **PADDING})
+    assert scan_json(body, {"data": {"a": None}, "id": None}) == {
+        "data": {"a": 1},
+        "id": "evt_1",
+    }
+    # A wanted object that is not an object is returned as is.
+    body = large({"data": [1], **PADDING})
+    assert scan_json(body, {"data": {"a": None}}) == {"data": [1]}
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"[" + b"1," * SCAN_THRESHOLD + b"1]",
+        b'{"id" 1' + b" " * SCAN_THRESHOLD,
+        b'{"id": 1 "type": 2' + b" " * SCAN_THRESHOLD,
+        b'{"id": nope' + b" " * SCAN_THRESHOLD,
+        b"{id: 1}" + b" " * SCAN_THRESHOLD,
+        b"[1]",
+    ],
+)
+def test_scan_rejects_malformed_json(body):
+    with pytest.raises(ValueError):
+        scan_json(body, {"id": None, "type": None})
+
+
+def test_decode_prefers_headers_and_falls_back_to_the_envelope():
+    headers, body = make_delivery("evt_1", "order.created", "seller-1")
+    event = decode_event(headers, body, 3.0)
+    assert (event.event_id, event.event_type, event.seller_id) == (
+        "evt_1",
+        "order.created",
+        "seller-1",
+    )
+    assert decode_event({}, body, 3.0) == event
+    with pytest.raises(EnvelopeError):
+        decode_event({}, b"not json", 0.0)
+    with pytest.raises(EnvelopeError, match="'type'"):
+        decode_event({"x-bluefly-event-id": "evt_1"}, b'{"seller_id": "s"}', 0.0)
+    with pytest.raises(EnvelopeError, match="'id'"):
+        decode_event({}, b'{"id": 5, "type": "t", "seller_id": "s"}', 0.0)
+
+
+@pytest.mark.parametrize("field", ["event_id", "event_type", "seller_id"])
+def test_overlong_fields_are_refused(field):
+    headers, body = make_delivery(**{field: "é" * (MAX_FIELD_BYTES // 2 + 1)})
+    with pytest.raises(EnvelopeError, match="too long"):
+        decode_event(headers, body, 0.0)
+    headers, body = make_delivery(**{field: "é" * (MAX_FIELD_BYTES // 2)})
+    assert decode_event(headers, body, 0.0).to_record()
+
+
+def test_payload_is_decoded_once_on_demand():
+    headers, body = make_delivery(data={"order_id": "o-7"})
+    event = decode_event(headers, body, 0.0)
+    assert event.data_fields(("order_id", "missing")) == {"order_id": "o-7"}
+    assert event.payload(cache=False) is not event.payload(cache=False)
+    payload = event.payload()
+    assert event.payload() is payload
+    assert event.data() == {"order_id": "o-7"}
+    assert event.fields({"id": None}) == {"id": "evt_1"}
+
+
+def test_record_round_trip():
+    headers, body = make_delivery("evt_é", "order.created", "seller-☃")
+    event = decode_event(headers, body, 1234.5)
+    restored = WebhookEvent.from_record(memoryview(event.to_record()), seq=9)
+    assert restored.seq == 9
+    restored.seq = 0
+    assert restored == event
+
+
+def test_check_envelope_compares_headers_with_the_body():
+    headers, body = make_delivery("evt_1")
+    decode_event(headers, body, 0.0).check_envelope()
+    for name in ("x-bluefly-event-id", "x-bluefly-event-type", "x-bluefly-seller-id"):
+        event = decode_event({**headers, name: "forged"}, body, 0.0)
+        with pytest.raises(EnvelopeError):
+            event.check_envelope()
+    event = decode_event(headers, b'{"data": {}}', 0.0)
+    with pytest.raises(EnvelopeError):
+        event.check_envelope()
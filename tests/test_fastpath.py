@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+
+from webhook_bluefly import ServerConfig, SignatureVerifier, WebhookServer
+from webhook_bluefly.fastpath import RESPONSES
+
+from .support import encode_request, make_delivery, read_response
+
+WEBHOOK = "/webhooks/bluefly"
+
+
+async def _ignore(event):
+    pass
+
+
+def fast(**kwargs) -> ServerConfig:
+    return ServerConfig(port=0, mode="fast", **kwargs)
+
+
+async def test_requests_split_byte_by_byte():
+    async with WebhookServer(_ignore, fast()) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        data = encode_request("POST", WEBHOOK, *make_delivery("evt_1"))
+        for i in range(len(data)):
+            writer.write(data[i : i + 1])
+            await writer.drain()
+        assert (await read_response(reader))[0] == 202
+        writer.close()
+    assert server.pipeline.stats.accepted == 1
+
+
+async def test_deferred_responses_keep_pipelined_order():
+    # A large body is verified in the executor, so its status is deferred
+    # while the responses behind it are ready at once.
+    verifier = SignatureVerifier({"seller-1": "secret"}, offload_threshold=4096)
+    headers, big = make_delivery("evt_big", data={"order_id": "o-1", "note": "x" * 8192})
+    headers["x-bluefly-signature"] = verifier.sign("seller-1", big)
+    unsigned = make_delivery("evt_small")
+    async with WebhookServer(_ignore, fast(), verifier=verifier) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(
+            encode_request("POST", WEBHOOK, headers, big)
+            + encode_request("POST", WEBHOOK, *unsigned)
+            + encode_request("GET", "/healthz")
+            + encode_request("POST", WEBHOOK, headers, big.replace(b"evt_big", b"evt_bad"))
+        )
+        statuses = [(await read_response(reader))[0] for _ in range(4)]
+        writer.close()
+    assert statuses == [202, 401, 200, 401]
+
+
+async def test_failed_deferred_acceptance_answers_500():
+    async def broken():
+        raise RuntimeError("boom")
+
+    async with WebhookServer(_ignore, fast()) as server:
+        server.pipeline.accept = lambda headers, body: broken()
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(
+            encode_request("POST", WEBHOOK, *make_delivery()) + encode_request("GET", "/healthz")
+        )
+        assert (await read_response(reader))[0] == 500
+        assert (await read_response(reader))[0] == 200
+        writer.close()
+
+
+async def test_connection_close_stops_reading_pipelined_requests():
+    async with WebhookServer(_ignore, fast()) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        headers, body = make_delivery("evt_1")
+        writer.write(
+            encode_request("POST", WEBHOOK, {**headers, "Connection": "close"}, body)
+            + encode_request("POST", WEBHOOK, *make_delivery("evt_2"))
+        )
+        status, response_headers, _ = await read_response(reader)
+        assert (status, response_headers["connection"]) == (202, "close")
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        writer.close()
+    assert server.pipeline.stats.accepted == 1
+
+
+async def test_http_10_closes_unless_asked_to_keep_alive():
+    async with WebhookServer(_ignore, fast()) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"GET /healthz HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+        assert (await read_response(reader))[1]["connection"] == "keep-alive"
+        writer.write(b"GET /healthz HTTP/1.0\r\n\r\n")
+        assert (await read_response(reader))[1]["connection"] == "close"
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        writer.close()
+
+
+async def test_protocol_errors_close_the_connection():
+    async with WebhookServer(_ignore, fast(max_header_size=256)) as server:
+        for request, expected in [
+            (b"GET /healthz HTTP/1.1\r\nX-Pad: " + b"x" * 300, 431),
+            (b"POST /webhooks/bluefly HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n", 501),
+            (b"POST /webhooks/bluefly HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400),
+            (b"GET /healthz HTTP/1.1\r\nbad header\r\n\r\n", 400),
+        ]:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(request)
+            status, headers, _ = await read_response(reader)
+            assert (status, headers["connection"]) == (expected, "close")
+            assert await asyncio.wait_for(reader.read(), 5) == b""
+            writer.close()
+
+
+async def test_idle_connections_are_closed():
+    async with WebhookServer(_ignore, fast(keepalive_timeout=0.05)) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("GET", "/healthz"))
+        assert (await read_response(reader))[0] == 200
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        writer.close()
+
+
+def test_overloaded_responses_ask_for_a_retry():
+    assert b"Retry-After: 1\r\n" in RESPONSES[503, True]
+    assert b"Retry-After" not in RESPONSES[202, True]
+    assert b"Connection: close\r\n" in RESPONSES[400, False]
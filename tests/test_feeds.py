@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import io
+import json
+import threading
+
+import pytest
+
+from webhook_bluefly import FeedDecoder, FeedIngestor, ServerConfig, WebhookServer, batched
+from webhook_bluefly import feeds
+from webhook_bluefly.auth import SignatureVerifier
+from webhook_bluefly.errors import FeedError, HTTPProtocolError
+from webhook_bluefly.feeds import feed_format, iter_chunks, iter_items
+
+from .support import encode_request, read_response
+
+ITEMS = [
+    {"sku": "A-1", "title": 'Shirt, "slim"\n[blue]', "price": 19.5},
+    {"sku": "B-2", "title": "Back\\slash {brace}", "price": 3, "tags": ["x", {"y": [1, 2]}]},
+    {"sku": "C-3", "title": "café ☃", "price": 7},
+]
+CSV_ITEMS = [{key: str(value) for key, value in item.items() if key != "tags"} for item in ITEMS]
+
+
+def encode(format: str, items: list) -> bytes:
+    if format == "json":
+        return json.dumps(items, indent=1).encode()
+    if format == "ndjson":
+        return b"".join(json.dumps(item).encode() + b"\n" for item in items)
+    out = io.StringIO()
+    out.write("sku,title,price\r\n")
+    for item in items:
+        title = item["title"].replace('"', '""')
+        out.write(f'{item["sku"]},"{title}",{item["price"]}\r\n')
+    return out.getvalue().encode()
+
+
+def split(data: bytes, size: int) -> list[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def parse(data: bytes, size: int = 1 << 20, format: str | None = None, **kwargs) -> list:
+    return list(iter_items(split(data, size), format, **kwargs))
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 1 << 20])
+@pytest.mark.parametrize("format", ["json", "ndjson", "csv"])
+def test_items_survive_any_chunking(format, size):
+    expected = CSV_ITEMS if format == "csv" else ITEMS
+    assert parse(encode(format, ITEMS), size) == expected
+
+
+@pytest.mark.parametrize("size", [1, 5, 6, 1 << 20])
+def test_scalar_items_split_across_chunks(size):
+    data = b'[12345, -2500.0, -0.5e3, "a\\"b]", true, null, [], {}]'
+    assert parse(data, size) == [12345, -2500.0, -500.0, 'a"b]', True, None, [], {}]
+
+
+def test_strings_and_escapes_split_at_every_offset():
+    items = [{"a": ["\\", '"]', "}{", "\\\"x\\\\"], "b": "☃ \\u0041"}, "\\", ["]"]]
+    data = json.dumps(items).encode()
+    for size in range(1, 40):
+        assert parse(data, size) == items, size
+
+
+def test_gzip_and_multi_member_gzip():
+    data = encode("ndjson", ITEMS)
+    single = gzip.compress(data)
+    multi = gzip.compress(data[:40]) + gzip.compress(data[40:])
+    assert parse(single, 3) == ITEMS
+    assert parse(multi, 3) == ITEMS
+
+
+def test_byte_order_mark_and_explicit_format():
+    data = b"\xef\xbb\xbf" + encode("json", ITEMS)
+    assert parse(data, 2) == ITEMS
+    assert parse(b"sku\nA\n", format="csv") == [{"sku": "A"}]
+    with pytest.raises(ValueError):
+        FeedDecoder("xml")
+
+
+def test_split_item_is_decoded_once(monkeypatch):
+    # Regression: an item split across chunks was decoded again from its
+    # start with every chunk, quadratic in the item's size.
+    calls = 0
+    real = feeds._decode_value
+
+    def counting(*args):
+        nonlocal calls
+        calls += 1
+        return real(*args)
+
+    monkeypatch.setattr(feeds, "_decode_value", counting)
+    item = {"values": [{"n": i, "s": "x]}\\\"" * 3} for i in range(2000)]}
+    data = json.dumps([item, 1]).encode()
+    assert parse(data, 97) == [item, 1]
+    assert len(data) // 97 > 500
+    assert calls < 10
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'{"not": "an array"}\n[',
+        b"[1 2]",
+        b"[1,]x",
+        b"[1] 2",
+        b'[{"a": tru}]',
+        b"[1, x, 2]",
+        b"[1, 2",
+        b'[{"a": "unterminated',
+        b"{}\n{bad}\n",
+        b'sku,title\nA,"open\n',
+        b"sku,title\nA\n",
+        b"[\xff]",
+        gzip.compress(b"[1, 2]")[:-4],
+    ],
+)
+@pytest.mark.parametrize("size", [1, 1 << 20])
+def test_malformed_feeds_raise(data, size):
+    with pytest.raises(FeedError):
+        parse(data, size)
+
+
+def test_malformed_item_fails_without_waiting_for_more_data():
+    decoder = FeedDecoder()
+    with pytest.raises(FeedError):
+        list(decoder.feed(b'[{"a": nope}, {"b": '))
+
+
+@pytest.mark.parametrize("format", ["json", "ndjson", "csv"])
+def test_items_larger_than_the_limit_are_refused(format):
+    data = encode(format, [{"sku": "A", "title": "t" * 500, "price": 1}])
+    with pytest.raises(FeedError, match="larger than"):
+        parse(data, 16, max_item_size=200)
+    assert parse(data, 16, max_item_size=2000)
+
+
+def test_parsers_must_implement_feed_and_close():
+    with pytest.raises(TypeError):
+        feeds._Parser(10)  # type: ignore[abstract]
+
+
+def test_batched_and_feed_format():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    with pytest.raises(ValueError):
+        list(batched([], 0))
+    assert feed_format({"content-type": "application/x-ndjson; charset=utf-8"}) == "ndjson"
+    assert feed_format({}) is None
+    assert list(iter_chunks(io.BytesIO(b"abcde"), 2)) == [b"ab", b"cd", b"e"]
+
+
+async def chunks(data: bytes, size: int = 10):
+    for part in split(data, size):
+        yield part
+
+
+async def _ignore(batch):
+    pass
+
+
+async def test_ingestor_acks_then_handles_batches():
+    batches = []
+
+    async def handler(batch):
+        batches.append(batch)
+
+    ingestor = FeedIngestor(handler, batch_size=2)
+    headers = {"x-bluefly-event-id": "feed-7", "x-bluefly-seller-id": "seller-1"}
+    assert await ingestor.receive(headers, chunks(encode("json", ITEMS))) == 202
+    await ingestor.stop()
+    assert [(b.feed_id, b.seller_id, b.number, b.items) for b in batches] == [
+        ("feed-7", "seller-1", 0, ITEMS[:2]),
+        ("feed-7", "seller-1", 1, ITEMS[2:]),
+    ]
+    assert (ingestor.stats.received, ingestor.stats.ingested, ingestor.stats.items) == (1, 1, 3)
+
+
+async def test_ingestor_checks_signatures():
+    async def handler(batch):
+        raise AssertionError("unsigned feed handled")
+
+    verifier = SignatureVerifier({"seller-1": "secret"})
+    ingestor = FeedIngestor(handler, verifier=verifier)
+    body = encode("ndjson", ITEMS)
+    headers = {"x-bluefly-seller-id": "seller-1", "x-bluefly-signature": "sha256=00"}
+    assert await ingestor.receive(headers, chunks(body)) == 401
+    headers["x-bluefly-seller-id"] = "unknown"
+    assert await ingestor.receive(headers, chunks(body)) == 401
+    assert ingestor.stats.rejected == 2
+
+    ingestor.handler = _ignore
+    signature = verifier.sign("seller-1", body)
+    headers = {"x-bluefly-seller-id": "seller-1", "x-bluefly-signature": signature}
+    assert await ingestor.receive(headers, chunks(body)) == 202
+    await ingestor.stop()
+    assert ingestor.stats.items == 3
+
+
+class BlockingSpool(io.BytesIO):
+    """A spool file whose writes wait for ``release`` and record their thread."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.release = threading.Event()
+        self.writers: set[int] = set()
+
+    def write(self, data) -> int:
+        self.writers.add(threading.get_ident())
+        self.release.wait(1)
+        return super().write(data)
+
+
+async def test_spool_writes_do_not_block_the_event_loop(monkeypatch):
+    spool = BlockingSpool()
+    monkeypatch.setattr(feeds.tempfile, "TemporaryFile", lambda dir=None: spool)
+    ingestor = FeedIngestor(_ignore)
+    body = encode("ndjson", ITEMS)
+    receiving = asyncio.create_task(ingestor.receive({}, chunks(body, len(body))))
+    await asyncio.sleep(0.1)
+    assert not receiving.done()
+    spool.release.set()
+    assert await receiving == 202
+    await ingestor.stop()
+    assert threading.get_ident() not in spool.writers
+    assert ingestor.stats.items == 3
+
+
+async def test_cancelled_receive_closes_the_spool_after_its_write(monkeypatch):
+    spool = BlockingSpool()
+    monkeypatch.setattr(feeds.tempfile, "TemporaryFile", lambda dir=None: spool)
+    ingestor = FeedIngestor(_ignore)
+    receiving = asyncio.create_task(ingestor.receive({}, chunks(b"[1, 2]")))
+    await asyncio.sleep(0.05)
+    receiving.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await receiving
+    assert not spool.closed
+    spool.release.set()
+    for _ in range(100):
+        if spool.closed:
+            break
+        await asyncio.sleep(0.01)
+    assert spool.closed
+
+
+async def test_malformed_feed_is_counted_as_failed():
+    ingestor = FeedIngestor(_ignore)
+    assert await ingestor.receive({}, chunks(b"[1, 2")) == 202
+    await ingestor.stop()
+    assert (ingestor.stats.ingested, ingestor.stats.failed) == (0, 1)
+
+
+@pytest.mark.parametrize("mode", ["stream", "fast"])
+async def test_feed_push_end_to_end(mode):
+    items = []
+
+    async def handler(batch):
+        items.extend(batch.items)
+
+    async def on_event(event):
+        pass
+
+    big = [{"sku": f"S-{i}", "title": "t" * 200} for i in range(2000)]
+    body = gzip.compress(encode("json", big))
+    ingestor = FeedIngestor(handler)
+    config = ServerConfig(port=0, mode=mode)
+    async with WebhookServer(on_event, config, feeds=ingestor) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        request = encode_request("POST", "/feeds/bluefly", {}, body)
+        for part in split(request, 4096):
+            writer.write(part)
+            await writer.drain()
+        writer.write(encode_request("GET", "/healthz"))
+        assert (await read_response(reader))[0] == 202
+        assert (await read_response(reader))[0] == 200
+        writer.close()
+    assert items == big
+
+
+class FailingIngestor(FeedIngestor):
+    async def receive(self, headers, body):
+        raise HTTPProtocolError(418, "no tea")
+
+
+async def test_feed_protocol_error_closes_the_connection():
+    # Regression: the error response was looked up for a status missing
+    # from the table, and the connection was left open.
+    config = ServerConfig(port=0, mode="fast")
+    async with WebhookServer(_ignore, config, feeds=FailingIngestor(_ignore)) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("POST", "/feeds/bluefly", {}, b"[1, 2]"))
+        writer.write(encode_request("GET", "/healthz"))
+        status, headers, _ = await read_response(reader)
+        assert status == 400
+        assert headers["connection"] == "close"
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        writer.close()
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from webhook_bluefly import InventoryIndex, Pipeline, ServerConfig, WebhookServer, WriteAheadLog
+from webhook_bluefly.events import decode_event
+from webhook_bluefly.inventory import SNAPSHOT_FILE, StockLevel
+from webhook_bluefly.server import MAX_INVENTORY_SKUS
+
+from .support import encode_request, make_delivery, read_response
+
+_counter = 0
+
+
+def stock_event(seq: int = 0, event_type: str = "inventory.updated", **data):
+    global _counter
+    _counter += 1
+    headers, body = make_delivery(f"evt_{_counter}", event_type, data=data)
+    event = decode_event(headers, body, 1.0)
+    event.seq = seq
+    return event
+
+
+def test_events_set_only_the_fields_they_carry():
+    index = InventoryIndex()
+    assert index.apply(stock_event(1, sku="A", price=9.5, version=1))
+    assert index.get("A") == StockLevel(None, 9.5, None, 1)
+    assert index.apply(stock_event(2, sku="A", quantity=4, warehouse="east", version=2))
+    assert index.get("A") == StockLevel(4, 9.5, "east", 2)
+    assert index.update("B", quantity=0)
+    assert index.get("B") == StockLevel(0, None, None, 0)
+    assert index.get("C") is None
+    assert list(index) == ["A", "B"]
+    assert "A" in index and "C" not in index
+    assert len(index) == 2
+    assert index.seq == 2
+    assert index.stats.applied == 3
+
+
+def test_stale_versions_are_dropped():
+    index = InventoryIndex()
+    index.update("A", quantity=5, version=3)
+    assert not index.update("A", quantity=1, version=2)
+    assert index.update("A", price=1.0, version=3)  # same version still applies
+    assert index.update("A", quantity=7)  # no version given
+    assert index.get("A") == StockLevel(7, 1.0, None, 3)
+    assert index.stats.stale == 1
+
+
+@pytest.mark.parametrize(
+    "sku, fields",
+    [
+        (None, {"quantity": 1}),
+        ("", {"quantity": 1}),
+        (7, {"quantity": 1}),
+        ("A", {"quantity": -1}),
+        ("A", {"quantity": True}),
+        ("A", {"quantity": 1.5}),
+        ("A", {"quantity": 2**63}),
+        ("A", {"price": float("nan")}),
+        ("A", {"price": float("inf")}),
+        ("A", {"price": "9.99"}),
+        ("A", {"price": 10**400}),
+        ("A", {"warehouse": 3}),
+        ("A", {"version": "2"}),
+        ("A", {"version": False}),
+    ],
+)
+def test_malformed_updates_are_counted(sku, fields):
+    index = InventoryIndex()
+    assert not index.update(sku, **fields)
+    assert index.stats.malformed == 1
+    assert len(index) == 0
+
+
+def test_other_topics_and_unscannable_bodies_are_ignored():
+    index = InventoryIndex()
+    assert not index.apply(stock_event(1, "order.created", sku="A", quantity=1))
+    assert index.stats.malformed == 0
+    event = stock_event(2, sku="A")
+    event.body = b'{"data": ' + b"[" * 10_000
+    assert not index.apply(event)
+    assert index.stats.malformed == 1
+    assert index.seq == 2
+    assert len(index) == 0
+
+
+def filled() -> InventoryIndex:
+    index = InventoryIndex()
+    index.update("A", quantity=1, price=2.5, warehouse="east", version=1)
+    index.update("B-☃", warehouse="west")
+    index.update("C", quantity=3, warehouse="east")
+    index.seq = 42
+    return index
+
+
+def test_snapshot_round_trip():
+    index = filled()
+    copy = InventoryIndex()
+    copy.update("stale", quantity=1)
+    copy.loads(index.dumps())
+    assert copy.seq == 42
+    assert list(copy) == list(index)
+    for sku in index:
+        assert copy.get(sku) == index.get(sku)
+    assert copy.get("stale") is None
+    # New warehouses intern after the loaded ones.
+    copy.update("D", warehouse="north")
+    copy.update("E", warehouse="east")
+    assert copy.get("D").warehouse == "north"
+    assert copy.get("E").warehouse == "east"
+
+    empty = InventoryIndex()
+    empty.loads(InventoryIndex().dumps())
+    assert len(empty) == 0
+
+
+def test_corrupt_snapshots_are_refused():
+    data = filled().dumps()
+    index = InventoryIndex()
+    with pytest.raises(ValueError, match="truncated"):
+        index.loads(data[:10])
+    with pytest.raises(ValueError, match="not an inventory"):
+        index.loads(b"X" + data[1:])
+    with pytest.raises(ValueError, match="checksum"):
+        index.loads(data[:-1] + bytes([data[-1] ^ 1]))
+    with pytest.raises(ValueError, match="checksum"):
+        index.loads(data + b"\x00")
+    assert len(index) == 0
+
+
+async def test_save_and_load(tmp_path):
+    index = filled()
+    with pytest.raises(RuntimeError):
+        await index.save()
+    assert not index.load()
+
+    index.directory = tmp_path / "inventory"
+    await index.save()
+    assert index.saved_seq == 42
+    assert not list(index.directory.glob("*.tmp"))
+
+    copy = InventoryIndex(index.directory)
+    assert copy.load()
+    assert (copy.seq, copy.saved_seq) == (42, 42)
+    assert copy.get("A") == index.get("A")
+
+    assert not InventoryIndex(tmp_path / "missing").load()
+    (index.directory / SNAPSHOT_FILE).write_bytes(b"garbage")
+    garbage = InventoryIndex(index.directory)
+    assert not garbage.load()
+    assert len(garbage) == 0
+
+
+def test_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        InventoryIndex(snapshot_interval=0)
+
+
+async def test_restore_replays_the_log_after_the_snapshot(tmp_path):
+    wal = WriteAheadLog(tmp_path / "wal", fsync=False)
+    await wal.open()
+    events = [
+        stock_event(sku="A", quantity=1, version=1),
+        stock_event(event_type="order.created", order_id="o-1"),
+        stock_event(sku="A", quantity=2, version=2),
+        stock_event(sku="B", price=4.0),
+    ]
+    seqs = [await wal.append(event.to_record()) for event in events]
+
+    index = InventoryIndex(tmp_path / "inventory")
+    for seq, event in zip(seqs[:2], events[:2]):
+        event.seq = seq
+        index.apply(event)
+    index.seq = seqs[1]
+    await index.save()
+    index.update("A", quantity=99, version=1)  # lost: not in the snapshot or the log
+
+    restored = InventoryIndex(tmp_path / "inventory")
+    assert restored.restore(wal) == 2
+    assert restored.seq == seqs[-1]
+    assert restored.get("A") == StockLevel(2, None, None, 2)
+    assert restored.get("B") == StockLevel(None, 4.0, None, 0)
+
+    # Without a snapshot the whole log is replayed.
+    fresh = InventoryIndex(tmp_path / "none")
+    assert fresh.restore(wal) == 3
+    assert fresh.get("A").quantity == 2
+    await wal.close()
+
+
+def test_memory_estimate_grows_with_skus():
+    index = InventoryIndex()
+    empty = index.memory_estimate()
+    for i in range(1000):
+        index.update(f"SKU-{i}", quantity=i, price=1.0, warehouse="east", version=1)
+    assert 50_000 < index.memory_estimate() - empty < 500_000
+
+
+async def test_pipeline_keeps_the_index_across_restarts(tmp_path):
+    async def handler(event):
+        pass
+
+    directory = tmp_path / "inventory"
+    pipeline = Pipeline(handler, inventory=InventoryIndex(directory))
+    await pipeline.start()
+    headers, body = make_delivery("evt_a", "inventory.updated", data={"sku": "A", "quantity": 3})
+    assert pipeline.accept(headers, body) == 202
+    # Regression: an integer price too large for a float raised
+    # OverflowError out of accept.
+    headers, body = make_delivery("evt_b", "inventory.updated", data={"sku": "B", "price": 10**400})
+    assert pipeline.accept(headers, body) == 202
+    await pipeline.stop()
+    assert (directory / SNAPSHOT_FILE).exists()
+
+    index = InventoryIndex(directory)
+    pipeline = Pipeline(handler, inventory=index)
+    await pipeline.start()
+    await pipeline.stop()
+    assert index.get("A").quantity == 3
+    assert index.get("B") is None
+
+
+@pytest.mark.parametrize("mode", ["stream", "fast"])
+async def test_inventory_endpoint(mode):
+    async def handler(event):
+        pass
+
+    index = InventoryIndex()
+    index.update("A", quantity=2, price=5.0, warehouse="east", version=7)
+    config = ServerConfig(port=0, mode=mode)
+    async with WebhookServer(handler, config, inventory=index) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("GET", "/inventory?sku=A&sku=missing"))
+        found = await read_response(reader)
+        writer.write(encode_request("GET", "/inventory"))
+        empty = await read_response(reader)
+        query = "&".join(f"sku=S{i}" for i in range(MAX_INVENTORY_SKUS + 1))
+        writer.write(encode_request("GET", f"/inventory?{query}"))
+        too_many = await read_response(reader)
+        writer.close()
+    assert found[0] == 200
+    assert json.loads(found[2]) == {
+        "A": {"quantity": 2, "price": 5.0, "warehouse": "east", "version": 7},
+        "missing": None,
+    }
+    assert empty[0] == too_many[0] == 400
+    assert "sku" in json.loads(empty[2])["error"]
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import os
+
+import pytest
+
+from webhook_bluefly import MetricsRegistry, Pipeline, ServerConfig, WebhookServer
+from webhook_bluefly.auth import SignatureVerifier
+from webhook_bluefly.metrics import (
+    OVERFLOW_TYPE,
+    STAGES,
+    Histogram,
+    bucket_index,
+    bucket_upper,
+)
+
+from .support import encode_request, make_delivery, read_response
+
+
+def test_buckets_bound_the_relative_error():
+    for micros in (0, 1, 31, 32, 33, 1000, 123_456, 10**9):
+        index = bucket_index(micros)
+        assert micros < bucket_upper(index)
+        if index:
+            assert bucket_upper(index - 1) <= micros
+        assert bucket_upper(index) - micros <= max(1, micros * 0.07)
+
+
+def test_quantiles_within_resolution():
+    registry = MetricsRegistry()
+    for micros in range(1, 10_001):
+        registry.observe("handle", "order.created", micros / 1e6)
+    histogram = registry.histogram("handle", "order.created")
+    assert histogram.count == 10_000
+    assert histogram.quantile(0.5) == pytest.approx(0.005, rel=0.07)
+    assert histogram.quantile(0.99) == pytest.approx(0.0099, rel=0.07)
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_negative_and_huge_durations_are_clamped():
+    registry = MetricsRegistry()
+    registry.observe("handle", "order.created", -1.0)
+    registry.observe("handle", "order.created", 10**6)
+    histogram = registry.histogram("handle")
+    assert histogram.count == 2
+    assert histogram.quantile(0.0) == bucket_upper(0) / 1e6
+
+
+def test_event_types_beyond_capacity_share_the_overflow_series():
+    registry = MetricsRegistry(max_series=len(STAGES) + 2)
+    for i in range(10):
+        registry.observe("receive", f"type.{i}", 0.001)
+    assert registry.histogram("receive", "type.0").count == 1
+    assert registry.histogram("receive", "type.1").count == 1
+    assert registry.histogram("receive", OVERFLOW_TYPE).count == 8
+    assert registry.histogram("receive").count == 10
+    # Regression: each overflowed type was rendered as a series of its own,
+    # repeating the overflow counts.
+    text = registry.render().decode()
+    assert "type.5" not in text
+    assert text.count('webhook_bluefly_stage_seconds_count{stage="receive"') == 3
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    registry.observe("persist", 'odd"type', 0.002)
+    registry.set_counters({"accepted": 3, "rejected": 1})
+    text = registry.render().decode()
+    assert 'webhook_bluefly_events_total{outcome="accepted"} 3' in text
+    labels = 'stage="persist",event_type="odd\\"type"'
+    assert f'webhook_bluefly_stage_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    assert f"webhook_bluefly_stage_seconds_count{{{labels}}} 1" in text
+    assert 'stage="handle"' not in text  # empty series are left out
+
+
+def test_workers_record_in_their_own_block_and_scrapes_add_them_up():
+    registry = MetricsRegistry(workers=2)
+    registry.bind(0)
+    registry.observe("handle", "order.created", 0.001)
+    registry.set_counters({"accepted": 5})
+    pid = os.fork()
+    if pid == 0:
+        try:
+            registry.bind(1)
+            registry.observe("handle", "order.created", 0.001)
+            registry.observe("handle", "order.shipped", 0.001)
+            registry.set_counters({"accepted": 2})
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert registry.histogram("handle", "order.created").count == 2
+    assert registry.histogram("handle", "order.shipped").count == 1
+    assert registry.counters()["accepted"] == 7
+    with pytest.raises(ValueError):
+        registry.bind(2)
+
+
+def test_rebinding_a_slot_continues_its_counters():
+    registry = MetricsRegistry(workers=1)
+    registry.set_counters({"accepted": 5})
+    registry.bind(0)  # a restarted worker in the same slot
+    registry.set_counters({"accepted": 1})
+    assert registry.counters() == {"accepted": 6}
+
+
+async def test_unverified_deliveries_do_not_register_series():
+    # Regression: 401s were recorded under the event type the sender made
+    # up, so forged types filled the series directory.
+    async def handler(event):
+        pass
+
+    registry = MetricsRegistry()
+    verifier = SignatureVerifier({"seller-1": "secret"})
+    pipeline = Pipeline(handler, verifier=verifier, metrics=registry)
+    await pipeline.start()
+    for i in range(300):
+        headers, body = make_delivery(f"evt_{i}", f"order.forged_{i}")
+        headers["x-bluefly-signature"] = "sha256=" + "0" * 64
+        assert pipeline.accept(headers, body) == 401
+    headers, body = make_delivery("evt_ok", "order.created")
+    headers["x-bluefly-signature"] = verifier.sign("seller-1", body)
+    assert pipeline.accept(headers, body) == 202
+    await pipeline.stop()
+    assert registry.histogram("receive", OVERFLOW_TYPE).count == 300
+    assert registry.histogram("verify", OVERFLOW_TYPE).count == 300
+    assert registry.histogram("receive", "order.created").count == 1
+    assert "forged" not in registry.render().decode()
+
+
+@pytest.mark.parametrize("mode", ["stream", "fast"])
+async def test_metrics_endpoint(mode):
+    handled = asyncio.Event()
+
+    async def handler(event):
+        handled.set()
+
+    config = ServerConfig(port=0, mode=mode)
+    async with WebhookServer(handler, config, metrics=MetricsRegistry()) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("POST", "/webhooks/bluefly", *make_delivery()))
+        assert (await read_response(reader))[0] == 202
+        await handled.wait()
+        writer.write(encode_request("GET", "/metrics"))
+        status, headers, body = await read_response(reader)
+        writer.close()
+    assert status == 200
+    assert headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = body.decode()
+    assert 'webhook_bluefly_events_total{outcome="accepted"} 1' in text
+    assert 'stage="receive",event_type="order.created"' in text
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import pytest
+
+from webhook_bluefly import InventoryEvent, OrderEvent, ProductEvent, typed_event
+from webhook_bluefly.errors import EnvelopeError
+from webhook_bluefly.events import _MISSING, decode_event
+from webhook_bluefly.models import Field, Record
+
+from .support import make_delivery
+
+ORDER = {
+    "order_id": "BF-1",
+    "status": "created",
+    "sequence": 1,
+    "lines": [{"sku": "A", "quantity": 2, "unit_price": 10, "currency": "USD"}],
+    "shipping_address": {"name": "J", "city": "New York", "country": "US"},
+    "total": 20.0,
+    "tracking_number": None,
+}
+
+
+def event(event_type: str, data):
+    headers, body = make_delivery("evt_1", event_type, data=data)
+    return decode_event(headers, body, 5.0)
+
+
+def test_models_by_topic():
+    order = typed_event(event("order.created", ORDER))
+    assert isinstance(order, OrderEvent)
+    assert (order.event_id, order.seller_id, order.topic) == ("evt_1", "seller-1", "order")
+    assert (order.occurred_at, order.received_at) == ("2024-05-01T12:00:00Z", 5.0)
+    assert isinstance(typed_event(event("inventory.updated", {"sku": "A"})), InventoryEvent)
+    assert isinstance(typed_event(event("product.updated", {"sku": "A"})), ProductEvent)
+    with pytest.raises(EnvelopeError):
+        typed_event(event("refund.created", {}))
+
+
+def test_fields_decode_lazily_and_release_the_raw_mapping():
+    order = typed_event(event("order.created", ORDER))
+    assert order.lines[0].sku == "A"
+    assert order.lines[0].unit_price == 10.0
+    assert type(order.lines[0].unit_price) is float
+    assert order.lines is order.lines
+    assert order._raw is not None
+    assert order.shipping_address.line2 is None
+    assert order.tracking_number is None
+    assert order.currency is None
+    order.materialize()
+    assert order._raw is None
+    assert order.total == 20.0
+    assert order.to_dict() == {
+        **ORDER,
+        "lines": [{"sku": "A", "quantity": 2, "unit_price": 10.0, "currency": "USD"}],
+        "shipping_address": {
+            "name": "J",
+            "line1": None,
+            "line2": None,
+            "city": "New York",
+            "region": None,
+            "postal_code": None,
+            "country": "US",
+        },
+        "currency": None,
+    }
+    assert "BF-1" in repr(order)
+
+
+def test_parsed_payload_is_not_cached_on_the_event():
+    source = event("inventory.updated", {"sku": "A", "quantity": 3})
+    inventory = typed_event(source)
+    assert inventory.quantity == 3
+    assert source._payload is _MISSING
+
+
+@pytest.mark.parametrize(
+    "data, attribute",
+    [
+        ({"quantity": "3"}, "quantity"),
+        ({"quantity": True}, "quantity"),
+        ({"quantity": 1.5}, "quantity"),
+        ({"price": "9.99"}, "price"),
+        ({"sku": 7}, "sku"),
+    ],
+)
+def test_wrong_types_raise_on_access(data, attribute):
+    inventory = typed_event(event("inventory.updated", data))
+    with pytest.raises(EnvelopeError, match=f"InventoryEvent.{attribute}"):
+        getattr(inventory, attribute)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"lines": {"sku": "A"}},
+        {"lines": ["A"]},
+        {"shipping_address": "NY"},
+    ],
+)
+def test_wrong_nested_types_raise_on_access(data):
+    order = typed_event(event("order.created", data))
+    with pytest.raises(EnvelopeError):
+        order.materialize()
+
+
+def test_envelopes_without_object_data_are_refused():
+    with pytest.raises(EnvelopeError):
+        typed_event(event("order.created", ["not", "an", "object"]))
+    headers, _ = make_delivery()
+    with pytest.raises(EnvelopeError):
+        typed_event(decode_event(headers, b"[1]", 0.0))
+
+
+def test_fields_are_read_only_and_slotted():
+    order = typed_event(event("order.created", ORDER))
+    with pytest.raises(AttributeError):
+        order.status = "shipped"
+    with pytest.raises(AttributeError):
+        order.extra = 1
+    assert not hasattr(order, "__dict__")
+
+
+def test_custom_records():
+    class Refund(Record):
+        __slots__ = ()
+
+        amount = Field(float, key="amount_usd")
+        meta = Field()
+
+    refund = Refund({"amount_usd": 5, "meta": [1, {"a": 2}]})
+    assert (refund.amount, refund.meta) == (5.0, [1, {"a": 2}])
+    assert refund.to_dict() == {"amount_usd": 5.0, "meta": [1, {"a": 2}]}
+    with pytest.raises(TypeError):
+        Field(set)
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from collections import Counter
+
+import pytest
+
+from webhook_bluefly import OrderStateStore
+from webhook_bluefly.events import decode_event
+from webhook_bluefly.orders import KEY_WIDTH, _DELETED, _EMPTY, _FREE
+
+from .support import make_delivery
+
+_counter = 0
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_714_600_000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def order_event(order_id: str, kind: str, sequence: int | None = None, **data):
+    global _counter
+    _counter += 1
+    data = {"order_id": order_id, **data}
+    if sequence is not None:
+        data["sequence"] = sequence
+    occurred_at = data.pop("occurred_at", "2024-05-01T12:00:00Z")
+    headers, body = make_delivery(
+        f"evt_{_counter}", f"order.{kind}", data=data, occurred_at=occurred_at
+    )
+    return decode_event(headers, body, 1_714_600_000.0)
+
+
+def new_store(**kwargs) -> OrderStateStore:
+    # Event times are in May 2024; keep them within retention.
+    kwargs.setdefault("clock", FakeClock())
+    return OrderStateStore(**kwargs)
+
+
+def check_table(store: OrderStateStore) -> None:
+    """Every live row sits in exactly one table slot and ``_used`` counts occupied slots."""
+    table = store._table
+    live = [row for row in range(len(store._status)) if store._status[row] != _FREE]
+    slots = Counter(entry - 1 for entry in table if entry > 0)
+    assert sorted(slots) == sorted(live)
+    assert all(count == 1 for count in slots.values())
+    assert store._used == sum(1 for entry in table if entry != _EMPTY)
+    assert len(store) == len(live)
+    for row in live:
+        key = bytes(store._keys[row * KEY_WIDTH : (row + 1) * KEY_WIDTH])
+        assert store._find(key) == row
+
+
+def test_folds_events_into_state():
+    store = new_store()
+    store.apply(order_event("o-1", "created", 1, total=99.5, currency="USD"))
+    state = store.apply(order_event("o-1", "shipped", 2, tracking_number="1Z999"))
+    assert state is not None
+    assert state.status == "shipped"
+    assert state.sequence == 2
+    assert state.total == 99.5
+    assert state.currency == "USD"
+    assert state.tracking_number == "1Z999"
+    assert store.get("o-1") == state
+    assert store.get("o-2") is None
+    assert "o-1" in store
+
+
+def test_stale_and_repeated_events_are_dropped():
+    store = new_store()
+    store.apply(order_event("o-1", "created", 1))
+    store.apply(order_event("o-1", "shipped", 2))
+    assert store.apply(order_event("o-1", "acknowledged", 2)) is None
+    assert store.apply(order_event("o-1", "created", 1)) is None
+    assert store.get("o-1").status == "shipped"
+    assert store.stats.stale == 2
+
+
+def test_out_of_order_events_wait_for_the_gap():
+    store = new_store()
+    assert store.apply(order_event("o-1", "shipped", 3)) is None
+    assert store.apply(order_event("o-1", "acknowledged", 2)) is None
+    assert store.pending == 2
+    # Applying the missing event drains the buffered ones behind it.
+    state = store.apply(order_event("o-1", "created", 1))
+    assert state.status == "shipped"
+    assert store.get("o-1").sequence == 3
+    assert store.pending == 0
+
+
+def test_buffered_events_apply_after_max_delay():
+    clock = FakeClock()
+    store = new_store(max_delay=10, clock=clock)
+    store.apply(order_event("o-1", "created", 1))
+    store.apply(order_event("o-1", "shipped", 3))
+    assert store.get("o-1").status == "created"
+    clock.now += 11
+    store.apply(order_event("o-2", "created", 1))
+    assert store.get("o-1").status == "shipped"
+    assert store.stats.gaps == 1
+
+
+def test_buffer_is_bounded():
+    store = new_store(max_pending=2)
+    for i in range(3):
+        store.apply(order_event(f"o-{i}", "shipped", 5))
+    assert store.pending <= 2
+    assert store.get("o-0").status == "shipped"
+
+
+def test_events_without_sequence_use_occurred_at():
+    store = new_store()
+    store.apply(order_event("o-1", "shipped", occurred_at="2024-05-02T00:00:00Z"))
+    assert store.apply(order_event("o-1", "created", occurred_at="2024-05-01T00:00:00Z")) is None
+    assert store.get("o-1").status == "shipped"
+
+
+def test_long_ids_and_tracking_numbers():
+    store = new_store()
+    long_id = "order-" + "x" * 100
+    other = "order-" + "x" * 99 + "y"
+    tracking = "T" * 80
+    store.apply(order_event(long_id, "created", 1))
+    store.apply(order_event(long_id, "shipped", 2, tracking_number=tracking))
+    store.apply(order_event(other, "created", 1))
+    assert store.get(long_id).tracking_number == tracking
+    assert store.get(other).status == "created"
+
+
+def test_malformed_and_foreign_events_are_ignored():
+    store = new_store()
+    assert store.apply(order_event("", "created", 1)) is None
+    assert store.apply(order_event("o-1", "created", sequence=0)) is None
+    headers, body = make_delivery("evt_inv", "inventory.updated", data={"sku": "A"})
+    assert store.apply(decode_event(headers, body, 0.0)) is None
+    assert store.stats.malformed == 2
+    assert len(store) == 0
+
+
+def test_table_stays_consistent_as_it_grows():
+    # Regression: a rebuild during insert placed the new row, then the
+    # insert placed it again, leaving duplicate slots.
+    store = new_store(capacity=1)
+    for i in range(20):
+        store.apply(order_event(f"o-{i}", "created", 1))
+        check_table(store)
+    assert len(store) == 20
+    assert store._used == 20
+
+
+def test_table_stays_consistent_across_expiry_and_reuse():
+    clock = FakeClock(1_714_564_810.0)  # just after the events occurred
+    store = new_store(capacity=1, retention=100, clock=clock)
+    for i in range(50):
+        store.apply(order_event(f"old-{i}", "created", 1))
+    clock.now += 101
+    assert store.expire() == 50
+    check_table(store)
+    assert any(entry == _DELETED for entry in store._table)
+    for i in range(60):
+        store.apply(order_event(f"new-{i}", "created", 1, occurred_at="2024-05-01T12:05:00Z"))
+        check_table(store)
+    for i in range(60):
+        assert store.get(f"new-{i}").status == "created"
+    assert store.get("old-1") is None
+
+
+def test_memory_estimate_grows_with_orders():
+    store = new_store(capacity=1)
+    empty = store.memory_estimate()
+    for i in range(1000):
+        store.apply(order_event(f"o-{i}", "created", 1))
+    assert 50_000 < store.memory_estimate() - empty < 500_000
+
+
+def test_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        OrderStateStore(retention=0)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from webhook_bluefly import ServerConfig, WebhookServer
+from webhook_bluefly.profiler import SamplingProfiler, collapse
+
+from .support import encode_request, read_response
+
+
+def spin(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,), name="busy;worker")
+    thread.start()
+    try:
+        yield thread
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_samples_other_threads_as_collapsed_stacks(busy_thread):
+    profiler = SamplingProfiler(interval=0.001)
+    counts = profiler.sample(0.2)
+    assert profiler.samples > 10
+    busy = {stack: n for stack, n in counts.items() if stack.startswith("busy:worker;")}
+    assert busy
+    assert all("spin (test_profiler.py:" in stack for stack in busy)
+    # The sampling thread leaves itself out.
+    assert not any("_sample (profiler.py" in stack for stack in counts)
+    assert not profiler.running
+
+
+def test_sampling_overhead_is_bounded(busy_thread):
+    profiler = SamplingProfiler(interval=1e-6, max_overhead=0.01)
+    started = time.perf_counter()
+    profiler.sample(0.2)
+    elapsed = time.perf_counter() - started
+    assert elapsed >= 0.2
+    # A sample takes at least a few microseconds, so the 1% budget sleeps
+    # for hundreds of microseconds after each instead of the 1 µs interval.
+    assert profiler.samples < 1000
+
+
+def test_profile_length_is_capped_and_profiles_do_not_overlap():
+    profiler = SamplingProfiler(max_seconds=0.05)
+    started = time.perf_counter()
+    profiler.sample(10)
+    assert time.perf_counter() - started < 1
+    with profiler._running:
+        with pytest.raises(RuntimeError):
+            profiler.sample(0.01)
+    with pytest.raises(ValueError):
+        SamplingProfiler(max_overhead=1.0)
+
+
+def test_collapse_orders_by_count(monkeypatch):
+    counts = Counter({"main;a": 2, "main;b": 5})
+    assert collapse(counts) == "main;b 5\nmain;a 2\n"
+    monkeypatch.setattr("webhook_bluefly.profiler.MAX_STACKS", 1)
+    assert collapse(counts) == "main;b 5\n"
+
+
+@pytest.mark.parametrize("mode", ["stream", "fast"])
+async def test_profile_endpoint(mode):
+    async def handler(event):
+        pass
+
+    config = ServerConfig(port=0, mode=mode)
+    async with WebhookServer(handler, config, profiler=SamplingProfiler()) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("GET", "/debug/profile?seconds=0.1&hz=500"))
+        status, _, body = await read_response(reader)
+        assert status == 200
+        lines = body.decode().splitlines()
+        assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+        assert any("MainThread;" in line for line in lines)
+
+        for query in ("seconds=x", "seconds=0", "seconds=1&hz=-1", "seconds=inf"):
+            writer.write(encode_request("GET", f"/debug/profile?{query}"))
+            assert (await read_response(reader))[0] == 400
+
+        other_reader, other_writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("GET", "/debug/profile?seconds=0.3"))
+        await asyncio.sleep(0.1)
+        other_writer.write(encode_request("GET", "/debug/profile?seconds=0.1"))
+        assert (await read_response(other_reader))[0] == 409
+        assert (await read_response(reader))[0] == 200
+        writer.close()
+        other_writer.close()
+
+
+async def test_profile_endpoint_needs_a_profiler():
+    async def handler(event):
+        pass
+
+    async with WebhookServer(handler, ServerConfig(port=0, mode="fast")) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("GET", "/debug/profile?seconds=1"))
+        assert (await read_response(reader))[0] == 404
+        writer.close()
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from webhook_bluefly import Rate, RateLimiter, RateLimitError, SharedBucketState
+from webhook_bluefly.httputil import encode_response
+from webhook_bluefly.ratelimit import endpoint_class
+
+from .support import StubAPI
+
+
+class FakeClock:
+    def __init__(self, now: float = 100.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_endpoint_classes():
+    assert endpoint_class("POST", "/v1/orders/BF-1/shipments") == "orders.write"
+    assert endpoint_class("GET", "/v2/products/SKU") == "products.read"
+    assert endpoint_class("HEAD", "/inventory") == "inventory.read"
+    assert endpoint_class("DELETE", "/") == ".write"
+    assert endpoint_class("GET", "/version/x") == "version.read"
+
+
+def test_burst_then_steady_rate():
+    clock = FakeClock()
+    limiter = RateLimiter({"orders.write": Rate(2.0, burst=3)}, clock=clock)
+    waits = [limiter.delay("s1", "orders.write") for _ in range(6)]
+    assert waits == pytest.approx([0, 0, 0, 0.5, 1.0, 1.5])
+    # Other sellers and endpoint classes have buckets of their own.
+    assert limiter.delay("s2", "orders.write") == 0
+    clock.now += 10
+    assert [limiter.delay("s1", "orders.write") for _ in range(3)] == [0, 0, 0]
+    assert limiter.stats.calls == 10
+    assert limiter.stats.delayed == 3
+    assert limiter.stats.delayed_seconds == pytest.approx(3.0)
+
+
+def test_unlisted_classes_use_the_default():
+    clock = FakeClock()
+    limiter = RateLimiter({}, default=Rate(1.0), clock=clock)
+    assert [limiter.delay("s", "refunds.write") for _ in range(2)] == [0, 1.0]
+    unlimited = RateLimiter({}, default=None, clock=clock)
+    assert [unlimited.delay("s", "refunds.write") for _ in range(50)] == [0] * 50
+    unlimited.throttled("s", "refunds.write", 1.0)
+    with pytest.raises(ValueError):
+        Rate(0)
+    with pytest.raises(ValueError):
+        Rate(1.0, burst=0.5)
+
+
+def test_max_wait_rejects_without_reserving():
+    clock = FakeClock()
+    limiter = RateLimiter({"orders.read": Rate(1.0)}, max_wait=1.5, clock=clock)
+    assert limiter.delay("s", "orders.read") == 0
+    assert limiter.delay("s", "orders.read") == 1.0
+    with pytest.raises(RateLimitError):
+        limiter.delay("s", "orders.read")
+    assert limiter.stats.rejected == 1
+    clock.now += 1.0
+    assert limiter.delay("s", "orders.read") == 1.0
+
+
+def test_throttling_empties_the_bucket_until_retry_after():
+    clock = FakeClock()
+    limiter = RateLimiter({"orders.write": Rate(1.0, burst=5)}, clock=clock)
+    assert limiter.delay("s", "orders.write") == 0
+    limiter.throttled("s", "orders.write", 30.0)
+    assert limiter.delay("s", "orders.write") == pytest.approx(30.0)
+    assert limiter.stats.throttled == 1
+    # An earlier Retry-After never shortens a pause already in force.
+    limiter.throttled("s", "orders.write", 1.0)
+    assert limiter.delay("s", "orders.write") == pytest.approx(31.0)
+
+
+def test_shared_state_is_seen_by_every_process(tmp_path):
+    path = tmp_path / "rates"
+    state = SharedBucketState(path, slots=64)
+    clock = FakeClock()
+    limiter = RateLimiter({"orders.write": Rate(1.0)}, state=state, clock=clock)
+    assert limiter.delay("s", "orders.write") == 0
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            other = RateLimiter(
+                {"orders.write": Rate(1.0)}, state=SharedBucketState(path, slots=64), clock=clock
+            )
+            code = 0 if other.delay("s", "orders.write") == 1.0 else 2
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert limiter.delay("s", "orders.write") == 2.0
+    limiter.throttled("s", "orders.write", 10.0)
+    assert limiter.delay("s", "orders.write") == pytest.approx(10.0)
+    state.close()
+    state.close()
+
+    with pytest.raises(ValueError):
+        SharedBucketState(path, slots=32)
+    (tmp_path / "other").write_bytes(b"x" * 100)
+    with pytest.raises(ValueError):
+        SharedBucketState(tmp_path / "other", slots=64)
+
+
+async def test_client_waits_for_its_bucket_and_backs_off_after_429():
+    responses = [encode_response(429, extra_headers={"Retry-After": "0.2"})]
+
+    def respond(request):
+        return responses.pop() if responses else encode_response(200, b"{}")
+
+    limiter = RateLimiter({"orders.read": Rate(20.0)})
+    async with StubAPI(respond) as api:
+        client = api.client(rate_limiter=limiter)
+        assert (await client.request("GET", "/v1/orders/1", seller_id="s")).status == 429
+        for _ in range(2):
+            await client.get_order("1", seller_id="s")
+        await client.close()
+    assert limiter.stats.throttled == 1
+    assert limiter.stats.delayed == 2
+    assert limiter.stats.delayed_seconds >= 0.2
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import random
+
+import pytest
+
+from webhook_bluefly import Pipeline, RetryPolicy
+from webhook_bluefly.retry import RetryScheduler, TimingWheel
+
+from .support import make_delivery
+
+
+class FakeClock:
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_policy_backs_off_with_full_jitter():
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0, seed=4)
+    for retry, ceiling in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 8.0), (5, 10.0), (40, 10.0)]:
+        delays = [policy.delay(retry) for _ in range(200)]
+        assert all(0.0 <= delay <= ceiling for delay in delays)
+        assert max(delays) > ceiling * 0.9
+    assert RetryPolicy(seed=1).delay(3) == RetryPolicy(seed=1).delay(3)
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
+
+
+def test_policy_counts_the_first_run_as_an_attempt():
+    policy = RetryPolicy(max_attempts=3)
+    assert [policy.will_retry(failures) for failures in (1, 2, 3)] == [True, True, False]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_every_timer_fires_on_its_tick(seed):
+    # Small wheels so that cascading and the overflow list are exercised.
+    rng = random.Random(seed)
+    clock = FakeClock()
+    wheel: TimingWheel[int] = TimingWheel(1.0, slots=4, levels=2, clock=clock)
+    expected: dict[int, int] = {}
+    cancelled = set()
+    fired: dict[int, int] = {}
+    timers = {}
+    for tick in range(1, 400):
+        for _ in range(rng.randrange(3)):
+            item = len(expected)
+            delay = rng.choice([0.0, 0.5, 1.0, 3.0, rng.uniform(0, 20), rng.uniform(0, 200)])
+            timers[item] = wheel.schedule(delay, item)
+            expected[item] = tick - 1 + max(1, -int(-delay // 1))
+        if timers and rng.random() < 0.1:
+            item = rng.choice(list(timers))
+            wheel.cancel(timers.pop(item))
+            cancelled.add(item)
+        clock.now = tick
+        for item in wheel.advance():
+            assert item not in fired
+            fired[item] = tick
+            del timers[item]
+    # Timers due after the last tick fire together when the wheel catches up.
+    clock.now = 1000
+    for item in wheel.advance():
+        fired[item] = expected[item] if expected[item] >= 400 else -1
+    assert set(fired) == set(expected) - cancelled
+    assert all(fired[item] == expected[item] for item in fired)
+    assert len(wheel) == 0
+
+
+def test_cancel_and_idle_jumps():
+    clock = FakeClock()
+    wheel: TimingWheel[str] = TimingWheel(0.1, clock=clock)
+    timer = wheel.schedule(0.25, "a")
+    wheel.schedule(0.25, "b")
+    assert len(wheel) == 2
+    wheel.cancel(timer)
+    wheel.cancel(timer)
+    assert len(wheel) == 1
+    clock.now = 0.2
+    assert wheel.advance() == []
+    clock.now = 0.35
+    assert wheel.advance() == ["b"]
+    # With nothing pending a long idle stretch costs nothing.
+    clock.now = 1e6
+    assert wheel.advance() == []
+    assert wheel._current == int(1e6 / 0.1)
+    wheel.schedule(0.1, "c")
+    clock.now += 0.15
+    assert wheel.advance() == ["c"]
+    with pytest.raises(ValueError):
+        TimingWheel(slots=6)
+
+
+async def test_scheduler_runs_callbacks_and_survives_their_errors():
+    fired = []
+
+    def callback(item):
+        fired.append(item)
+        if item == "bad":
+            raise RuntimeError("callback failed")
+
+    scheduler: RetryScheduler[str] = RetryScheduler(callback, tick=0.01)
+    await scheduler.start()
+    scheduler.schedule(0.03, "late")
+    scheduler.schedule(0.0, "bad")
+    cancelled = scheduler.schedule(0.02, "never")
+    scheduler.cancel(cancelled)
+    while len(fired) < 2:
+        await asyncio.sleep(0.01)
+    assert fired == ["bad", "late"]
+    assert len(scheduler) == 0
+    scheduler.schedule(0.01, "after idle")
+    while len(fired) < 3:
+        await asyncio.sleep(0.01)
+    await scheduler.stop()
+    scheduler.schedule(0.0, "stopped")
+    await asyncio.sleep(0.05)
+    assert fired[-1] == "after idle"
+    assert len(scheduler) == 1
+
+
+async def test_pipeline_retries_until_the_handler_succeeds():
+    attempts = []
+
+    async def handler(event):
+        attempts.append(event.attempts)
+        if len(attempts) < 3:
+            raise ConnectionError("flaky")
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, seed=1)
+    pipeline = Pipeline(handler, retry_policy=policy)
+    await pipeline.start()
+    pipeline.accept(*make_delivery())
+    while pipeline.stats.handled < 1:
+        await asyncio.sleep(0.01)
+    await pipeline.stop()
+    assert attempts == [0, 1, 2]
+    assert (pipeline.stats.retried, pipeline.stats.failed) == (2, 0)
+
+
+async def test_pipeline_gives_up_after_max_attempts():
+    async def handler(event):
+        raise ConnectionError("down")
+
+    pipeline = Pipeline(handler, retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01))
+    await pipeline.start()
+    pipeline.accept(*make_delivery())
+    while pipeline.stats.failed < 1:
+        await asyncio.sleep(0.01)
+    await pipeline.stop()
+    assert pipeline.stats.retried == 1
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import marshal
+import sys
+import textwrap
+
+import pytest
+
+from webhook_bluefly.events import decode_event
+from webhook_bluefly.routing import CACHE_VERSION, CompiledRoutes, Router, load_routes
+
+from .support import make_delivery
+
+# Names of the generated handler modules, in the order they were imported.
+IMPORTS: list[str] = []
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    """Write handler modules under a fresh name prefix and make them importable."""
+    prefix = f"handlers_{tmp_path.name.replace('-', '_')}"
+    package = tmp_path / prefix
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    def write(name: str, body: str = "", *, delay: float = 0.0) -> str:
+        source = f"""
+            import time
+            from tests.test_routing import IMPORTS
+            time.sleep({delay})
+            IMPORTS.append(__name__)
+
+            async def handle(event):
+                return (__name__, event.event_type)
+        """
+        (package / f"{name}.py").write_text(textwrap.dedent(source) + textwrap.dedent(body))
+        return f"{prefix}.{name}"
+
+    yield write
+    for name in [name for name in sys.modules if name.startswith(prefix)]:
+        del sys.modules[name]
+
+
+def event(event_type: str):
+    headers, body = make_delivery("evt_1", event_type)
+    return decode_event(headers, body, 0.0)
+
+
+def test_lookup_order():
+    routes = CompiledRoutes.compile(
+        {
+            "order.*": "m:order",
+            "order.ship*": "m:ship",
+            "order.created": "m:created",
+            "inventory.?pdated": "m:inventory",
+        },
+        "m:default",
+    )
+    assert [pattern for pattern, _ in routes.patterns] == [
+        "order.ship*",
+        "inventory.?pdated",
+        "order.*",
+    ]
+    assert routes.lookup("order.created") == "m:created"
+    assert routes.lookup("order.shipped") == "m:ship"
+    assert routes.lookup("order.cancelled") == "m:order"
+    assert routes.lookup("inventory.updated") == "m:inventory"
+    assert routes.lookup("refund.created") == "m:default"
+    assert CompiledRoutes.compile({"a": "m:a"}).lookup("b") is None
+    assert routes.specs() == {"m:order", "m:ship", "m:created", "m:inventory", "m:default"}
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"routes": {"order.*": "no_function"}},
+        {"routes": {"order.*": ":handle"}},
+        {"routes": {}, "default": "mod:"},
+        ["not", "an", "object"],
+    ],
+)
+def test_malformed_routes_are_refused(tmp_path, config):
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps(config))
+    with pytest.raises(ValueError):
+        load_routes(path)
+
+
+def test_missing_modules_fail_the_load(tmp_path):
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({"routes": {"order.*": "no_such_module_xyz:handle"}}))
+    with pytest.raises(ImportError):
+        load_routes(path)
+    path.write_text("{not json")
+    with pytest.raises(ValueError):
+        load_routes(path)
+
+
+def test_compiled_routes_are_cached_by_content(tmp_path, modules, monkeypatch):
+    spec = modules("orders") + ":handle"
+    path = tmp_path / "routes.json"
+    cache = tmp_path / "cache"
+    path.write_text(json.dumps({"routes": {"order.*": spec}}))
+    first = load_routes(path, cache_dir=cache)
+    [cached] = cache.iterdir()
+
+    checks = []
+    monkeypatch.setattr(CompiledRoutes, "check", lambda self: checks.append(self))
+    assert load_routes(path, cache_dir=cache) == first
+    assert checks == []
+    # A changed file is checked and cached anew.
+    path.write_text(json.dumps({"routes": {"order.*": spec}, "default": spec}))
+    assert load_routes(path, cache_dir=cache).default == spec
+    assert len(checks) == 1
+    assert len(list(cache.iterdir())) == 2
+
+    # Unreadable or outdated cache files are ignored and replaced.
+    cached.write_bytes(b"garbage")
+    path.write_text(json.dumps({"routes": {"order.*": spec}}))
+    assert load_routes(path, cache_dir=cache) == first
+    cached.write_bytes(marshal.dumps((CACHE_VERSION + 1, {}, (), None)))
+    assert load_routes(path, cache_dir=cache) == first
+    assert CompiledRoutes.loads(cached.read_bytes()) == first
+    assert len(checks) == 3
+
+
+async def test_router_imports_each_handler_on_first_use(modules):
+    orders = modules("orders", delay=0.1)
+    stock = modules("stock")
+    router = Router(CompiledRoutes.compile({"order.*": f"{orders}:handle"}, f"{stock}:handle"))
+    assert orders not in sys.modules
+
+    results = await asyncio.gather(
+        router(event("order.created")),
+        router(event("order.shipped")),
+        asyncio.sleep(0.01, "loop kept running"),
+    )
+    assert results == [
+        (orders, "order.created"),
+        (orders, "order.shipped"),
+        "loop kept running",
+    ]
+    assert IMPORTS.count(orders) == 1
+    assert stock not in IMPORTS
+    assert await router(event("refund.created")) == (stock, "refund.created")
+
+
+async def test_unrouted_events_and_failed_imports(modules):
+    broken = modules("broken", "raise RuntimeError('import failed')")
+    router = Router(CompiledRoutes.compile({"order.*": f"{broken}:handle"}))
+    with pytest.raises(LookupError):
+        await router(event("refund.created"))
+    with pytest.raises(RuntimeError):
+        await router(event("order.created"))
+    # The import is attempted again for the next event.
+    with pytest.raises(RuntimeError):
+        await router(event("order.created"))
+    assert IMPORTS.count(broken) == 2
+    assert not router._loading
+
+
+def test_preload_imports_every_handler(modules):
+    specs = [modules(name) + ":handle" for name in ("a", "b")]
+    router = Router(CompiledRoutes.compile({"x.*": specs[0]}, specs[1]))
+    router.preload()
+    assert set(IMPORTS[-2:]) == {spec.split(":")[0] for spec in specs}
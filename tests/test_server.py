@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from webhook_bluefly import ServerConfig, WebhookServer
+from webhook_bluefly.server import Request, Response
+
+from .support import encode_request, make_delivery, read_response
+
+
+@pytest.fixture(params=["stream", "fast"])
+def mode(request):
+    return request.param
+
+
+async def test_acks_before_the_handler_runs(mode):
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(event):
+        await release.wait()
+        handled.append(event.event_id)
+
+    async with WebhookServer(handler, ServerConfig(port=0, mode=mode)) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        headers, body = make_delivery("evt_slow")
+        writer.write(encode_request("POST", "/webhooks/bluefly", headers, body))
+        status, _, _ = await read_response(reader)
+        assert status == 202
+        assert handled == []
+        release.set()
+        writer.close()
+    assert handled == ["evt_slow"]
+
+
+async def test_keep_alive_and_pipelined_requests(mode):
+    async def handler(event):
+        pass
+
+    async with WebhookServer(handler, ServerConfig(port=0, mode=mode)) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        first = encode_request("POST", "/webhooks/bluefly", *make_delivery("evt_1"))
+        second = encode_request("POST", "/webhooks/bluefly", *make_delivery("evt_2"))
+        writer.write(first + second + encode_request("GET", "/healthz"))
+        statuses = [(await read_response(reader))[0] for _ in range(3)]
+        assert statuses == [202, 202, 200]
+        writer.close()
+    assert server.pipeline.stats.accepted == 2
+
+
+async def test_head_requests_get_no_body(mode):
+    async def handler(event):
+        pass
+
+    async with WebhookServer(handler, ServerConfig(port=0, mode=mode)) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("HEAD", "/healthz") + encode_request("GET", "/healthz"))
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 200 ") and b"Content-Length: 3\r\n" in head
+        # The GET's response follows the HEAD's headers directly.
+        status, _, body = await read_response(reader)
+        assert (status, body) == (200, b"ok\n")
+        writer.close()
+
+
+@pytest.mark.parametrize(
+    "request_bytes, expected",
+    [
+        (encode_request("GET", "/webhooks/bluefly"), 405),
+        (encode_request("GET", "/nowhere"), 404),
+        (encode_request("POST", "/webhooks/bluefly", body=b"not json"), 400),
+        (b"GARBAGE\r\n\r\n", 400),
+        (b"POST /webhooks/bluefly HTTP/1.1\r\nContent-Length: \xb2\r\n\r\n", 400),
+        (b"GET / HTTP/2.0\r\n\r\n", 505),
+    ],
+)
+async def test_error_statuses(mode, request_bytes, expected):
+    async def handler(event):
+        raise AssertionError("no event should be handled")
+
+    async with WebhookServer(handler, ServerConfig(port=0, mode=mode)) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(request_bytes)
+        status, _, _ = await read_response(reader)
+        assert status == expected
+        writer.close()
+
+
+async def test_oversized_body_is_refused(mode):
+    async def handler(event):
+        pass
+
+    config = ServerConfig(port=0, mode=mode, max_body_size=100)
+    async with WebhookServer(handler, config) as server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(encode_request("POST", "/webhooks/bluefly", body=b"x" * 101))
+        status, _, _ = await read_response(reader)
+        assert status == 413
+        assert await reader.read() == b""
+        writer.close()
+
+
+async def test_handle_routes_without_a_socket():
+    async def handler(event):
+        pass
+
+    server = WebhookServer(handler, ServerConfig(port=0))
+    await server.pipeline.start()
+    try:
+        headers, body = make_delivery()
+        response = await server.handle(
+            Request("POST", "/webhooks/bluefly", "HTTP/1.1", headers, body)
+        )
+        assert response.status == 202
+        health = await server.handle(Request("HEAD", "/healthz", "HTTP/1.1", {}))
+        assert health.status == 200
+    finally:
+        await server.stop()
+
+
+def test_response_encoding():
+    raw = Response(202).encode(False)
+    assert raw.startswith(b"HTTP/1.1 202 Accepted\r\n")
+    assert b"Connection: close" in raw or b"connection: close" in raw.lower()
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ServerConfig(mode="udp")
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from webhook_bluefly import CoalescingSink, Pipeline, RetryPolicy
+from webhook_bluefly.events import decode_event
+
+from .support import make_delivery
+
+_counter = 0
+
+
+def stock(sku: str, quantity: int):
+    global _counter
+    _counter += 1
+    headers, body = make_delivery(
+        f"evt_{_counter}", "inventory.updated", data={"sku": sku, "quantity": quantity}
+    )
+    return decode_event(headers, body, 0.0)
+
+
+def quantities(events) -> dict[str, int]:
+    return {e.data()["sku"]: e.data()["quantity"] for e in events}
+
+
+class Downstream:
+    """Records written batches; fails the writes it is told to."""
+
+    def __init__(self) -> None:
+        self.batches: list[dict[str, int]] = []
+        self.fail_next = 0
+        self.state: dict[str, int] = {}
+
+    async def __call__(self, events) -> None:
+        if self.fail_next:
+            self.fail_next -= 1
+            raise OSError("downstream unavailable")
+        batch = quantities(events)
+        self.batches.append(batch)
+        self.state.update(batch)
+
+
+async def test_emits_latest_event_per_key_in_first_seen_order():
+    downstream = Downstream()
+    sink = CoalescingSink(downstream, window=60)
+    futures = [await sink(stock(sku, q)) for sku, q in [("A", 1), ("B", 5), ("A", 2), ("A", 3)]]
+    assert len(sink) == 2
+    # Superseded events count as handled right away.
+    assert futures[0].done() and futures[2].done()
+    await sink.flush()
+    assert downstream.batches == [{"A": 3, "B": 5}]
+    assert list(downstream.batches[0]) == ["A", "B"]
+    assert all(f.done() and f.exception() is None for f in futures)
+    assert sink.stats.superseded == 2
+    assert sink.stats.emitted == 2
+
+
+async def test_flushes_after_the_window():
+    downstream = Downstream()
+    sink = CoalescingSink(downstream, window=0.01)
+    done = await sink(stock("A", 1))
+    await asyncio.wait_for(done, 1)
+    assert downstream.batches == [{"A": 1}]
+
+
+async def test_flushes_when_max_keys_is_reached():
+    downstream = Downstream()
+    sink = CoalescingSink(downstream, window=60, max_keys=2)
+    await sink(stock("A", 1))
+    done = await sink(stock("B", 1))
+    await asyncio.wait_for(done, 1)
+    await sink(stock("C", 1))
+    await sink.close()
+    assert downstream.batches == [{"A": 1, "B": 1}, {"C": 1}]
+
+
+async def test_failed_flush_fails_only_the_events_sent():
+    downstream = Downstream()
+    downstream.fail_next = 1
+    sink = CoalescingSink(downstream, window=60)
+    old = await sink(stock("A", 1))
+    sent = await sink(stock("A", 2))
+    await sink.flush()
+    assert old.exception() is None
+    assert isinstance(sent.exception(), OSError)
+    assert sink.stats.failed_batches == 1
+
+
+async def test_superseded_retry_is_not_written():
+    downstream = Downstream()
+    downstream.fail_next = 1
+    sink = CoalescingSink(downstream, window=60, retry_policy=RetryPolicy())
+    failed_event = stock("A", 1)
+    failed = await sink(failed_event)
+    await sink.flush()
+    assert isinstance(failed.exception(), OSError)
+    newer = await sink(stock("A", 2))
+    await sink.flush()
+    assert newer.exception() is None
+    # The pipeline retries the failed event after the newer one was written.
+    failed_event.attempts = 1
+    retry = await sink(failed_event)
+    assert retry.done() and retry.exception() is None
+    await sink.flush()
+    assert downstream.state == {"A": 2}
+
+
+async def test_retry_of_the_latest_failed_event_is_written():
+    downstream = Downstream()
+    downstream.fail_next = 1
+    sink = CoalescingSink(downstream, window=60, retry_policy=RetryPolicy())
+    older, latest = stock("A", 1), stock("A", 2)
+    futures = [await sink(older)]
+    await sink.flush()
+    older.attempts = 1
+    futures.append(await sink(latest))
+    downstream.fail_next = 1
+    await sink.flush()
+    assert all(isinstance(f.exception(), OSError) for f in futures)
+    # Both failed; only the later one may still write.
+    latest.attempts = 1
+    assert not (await sink(latest)).done()
+    stale = await sink(older)
+    assert stale.done()
+    await sink.flush()
+    assert downstream.batches == [{"A": 2}]
+    # Nothing is remembered once the latest event is written.
+    assert not sink._failed
+
+
+async def test_newer_event_that_failed_elsewhere_is_written():
+    # Regression: any event with failed attempts counted as a retry and was
+    # dropped while an older failed event for its key was remembered.
+    downstream = Downstream()
+    downstream.fail_next = 1
+    sink = CoalescingSink(downstream, window=60, retry_policy=RetryPolicy())
+    older = stock("A", 1)
+    await sink(older)
+    await sink.flush()
+    newer = stock("A", 2)
+    newer.attempts = 1  # its handler failed before it reached the sink
+    assert not (await sink(newer)).done()
+    await sink.flush()
+    assert downstream.state == {"A": 2}
+    older.attempts = 1
+    assert (await sink(older)).done()
+    assert not sink._failed
+
+
+@pytest.mark.parametrize("policy", [None, RetryPolicy(max_attempts=2)])
+async def test_events_given_up_on_are_not_remembered(policy):
+    downstream = Downstream()
+    downstream.fail_next = 2
+    sink = CoalescingSink(downstream, window=60, retry_policy=policy)
+    event = stock("A", 1)
+    event.attempts = 1
+    failed = await sink(event)
+    await sink.flush()
+    assert isinstance(failed.exception(), OSError)
+    assert not sink._failed
+
+
+async def test_event_arriving_during_a_failing_flush_supersedes_it():
+    gate = asyncio.Event()
+    written = []
+
+    async def downstream(events):
+        await gate.wait()
+        if not written:
+            written.append(None)
+            raise OSError("down")
+        written.append(quantities(events))
+
+    sink = CoalescingSink(downstream, window=60)
+    first = await sink(stock("A", 1))
+    flushing = asyncio.create_task(sink.flush())
+    await asyncio.sleep(0)
+    newer = await sink(stock("A", 2))
+    gate.set()
+    await flushing
+    assert first.exception() is None
+    await sink.flush()
+    assert newer.exception() is None
+    assert written[1:] == [{"A": 2}]
+
+
+async def test_pipeline_counts_events_handled_once_written():
+    downstream = Downstream()
+    sink = CoalescingSink(downstream, window=0.01)
+
+    async def handler(event):
+        return await sink(event)
+
+    pipeline = Pipeline(handler)
+    await pipeline.start()
+    for quantity in range(5):
+        headers, body = make_delivery(
+            f"evt_q{quantity}", "inventory.updated", data={"sku": "A", "quantity": quantity}
+        )
+        assert pipeline.accept(headers, body) == 202
+    await pipeline.stop()
+    assert pipeline.stats.handled == 5
+    assert downstream.state == {"A": 4}
+    assert sum(len(batch) for batch in downstream.batches) < 5
+
+
+async def test_pipeline_retries_keep_last_write_wins():
+    # Regression: a failed flush failed every coalesced event, and their
+    # jittered retries could write an older quantity after a newer one.
+    downstream = Downstream()
+    downstream.fail_next = 1
+    policy = RetryPolicy(max_attempts=5, base_delay=0.01, max_delay=0.05, seed=1)
+    sink = CoalescingSink(downstream, window=0.005, retry_policy=policy)
+
+    async def handler(event):
+        return await sink(event)
+
+    pipeline = Pipeline(handler, retry_policy=policy)
+    await pipeline.start()
+    for quantity in range(1, 6):
+        headers, body = make_delivery(
+            f"evt_q{quantity}", "inventory.updated", data={"sku": "A", "quantity": quantity}
+        )
+        assert pipeline.accept(headers, body) == 202
+        await asyncio.sleep(0.002)
+    await asyncio.sleep(0.02)
+    for quantity in (6, 7):
+        headers, body = make_delivery(
+            f"evt_q{quantity}", "inventory.updated", data={"sku": "A", "quantity": quantity}
+        )
+        assert pipeline.accept(headers, body) == 202
+    for _ in range(100):
+        if pipeline.stats.handled == 7:
+            break
+        await asyncio.sleep(0.01)
+    await pipeline.stop()
+    await sink.close()
+    assert pipeline.stats.handled == 7
+    assert downstream.state == {"A": 7}
+    assert all(json.dumps(b) for b in downstream.batches)
+
+
+def test_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        CoalescingSink(Downstream(), window=-1)
+    with pytest.raises(ValueError):
+        CoalescingSink(Downstream(), max_keys=0)
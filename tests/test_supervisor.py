@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import pytest
+
+from webhook_bluefly.cli import build_parser, main
+from webhook_bluefly.supervisor import STABLE_AFTER, Supervisor, WorkerSlot, reserve_port
+
+from .support import encode_request, make_delivery
+
+ROOT = Path(__file__).parents[1]
+
+
+async def handler(event):
+    """Event handler for the receivers started by these tests."""
+
+
+def wait_until(predicate, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting")
+        time.sleep(0.02)
+
+
+def stop(process: subprocess.Popen) -> int:
+    """SIGTERM ``process`` and return its exit status, killing it if it hangs."""
+    try:
+        process.send_signal(signal.SIGTERM)
+        return process.wait(20)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def test_restart_backoff():
+    clock = [100.0]
+    supervisor = Supervisor(
+        lambda slot: 0, 1, min_restart_delay=1.0, max_restart_delay=5.0, clock=lambda: clock[0]
+    )
+    slot = supervisor.slots[0]
+    delays = []
+    for _ in range(5):
+        slot.pid, slot.started_at = 1, clock[0]
+        supervisor._exited(slot, 1 << 8)
+        delays.append(slot.restart_delay)
+    assert delays == [1.0, 2.0, 4.0, 5.0, 5.0]
+    assert (slot.pid, slot.restarts, slot.restart_at) == (0, 5, 105.0)
+    # A worker that ran for a while starts over from the minimum.
+    slot.pid, slot.started_at = 1, clock[0]
+    clock[0] += STABLE_AFTER
+    supervisor._exited(slot, 0)
+    assert slot.restart_delay == 1.0
+    assert supervisor._next_deadline() == 1.0
+    with pytest.raises(ValueError):
+        Supervisor(lambda slot: 0, 0)
+    assert WorkerSlot(3).pid == 0
+
+
+def test_reserved_port_is_shared_by_listening_workers():
+    placeholder = reserve_port("127.0.0.1", 0)
+    port = placeholder.getsockname()[1]
+    listeners = []
+    try:
+        assert port
+        for _ in range(2):
+            sock = socket.socket()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("127.0.0.1", port))
+            sock.listen()
+            listeners.append(sock)
+        with socket.create_connection(("127.0.0.1", port), timeout=5):
+            pass
+    finally:
+        placeholder.close()
+        for sock in listeners:
+            sock.close()
+
+
+def test_workers_are_restarted_in_their_slot_and_stopped_on_sigterm(tmp_path):
+    log = tmp_path / "starts"
+    script = textwrap.dedent(
+        f"""
+        import os, sys, time
+        from webhook_bluefly.supervisor import Supervisor
+
+        def target(slot):
+            with open({str(log)!r}, "a") as f:
+                f.write(f"{{slot}} {{os.getpid()}}\\n")
+            with open({str(log)!r}) as f:
+                starts = sum(line.startswith(f"{{slot}} ") for line in f)
+            if slot == 0 and starts < 3:
+                return 3
+            time.sleep(60)
+            return 0
+
+        sys.exit(Supervisor(target, 2, min_restart_delay=0.05).run())
+        """
+    )
+    process = subprocess.Popen([sys.executable, "-c", script], cwd=ROOT, stderr=subprocess.PIPE)
+    try:
+
+        def starts() -> list[str]:
+            return log.read_text().split() if log.exists() else []
+
+        wait_until(lambda: starts()[0::2].count("0") == 3 and "1" in starts()[0::2])
+        pids = [int(pid) for pid in starts()[1::2]]
+        assert len(set(pids)) == 4
+        status = stop(process)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    assert status == 0
+    stderr = process.stderr.read().decode()
+    assert stderr.count("worker 0 exited with status 3") == 2
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+def test_cli_rejects_bad_settings(capsys):
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(["serve"])
+    spec = f"{__name__}:handler"
+    assert main(["serve", "--handler", spec, "--workers", "2", "--inventory-dir", "x"]) == 2
+    assert main(["serve", "--handler", "tests.no_such_module:handler"]) == 2
+    assert main(["serve", "--handler", "nocolon"]) == 2
+    assert main(["serve", "--handler", f"{__name__}:ROOT"]) == 2
+
+
+def test_cli_serves_with_several_workers(tmp_path):
+    command = [
+        sys.executable,
+        "-m",
+        "webhook_bluefly",
+        "serve",
+        "--handler",
+        f"{__name__}:handler",
+        "--workers",
+        "2",
+        "--port",
+        "0",
+        "--mode",
+        "fast",
+        "--dedup",
+        "--metrics",
+        "--wal-dir",
+        str(tmp_path / "wal"),
+        "--no-fsync",
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, stderr=subprocess.PIPE, text=True)
+    try:
+        port = 0
+        while not port:
+            line = process.stderr.readline()
+            assert line, "receiver exited early"
+            match = re.search(r"supervising 2 workers on [\d.]+:(\d+)", line)
+            port = int(match.group(1)) if match else 0
+        statuses = []
+        for i in range(8):
+            request = encode_request("POST", "/webhooks/bluefly", *make_delivery(f"evt_{i % 4}"))
+            statuses.append(post(port, request))
+        status = stop(process)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    assert status == 0
+    # Duplicates are caught whichever worker receives them.
+    assert statuses == [202] * 4 + [200] * 4
+    assert sorted(path.name for path in (tmp_path / "wal").iterdir()) == [
+        "worker-0",
+        "worker-1",
+    ]
+
+
+def post(port: int, request: bytes) -> int:
+    deadline = time.monotonic() + 20
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+                sock.sendall(request)
+                return int(sock.recv(64).split()[1])
+        except (ConnectionRefusedError, IndexError):
+            # Workers are still starting.
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import asyncio
+
+from webhook_bluefly import DeadLetterStore, Pipeline, RetryPolicy, Tracer, span
+
+from .support import make_delivery
+
+
+class ListExporter:
+    def __init__(self) -> None:
+        self.traces: list[list[dict]] = []
+
+    def export(self, spans: list[dict]) -> None:
+        self.traces.append(spans)
+
+    def close(self) -> None:
+        pass
+
+
+async def wait_for(predicate) -> None:
+    while not predicate():
+        await asyncio.sleep(0.005)
+
+
+async def test_sampled_event_is_exported_once_with_its_stages():
+    async def handler(event):
+        with span(event, "erp.push"):
+            pass
+
+    exporter = ListExporter()
+    pipeline = Pipeline(handler, tracer=Tracer(exporter, sample_rate=1.0))
+    await pipeline.start()
+    assert pipeline.accept(*make_delivery("evt_1")) == 202
+    await wait_for(lambda: exporter.traces)
+    await pipeline.stop()
+    [spans] = exporter.traces
+    root = spans[0]
+    assert root["attributes"]["outcome"] == "handled"
+    assert root["attributes"]["status"] == 202
+    assert {"receive", "dispatch", "handle", "erp.push"} <= {s["name"] for s in spans}
+    assert all(s["parent_id"] == root["span_id"] for s in spans[1:])
+
+
+async def test_unsampled_events_carry_no_trace():
+    seen = []
+
+    async def handler(event):
+        seen.append(event.trace)
+
+    exporter = ListExporter()
+    pipeline = Pipeline(handler, tracer=Tracer(exporter, sample_rate=0.0))
+    await pipeline.start()
+    pipeline.accept(*make_delivery("evt_1"))
+    await wait_for(lambda: seen)
+    await pipeline.stop()
+    assert seen == [None]
+    assert exporter.traces == []
+
+
+async def test_redriven_dead_letter_does_not_reuse_its_exported_trace():
+    # Regression: a letter held in memory kept the trace already exported
+    # when it failed, so the redrive closed it again and drove its pending
+    # count negative, adding spans to a finished trace.
+    healthy = False
+
+    async def handler(event):
+        if not healthy:
+            raise ConnectionError("down")
+
+    exporter = ListExporter()
+    store = DeadLetterStore()
+    pipeline = Pipeline(
+        handler,
+        retry_policy=RetryPolicy(max_attempts=1),
+        dead_letters=store,
+        tracer=Tracer(exporter, sample_rate=1.0),
+    )
+    await pipeline.start()
+    pipeline.accept(*make_delivery("evt_1"))
+    await wait_for(lambda: len(store) == 1)
+    await wait_for(lambda: exporter.traces)
+    trace = store.load(store.select()[0]).trace
+    assert trace is not None
+    spans = list(trace.spans)
+
+    stats = await pipeline.redrive()
+    assert stats.failed == 1
+    healthy = True
+    stats = await pipeline.redrive()
+    assert stats.succeeded == 1
+    await pipeline.stop()
+    assert trace._pending == 0
+    assert trace.spans == spans
+    assert len(exporter.traces) == 1
+    assert exporter.traces[0][0]["attributes"]["outcome"] == "failed"
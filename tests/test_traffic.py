@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import importlib.util
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+from webhook_bluefly import Pipeline
+from webhook_bluefly.httputil import parse_head
+
+_spec = importlib.util.spec_from_file_location(
+    "traffic", Path(__file__).parents[1] / "benchmarks" / "traffic.py"
+)
+traffic = sys.modules["traffic"] = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(traffic)
+
+
+def split_request(request: bytes) -> tuple[str, dict[str, str], bytes]:
+    head, _, body = request.partition(b"\r\n\r\n")
+    method, target, _, headers = parse_head(head)
+    assert int(headers["content-length"]) == len(body)
+    return target, headers, body
+
+
+def test_generated_traffic_is_deterministic_and_mixed():
+    requests = traffic.TrafficGenerator(seed=7).requests(2000)
+    assert requests == traffic.TrafficGenerator(seed=7).requests(2000)
+    assert requests != traffic.TrafficGenerator(seed=8).requests(2000)
+    ids = Counter(split_request(r)[1]["x-bluefly-event-id"] for r in requests)
+    duplicates = sum(count - 1 for count in ids.values())
+    assert 40 < duplicates < 160
+    topics = Counter(split_request(r)[1]["x-bluefly-event-type"].split(".")[0] for r in requests)
+    assert topics["inventory"] > topics["order"] > topics["product"] > 0
+
+
+def test_orders_follow_their_lifecycle():
+    generator = traffic.TrafficGenerator(duplicate_rate=0.0, mix=traffic.TrafficMix(1.0, 0, 0))
+    last: dict[str, int] = {}
+    for request in generator.requests(500):
+        _, headers, body = split_request(request)
+        event = json.loads(body)
+        data = event["data"]
+        assert event["type"] == f"order.{data['status']}"
+        assert data["sequence"] == last.get(data["order_id"], -1) + 1
+        last[data["order_id"]] = data["sequence"]
+    assert max(last.values()) == 2
+
+
+async def test_pipeline_accepts_the_generated_deliveries():
+    async def handler(event):
+        pass
+
+    generator = traffic.TrafficGenerator(seed=3, duplicate_rate=0.0)
+    pipeline = Pipeline(handler, verifier=generator.verifier)
+    await pipeline.start()
+    for request in generator.requests(300):
+        target, headers, body = split_request(request)
+        assert target == "/webhooks/bluefly"
+        assert pipeline.accept(headers, body) == 202
+    await pipeline.stop()
+    assert pipeline.stats.handled == 300
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from webhook_bluefly import Pipeline
+from webhook_bluefly import validation
+from webhook_bluefly.errors import ValidationError
+from webhook_bluefly.events import decode_event
+from webhook_bluefly.validation import Quarantine, Validators, compile_schema
+
+from .support import make_delivery
+
+SCHEMA = {
+    "type": "object",
+    "required": ["id", "lines"],
+    "additionalProperties": False,
+    "properties": {
+        "id": {"type": "string", "minLength": 2, "maxLength": 4},
+        "status": {"enum": ["new", "done"]},
+        "score": {"type": "number", "minimum": 0, "maximum": 1},
+        "note": {"type": ["string", "null"]},
+        "lines": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 3,
+            "items": {
+                "type": "object",
+                "required": ["qty"],
+                "properties": {"qty": {"type": "integer", "minimum": 1}},
+            },
+        },
+    },
+}
+
+
+def event(event_type: str = "order.created", data=None, **extra):
+    headers, body = make_delivery("evt_1", event_type, data=data, **extra)
+    return decode_event(headers, body, 0.0)
+
+
+def test_valid_values_pass():
+    validate = compile_schema(SCHEMA)
+    validate({"id": "ab", "lines": [{"qty": 1}]})
+    validate({"id": "abcd", "status": "done", "score": 1, "note": None, "lines": [{"qty": 3}] * 3})
+    assert "def validate(v0):" in validate.source
+
+
+@pytest.mark.parametrize(
+    "value, path, message",
+    [
+        ([], "", "expected object"),
+        ({"lines": [{"qty": 1}]}, "id", "is required"),
+        ({"id": 12, "lines": [{"qty": 1}]}, "id", "expected string"),
+        ({"id": "a", "lines": [{"qty": 1}]}, "id", "at least 2 characters"),
+        ({"id": "abcde", "lines": [{"qty": 1}]}, "id", "at most 4 characters"),
+        ({"id": "ab", "status": "old", "lines": [{"qty": 1}]}, "status", "must be one of"),
+        ({"id": "ab", "score": -1, "lines": [{"qty": 1}]}, "score", ">= 0"),
+        ({"id": "ab", "score": 1.5, "lines": [{"qty": 1}]}, "score", "<= 1"),
+        ({"id": "ab", "score": True, "lines": [{"qty": 1}]}, "score", "expected number"),
+        ({"id": "ab", "note": 1, "lines": [{"qty": 1}]}, "note", "string or null"),
+        ({"id": "ab", "lines": []}, "lines", "at least 1 items"),
+        ({"id": "ab", "lines": [{"qty": 1}] * 4}, "lines", "at most 3 items"),
+        ({"id": "ab", "lines": [{"qty": 1}, {"qty": 0}]}, "lines[1].qty", ">= 1"),
+        ({"id": "ab", "lines": [{"qty": 1}, {}]}, "lines[1].qty", "is required"),
+        ({"id": "ab", "lines": [{"qty": 1.0}]}, "lines[0].qty", "expected integer"),
+        ({"id": "ab", "lines": [{"qty": 1}], "extra": 1}, "extra", "is not allowed"),
+    ],
+)
+def test_invalid_values_name_the_failing_path(value, path, message):
+    with pytest.raises(ValidationError, match=message) as info:
+        compile_schema(SCHEMA)(value)
+    assert info.value.path == path
+
+
+def test_unsupported_schemas_fail_at_registration():
+    with pytest.raises(ValueError):
+        compile_schema({"type": "date"})
+    validators = Validators()
+    with pytest.raises(ValueError):
+        validators.register("order.created", 2, {"properties": {"x": {"type": "uuid"}}})
+
+
+def test_default_schemas():
+    validators = Validators()
+    line = {"sku": "A", "quantity": 1, "unit_price": 5}
+    data = {"order_id": "o-1", "status": "created", "lines": [line], "total": 5}
+    validators.validate(event("order.created", data))
+    validators.validate(event("order.shipped", {"order_id": "o-1", "status": "shipped"}))
+    validators.validate(event("inventory.updated", {"sku": "A", "quantity": 0}))
+    validators.validate(event("product.updated", {"sku": "A", "images": [{"url": "u"}]}))
+    with pytest.raises(ValidationError, match="lines"):
+        validators.validate(event("order.created", {"order_id": "o-1", "status": "created"}))
+    with pytest.raises(ValidationError, match="quantity"):
+        validators.validate(event("inventory.updated", {"sku": "A", "quantity": -1}))
+
+
+def test_versions_wildcards_and_strictness():
+    validators = Validators({("order.*", 1): {"type": "object"}})
+    validators.register("order.created", 2, {"type": "object", "required": ["v2"]})
+    validators.validate(event("order.created", {}))
+    validators.validate(event("order.created", {"v2": 1}, schema_version=2))
+    with pytest.raises(ValidationError, match="v2"):
+        validators.validate(event("order.created", {}, schema_version=2))
+    with pytest.raises(ValidationError, match="no schema"):
+        validators.validate(event("order.shipped", {}, schema_version=2))
+    with pytest.raises(ValidationError, match="no schema"):
+        validators.validate(event("refund.created", {}))
+    with pytest.raises(ValidationError, match="schema_version"):
+        validators.validate(event("order.created", {}, schema_version="2"))
+    Validators(strict=False).validate(event("refund.created", {}))
+
+
+def test_bodies_that_are_not_objects():
+    validators = Validators()
+    headers, _ = make_delivery()
+    with pytest.raises(ValidationError, match="not valid JSON"):
+        validators.validate(decode_event(headers, b"{", 0.0))
+    with pytest.raises(ValidationError, match="JSON object"):
+        validators.validate(decode_event(headers, b"[]", 0.0))
+
+
+def test_validators_compile_once_and_bound_their_cache(monkeypatch):
+    validators = Validators()
+    for _ in range(3):
+        assert validators.get("order.shipped") is validators.get("order.shipped")
+    assert validators.compilations == 1
+    assert validators.get("refund.created") is None
+    assert validators.compilations == 1
+    monkeypatch.setattr(validation, "MAX_CACHED", 4)
+    for i in range(10):
+        validators.get(f"order.custom_{i}")
+    assert len(validators._compiled) <= 4
+
+
+def test_quarantine_keeps_recent_events_and_writes_them(tmp_path):
+    path = tmp_path / "quarantine.jsonl"
+    quarantine = Quarantine(path, max_events=2)
+    for i in range(3):
+        quarantine.add(event(data={"n": i}), f"reason {i}")
+    assert quarantine.total == 3
+    assert [entry.reason for entry in quarantine] == ["reason 1", "reason 2"]
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["reason"] for line in lines] == ["reason 0", "reason 1", "reason 2"]
+    assert json.loads(lines[0]["body"])["data"] == {"n": 0}
+
+    broken = Quarantine(tmp_path / "missing" / "q.jsonl")
+    broken.add(event(), "kept in memory")
+    assert len(broken) == 1
+
+
+async def test_pipeline_quarantines_invalid_events():
+    handled = []
+
+    async def handler(event):
+        handled.append(event.event_id)
+
+    pipeline = Pipeline(handler, validators=Validators())
+    await pipeline.start()
+    pipeline.accept(*make_delivery("evt_bad", "inventory.updated", data={"sku": "", "quantity": 1}))
+    pipeline.accept(*make_delivery("evt_ok", "inventory.updated", data={"sku": "A", "quantity": 1}))
+    await asyncio.sleep(0)
+    await pipeline.stop()
+    assert handled == ["evt_ok"]
+    assert pipeline.stats.quarantined == 1
+    [entry] = pipeline.quarantine
+    assert entry.event.event_id == "evt_bad"
+    assert entry.reason.startswith("sku: ")
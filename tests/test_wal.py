@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from webhook_bluefly import DedupStore, Pipeline, WriteAheadLog
+from webhook_bluefly.events import WebhookEvent
+from webhook_bluefly.wal import SEGMENT_MAGIC, WALError, iter_records
+
+from .support import make_delivery
+
+
+async def append_all(wal: WriteAheadLog, count: int, start: int = 0) -> list[int]:
+    futures = [
+        wal.append(f"payload-{i}".encode(), f"key-{i}".encode())
+        for i in range(start, start + count)
+    ]
+    return list(await asyncio.gather(*futures))
+
+
+async def test_appends_resolve_to_increasing_seqs_in_one_commit(tmp_path):
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    seqs = await append_all(wal, 50)
+    assert seqs == list(range(1, 51))
+    assert wal.commits == 1
+    await wal.close()
+
+
+async def test_replay_after_reopen(tmp_path):
+    wal = WriteAheadLog(tmp_path, segment_size=256, fsync=False)
+    await wal.open()
+    for i in range(10):
+        await append_all(wal, 3, start=i * 3)
+    await wal.close()
+    assert len(wal.segments()) > 1
+
+    wal = WriteAheadLog(tmp_path, segment_size=256, fsync=False)
+    await wal.open()
+    assert wal.last_seq == 30
+    records = list(wal.replay(12))
+    assert [seq for seq, _ in records] == list(range(13, 31))
+    assert records[0][1] == b"payload-12"
+    assert await append_all(wal, 1, start=30) == [31]
+    await wal.close()
+
+
+async def test_torn_tail_is_truncated(tmp_path):
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    await append_all(wal, 5)
+    await wal.close()
+    segment = wal.segments()[-1]
+    size = segment.stat().st_size
+    with open(segment, "ab") as f:
+        f.write(b"\x07" * 11)
+
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    assert wal.last_seq == 5
+    assert wal.recovery.truncated_bytes == 11
+    assert segment.stat().st_size == size
+    await wal.close()
+
+
+async def test_corrupt_record_ends_recovery(tmp_path):
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    await append_all(wal, 3)
+    await wal.close()
+    segment = wal.segments()[-1]
+    data = bytearray(segment.read_bytes())
+    data[-1] ^= 0xFF
+    segment.write_bytes(bytes(data))
+    assert [seq for _, seq, _, _ in iter_records(bytes(data))] == [1, 2]
+
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    assert wal.last_seq == 2
+    await wal.close()
+
+
+async def test_rejects_foreign_files(tmp_path):
+    (tmp_path / f"{1:020d}.wal").write_bytes(b"not a segment at all")
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    with pytest.raises(WALError):
+        await wal.open()
+
+
+async def test_append_requires_open_log(tmp_path):
+    wal = WriteAheadLog(tmp_path)
+    with pytest.raises(WALError):
+        wal.append(b"x")
+
+
+async def test_pipeline_acks_once_the_event_is_logged(tmp_path):
+    async def handler(event):
+        pass
+
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    pipeline = Pipeline(handler, wal=wal)
+    await pipeline.start()
+    status = pipeline.accept(*make_delivery("evt_1"))
+    assert not isinstance(status, int)
+    assert await status == 202
+    await pipeline.stop()
+
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    [(seq, record)] = list(wal.replay())
+    assert WebhookEvent.from_record(record, seq).event_id == "evt_1"
+    await wal.close()
+
+
+async def test_pipeline_refuses_ids_too_long_to_log(tmp_path):
+    async def handler(event):
+        pass
+
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    dedup = DedupStore()
+    pipeline = Pipeline(handler, wal=wal, dedup=dedup)
+    await pipeline.start()
+    event_id = "e" * 70_000
+    assert pipeline.accept(*make_delivery(event_id)) == 400
+    assert not dedup.check_and_add(event_id)
+    await pipeline.stop()
+
+
+async def test_checkpoint_survives_reopen(tmp_path):
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    await append_all(wal, 4)
+    await wal.save_checkpoint(3)
+    await wal.close()
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    await wal.open()
+    assert wal.checkpoint == 3
+    assert [seq for seq, _ in wal.replay(wal.checkpoint)] == [4]
+    await wal.close()
+
+
+async def filled_log(tmp_path, batches: int = 10) -> WriteAheadLog:
+    wal = WriteAheadLog(tmp_path, segment_size=len(SEGMENT_MAGIC) + 64, fsync=False)
+    await wal.open()
+    for i in range(batches):
+        await append_all(wal, 2, start=i * 2)
+    return wal
+
+
+async def test_compact_deletes_handled_old_segments(tmp_path):
+    wal = await filled_log(tmp_path)
+    segments = wal.segments()
+    assert len(segments) == 10
+    await wal.save_checkpoint(wal.last_seq)
+    assert await wal.compact(wal.last_seq, time.time() + 1) == 9
+    assert wal.segments() == segments[-1:]
+    # The open segment stays and the log keeps working.
+    assert await append_all(wal, 1, start=100) == [21]
+    await wal.close()
+
+
+async def test_compact_keeps_segments_above_the_checkpoint(tmp_path):
+    wal = await filled_log(tmp_path)
+    # Segments hold seqs 1-2, 3-4, ...; only the first two are fully handled.
+    await wal.save_checkpoint(5)
+    assert await wal.compact(20, time.time() + 1) == 2
+    assert [seq for seq, _ in wal.replay(5)][0] == 6
+    assert await wal.compact(4, time.time() + 1) == 0
+    await wal.close()
+
+
+async def test_compact_keeps_recently_sealed_segments(tmp_path):
+    wal = await filled_log(tmp_path)
+    await wal.save_checkpoint(wal.last_seq)
+    assert await wal.compact(wal.last_seq, time.time() - 3600) == 0
+    assert len(wal.segments()) == 10
+    await wal.close()
+
+
+async def test_pipeline_compacts_after_checkpoints(tmp_path):
+    handled = []
+
+    async def handler(event):
+        handled.append(event.event_id)
+
+    wal = WriteAheadLog(tmp_path, segment_size=len(SEGMENT_MAGIC) + 64, fsync=False)
+    pipeline = Pipeline(handler, wal=wal, checkpoint_interval=0.01)
+    await pipeline.start()
+    for i in range(10):
+        status = pipeline.accept(*make_delivery(f"evt_{i}"))
+        assert await status == 202
+    for _ in range(100):
+        if len(wal.segments()) == 1:
+            break
+        await asyncio.sleep(0.01)
+    assert len(wal.segments()) == 1
+    await pipeline.stop()
+    assert len(handled) == 10
+
+
+def test_segment_size_is_bounded(tmp_path):
+    with pytest.raises(ValueError):
+        WriteAheadLog(tmp_path, segment_size=0)
+    assert not os.listdir(tmp_path)
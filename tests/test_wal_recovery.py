@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+from webhook_bluefly import DedupStore, Pipeline, WriteAheadLog
+from webhook_bluefly import wal as wal_module
+from webhook_bluefly.wal import FOOTER_TRAILER, SEGMENT_MAGIC
+
+from .support import make_delivery
+
+# Every commit after the first seals the previous segment.
+SMALL_SEGMENT = len(SEGMENT_MAGIC) + 1
+
+
+async def write_batches(path, batches: int, *, segment_size: int = SMALL_SEGMENT) -> WriteAheadLog:
+    wal = WriteAheadLog(path, segment_size=segment_size, fsync=False)
+    await wal.open()
+    for i in range(batches):
+        await asyncio.gather(
+            wal.append(b"a" * 8, f"k{i}a".encode()), wal.append(b"b" * 8, f"k{i}b".encode())
+        )
+    return wal
+
+
+def set_sealed_at(path, sealed_at: float) -> None:
+    # Rewrite a segment's trailer in place; the index crc does not cover it.
+    data = bytearray(path.read_bytes())
+    at = len(data) - FOOTER_TRAILER.size
+    fields = list(FOOTER_TRAILER.unpack_from(data, at))
+    fields[4] = sealed_at
+    FOOTER_TRAILER.pack_into(data, at, *fields)
+    path.write_bytes(bytes(data))
+
+
+async def test_recovers_sealed_segments_from_footers(tmp_path):
+    wal = await write_batches(tmp_path, 6)
+    await wal.close()
+    wal = WriteAheadLog(tmp_path, segment_size=SMALL_SEGMENT, fsync=False)
+    await wal.open()
+    assert wal.last_seq == 12
+    assert wal.recovery.segments == 6
+    assert wal.recovery.tail_records == 2
+    await wal.close()
+
+
+async def test_recent_keys_covers_recent_segments_and_the_tail(tmp_path):
+    wal = await write_batches(tmp_path, 4)
+    await wal.close()
+    old = wal.segments()[:2]
+    for path in old:
+        set_sealed_at(path, 1000.0)
+    wal = WriteAheadLog(tmp_path, segment_size=SMALL_SEGMENT, fsync=False)
+    await wal.open()
+    keys = list(wal.recent_keys(time.time() - 60))
+    assert keys == [b"k2a", b"k2b", b"k3a", b"k3b"]
+    assert len(list(wal.recent_keys(0))) == 8
+    await wal.close()
+
+
+async def test_recent_keys_does_not_read_old_footer_indexes(tmp_path, monkeypatch):
+    wal = await write_batches(tmp_path, 50)
+    await wal.close()
+    for path in wal.segments()[:-3]:
+        set_sealed_at(path, 1000.0)
+    parsed = []
+    real_read_footer = wal_module.read_footer
+
+    def counting_read_footer(data, path):
+        parsed.append(path)
+        return real_read_footer(data, path)
+
+    monkeypatch.setattr(wal_module, "read_footer", counting_read_footer)
+    wal = WriteAheadLog(tmp_path, segment_size=SMALL_SEGMENT, fsync=False)
+    await wal.open()
+    parsed.clear()
+    keys = list(wal.recent_keys(time.time() - 60))
+    assert len(keys) == 6
+    assert parsed == wal.segments()[-3:-1]
+    await wal.close()
+
+
+async def test_recent_keys_skips_unreadable_footers(tmp_path):
+    wal = await write_batches(tmp_path, 3)
+    await wal.close()
+    first = wal.segments()[0]
+    with open(first, "r+b") as f:
+        f.truncate(os.path.getsize(first) - 1)
+    wal = WriteAheadLog(tmp_path, segment_size=SMALL_SEGMENT, fsync=False)
+    await wal.open()
+    assert list(wal.recent_keys(0)) == [b"k1a", b"k1b", b"k2a", b"k2b"]
+    await wal.close()
+
+
+async def test_pipeline_restart_reloads_dedup_and_replays_unhandled(tmp_path):
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(event):
+        await release.wait()
+        handled.append(event.event_id)
+
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    pipeline = Pipeline(handler, wal=wal, dedup=DedupStore(100))
+    await pipeline.start()
+    for event_id in ("evt_1", "evt_2"):
+        assert await pipeline.accept(*make_delivery(event_id)) == 202
+    # Stop without handling: both events stay above the checkpoint.
+    await pipeline.stop(drain=False)
+    assert handled == []
+
+    release.set()
+    wal = WriteAheadLog(tmp_path, fsync=False)
+    pipeline = Pipeline(handler, wal=wal, dedup=DedupStore(100))
+    await pipeline.start()
+    assert pipeline.stats.replayed == 2
+    assert pipeline.accept(*make_delivery("evt_1")) == 200
+    await pipeline.stop()
+    assert sorted(handled) == ["evt_1", "evt_2"]
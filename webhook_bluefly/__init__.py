@@ -0,0 +1,122 @@
+"""Receiver and processing pipeline for Bluefly marketplace webhooks.
+
+Public names are imported from their submodules on first access, so
+``import webhook_bluefly`` is nearly free and the command line, which imports
+only the modules it uses, does not load unused parts such as the API
+client.
+"""
+
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .auth import SignatureVerifier
+    from .client import BlueflyClient, LocalTransport, TCPTransport
+    from .deadletter import DeadLetter, DeadLetterStore
+    from .dedup import DedupStore, SharedDedupStore
+    from .dispatch import Dispatcher
+    from .errors import (
+        APIError,
+        ClientError,
+        EnvelopeError,
+        FeedError,
+        HTTPProtocolError,
+        RateLimitError,
+        ValidationError,
+        WebhookBlueflyError,
+    )
+    from .events import WebhookEvent
+    from .feeds import FeedBatch, FeedDecoder, FeedIngestor, batched, iter_chunks, iter_items
+    from .inventory import InventoryIndex, StockLevel
+    from .metrics import MetricsRegistry
+    from .models import InventoryEvent, OrderEvent, ProductEvent, TypedEvent, typed_event
+    from .orders import OrderState, OrderStateStore
+    from .pipeline import Pipeline, RedriveStats
+    from .profiler import SamplingProfiler
+    from .ratelimit import Rate, RateLimiter, SharedBucketState
+    from .retry import RetryPolicy
+    from .routing import CompiledRoutes, Router, load_routes
+    from .server import ServerConfig, WebhookServer, run
+    from .sinks import CoalescingSink
+    from .tracing import JSONLinesExporter, Tracer, UDPExporter, span
+    from .validation import Quarantine, Validators
+    from .wal import WALError, WriteAheadLog
+
+__version__ = "0.1.0"
+
+# Public name -> defining submodule.
+_EXPORTS = {
+    "APIError": "errors",
+    "BlueflyClient": "client",
+    "ClientError": "errors",
+    "CoalescingSink": "sinks",
+    "CompiledRoutes": "routing",
+    "DeadLetter": "deadletter",
+    "DeadLetterStore": "deadletter",
+    "DedupStore": "dedup",
+    "Dispatcher": "dispatch",
+    "EnvelopeError": "errors",
+    "FeedBatch": "feeds",
+    "FeedDecoder": "feeds",
+    "FeedError": "errors",
+    "FeedIngestor": "feeds",
+    "HTTPProtocolError": "errors",
+    "InventoryEvent": "models",
+    "InventoryIndex": "inventory",
+    "JSONLinesExporter": "tracing",
+    "LocalTransport": "client",
+    "MetricsRegistry": "metrics",
+    "OrderEvent": "models",
+    "OrderState": "orders",
+    "OrderStateStore": "orders",
+    "Pipeline": "pipeline",
+    "ProductEvent": "models",
+    "Quarantine": "validation",
+    "Rate": "ratelimit",
+    "RateLimitError": "errors",
+    "RateLimiter": "ratelimit",
+    "RedriveStats": "pipeline",
+    "RetryPolicy": "retry",
+    "Router": "routing",
+    "SamplingProfiler": "profiler",
+    "ServerConfig": "server",
+    "SharedBucketState": "ratelimit",
+    "SharedDedupStore": "dedup",
+    "SignatureVerifier": "auth",
+    "StockLevel": "inventory",
+    "TCPTransport": "client",
+    "Tracer": "tracing",
+    "TypedEvent": "models",
+    "UDPExporter": "tracing",
+    "ValidationError": "errors",
+    "Validators": "validation",
+    "WALError": "wal",
+    "WebhookBlueflyError": "errors",
+    "WebhookEvent": "events",
+    "WebhookServer": "server",
+    "WriteAheadLog": "wal",
+    "batched": "feeds",
+    "iter_chunks": "feeds",
+    "iter_items": "feeds",
+    "load_routes": "routing",
+    "run": "server",
+    "span": "tracing",
+    "typed_event": "models",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *__all__})
@@ -0,0 +1,245 @@
+"""Command-line entry point: ``webhook-bluefly serve``.
+
+``serve`` runs the receiver with either one handler, named by ``--handler
+module:function``, or a :class:`~.routing.Router` over a ``--routes`` file.
+With ``--workers N`` greater than one it runs under the pre-fork
+:class:`~.supervisor.Supervisor`. A ``--handler`` module is imported once in
+the supervisor, so its code is shared copy-on-write by the forked workers
+and an import error is reported before anything is forked. Routed handlers
+are imported by each worker when their first event arrives, which makes a
+worker ready sooner; ``--preload`` imports them in the supervisor instead,
+which suits long-lived workers better. The checked routes file is cached
+under ``--routes-cache``, so restarts with an unchanged file skip the check.
+
+A write-ahead log only has one writer, so with ``--wal-dir`` each worker
+slot logs to its own ``worker-<slot>`` subdirectory of it. A restarted
+worker takes over its slot's log and replays the events its predecessor
+acked but did not handle. Lowering ``--workers`` leaves the logs of the
+removed slots unreplayed, so drain the receiver first. ``--dedup`` state, on
+the other hand, is one :class:`~.dedup.SharedDedupStore` created before the
+fork, so a redelivery is caught whichever worker it reaches. Likewise
+``--metrics`` creates one :class:`~.metrics.MetricsRegistry` for all
+workers, so a scrape of ``/metrics`` reports the whole receiver whichever
+worker answers it.
+
+``--inventory-dir`` keeps an :class:`~.inventory.InventoryIndex` of the
+inventory events received, served on ``/inventory`` and snapshotted to that
+directory. Deliveries are spread over the workers, so each would only index
+its share; it is therefore only available with a single worker.
+
+``--feed-handler module:function`` accepts catalog feeds pushed to
+``--feed-path``. Each feed is spooled to ``--feed-spool-dir`` and its items
+are passed to the handler in :class:`~.feeds.FeedBatch` lists of
+``--feed-batch-size``; see :mod:`webhook_bluefly.feeds`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+from pathlib import Path
+
+from .auth import SignatureVerifier
+from .dedup import DedupStore, SharedDedupStore
+from .feeds import FeedHandler, FeedIngestor
+from .inventory import InventoryIndex
+from .metrics import MetricsRegistry
+from .pipeline import Handler
+from .profiler import SamplingProfiler
+from .routing import Router, load_handler
+from .server import MODES, ServerConfig, WebhookServer
+from .supervisor import Supervisor, reserve_port
+from .tracing import JSONLinesExporter, Tracer
+from .wal import WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="webhook-bluefly", description="Receiver for Bluefly marketplace webhooks."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the webhook receiver")
+    handlers = serve.add_mutually_exclusive_group(required=True)
+    handlers.add_argument("--handler", help="event handler as module:function")
+    handlers.add_argument("--routes", help="JSON file routing event types to handlers")
+    serve.add_argument(
+        "--routes-cache", default=_default_cache_dir(), help="directory for compiled routes"
+    )
+    serve.add_argument(
+        "--preload", action="store_true", help="import routed handlers before starting"
+    )
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--path", default="/webhooks/bluefly", help="webhook route")
+    serve.add_argument("--mode", choices=MODES, default="stream")
+    serve.add_argument("--workers", type=int, default=1, help="receiver processes")
+    serve.add_argument(
+        "--partitions", type=int, default=1, help="dispatcher partitions per process"
+    )
+    serve.add_argument("--queue-size", type=int, default=10_000)
+    serve.add_argument("--secrets-file", help="JSON object mapping seller ids to secrets")
+    serve.add_argument("--dedup", action="store_true", help="drop redelivered event ids")
+    serve.add_argument("--dedup-ttl", type=float, default=24 * 3600.0)
+    serve.add_argument("--dedup-entries", type=int, default=1_000_000)
+    serve.add_argument("--wal-dir", help="write-ahead log directory; enables durable acks")
+    serve.add_argument("--no-fsync", action="store_true", help="do not fsync the log")
+    serve.add_argument("--metrics", action="store_true", help="serve Prometheus /metrics")
+    serve.add_argument(
+        "--profiling", action="store_true", help="serve the /debug/profile sampling profiler"
+    )
+    serve.add_argument(
+        "--inventory-dir", help="keep an /inventory index, snapshotted to this directory"
+    )
+    serve.add_argument(
+        "--inventory-interval", type=float, default=60.0, help="seconds between snapshots"
+    )
+    serve.add_argument("--feed-handler", help="catalog feed batch handler as module:function")
+    serve.add_argument("--feed-path", default="/feeds/bluefly", help="catalog feed route")
+    serve.add_argument("--feed-batch-size", type=int, default=500, help="items per feed batch")
+    serve.add_argument("--feed-spool-dir", help="directory for spooled feeds")
+    serve.add_argument("--trace-file", help="append sampled event traces to this file")
+    serve.add_argument(
+        "--trace-sample", type=float, default=0.01, help="fraction of events to trace"
+    )
+    serve.add_argument(
+        "--trace-min-duration", type=float, default=0.0, help="only keep traces this slow"
+    )
+    serve.add_argument("--log-level", default="INFO")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s",
+    )
+    return serve(args)
+
+
+def serve(args: argparse.Namespace) -> int:
+    if args.inventory_dir and args.workers > 1:
+        logger.error("--inventory-dir needs a single worker")
+        return 2
+    handler: Handler
+    feed_handler: FeedHandler | None = None
+    try:
+        if args.routes:
+            router = Router.from_file(args.routes, cache_dir=args.routes_cache or None)
+            if args.preload:
+                router.preload()
+            handler = router
+        else:
+            handler = load_handler(args.handler)
+        if args.feed_handler:
+            feed_handler = load_handler(args.feed_handler)  # type: ignore[assignment]
+    except (ImportError, AttributeError, ValueError, TypeError, OSError) as exc:
+        logger.error("cannot load handler: %s", exc)
+        return 2
+    metrics = MetricsRegistry(max(1, args.workers)) if args.metrics else None
+    if args.workers <= 1:
+        dedup = DedupStore(args.dedup_entries, args.dedup_ttl) if args.dedup else None
+        return _run_worker(args, handler, feed_handler, 0, dedup, metrics)
+    try:
+        placeholder = reserve_port(args.host, args.port)
+    except (OSError, RuntimeError) as exc:
+        logger.error("cannot bind %s:%d: %s", args.host, args.port, exc)
+        return 1
+    args.port = placeholder.getsockname()[1]
+    logger.info("supervising %d workers on %s:%d", args.workers, args.host, args.port)
+    shared = SharedDedupStore(args.dedup_entries, args.dedup_ttl) if args.dedup else None
+
+    def worker(slot: int) -> int:
+        placeholder.close()
+        return _run_worker(args, handler, feed_handler, slot, shared, metrics)
+
+    try:
+        return Supervisor(worker, args.workers).run()
+    finally:
+        placeholder.close()
+
+
+def _run_worker(
+    args: argparse.Namespace,
+    handler: Handler,
+    feed_handler: FeedHandler | None,
+    slot: int,
+    dedup: DedupStore | SharedDedupStore | None,
+    metrics: MetricsRegistry | None,
+) -> int:
+    config = ServerConfig(
+        host=args.host,
+        port=args.port,
+        path=args.path,
+        feed_path=args.feed_path,
+        mode=args.mode,
+        workers=args.partitions,
+        queue_size=args.queue_size,
+        reuse_port=args.workers > 1,
+    )
+    verifier = None
+    if args.secrets_file:
+        verifier = SignatureVerifier(json.loads(Path(args.secrets_file).read_text()))
+    wal = None
+    if args.wal_dir:
+        directory = Path(args.wal_dir)
+        if args.workers > 1:
+            directory = directory / f"worker-{slot}"
+        wal = WriteAheadLog(directory, fsync=not args.no_fsync)
+    if metrics is not None:
+        metrics.bind(slot)
+    tracer = None
+    if args.trace_file:
+        tracer = Tracer(
+            JSONLinesExporter(args.trace_file),
+            sample_rate=args.trace_sample,
+            min_duration=args.trace_min_duration,
+        )
+    inventory = None
+    if args.inventory_dir:
+        inventory = InventoryIndex(args.inventory_dir, snapshot_interval=args.inventory_interval)
+    feeds = None
+    if feed_handler is not None:
+        feeds = FeedIngestor(
+            feed_handler,
+            batch_size=args.feed_batch_size,
+            verifier=verifier,
+            spool_dir=args.feed_spool_dir,
+        )
+    server = WebhookServer(
+        handler,
+        config,
+        verifier=verifier,
+        dedup=dedup,
+        wal=wal,
+        metrics=metrics,
+        tracer=tracer,
+        profiler=SamplingProfiler() if args.profiling else None,
+        inventory=inventory,
+        feeds=feeds,
+    )
+    asyncio.run(_serve_until_signalled(server))
+    return 0
+
+
+async def _serve_until_signalled(server: WebhookServer) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await server.start()
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+
+
+def _default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "webhook-bluefly")
@@ -0,0 +1,447 @@
+"""Pooled keep-alive HTTP/1.1 client for calls back into the Bluefly seller API.
+
+Handlers acknowledge orders, confirm shipments and fetch full resources for
+thin webhooks. Opening a TCP and TLS connection for each of those calls costs
+several round trips, so :class:`BlueflyClient` keeps a pool of idle
+keep-alive connections per host and reuses the most recently used one
+first. A per-host connection limit and a client-wide concurrency limit keep
+a burst of callbacks from opening hundreds of sockets::
+
+    async with BlueflyClient(token=API_TOKEN) as api:
+        await api.acknowledge_order("BF-123")
+        order = await api.get_order("BF-123")
+
+With a :class:`~.ratelimit.RateLimiter`, each call first waits for its
+seller's and endpoint class's token bucket, so bursts are spread out locally
+instead of being answered 429 by Bluefly. Calls pass ``seller_id`` to pick
+the bucket.
+
+Connections are made through a :class:`Transport`. :class:`TCPTransport`
+shares one ``ssl.SSLContext`` across all connections, so CA certificates are
+loaded once. :class:`LocalTransport` sends every request to a local port in
+plain text, for tests against a stub server.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import ssl
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Mapping, Protocol
+from urllib.parse import quote, urlsplit
+
+from .errors import APIError, ClientError
+from .httputil import SERVER_NAME, parse_header_lines, wants_keep_alive
+from .ratelimit import RateLimiter, endpoint_class
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.bluefly.example"
+USER_AGENT = SERVER_NAME.decode()
+
+# Methods that may be resent when a pooled connection turns out to be dead.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+TOO_MANY_REQUESTS = 429
+# Pause assumed for a 429 without a usable Retry-After header.
+DEFAULT_RETRY_AFTER = 1.0
+
+Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class Transport(Protocol):
+    async def connect(self, host: str, port: int, secure: bool) -> Connection:
+        """Open a connection to ``host:port``, with TLS if ``secure``."""
+
+
+class TCPTransport:
+    """Plain TCP or TLS connections via :func:`asyncio.open_connection`."""
+
+    def __init__(self, ssl_context: ssl.SSLContext | None = None) -> None:
+        self._ssl_context = ssl_context
+
+    @property
+    def ssl_context(self) -> ssl.SSLContext:
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    async def connect(self, host: str, port: int, secure: bool) -> Connection:
+        return await asyncio.open_connection(
+            host, port, ssl=self.ssl_context if secure else None
+        )
+
+
+class LocalTransport:
+    """Connects every request to ``host:port`` without TLS, whatever the URL."""
+
+    def __init__(self, port: int, host: str = "127.0.0.1") -> None:
+        self.host = host
+        self.port = port
+
+    async def connect(self, host: str, port: int, secure: bool) -> Connection:
+        return await asyncio.open_connection(self.host, self.port)
+
+
+@dataclass(slots=True)
+class ClientResponse:
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def json(self) -> Any:
+        return json.loads(self.body) if self.body else None
+
+
+@dataclass
+class PoolStats:
+    opened: int = 0
+    reused: int = 0
+    closed: int = 0
+    idle: int = 0
+    in_use: int = 0
+
+
+class _PooledConnection:
+    __slots__ = ("reader", "writer", "idle_since", "requests")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.idle_since = 0.0
+        self.requests = 0
+
+    def close(self) -> None:
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class _HostPool:
+    """Idle connections to one ``(scheme, host, port)``, most recent last."""
+
+    __slots__ = ("host", "port", "secure", "idle", "limit", "stats")
+
+    def __init__(self, host: str, port: int, secure: bool, limit: int) -> None:
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.idle: deque[_PooledConnection] = deque()
+        self.limit = asyncio.Semaphore(limit)
+        self.stats = PoolStats()
+
+
+class BlueflyClient:
+    """Async client with per-host keep-alive pools and bounded concurrency.
+
+    ``max_connections_per_host`` caps open connections to each host;
+    ``max_concurrency`` caps in-flight requests across all hosts. Idle
+    connections older than ``idle_timeout`` seconds are closed instead of
+    reused. ``timeout`` bounds each request, including waiting for a
+    connection but not waiting for ``rate_limiter``.
+    """
+
+    def __init__(
+        self,
+        base_url: str = DEFAULT_BASE_URL,
+        *,
+        token: str | None = None,
+        transport: Transport | None = None,
+        max_connections_per_host: int = 16,
+        max_concurrency: int = 256,
+        idle_timeout: float = 30.0,
+        timeout: float = 10.0,
+        max_response_size: int = 16 * 1024 * 1024,
+        rate_limiter: RateLimiter | None = None,
+    ) -> None:
+        if max_connections_per_host < 1 or max_concurrency < 1:
+            raise ValueError("connection and concurrency limits must be >= 1")
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.transport = transport or TCPTransport()
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.max_response_size = max_response_size
+        self.rate_limiter = rate_limiter
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+        self._pools: dict[tuple[str, str, int], _HostPool] = {}
+        self._closed = False
+
+    async def __aenter__(self) -> BlueflyClient:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    def stats(self) -> dict[str, PoolStats]:
+        """Connection counters per ``scheme://host:port``."""
+        return {
+            f"{scheme}://{host}:{port}": pool.stats
+            for (scheme, host, port), pool in self._pools.items()
+        }
+
+    async def close(self) -> None:
+        """Close every idle connection; in-flight requests finish normally."""
+        self._closed = True
+        for pool in self._pools.values():
+            while pool.idle:
+                self._discard(pool, pool.idle.pop())
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        json_body: Any = None,
+        body: bytes = b"",
+        headers: Mapping[str, str] | None = None,
+        seller_id: str | None = None,
+    ) -> ClientResponse:
+        """Send one request and return the response, whatever its status.
+
+        ``url`` may be absolute or a path relative to ``base_url``. Raises
+        :class:`ClientError` if no response could be read. ``seller_id``
+        selects the rate limiter's bucket.
+        """
+        if self._closed:
+            raise ClientError("client is closed")
+        if url.startswith("/"):
+            url = self.base_url + url
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ClientError(f"unsupported URL {url!r}")
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target = f"{target}?{parts.query}"
+        if json_body is not None:
+            body = json.dumps(json_body, separators=(",", ":")).encode()
+        head = self._encode_head(method, parts.netloc, target, body, json_body is not None, headers)
+        pool = self._pool(parts.scheme, parts.hostname, port, secure)
+        limiter = self.rate_limiter
+        if limiter is not None:
+            endpoint = endpoint_class(method, parts.path)
+            await limiter.acquire(seller_id or "", endpoint)
+        try:
+            async with self._concurrency:
+                response = await asyncio.wait_for(
+                    self._send(pool, method, head + body), self.timeout
+                )
+        except asyncio.TimeoutError:
+            raise ClientError(f"{method} {url} timed out after {self.timeout}s") from None
+        if limiter is not None and response.status == TOO_MANY_REQUESTS:
+            limiter.throttled(seller_id or "", endpoint, _retry_after(response.headers))
+        return response
+
+    async def call(
+        self, method: str, path: str, json_body: Any = None, *, seller_id: str | None = None
+    ) -> Any:
+        """Send a request and return its decoded JSON body; raise :class:`APIError` on non-2xx."""
+        response = await self.request(method, path, json_body=json_body, seller_id=seller_id)
+        if not response.ok:
+            raise APIError(response.status, response.body, method, path)
+        return response.json()
+
+    async def acknowledge_order(self, order_id: str, *, seller_id: str | None = None) -> Any:
+        return await self.call(
+            "POST", f"/v1/orders/{quote(order_id, safe='')}/acknowledge", seller_id=seller_id
+        )
+
+    async def confirm_shipment(
+        self,
+        order_id: str,
+        tracking_number: str,
+        *,
+        carrier: str | None = None,
+        seller_id: str | None = None,
+    ) -> Any:
+        shipment = {"tracking_number": tracking_number, "carrier": carrier}
+        return await self.call(
+            "POST",
+            f"/v1/orders/{quote(order_id, safe='')}/shipments",
+            shipment,
+            seller_id=seller_id,
+        )
+
+    async def get_order(self, order_id: str, *, seller_id: str | None = None) -> Any:
+        return await self.call("GET", f"/v1/orders/{quote(order_id, safe='')}", seller_id=seller_id)
+
+    async def get_product(self, sku: str, *, seller_id: str | None = None) -> Any:
+        return await self.call("GET", f"/v1/products/{quote(sku, safe='')}", seller_id=seller_id)
+
+    async def get_inventory(self, sku: str, *, seller_id: str | None = None) -> Any:
+        return await self.call("GET", f"/v1/inventory/{quote(sku, safe='')}", seller_id=seller_id)
+
+    def _encode_head(
+        self,
+        method: str,
+        host: str,
+        target: str,
+        body: bytes,
+        is_json: bool,
+        headers: Mapping[str, str] | None,
+    ) -> bytes:
+        lines = [
+            f"{method} {target} HTTP/1.1",
+            f"Host: {host}",
+            f"User-Agent: {USER_AGENT}",
+            "Accept: application/json",
+        ]
+        if body or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(body)}")
+        if is_json:
+            lines.append("Content-Type: application/json")
+        if self.token is not None:
+            lines.append(f"Authorization: Bearer {self.token}")
+        if headers:
+            lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    def _pool(self, scheme: str, host: str, port: int, secure: bool) -> _HostPool:
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _HostPool(host, port, secure, self.max_connections_per_host)
+        return pool
+
+    async def _send(self, pool: _HostPool, method: str, data: bytes) -> ClientResponse:
+        async with pool.limit:
+            while True:
+                connection, reused = await self._checkout(pool)
+                pool.stats.in_use += 1
+                try:
+                    connection.writer.write(data)
+                    response, keep_alive = await self._read_response(connection.reader, method)
+                except (ConnectionError, asyncio.IncompleteReadError, EOFError) as exc:
+                    self._discard(pool, connection)
+                    # A pooled connection the server already closed fails
+                    # before any response; resend once on a fresh one.
+                    if reused and method in IDEMPOTENT_METHODS:
+                        logger.debug("retrying %s on a new connection after %r", method, exc)
+                        continue
+                    raise ClientError(f"connection to {pool.host}:{pool.port} failed: {exc!r}")
+                except BaseException:
+                    self._discard(pool, connection)
+                    raise
+                finally:
+                    pool.stats.in_use -= 1
+                connection.requests += 1
+                if keep_alive and not self._closed:
+                    connection.idle_since = time.monotonic()
+                    pool.idle.append(connection)
+                    pool.stats.idle = len(pool.idle)
+                else:
+                    self._discard(pool, connection)
+                return response
+
+    async def _checkout(self, pool: _HostPool) -> tuple[_PooledConnection, bool]:
+        deadline = time.monotonic() - self.idle_timeout
+        while pool.idle:
+            connection = pool.idle.pop()
+            pool.stats.idle = len(pool.idle)
+            if connection.idle_since < deadline or connection.reader.at_eof():
+                self._discard(pool, connection)
+                continue
+            pool.stats.reused += 1
+            return connection, True
+        try:
+            reader, writer = await self.transport.connect(pool.host, pool.port, pool.secure)
+        except (OSError, ssl.SSLError) as exc:
+            raise ClientError(f"could not connect to {pool.host}:{pool.port}: {exc}") from exc
+        pool.stats.opened += 1
+        return _PooledConnection(reader, writer), False
+
+    def _discard(self, pool: _HostPool, connection: _PooledConnection) -> None:
+        connection.close()
+        pool.stats.closed += 1
+
+    async def _read_response(
+        self, reader: asyncio.StreamReader, method: str
+    ) -> tuple[ClientResponse, bool]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as exc:
+            if not exc.partial:
+                raise EOFError("connection closed before the response") from None
+            raise
+        except asyncio.LimitOverrunError:
+            raise ClientError("response head too large") from None
+        lines = head[:-4].decode("latin-1").split("\r\n")
+        version, _, rest = lines[0].partition(" ")
+        status_text = rest[:3]
+        if version not in ("HTTP/1.1", "HTTP/1.0") or not _is_number(status_text):
+            raise ClientError(f"malformed status line {lines[0]!r}")
+        status = int(status_text)
+        try:
+            headers = parse_header_lines(lines[1:])
+        except ValueError as exc:
+            raise ClientError(str(exc)) from None
+        keep_alive = wants_keep_alive(version, headers)
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return ClientResponse(status, headers, b""), keep_alive
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            raw = headers["content-length"]
+            if not _is_number(raw):
+                raise ClientError("invalid content-length in response")
+            length = int(raw)
+            if length > self.max_response_size:
+                raise ClientError(f"response body of {length} bytes is too large")
+            body = await reader.readexactly(length)
+        else:
+            body = await self._read_to_close(reader)
+            keep_alive = False
+        return ClientResponse(status, headers, body), keep_alive
+
+    async def _read_to_close(self, reader: asyncio.StreamReader) -> bytes:
+        """Read a body delimited by the server closing the connection."""
+        chunks = []
+        total = 0
+        while chunk := await reader.read(64 * 1024):
+            total += len(chunk)
+            if total > self.max_response_size:
+                raise ClientError("response body is too large")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def _read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        total = 0
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            try:
+                size = int(size_line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise ClientError("malformed chunk size in response") from None
+            if size == 0:
+                # Skip trailers up to the final blank line.
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            total += size
+            if total > self.max_response_size:
+                raise ClientError("response body is too large")
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+
+def _retry_after(headers: Mapping[str, str]) -> float:
+    # Only the delta-seconds form; an HTTP date falls back to the default.
+    try:
+        return max(0.0, float(headers.get("retry-after", "")))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER
+
+
+def _is_number(text: str) -> bool:
+    # isdigit() alone accepts non-ASCII digits, which int() then refuses.
+    return text.isascii() and text.isdigit()
@@ -0,0 +1,330 @@
+"""Indexed store for events whose handler failed on every attempt.
+
+When a handler still fails after the last retry allowed by the pipeline's
+:class:`~.retry.RetryPolicy`, the event is handed to a
+:class:`DeadLetterStore` instead of being dropped. Dead letters are indexed
+by event type, seller, error class and time, so after an outage an operator
+can pick out exactly the events that failed because of it, e.g. every
+``order.*`` event that died with ``TimeoutError`` in the last hour, and
+redrive them with :meth:`~.pipeline.Pipeline.redrive`.
+
+Without a ``path`` the store keeps the events in memory. With one, it
+appends each dead letter to a single file, using the write-ahead log's
+checksummed record framing, and keeps only the indexed metadata and the
+record offset in memory; bodies are read back when an event is redriven.
+Records are written but not fsync'ed, like the quarantine file. The file
+layout is :data:`FILE_MAGIC` followed by records whose seq is the dead
+letter id::
+
+    added:    key = JSON of the DeadLetter fields | payload = WebhookEvent.to_record()
+    removed:  empty key | empty payload
+
+On open the file is scanned once to rebuild the indexes, a torn tail is
+truncated, and the file is rewritten without removed letters when they
+outnumber the live ones.
+"""
+
+from __future__ import annotations
+
+import bisect
+import fnmatch
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+from .events import WebhookEvent
+from .fileutil import MappedFile, write_all
+from .wal import RECORD_HEADER, WALError, iter_records, record_crc
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b"BFDLQ\x00\x01\x00"
+# Error messages are truncated so the metadata fits a record key.
+MAX_MESSAGE = 1000
+INDEXES = ("event_type", "seller_id", "error")
+
+
+@dataclass(slots=True)
+class DeadLetter:
+    """Metadata of one dead-lettered event; load the event with :meth:`DeadLetterStore.load`."""
+
+    id: int
+    event_id: str
+    event_type: str
+    seller_id: str
+    received_at: float
+    error: str
+    message: str
+    dead_at: float
+    attempts: int
+    _event: WebhookEvent | None = None
+    _offset: int = 0
+
+
+class DeadLetterStore:
+    """Dead-lettered events indexed by type, seller, error class and time."""
+
+    def __init__(
+        self, path: str | Path | None = None, *, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.path = Path(path) if path is not None else None
+        self.total = 0
+        self._clock = clock
+        self._letters: dict[int, DeadLetter] = {}
+        self._indexes: dict[str, dict[str, set[int]]] = {name: {} for name in INDEXES}
+        # Ids sorted by dead_at; removed ids are skipped and pruned lazily.
+        self._times: list[float] = []
+        self._ids: list[int] = []
+        self._next_id = 1
+        self._fd = -1
+        self._size = 0
+        if self.path is not None:
+            self._open(self.path)
+
+    def __len__(self) -> int:
+        return len(self._letters)
+
+    def __iter__(self) -> Iterator[DeadLetter]:
+        return iter(self.select())
+
+    def __contains__(self, letter: DeadLetter) -> bool:
+        return self._letters.get(letter.id) is letter
+
+    def get(self, letter_id: int) -> DeadLetter | None:
+        return self._letters.get(letter_id)
+
+    def add(self, event: WebhookEvent, error: BaseException) -> DeadLetter:
+        """Dead-letter ``event``, which failed with ``error`` on its last attempt."""
+        letter = DeadLetter(
+            self._next_id,
+            event.event_id,
+            event.event_type,
+            event.seller_id,
+            event.received_at,
+            type(error).__name__,
+            str(error)[:MAX_MESSAGE],
+            self._clock(),
+            event.attempts,
+        )
+        self._next_id += 1
+        if self._fd >= 0:
+            letter._offset = self._size
+            self._write(letter.id, _metadata(letter), event.to_record())
+        else:
+            letter._event = event
+        self._index(letter)
+        self.total += 1
+        return letter
+
+    def remove(self, letter: DeadLetter) -> None:
+        if self._letters.get(letter.id) is not letter:
+            return
+        del self._letters[letter.id]
+        for name in INDEXES:
+            index = self._indexes[name]
+            key = getattr(letter, name)
+            ids = index[key]
+            ids.discard(letter.id)
+            if not ids:
+                del index[key]
+        if self._fd >= 0:
+            self._write(letter.id, b"", b"")
+        if len(self._ids) > 2 * len(self._letters) + 1024:
+            self._prune_times()
+
+    def load(self, letter: DeadLetter) -> WebhookEvent:
+        """Return the dead-lettered event, reading it back from the file if needed."""
+        if letter._event is not None:
+            return letter._event
+        if self._fd < 0:
+            raise WALError(f"dead letter {letter.id} is not in memory and the store is closed")
+        header = os.pread(self._fd, RECORD_HEADER.size, letter._offset)
+        length, crc, seq, key_length = RECORD_HEADER.unpack(header)
+        data = os.pread(self._fd, key_length + length, letter._offset + RECORD_HEADER.size)
+        key, payload = data[:key_length], data[key_length:]
+        if seq != letter.id or record_crc(seq, key, payload) != crc:
+            raise WALError(f"dead letter {letter.id} is corrupt in {self.path}")
+        event = WebhookEvent.from_record(payload)
+        event.attempts = letter.attempts
+        return event
+
+    def select(
+        self,
+        *,
+        event_type: str | None = None,
+        seller_id: str | None = None,
+        error: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int | None = None,
+    ) -> list[DeadLetter]:
+        """Return matching dead letters, oldest first.
+
+        ``event_type`` may be a glob such as ``"order.*"``; ``since`` and
+        ``until`` bound ``dead_at``, inclusive and exclusive respectively.
+        """
+        letters = self._letters
+        candidates: set[int] | None = None
+        for name, value in (("seller_id", seller_id), ("error", error), ("event_type", event_type)):
+            if value is None:
+                continue
+            index = self._indexes[name]
+            if name == "event_type" and any(c in value for c in "*?["):
+                types = set(fnmatch.filter(index, value))
+                if candidates is not None:
+                    # Filter the narrower match rather than merging whole type sets.
+                    candidates = {i for i in candidates if letters[i].event_type in types}
+                else:
+                    candidates = set().union(*(index[key] for key in types))
+            else:
+                ids = index.get(value, set())
+                candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+        lo = 0 if since is None else bisect.bisect_left(self._times, since)
+        hi = len(self._times) if until is None else bisect.bisect_left(self._times, until)
+        if candidates is not None and len(candidates) < (hi - lo) // 8:
+            # Small index hit: sort it rather than walking the time range.
+            found = [letters[i] for i in candidates]
+            found = [
+                letter
+                for letter in found
+                if (since is None or letter.dead_at >= since)
+                and (until is None or letter.dead_at < until)
+            ]
+            found.sort(key=lambda letter: (letter.dead_at, letter.id))
+            return found[:limit] if limit is not None else found
+        result: list[DeadLetter] = []
+        for letter_id in self._ids[lo:hi]:
+            letter = letters.get(letter_id)
+            if letter is None or (candidates is not None and letter_id not in candidates):
+                continue
+            result.append(letter)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def counts(self, by: str) -> dict[str, int]:
+        """Number of dead letters per ``event_type``, ``seller_id`` or ``error``."""
+        if by not in self._indexes:
+            raise ValueError(f"cannot count dead letters by {by!r}; use one of {INDEXES}")
+        return {key: len(ids) for key, ids in self._indexes[by].items()}
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _index(self, letter: DeadLetter) -> None:
+        self._letters[letter.id] = letter
+        for name in INDEXES:
+            self._indexes[name].setdefault(getattr(letter, name), set()).add(letter.id)
+        if not self._times or letter.dead_at >= self._times[-1]:
+            self._times.append(letter.dead_at)
+            self._ids.append(letter.id)
+        else:
+            # The wall clock stepped back.
+            position = bisect.bisect_right(self._times, letter.dead_at)
+            self._times.insert(position, letter.dead_at)
+            self._ids.insert(position, letter.id)
+
+    def _prune_times(self) -> None:
+        letters = self._letters
+        keep = [i for i, letter_id in enumerate(self._ids) if letter_id in letters]
+        self._times = [self._times[i] for i in keep]
+        self._ids = [self._ids[i] for i in keep]
+
+    def _write(self, letter_id: int, key: bytes, payload: bytes) -> None:
+        record = b"".join(
+            (
+                RECORD_HEADER.pack(
+                    len(payload), record_crc(letter_id, key, payload), letter_id, len(key)
+                ),
+                key,
+                payload,
+            )
+        )
+        try:
+            write_all(self._fd, record)
+        except OSError:
+            logger.exception("could not write dead letter %d to %s", letter_id, self.path)
+            return
+        self._size += len(record)
+
+    def _open(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not path.exists() or path.stat().st_size == 0:
+            path.write_bytes(FILE_MAGIC)
+        removed = 0
+        with MappedFile(path) as data:
+            if data[: len(FILE_MAGIC)] != FILE_MAGIC:
+                raise WALError(f"{path} is not a dead-letter file")
+            end = len(FILE_MAGIC)
+            for offset, seq, key, payload in iter_records(data, len(FILE_MAGIC)):
+                end = offset + RECORD_HEADER.size + len(key) + len(payload)
+                self._next_id = max(self._next_id, seq + 1)
+                if payload:
+                    letter = DeadLetter(seq, **json.loads(str(key, "utf-8")))
+                    letter._offset = offset
+                    self._index(letter)
+                elif seq in self._letters:
+                    removed += 1
+                    self.remove(self._letters[seq])
+            size = len(data)
+        self._fd = os.open(path, os.O_RDWR)
+        if end < size:
+            logger.warning("truncating torn tail of %s at offset %d", path, end)
+            os.ftruncate(self._fd, end)
+        self._size = os.lseek(self._fd, end, os.SEEK_SET)
+        self.total = len(self._letters)
+        if removed > len(self._letters):
+            self._compact(path)
+        if self._letters:
+            logger.info("loaded %d dead letters from %s", len(self._letters), path)
+
+    def _compact(self, path: Path) -> None:
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            write_all(fd, FILE_MAGIC)
+            offset = len(FILE_MAGIC)
+            moved: list[tuple[DeadLetter, int]] = []
+            for letter in self.select():
+                event = self.load(letter)
+                key, payload = _metadata(letter), event.to_record()
+                crc = record_crc(letter.id, key, payload)
+                record = RECORD_HEADER.pack(len(payload), crc, letter.id, len(key))
+                write_all(fd, b"".join((record, key, payload)))
+                moved.append((letter, offset))
+                offset += RECORD_HEADER.size + len(key) + len(payload)
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmp)
+            raise
+        os.close(fd)
+        os.replace(tmp, path)
+        os.close(self._fd)
+        self._fd = os.open(path, os.O_RDWR)
+        self._size = offset
+        for letter, new_offset in moved:
+            letter._offset = new_offset
+
+
+def _metadata(letter: DeadLetter) -> bytes:
+    return json.dumps(
+        {
+            "event_id": letter.event_id,
+            "event_type": letter.event_type,
+            "seller_id": letter.seller_id,
+            "received_at": letter.received_at,
+            "error": letter.error,
+            "message": letter.message,
+            "dead_at": letter.dead_at,
+            "attempts": letter.attempts,
+        },
+        separators=(",", ":"),
+    ).encode()
@@ -0,0 +1,443 @@
+"""Bounded-memory idempotency store for Bluefly redeliveries.
+
+Bluefly redelivers an event whenever an ack is slow or lost, so the same
+event id can arrive many times. :class:`DedupStore` remembers recently seen
+ids in an exact LRU set with a TTL, bounded to ``max_entries``, fronted by a
+Bloom filter.
+
+The Bloom filter only ever answers "definitely new": ids it has not seen skip
+the exact set entirely, and ids it may have seen are confirmed against the
+exact set. A Bloom false positive therefore costs one extra lookup and never
+drops a legitimate event. The filter is split into two generations that
+rotate every ``max_entries`` insertions, so its false-positive rate stays
+bounded even though bits cannot be cleared.
+
+:class:`DedupStore` lives in one process. When the receiver runs as several
+pre-forked workers, a redelivery can land on a different worker than the
+original, so :class:`SharedDedupStore` keeps the ids in a hash table in
+anonymous shared memory instead, created before the fork and inherited by
+every worker. The table is split into buckets of :data:`BUCKET_SLOTS`
+slots; an id is hashed to one bucket and may occupy any slot in it, so a
+lookup reads at most one small contiguous run of memory and expired entries
+are reused in place without tombstones. Each slot stores a 64-bit
+fingerprint of the id and its expiry time. Buckets are guarded by a fixed
+set of striped locks, each one byte of an ``fcntl`` record lock on an
+unlinked temporary file, plus a thread lock per stripe within a process.
+The kernel drops a process's record locks when it exits, so a worker killed
+while holding a stripe cannot block it for the others.
+
+Taking a stripe therefore costs a system call to lock and another to
+unlock, so this store does not meet the goal of an uncontended lookup
+without system calls. A lock held in the mapping itself would need an
+atomic compare-and-swap to record its owner together with taking it, and
+Python has none for shared memory; without one, a worker that dies between
+taking the lock and recording itself as owner leaves a stripe that no one
+can safely release.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import mmap
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry cost of the exact set: OrderedDict slot and link node, the
+# float expiry and a typical ~30 character event id string.
+ENTRY_OVERHEAD = 230
+
+# Slots per bucket of the shared table: 16 fingerprints span two cache lines.
+BUCKET_SLOTS = 16
+
+
+@dataclass
+class DedupStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    bloom_negatives: int = 0
+    bloom_false_positives: int = 0
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter over strings, using double hashing."""
+
+    __slots__ = ("size", "hashes", "_bits")
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be >= 1 and 0 < error_rate < 1")
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.size = max(64, bits)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def positions(self, key: str) -> list[int]:
+        """Bit positions for ``key``; equal-sized filters share them."""
+        # str caches its hash, so this costs nothing extra when the same id
+        # is later looked up in a dict.
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def set_positions(self, positions: list[int]) -> None:
+        bits = self._bits
+        for pos in positions:
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def has_positions(self, positions: list[int]) -> bool:
+        bits = self._bits
+        for pos in positions:
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, key: str) -> None:
+        self.set_positions(self.positions(key))
+
+    def __contains__(self, key: str) -> bool:
+        return self.has_positions(self.positions(key))
+
+    def clear(self) -> None:
+        self._bits = bytearray(len(self._bits))
+
+
+class DedupStore:
+    """Remembers event ids for ``ttl`` seconds, holding at most ``max_entries``.
+
+    All operations are O(1) amortized. When the exact set is full the least
+    recently seen id is evicted; an evicted id that is redelivered is treated
+    as new, which only matters for retries older than the set can hold.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1_000_000,
+        ttl: float = 24 * 3600.0,
+        *,
+        bloom_error_rate: float = 0.01,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = DedupStats()
+        self._clock = clock
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._bloom = BloomFilter(max_entries, bloom_error_rate)
+        self._previous_bloom = BloomFilter(max_entries, bloom_error_rate)
+        self._bloom_count = 0
+
+    @classmethod
+    def for_memory_budget(
+        cls, budget_bytes: int, ttl: float = 24 * 3600.0, **kwargs: Any
+    ) -> DedupStore:
+        """Size a store so its exact set and Bloom filters fit ``budget_bytes``."""
+        error_rate = kwargs.get("bloom_error_rate", 0.01)
+        # Two Bloom generations cost 2 * -ln(p) / ln(2)^2 bits per entry.
+        bloom_per_entry = 2 * -math.log(error_rate) / math.log(2) ** 2 / 8
+        max_entries = int(budget_bytes / (ENTRY_OVERHEAD + bloom_per_entry))
+        return cls(max(1, max_entries), ttl, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def memory_estimate(self) -> int:
+        """Approximate bytes used when the exact set is full."""
+        blooms = self._bloom.nbytes + self._previous_bloom.nbytes
+        return self.max_entries * ENTRY_OVERHEAD + blooms
+
+    def __contains__(self, event_id: str) -> bool:
+        expires = self._entries.get(event_id)
+        return expires is not None and expires > self._clock()
+
+    def check_and_add(self, event_id: str) -> bool:
+        """Record ``event_id`` and return True if it was already present."""
+        now = self._clock()
+        entries = self._entries
+        stats = self.stats
+        bloom = self._bloom
+        positions = bloom.positions(event_id)
+        if not bloom.has_positions(positions) and not self._previous_bloom.has_positions(positions):
+            stats.bloom_negatives += 1
+        else:
+            expires = entries.get(event_id)
+            if expires is not None:
+                if expires > now:
+                    entries.move_to_end(event_id)
+                    # Keep recently seen ids in the current Bloom generation,
+                    # see _insert.
+                    bloom.set_positions(positions)
+                    stats.hits += 1
+                    return True
+                del entries[event_id]
+                stats.expirations += 1
+            else:
+                stats.bloom_false_positives += 1
+        stats.misses += 1
+        self._insert(event_id, positions, now)
+        return False
+
+    def preload(self, event_ids: Iterable[str]) -> int:
+        """Insert ids recovered at startup without counting them as misses."""
+        now = self._clock()
+        bloom = self._bloom
+        count = 0
+        for event_id in event_ids:
+            if event_id not in self._entries:
+                self._insert(event_id, bloom.positions(event_id), now)
+                bloom = self._bloom
+                count += 1
+        return count
+
+    def discard(self, event_id: str) -> None:
+        """Forget ``event_id`` so a redelivery is accepted again.
+
+        Used when a delivery was recorded but could not be accepted, e.g. the
+        queue was full; the Bloom bits stay set, which is harmless. The
+        insertion no longer counts towards rotating the Bloom generations,
+        see :meth:`_insert`.
+        """
+        if self._entries.pop(event_id, None) is not None and self._bloom_count:
+            self._bloom_count -= 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bloom.clear()
+        self._previous_bloom.clear()
+        self._bloom_count = 0
+
+    def _insert(self, event_id: str, positions: list[int], now: float) -> None:
+        entries = self._entries
+        entries[event_id] = now + self.ttl
+        self._bloom.set_positions(positions)
+        self._bloom_count += 1
+        if self._bloom_count >= self.max_entries:
+            # Every sighting re-adds an id to the current generation, and
+            # discard() uncounts insertions that left the set, so at least
+            # max_entries live ids are newer than any id last seen in the
+            # previous generation: LRU eviction has dropped all of those, and
+            # the generation cleared here holds no live ids.
+            self._previous_bloom, self._bloom = self._bloom, self._previous_bloom
+            self._bloom.clear()
+            self._bloom_count = 0
+        self._expire(now)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _expire(self, now: float) -> None:
+        entries = self._entries
+        while entries:
+            event_id, expires = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[event_id]
+            self.stats.expirations += 1
+
+
+class SharedDedupStore:
+    """A :class:`DedupStore` counterpart shared by forked worker processes.
+
+    Create it in the parent before forking. Capacity is fixed: when an id's
+    bucket is full of live entries, the one closest to expiry is evicted,
+    the equivalent of :class:`DedupStore`'s LRU eviction. Two ids collide
+    only if their 64-bit string hashes are equal, which at a million stored
+    ids happens about once per 10^13 lookups. ``stats`` counts this
+    process's operations only.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1_000_000,
+        ttl: float = 24 * 3600.0,
+        *,
+        stripes: int = 64,
+        load_factor: float = 0.75,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if fcntl is None:
+            raise RuntimeError("shared dedup state needs fcntl record locks")
+        if max_entries < 1 or stripes < 1 or not 0 < load_factor <= 1:
+            raise ValueError("max_entries and stripes must be >= 1 and 0 < load_factor <= 1")
+        buckets = 1 << max(0, math.ceil(math.log2(max_entries / load_factor / BUCKET_SLOTS)))
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.slots = buckets * BUCKET_SLOTS
+        self.stats = DedupStats()
+        self._clock = clock
+        self._bucket_mask = buckets - 1
+        stripes = min(stripes, buckets)
+        self._stripes = stripes
+        # Layout: fingerprints (u64) | expiry times (f64).
+        self._map = mmap.mmap(-1, self.slots * 16)
+        view = memoryview(self._map)
+        self._fingerprints = view[: self.slots * 8].cast("Q")
+        self._expires = view[self.slots * 8 :].cast("d")
+        # Byte ``stripe`` of this file is that stripe's lock. Record locks
+        # belong to a process, so threads of one also take the stripe's
+        # entry in ``_thread_locks``.
+        self._lock_file = tempfile.TemporaryFile()
+        self._fd = self._lock_file.fileno()
+        self._thread_locks = [threading.Lock() for _ in range(stripes)]
+        _stores.add(self)
+
+    @property
+    def memory_estimate(self) -> int:
+        return len(self._map)
+
+    def __len__(self) -> int:
+        """Live entries; scans the whole table, so for diagnostics only."""
+        now = self._clock()
+        fingerprints, expires = self._fingerprints, self._expires
+        return sum(1 for i in range(self.slots) if fingerprints[i] and expires[i] > now)
+
+    def __contains__(self, event_id: str) -> bool:
+        fingerprint, start = self._locate(event_id)
+        for slot in range(start, start + BUCKET_SLOTS):
+            if self._fingerprints[slot] == fingerprint:
+                return self._expires[slot] > self._clock()
+        return False
+
+    def check_and_add(self, event_id: str) -> bool:
+        """Record ``event_id`` and return True if any worker already did."""
+        if self._add(event_id):
+            self.stats.hits += 1
+            return True
+        self.stats.misses += 1
+        return False
+
+    def preload(self, event_ids: Iterable[str]) -> int:
+        """Insert ids recovered at startup, skipping those already present."""
+        return sum(1 for event_id in event_ids if not self._add(event_id))
+
+    def discard(self, event_id: str) -> None:
+        fingerprint, start = self._locate(event_id)
+        stripe = (start // BUCKET_SLOTS) % self._stripes
+        self._acquire(stripe)
+        try:
+            slot = self._find(fingerprint, start)
+            if slot >= 0:
+                self._fingerprints[slot] = 0
+                self._expires[slot] = 0.0
+        finally:
+            self._release(stripe)
+
+    def clear(self) -> None:
+        # All stripes at once, as one record lock over their bytes.
+        self._acquire(0, self._stripes)
+        try:
+            self._map[:] = bytes(self.slots * 16)
+        finally:
+            self._release(0, self._stripes)
+
+    def _add(self, event_id: str) -> bool:
+        fingerprint, start = self._locate(event_id)
+        stripe = (start // BUCKET_SLOTS) % self._stripes
+        self._acquire(stripe)
+        try:
+            now = self._clock()
+            slot = self._find(fingerprint, start)
+            if slot >= 0:
+                if self._expires[slot] > now:
+                    return True
+                self.stats.expirations += 1
+            else:
+                slot = self._free_slot(start, now)
+            self._fingerprints[slot] = fingerprint
+            self._expires[slot] = now + self.ttl
+            return False
+        finally:
+            self._release(stripe)
+
+    def _locate(self, event_id: str) -> tuple[int, int]:
+        # hash() is only stable within one interpreter's hash seed. That is
+        # enough here: every process that shares the table was forked from
+        # the one that created it, and str caches its hash.
+        h = hash(event_id) & 0xFFFFFFFFFFFFFFFF
+        return h or 1, ((h >> 40) & self._bucket_mask) * BUCKET_SLOTS
+
+    def _find(self, fingerprint: int, start: int) -> int:
+        bucket = self._fingerprints[start : start + BUCKET_SLOTS].tolist()
+        try:
+            return start + bucket.index(fingerprint)
+        except ValueError:
+            return -1
+
+    def _free_slot(self, start: int, now: float) -> int:
+        end = start + BUCKET_SLOTS
+        try:
+            return start + self._fingerprints[start:end].tolist().index(0)
+        except ValueError:
+            pass
+        expires = self._expires[start:end].tolist()
+        oldest = min(expires)
+        if oldest > now:
+            self.stats.evictions += 1
+        else:
+            self.stats.expirations += 1
+        return start + expires.index(oldest)
+
+    def _acquire(self, stripe: int, count: int = 1) -> None:
+        # Thread locks are always taken in stripe order, so clear() cannot
+        # deadlock with a single-stripe operation.
+        locks = self._thread_locks[stripe : stripe + count]
+        taken = 0
+        try:
+            for lock in locks:
+                lock.acquire()
+                taken += 1
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, count, stripe)
+        except BaseException:
+            for lock in reversed(locks[:taken]):
+                lock.release()
+            raise
+
+    def _release(self, stripe: int, count: int = 1) -> None:
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, count, stripe)
+        finally:
+            for lock in reversed(self._thread_locks[stripe : stripe + count]):
+                lock.release()
+
+    def _after_fork(self) -> None:
+        # Other threads may have held thread locks at the fork; the child
+        # holds none of the record locks.
+        self._thread_locks = [threading.Lock() for _ in range(self._stripes)]
+        self.stats = DedupStats()
+
+
+# Every SharedDedupStore of this process, for the one fork hook below.
+_stores: weakref.WeakSet[SharedDedupStore] = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for store in list(_stores):
+        store._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,206 @@
+"""Key-partitioned dispatch of accepted events to handler workers.
+
+Events for the same Bluefly order or SKU must be handled in the order they
+were accepted, but unrelated keys can be handled in parallel. The
+:class:`Dispatcher` hashes each event's partition key onto one of N queues,
+each drained by exactly one worker task: per-key order is preserved and
+distinct keys spread across workers.
+
+Worker counts are configurable per topic, so a flood of product updates
+cannot hold up order handling::
+
+    Dispatcher(handler, workers={"order": 8, "inventory": 4, "*": 2})
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Mapping
+
+from .events import TOPIC_INVENTORY, TOPIC_ORDER, TOPIC_PRODUCT, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GROUP = "*"
+
+# Envelope ``data`` fields that identify the entity an event is about, by topic.
+PARTITION_FIELDS: dict[str, tuple[str, ...]] = {
+    TOPIC_ORDER: ("order_id",),
+    TOPIC_INVENTORY: ("sku",),
+    TOPIC_PRODUCT: ("sku", "product_id"),
+}
+
+
+def partition_key(event: WebhookEvent) -> str:
+    """Return the order id or SKU an event is about, falling back to its event id.
+
+    Only the needed ``data`` members are scanned from the body, and the
+    result is cached on the event.
+    """
+    key = event.partition
+    if key is None:
+        key = event.partition = _scan_partition_key(event)
+    return key
+
+
+def _scan_partition_key(event: WebhookEvent) -> str:
+    fields = PARTITION_FIELDS.get(event.topic)
+    if fields:
+        try:
+            data = event.data_fields(fields)
+        except ValueError:
+            data = {}
+        for name in fields:
+            value = data.get(name)
+            if value is not None:
+                return str(value)
+    return event.event_id
+
+
+@dataclass
+class PartitionStats:
+    depth: int
+    dispatched: int
+
+
+class _Group:
+    """The partitions serving one topic, or the default group."""
+
+    __slots__ = ("name", "queues", "dispatched")
+
+    def __init__(self, name: str, workers: int, queue_size: int) -> None:
+        if workers < 1:
+            raise ValueError(f"worker count for {name!r} must be >= 1")
+        per_queue = max(1, queue_size // workers) if queue_size > 0 else 0
+        self.name = name
+        self.queues: list[asyncio.Queue[WebhookEvent]] = [
+            asyncio.Queue(per_queue) for _ in range(workers)
+        ]
+        self.dispatched = [0] * workers
+
+
+class Dispatcher:
+    """Runs ``handler`` for each submitted event on its key's worker.
+
+    ``queue_size`` is the total capacity of a group, split evenly between its
+    partitions. ``handler`` exceptions are logged and do not stop the worker.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[WebhookEvent], Awaitable[None]],
+        *,
+        workers: int | Mapping[str, int] = 1,
+        queue_size: int = 10_000,
+        key_func: Callable[[WebhookEvent], str] = partition_key,
+    ) -> None:
+        if isinstance(workers, int):
+            workers = {DEFAULT_GROUP: workers}
+        elif DEFAULT_GROUP not in workers:
+            workers = {**workers, DEFAULT_GROUP: 1}
+        self.handler = handler
+        self.workers = dict(workers)
+        self.queue_size = queue_size
+        self.key_func = key_func
+        self._groups: dict[str, _Group] = {}
+        self._default: _Group | None = None
+        self._tasks: list[asyncio.Task[None]] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def route(self, event: WebhookEvent) -> asyncio.Queue[WebhookEvent]:
+        """Return the queue ``event`` belongs to."""
+        group = self._groups.get(event.topic) or self._default
+        if group is None:
+            raise RuntimeError("dispatcher is not started")
+        queues = group.queues
+        if len(queues) == 1:
+            return queues[0]
+        return queues[hash(self.key_func(event)) % len(queues)]
+
+    def submit(
+        self, event: WebhookEvent, queue: asyncio.Queue[WebhookEvent] | None = None
+    ) -> bool:
+        """Queue ``event`` without waiting; return False if its partition is full.
+
+        ``queue`` may be passed when the caller already routed the event.
+        """
+        if queue is None:
+            queue = self.route(event)
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put(self, event: WebhookEvent) -> None:
+        """Queue ``event``, waiting for room in its partition."""
+        await self.route(event).put(event)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._groups = {
+            name: _Group(name, count, self.queue_size) for name, count in self.workers.items()
+        }
+        self._default = self._groups.pop(DEFAULT_GROUP)
+        for group in self._all_groups():
+            for i, queue in enumerate(group.queues):
+                self._tasks.append(
+                    asyncio.create_task(
+                        self._work(group, i, queue), name=f"bluefly-dispatch-{group.name}-{i}"
+                    )
+                )
+
+    async def join(self) -> None:
+        """Wait until every queued event has been handled."""
+        for group in self._all_groups():
+            for queue in group.queues:
+                await queue.join()
+
+    async def stop(self, *, drain: bool = True) -> None:
+        if not self._tasks:
+            return
+        if drain:
+            await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._groups = {}
+        self._default = None
+
+    def stats(self) -> dict[str, list[PartitionStats]]:
+        """Queue depth and events dispatched per partition, by group."""
+        return {
+            group.name: [
+                PartitionStats(queue.qsize(), dispatched)
+                for queue, dispatched in zip(group.queues, group.dispatched)
+            ]
+            for group in self._all_groups()
+        }
+
+    def _all_groups(self) -> list[_Group]:
+        groups = list(self._groups.values())
+        if self._default is not None:
+            groups.append(self._default)
+        return groups
+
+    async def _work(self, group: _Group, index: int, queue: asyncio.Queue[WebhookEvent]) -> None:
+        handler = self.handler
+        dispatched = group.dispatched
+        while True:
+            event = await queue.get()
+            try:
+                await handler(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("handler failed for event %s", event.event_id)
+            finally:
+                dispatched[index] += 1
+                queue.task_done()
@@ -0,0 +1,48 @@
+"""Exception hierarchy for webhook-bluefly."""
+
+from __future__ import annotations
+
+
+class WebhookBlueflyError(Exception):
+    """Base class for all errors raised by this package."""
+
+
+class EnvelopeError(WebhookBlueflyError):
+    """A webhook request is missing or has a malformed event envelope."""
+
+
+class HTTPProtocolError(WebhookBlueflyError):
+    """A request could not be parsed; the connection is answered and closed."""
+
+    def __init__(self, status: int, reason: str) -> None:
+        super().__init__(reason)
+        self.status = status
+
+
+class FeedError(WebhookBlueflyError):
+    """A catalog feed is malformed, truncated or has an item that is too large."""
+
+
+class ValidationError(WebhookBlueflyError):
+    """An event payload does not match the schema for its type and version."""
+
+    def __init__(self, message: str, path: str = "") -> None:
+        super().__init__(f"{path}: {message}" if path else message)
+        self.path = path
+
+
+class ClientError(WebhookBlueflyError):
+    """An outbound request to the Bluefly API could not be completed."""
+
+
+class RateLimitError(ClientError):
+    """An outbound call would have to wait longer than the rate limiter allows."""
+
+
+class APIError(ClientError):
+    """The Bluefly API answered with a non-2xx status."""
+
+    def __init__(self, status: int, body: bytes, method: str, url: str) -> None:
+        super().__init__(f"{method} {url} returned {status}")
+        self.status = status
+        self.body = body
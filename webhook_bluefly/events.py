@@ -0,0 +1,287 @@
+"""Event envelope shared by every stage of the ingest pipeline.
+
+Bluefly delivers each event as a JSON envelope::
+
+    {"id": "evt_...", "type": "order.created", "seller_id": "...",
+     "occurred_at": "...", "data": {...}}
+
+The same identifying fields are mirrored in ``X-Bluefly-*`` request headers.
+Headers are preferred because they can be read without touching the body.
+Only the body is signed, though, so once a delivery's signature has been
+checked, :meth:`WebhookEvent.check_envelope` confirms that the headers agree
+with the envelope before the event id is trusted for deduplication.
+
+Routing only ever needs a handful of envelope members, so the ingest path
+never decodes a body in full: :func:`scan_json` picks the wanted members out
+of the raw JSON and stops reading as soon as it has them. The full payload
+is parsed only when a handler asks for it, so duplicates and filtered-out
+events (often large product updates) are never decoded at all.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import struct
+from dataclasses import dataclass, field
+from json.decoder import scanstring
+from typing import TYPE_CHECKING, Any, Mapping
+
+from .errors import EnvelopeError
+
+if TYPE_CHECKING:
+    from .tracing import Trace
+
+TOPIC_ORDER = "order"
+TOPIC_INVENTORY = "inventory"
+TOPIC_PRODUCT = "product"
+TOPICS = frozenset({TOPIC_ORDER, TOPIC_INVENTORY, TOPIC_PRODUCT})
+
+HEADER_EVENT_ID = "x-bluefly-event-id"
+HEADER_EVENT_TYPE = "x-bluefly-event-type"
+HEADER_SELLER_ID = "x-bluefly-seller-id"
+HEADER_SIGNATURE = "x-bluefly-signature"
+
+_MISSING = object()
+
+# Fixed part of the durable record form: received_at and the byte lengths of
+# event_id, event_type and seller_id, which precede the raw body.
+_RECORD_HEADER = struct.Struct("<dHHH")
+
+# Longest event id, type or seller id accepted, in UTF-8 bytes; the record
+# form stores each length in 16 bits.
+MAX_FIELD_BYTES = 256
+
+# Bodies shorter than this are cheaper to decode in full than to scan.
+SCAN_THRESHOLD = 1024
+
+_ENVELOPE_FIELDS: dict[str, Any] = {"id": None, "type": None, "seller_id": None}
+_OBJECT_START = re.compile(r"[ \t\n\r]*\{[ \t\n\r]*")
+_OBJECT_END = re.compile(r"[ \t\n\r]*\}")
+_MEMBER = re.compile(r'[ \t\n\r]*"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*')
+_SEPARATOR = re.compile(r"[ \t\n\r]*([,}])[ \t\n\r]*")
+_scan_once = json.JSONDecoder().scan_once
+
+
+def topic_of(event_type: str) -> str:
+    """Return the topic of an event type, e.g. ``"order"`` for ``"order.shipped"``."""
+    return event_type.partition(".")[0]
+
+
+def scan_json(body: bytes | str, wanted: Mapping[str, Any]) -> dict[str, Any]:
+    """Return selected members of the JSON object ``body`` without decoding it all.
+
+    ``wanted`` maps member names to ``None`` for the member's value, or to a
+    nested mapping of the same form to descend into an object member, e.g.
+    ``{"id": None, "data": {"sku": None}}``. Members that are absent are
+    absent from the result. Scanning stops once every wanted member has been
+    read, so the rest of the body is neither decoded nor validated. Raises
+    :class:`ValueError` on malformed JSON up to that point, including values
+    nested too deeply to decode.
+    """
+    try:
+        return _scan(body, wanted)
+    except RecursionError:
+        raise ValueError("JSON nested too deeply") from None
+
+
+def _scan(body: bytes | str, wanted: Mapping[str, Any]) -> dict[str, Any]:
+    if len(body) < SCAN_THRESHOLD:
+        # json.loads in C beats stepping through members in Python here.
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError("expected a JSON object")
+        return _pick(payload, wanted)
+    text = body.decode() if isinstance(body, (bytes, bytearray)) else body
+    found: dict[str, Any] = {}
+    match = _OBJECT_START.match(text)
+    if match is None:
+        raise ValueError("expected a JSON object")
+    _scan_members(text, match.end(), wanted, found, stop_early=True)
+    return found
+
+
+def _pick(payload: dict[str, Any], wanted: Mapping[str, Any]) -> dict[str, Any]:
+    found = {}
+    for key, want in wanted.items():
+        if key in payload:
+            value = payload[key]
+            if want is not None and isinstance(value, dict):
+                value = _pick(value, want)
+            found[key] = value
+    return found
+
+
+def _scan_members(
+    text: str, pos: int, wanted: Mapping[str, Any], found: dict[str, Any], *, stop_early: bool
+) -> int:
+    """Scan object members from just after ``{``; return the position reached.
+
+    With ``stop_early`` the scan returns right after the last wanted member;
+    otherwise it consumes the object through its closing brace.
+    """
+    remaining = len(wanted)
+    match = _OBJECT_END.match(text, pos)
+    if match is not None:
+        return match.end()
+    while True:
+        match = _MEMBER.match(text, pos)
+        if match is None:
+            raise ValueError(f"expected a member name at offset {pos}")
+        key = match.group(1)
+        if "\\" in key:
+            key = scanstring(f'{key}"', 0)[0]
+        pos = match.end()
+        want = wanted.get(key, _MISSING) if key not in found else _MISSING
+        if want is not _MISSING and want is not None and text[pos : pos + 1] == "{":
+            nested: dict[str, Any] = {}
+            last = stop_early and remaining == 1
+            pos = _scan_members(text, pos + 1, want, nested, stop_early=last)
+            found[key] = nested
+            remaining -= 1
+        else:
+            try:
+                value, pos = _scan_once(text, pos)
+            except StopIteration:
+                raise ValueError(f"expected a value at offset {pos}") from None
+            if want is not _MISSING:
+                found[key] = value
+                remaining -= 1
+        if stop_early and not remaining:
+            return pos
+        match = _SEPARATOR.match(text, pos)
+        if match is None:
+            raise ValueError(f"expected ',' or '}}' at offset {pos}")
+        if match.group(1) == "}":
+            return match.end()
+        pos = match.end()
+
+
+@dataclass(slots=True)
+class WebhookEvent:
+    """A single accepted Bluefly webhook delivery.
+
+    ``body`` holds the exact bytes received on the wire; the decoded JSON is
+    available through :meth:`payload` and is parsed at most once. ``seq`` is
+    the write-ahead log sequence number, or 0 when the event was not logged.
+    ``partition`` caches the dispatcher's partition key once computed,
+    ``attempts`` counts failed handler runs, ``queued_at`` is the
+    ``perf_counter`` time it was last queued when metrics are recorded, and
+    ``trace`` is set on events sampled for tracing.
+    """
+
+    event_id: str
+    event_type: str
+    seller_id: str
+    body: bytes
+    received_at: float
+    seq: int = 0
+    partition: str | None = field(default=None, repr=False, compare=False)
+    attempts: int = field(default=0, repr=False, compare=False)
+    queued_at: float = field(default=0.0, repr=False, compare=False)
+    trace: Trace | None = field(default=None, repr=False, compare=False)
+    _payload: Any = field(default=_MISSING, repr=False, compare=False)
+
+    @property
+    def topic(self) -> str:
+        return topic_of(self.event_type)
+
+    def payload(self, *, cache: bool = True) -> Any:
+        """Return the decoded JSON body, parsing it on first access.
+
+        With ``cache=False`` a fresh parse is not kept on the event, for
+        callers that convert the payload into a more compact form.
+        """
+        if self._payload is not _MISSING:
+            return self._payload
+        payload = json.loads(self.body)
+        if cache:
+            self._payload = payload
+        return payload
+
+    def data(self) -> Any:
+        """Return the ``data`` member of the envelope."""
+        return self.payload().get("data")
+
+    def fields(self, wanted: Mapping[str, Any]) -> dict[str, Any]:
+        """Return the envelope members selected by ``wanted``, as :func:`scan_json` does.
+
+        An already parsed payload is used instead of scanning the body.
+        """
+        if self._payload is not _MISSING:
+            payload = self._payload
+            return _pick(payload, wanted) if isinstance(payload, dict) else {}
+        return scan_json(self.body, wanted)
+
+    def data_fields(self, names: tuple[str, ...]) -> dict[str, Any]:
+        """Return the named members of ``data``, scanning rather than parsing the body."""
+        data = self.fields({"data": dict.fromkeys(names)}).get("data")
+        return data if isinstance(data, dict) else {}
+
+    def check_envelope(self) -> None:
+        """Raise :class:`EnvelopeError` unless the envelope's id, type and seller match.
+
+        The event's identifying fields may have come from unsigned headers;
+        this checks them against the body, which the signature covers.
+        """
+        try:
+            envelope = self.fields(_ENVELOPE_FIELDS)
+        except ValueError as exc:
+            raise EnvelopeError(f"malformed envelope: {exc}") from None
+        for name, value in (
+            ("id", self.event_id),
+            ("type", self.event_type),
+            ("seller_id", self.seller_id),
+        ):
+            if envelope.get(name) != value:
+                raise EnvelopeError(f"header for envelope field {name!r} does not match")
+
+    def to_record(self) -> bytes:
+        """Serialize for the write-ahead log; the body is stored verbatim."""
+        event_id = self.event_id.encode()
+        event_type = self.event_type.encode()
+        seller_id = self.seller_id.encode()
+        header = _RECORD_HEADER.pack(
+            self.received_at, len(event_id), len(event_type), len(seller_id)
+        )
+        return b"".join((header, event_id, event_type, seller_id, self.body))
+
+    @classmethod
+    def from_record(cls, record: bytes | memoryview, seq: int = 0) -> WebhookEvent:
+        """Inverse of :meth:`to_record`."""
+        received_at, id_len, type_len, seller_len = _RECORD_HEADER.unpack_from(record)
+        view = memoryview(record)
+        pos = _RECORD_HEADER.size
+        event_id = str(view[pos : pos + id_len], "utf-8")
+        pos += id_len
+        event_type = str(view[pos : pos + type_len], "utf-8")
+        pos += type_len
+        seller_id = str(view[pos : pos + seller_len], "utf-8")
+        pos += seller_len
+        return cls(event_id, event_type, seller_id, bytes(view[pos:]), received_at, seq)
+
+
+def decode_event(headers: Mapping[str, str], body: bytes, received_at: float) -> WebhookEvent:
+    """Build a :class:`WebhookEvent` from lower-cased request headers and body.
+
+    Raises :class:`EnvelopeError` if the event id, type or seller cannot be
+    determined from either the headers or the JSON envelope, or is longer
+    than :data:`MAX_FIELD_BYTES`.
+    """
+    event_id = headers.get(HEADER_EVENT_ID)
+    event_type = headers.get(HEADER_EVENT_TYPE)
+    seller_id = headers.get(HEADER_SELLER_ID)
+    if not (event_id and event_type and seller_id):
+        try:
+            envelope = scan_json(body, _ENVELOPE_FIELDS)
+        except ValueError as exc:
+            raise EnvelopeError(f"malformed envelope: {exc}") from None
+        event_id = event_id or envelope.get("id")
+        event_type = event_type or envelope.get("type")
+        seller_id = seller_id or envelope.get("seller_id")
+    for name, value in (("id", event_id), ("type", event_type), ("seller_id", seller_id)):
+        if not isinstance(value, str) or not value:
+            raise EnvelopeError(f"envelope field {name!r} is missing")
+        if len(value) > MAX_FIELD_BYTES or len(value.encode()) > MAX_FIELD_BYTES:
+            raise EnvelopeError(f"envelope field {name!r} is too long")
+    return WebhookEvent(event_id, event_type, seller_id, body, received_at)
@@ -0,0 +1,415 @@
+"""Raw ``asyncio.Protocol`` transport for the webhook route.
+
+The fast path parses HTTP/1.1 straight out of the connection buffer and
+answers with precomputed response bytes. It never creates a coroutine,
+``Request`` or ``Response`` object per delivery, which is where most of the
+stream transport's per-event CPU goes. Keep-alive and pipelining are
+supported: all requests found in one read are answered with a single write,
+in order. When the pipeline defers a decision (see :meth:`Pipeline.accept`),
+that response and every later one on the connection are queued and written
+by a per-connection flush task, preserving pipelined order.
+
+Catalog feeds POSTed to the feed path, when the server has a
+:class:`~.feeds.FeedIngestor`, are not buffered: once the head is parsed,
+body bytes are handed to the ingestor as they arrive, through a
+:class:`_FeedBody`, and reading pauses while more than
+``_MAX_FEED_BUFFER`` of them wait to be spooled.
+
+Only the webhook route, the health check and, when configured, the feed
+path, ``/metrics``, ``/debug/profile`` and ``/inventory`` are served;
+anything else gets a 404.
+Select it with ``ServerConfig(mode="fast")``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import TYPE_CHECKING, Awaitable, Union
+
+from .errors import HTTPProtocolError
+from .httputil import (
+    HEALTH_PATH,
+    INVENTORY_PATH,
+    JSON_CONTENT_TYPE,
+    METRICS_PATH,
+    PROFILE_PATH,
+    content_length,
+    encode_response,
+    parse_head,
+    wants_keep_alive,
+)
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .pipeline import OVERLOADED
+
+if TYPE_CHECKING:
+    from .server import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+_HEAD_END = b"\r\n\r\n"
+# Stop reading from a connection once this many responses are waiting.
+_MAX_PENDING = 1024
+# Stop reading a feed body once this many of its bytes are waiting.
+_MAX_FEED_BUFFER = 1024 * 1024
+# A queued response: ready bytes, a deferred (status future, keep-alive)
+# pair, a future of complete response bytes, or None to close the
+# connection once everything before it is sent.
+_Pending = Union[bytes, tuple["asyncio.Future[int]", bool], "asyncio.Future[bytes]", None]
+
+
+def _build_responses(statuses: tuple[int, ...]) -> dict[tuple[int, bool], bytes]:
+    responses = {}
+    for status in statuses:
+        extra = {"Retry-After": "1"} if status == OVERLOADED else None
+        for keep_alive in (True, False):
+            responses[status, keep_alive] = encode_response(
+                status, keep_alive=keep_alive, extra_headers=extra
+            )
+    return responses
+
+
+# Every response the fast path can send, keyed by (status, keep_alive).
+RESPONSES = _build_responses((200, 202, 400, 401, 404, 405, 409, 413, 422, 431, 500, 501, 503, 505))
+# Health check responses, keyed by (keep_alive, head_only).
+_HEALTH_OK = {
+    (keep_alive, head_only): encode_response(
+        200, b"ok\n", keep_alive=keep_alive, head_only=head_only
+    )
+    for keep_alive in (True, False)
+    for head_only in (True, False)
+}
+
+
+class _FeedBody:
+    """Async iterator over a feed body, filled by ``data_received``."""
+
+    __slots__ = ("remaining", "_transport", "_chunks", "_size", "_paused", "_waiter", "_error")
+
+    def __init__(self, transport: asyncio.Transport, length: int) -> None:
+        # Body bytes not received yet.
+        self.remaining = length
+        self._transport = transport
+        self._chunks: deque[bytes] | None = deque()
+        self._size = 0
+        self._paused = False
+        self._waiter: asyncio.Future[None] | None = None
+        self._error: Exception | None = None
+
+    def push(self, data: bytes) -> bytes:
+        """Take the part of ``data`` that belongs to the body; return the rest."""
+        rest = b""
+        if len(data) > self.remaining:
+            data, rest = data[: self.remaining], data[self.remaining :]
+        self.remaining -= len(data)
+        if data and self._chunks is not None:
+            self._chunks.append(data)
+            self._size += len(data)
+            if self._size > _MAX_FEED_BUFFER and not self._paused:
+                self._paused = True
+                self._transport.pause_reading()
+        self._wake()
+        return rest
+
+    def discard(self) -> None:
+        """Drop the rest of the body as it arrives; nobody is reading it."""
+        self._chunks = None
+        self._resume()
+
+    def fail(self, exc: Exception) -> None:
+        """Make the reader raise ``exc``; the body will not be completed."""
+        self._error = exc
+        self._wake()
+
+    def __aiter__(self) -> _FeedBody:
+        return self
+
+    async def __anext__(self) -> bytes:
+        while not self._chunks:
+            if self._error is not None:
+                raise self._error
+            if not self.remaining or self._chunks is None:
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        chunk = self._chunks.popleft()
+        self._size -= len(chunk)
+        if self._size <= _MAX_FEED_BUFFER // 2:
+            self._resume()
+        return chunk
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _resume(self) -> None:
+        if self._paused:
+            self._paused = False
+            self._transport.resume_reading()
+
+
+class FastHTTPProtocol(asyncio.Protocol):
+    """One instance per connection; see the module docstring."""
+
+    __slots__ = (
+        "_server",
+        "_pipeline",
+        "_path",
+        "_feed_path",
+        "_max_header_size",
+        "_max_body_size",
+        "_max_feed_size",
+        "_keepalive_timeout",
+        "_loop",
+        "_transport",
+        "_buffer",
+        "_last_activity",
+        "_idle_timer",
+        "_pending",
+        "_flusher",
+        "_body",
+    )
+
+    def __init__(self, server: WebhookServer) -> None:
+        config = server.config
+        self._server = server
+        self._pipeline = server.pipeline
+        self._path = config.path
+        # Feed pushes are only streamed when there is an ingestor for them.
+        self._feed_path = config.feed_path if server.feeds is not None else None
+        self._max_header_size = config.max_header_size
+        self._max_body_size = config.max_body_size
+        self._max_feed_size = config.max_feed_size
+        self._keepalive_timeout = config.keepalive_timeout
+        self._loop = asyncio.get_running_loop()
+        self._transport: asyncio.Transport | None = None
+        self._buffer = bytearray()
+        self._last_activity = 0.0
+        self._idle_timer: asyncio.TimerHandle | None = None
+        self._pending: deque[_Pending] = deque()
+        self._flusher: asyncio.Task[None] | None = None
+        # The feed body still being received, if any.
+        self._body: _FeedBody | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = transport  # type: ignore[assignment]
+        self._last_activity = self._loop.time()
+        self._schedule_idle_check()
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._body is not None:
+            self._body.fail(HTTPProtocolError(400, "connection closed during request body"))
+            self._body = None
+        self._pending.clear()
+        self._transport = None
+
+    def pause_writing(self) -> None:
+        # The peer is not reading its acks; stop reading its requests too.
+        if self._transport is not None:
+            self._transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        if self._transport is not None:
+            self._transport.resume_reading()
+
+    def data_received(self, data: bytes) -> None:
+        self._last_activity = self._loop.time()
+        if self._body is not None:
+            data = self._body.push(data)
+            if self._body.remaining:
+                return
+            self._body = None
+            if not data:
+                return
+        buffer = self._buffer
+        buffer += data
+        out: list[_Pending] = []
+        deferred = bool(self._pending)
+        close = False
+        try:
+            while True:
+                head_end = buffer.find(_HEAD_END)
+                if head_end < 0:
+                    if len(buffer) > self._max_header_size:
+                        raise HTTPProtocolError(431, "request head too large")
+                    break
+                method, target, version, headers = parse_head(bytes(buffer[:head_end]))
+                if method == "POST" and target.partition("?")[0] == self._feed_path:
+                    length = content_length(headers, self._max_feed_size)
+                    keep_alive = wants_keep_alive(version, headers)
+                    body = _FeedBody(self._transport, length)  # type: ignore[arg-type]
+                    deferred = True
+                    out.append(asyncio.ensure_future(self._feed(headers, body, keep_alive)))
+                    buffer[:] = body.push(bytes(buffer[head_end + 4 :]))
+                    if body.remaining:
+                        self._body = body
+                        break
+                    if not keep_alive:
+                        close = True
+                        break
+                    continue
+                length = content_length(headers, self._max_body_size)
+                body_start = head_end + 4
+                body_end = body_start + length
+                if len(buffer) < body_end:
+                    break
+                body = bytes(buffer[body_start:body_end])
+                del buffer[:body_end]
+                keep_alive = wants_keep_alive(version, headers)
+                response = self._respond(method, target, headers, body, keep_alive)
+                if response.__class__ is not bytes:
+                    deferred = True
+                out.append(response)
+                if not keep_alive:
+                    close = True
+                    break
+        except HTTPProtocolError as exc:
+            response = RESPONSES.get((exc.status, False))
+            out.append(response or encode_response(exc.status, keep_alive=False))
+            close = True
+        transport = self._transport
+        if transport is None:
+            return
+        if close:
+            buffer.clear()
+        if deferred:
+            self._pending.extend(out)
+            if close:
+                self._pending.append(None)
+            if len(self._pending) > _MAX_PENDING:
+                transport.pause_reading()
+            if self._flusher is None:
+                self._flusher = self._loop.create_task(self._flush())
+            return
+        if out:
+            transport.write(b"".join(out) if len(out) > 1 else out[0])  # type: ignore[arg-type]
+        if close:
+            transport.close()
+
+    def _respond(
+        self, method: str, target: str, headers: dict[str, str], body: bytes, keep_alive: bool
+    ) -> _Pending:
+        path = target.partition("?")[0]
+        if path == self._path:
+            if method != "POST":
+                return RESPONSES[405, keep_alive]
+            status = self._pipeline.accept(headers, body)
+            if status.__class__ is int:
+                return RESPONSES[status, keep_alive]  # type: ignore[index]
+            return asyncio.ensure_future(status), keep_alive  # type: ignore[arg-type]
+        if path == HEALTH_PATH and method in ("GET", "HEAD"):
+            return _HEALTH_OK[keep_alive, method == "HEAD"]
+        if path == METRICS_PATH and method == "GET" and self._pipeline.metrics is not None:
+            return encode_response(
+                200,
+                self._pipeline.render_metrics(),
+                content_type=METRICS_CONTENT_TYPE,
+                keep_alive=keep_alive,
+            )
+        if path == PROFILE_PATH and method == "GET" and self._server.profiler is not None:
+            query = target.partition("?")[2]
+            return asyncio.ensure_future(self._profile(query, keep_alive))
+        if path == INVENTORY_PATH and method == "GET" and self._pipeline.inventory is not None:
+            status, body = self._server.query_inventory(target.partition("?")[2])
+            return encode_response(
+                status, body, content_type=JSON_CONTENT_TYPE, keep_alive=keep_alive
+            )
+        return RESPONSES[404, keep_alive]
+
+    async def _feed(self, headers: dict[str, str], body: _FeedBody, keep_alive: bool) -> bytes:
+        assert self._server.feeds is not None
+        try:
+            status = await self._server.feeds.receive(headers, body)
+        except HTTPProtocolError as exc:
+            body.discard()
+            self._close_after(asyncio.current_task())
+            return RESPONSES.get((exc.status, False), RESPONSES[400, False])
+        except BaseException:
+            body.discard()
+            raise
+        return RESPONSES[status, keep_alive]
+
+    def _close_after(self, waiter: object) -> None:
+        """Close the connection once the response ``waiter`` stands for is written."""
+        if self._transport is None:
+            return
+        self._transport.pause_reading()
+        for index, item in enumerate(self._pending):
+            if item is waiter:
+                self._pending.insert(index + 1, None)
+                return
+
+    async def _profile(self, query: str, keep_alive: bool) -> bytes:
+        status, body = await self._server.profile(query)
+        return encode_response(status, body, keep_alive=keep_alive)
+
+    async def _flush(self) -> None:
+        """Write queued responses in order, waiting on deferred ones."""
+        pending = self._pending
+        try:
+            while pending and self._transport is not None:
+                item = pending[0]
+                if item is None:
+                    pending.clear()
+                    self._transport.close()
+                    return
+                if item.__class__ is bytes:
+                    chunk: bytes = item  # type: ignore[assignment]
+                else:
+                    if item.__class__ is tuple:
+                        waiter, keep_alive = item  # type: ignore[misc]
+                        chunk = RESPONSES[await _status_of(waiter), keep_alive]
+                    else:
+                        chunk = await _response_of(item)  # type: ignore[arg-type]
+                    if self._transport is None:
+                        return
+                pending.popleft()
+                self._transport.write(chunk)
+                if len(pending) == _MAX_PENDING:
+                    self._transport.resume_reading()
+        finally:
+            self._flusher = None
+
+    def _schedule_idle_check(self) -> None:
+        self._idle_timer = self._loop.call_at(
+            self._last_activity + self._keepalive_timeout, self._check_idle
+        )
+
+    def _check_idle(self) -> None:
+        self._idle_timer = None
+        if self._transport is None:
+            return
+        if self._loop.time() - self._last_activity >= self._keepalive_timeout:
+            self._transport.close()
+            return
+        self._schedule_idle_check()
+
+
+async def _response_of(waiter: Awaitable[bytes]) -> bytes:
+    try:
+        return await waiter
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("deferred response failed")
+        return RESPONSES[500, False]
+
+
+async def _status_of(waiter: Awaitable[int]) -> int:
+    try:
+        return await waiter
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("deferred webhook acceptance failed")
+        return 500
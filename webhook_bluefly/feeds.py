@@ -0,0 +1,696 @@
+"""Streaming ingestion of catalog feeds.
+
+Bluefly pushes full catalog feeds and bulk product updates as single
+requests of hundreds of megabytes: a JSON array of items, newline-delimited
+JSON, or CSV with a header row, any of them optionally gzip-compressed.
+Reading such a body whole, then decompressing and decoding it, takes
+several times its size in memory and has taken workers down.
+
+Feeds are processed instead as a pipeline of generators, each holding only
+the chunk it is working on: :func:`iter_chunks` reads fixed-size chunks,
+:class:`FeedDecoder` inflates them if they are gzip data and parses items
+as soon as they are complete, and :func:`batched` groups the items into
+lists for a handler::
+
+    with open("catalog.json.gz", "rb") as feed:
+        for batch in batched(iter_items(iter_chunks(feed)), 500):
+            load_products(batch)
+
+Memory use is bounded by the chunk size plus the largest single item, which
+is limited to ``max_item_size``. The format is taken from the first
+non-blank character unless given: ``[`` starts a JSON array, ``{`` NDJSON,
+anything else CSV.
+
+:class:`FeedIngestor` does the same for feeds pushed to the receiver. The
+server streams the request body to it chunk by chunk. Each chunk is hashed
+for the signature on the event loop and written to an unnamed spool file
+from a worker thread. The push is acked once it is complete and verified,
+so the ack never waits for the feed to be processed. Spooled feeds are then
+parsed one at a time, in a worker thread, and handed to the feed handler as
+:class:`FeedBatch` lists; the next batch is parsed only once the handler has
+returned. Feeds are not written to the write-ahead log: one still being
+ingested when the receiver stops early is lost.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import re
+import tempfile
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    Mapping,
+    TypeVar,
+)
+
+from .errors import FeedError
+from .events import HEADER_EVENT_ID, HEADER_SELLER_ID, HEADER_SIGNATURE
+
+if TYPE_CHECKING:
+    from .auth import SignatureVerifier
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("json", "ndjson", "csv")
+CHUNK_SIZE = 64 * 1024
+MAX_ITEM_SIZE = 16 * 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+# Content-Type media types that name a format.
+MEDIA_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+
+T = TypeVar("T")
+
+_WHITESPACE = " \t\n\r"
+_decode_value = json.JSONDecoder().raw_decode
+# Scanning a JSON item split across chunks for its end: whole strings or
+# brackets, a quote opening a string that runs on into the next chunk, the
+# rest of such a string, and the delimiter after a scalar.
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}"]', re.DOTALL)
+_STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR_END = re.compile(r"[ \t\n\r,\]]")
+_DELIMITERS = _WHITESPACE + ",]"
+
+
+@dataclass(slots=True)
+class FeedBatch:
+    """Consecutive items of one feed; ``number`` counts batches from 0."""
+
+    feed_id: str
+    seller_id: str
+    number: int
+    items: list[Any]
+
+
+FeedHandler = Callable[[FeedBatch], Awaitable[None]]
+
+
+@dataclass
+class FeedStats:
+    received: int = 0
+    rejected: int = 0
+    ingested: int = 0
+    failed: int = 0
+    items: int = 0
+    batches: int = 0
+
+
+class FeedDecoder:
+    """Incremental feed parser: bytes in, complete items out.
+
+    :meth:`feed` and :meth:`close` return generators, which must be
+    exhausted before the next call. Raises :class:`~.errors.FeedError` on
+    malformed or truncated input.
+    """
+
+    def __init__(self, format: str | None = None, *, max_item_size: int = MAX_ITEM_SIZE) -> None:
+        if format is not None and format not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}, got {format!r}")
+        self.format = format
+        self.max_item_size = max_item_size
+        self.items = 0
+        self._head = b""
+        self._sniffed = False
+        self._inflate: Any = None
+        self._text = codecs.getincrementaldecoder("utf-8-sig")()
+        self._parser: _Parser | None = None
+
+    def feed(self, data: bytes) -> Iterator[Any]:
+        for chunk in self._decompress(data):
+            yield from self._parse(self._decode(chunk))
+
+    def close(self) -> Iterator[Any]:
+        if not self._sniffed and self._head:
+            yield from self._parse(self._decode(self._head))
+        if self._inflate is not None and not self._inflate.eof:
+            raise FeedError("truncated gzip data")
+        yield from self._parse(self._decode(b"", final=True))
+        if self._parser is not None:
+            for item in self._parser.close():
+                self.items += 1
+                yield item
+
+    def _decompress(self, data: bytes) -> Iterator[bytes]:
+        if not self._sniffed:
+            # Two bytes tell gzip data apart; hold back until they are here.
+            data = self._head + data
+            if len(data) < len(GZIP_MAGIC):
+                self._head = data
+                return
+            self._sniffed = True
+            self._head = b""
+            if data.startswith(GZIP_MAGIC):
+                self._inflate = zlib.decompressobj(wbits=31)
+        inflate = self._inflate
+        if inflate is None:
+            yield data
+            return
+        more = False
+        while data or more:
+            if inflate.eof:
+                # Another gzip member follows, as parallel compressors write them.
+                inflate = self._inflate = zlib.decompressobj(wbits=31)
+            try:
+                # Bounded output per call keeps a highly compressed chunk small.
+                out = inflate.decompress(data, CHUNK_SIZE)
+            except zlib.error as exc:
+                raise FeedError(f"invalid gzip data: {exc}") from None
+            data = inflate.unused_data if inflate.eof else inflate.unconsumed_tail
+            more = len(out) == CHUNK_SIZE and not inflate.eof
+            if out:
+                yield out
+
+    def _decode(self, chunk: bytes, final: bool = False) -> str:
+        try:
+            return self._text.decode(chunk, final)
+        except UnicodeDecodeError as exc:
+            raise FeedError(f"feed is not valid UTF-8: {exc}") from None
+
+    def _parse(self, text: str) -> Iterator[Any]:
+        if not text:
+            return
+        parser = self._parser
+        if parser is None:
+            stripped = text.lstrip(_WHITESPACE)
+            if not stripped:
+                return
+            format = self.format or _sniff(stripped[0])
+            parser = self._parser = _PARSERS[format](self.max_item_size)
+        for item in parser.feed(text):
+            self.items += 1
+            yield item
+
+
+class _Parser(ABC):
+    def __init__(self, max_item_size: int) -> None:
+        self.max_item_size = max_item_size
+
+    @abstractmethod
+    def feed(self, text: str) -> Iterator[Any]:
+        """Items completed by ``text``."""
+
+    @abstractmethod
+    def close(self) -> Iterator[Any]:
+        """Items left at the end of the feed; raises if one is incomplete."""
+
+    def _check_size(self, pending: int) -> None:
+        if pending > self.max_item_size:
+            raise FeedError(f"item larger than {self.max_item_size} bytes")
+
+
+class _JSONArrayParser(_Parser):
+    """Items of a top-level JSON array, decoded one at a time.
+
+    An item split across chunks is not decoded again with every chunk: its
+    pieces are kept aside while a scan of each new chunk tracks the item's
+    bracket depth and strings, and it is decoded once the scan sees it end.
+    """
+
+    # Expecting "[", an item or "]", an item, "," or "]", nothing more.
+    _START, _FIRST, _ITEM, _NEXT, _DONE = range(5)
+
+    def __init__(self, max_item_size: int) -> None:
+        super().__init__(max_item_size)
+        self._state = self._START
+        # Pieces of the item split across chunks, and the scan state at their end.
+        self._parts: list[str] = []
+        self._size = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._scalar = False
+
+    def feed(self, text: str) -> Iterator[Any]:
+        if self._parts:
+            end = self._scan(text, 0)
+            if end < 0:
+                self._parts.append(text)
+                self._size += len(text)
+                self._check_size(self._size)
+                return
+            self._parts.append(text[:end])
+            yield self._split_item()
+            text = text[end:]
+        yield from self._drain(text)
+
+    def close(self) -> Iterator[Any]:
+        if self._parts:
+            yield self._split_item()
+        if self._state != self._DONE:
+            raise FeedError("feed ended inside the JSON array")
+
+    def _drain(self, text: str) -> Iterator[Any]:
+        pos = 0
+        end = len(text)
+        while True:
+            while pos < end and text[pos] in _WHITESPACE:
+                pos += 1
+            if pos == end:
+                return
+            state = self._state
+            char = text[pos]
+            if state == self._START:
+                if char != "[":
+                    raise FeedError("JSON feed must be an array")
+                self._state = self._FIRST
+                pos += 1
+            elif state == self._NEXT:
+                if char not in ",]":
+                    raise FeedError(f"expected ',' or ']' between items, got {char!r}")
+                self._state = self._ITEM if char == "," else self._DONE
+                pos += 1
+            elif state == self._DONE:
+                raise FeedError("data after the end of the JSON array")
+            elif char == "]" and state == self._FIRST:
+                self._state = self._DONE
+                pos += 1
+            else:
+                try:
+                    item, item_end = _decode_value(text, pos)
+                except json.JSONDecodeError:
+                    item_end = -1
+                # A scalar is only complete once a delimiter follows it: "12" or
+                # "12." at the end of a chunk may be the start of "12.5".
+                if item_end < 0 or char not in '[{"' and (
+                    item_end == end or text[item_end] not in _DELIMITERS
+                ):
+                    item_end = self._split(text, pos)
+                    if item_end < 0:
+                        return
+                    item = self._split_item()
+                self._state = self._NEXT
+                pos = item_end
+                yield item
+
+    def _split(self, text: str, pos: int) -> int:
+        """Set aside the item starting at ``pos``; return where it ends in ``text``, or -1."""
+        char = text[pos]
+        self._depth = 0
+        self._in_string = char == '"'
+        self._escaped = False
+        self._scalar = char not in '[{"'
+        end = self._scan(text, pos + 1 if self._in_string else pos)
+        self._parts = [text[pos:end] if end >= 0 else text[pos:]]
+        self._size = len(self._parts[0])
+        self._check_size(self._size)
+        return end
+
+    def _split_item(self) -> Any:
+        """Decode the item set aside, now that all of it has arrived."""
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        try:
+            item, end = _decode_value(text)
+        except json.JSONDecodeError as exc:
+            raise FeedError(f"invalid JSON item: {exc}") from None
+        if text[end:].strip(_WHITESPACE):
+            raise FeedError(f"invalid JSON item: extra data at offset {end}")
+        self._state = self._NEXT
+        return item
+
+    def _scan(self, text: str, pos: int) -> int:
+        """Where the split item ends in ``text``, or -1; carries the scan state over."""
+        if self._scalar:
+            match = _SCALAR_END.search(text, pos)
+            return match.start() if match is not None else -1
+        if self._in_string:
+            if self._escaped:
+                if pos == len(text):
+                    return -1
+                self._escaped = False
+                pos += 1
+            match = _STRING_REST.match(text, pos)
+            if match is None:
+                self._escaped = _escapes_next(text, pos)
+                return -1
+            self._in_string = False
+            pos = match.end()
+            if self._depth == 0:
+                return pos
+        depth = self._depth
+        for match in _TOKEN.finditer(text, pos):
+            token = match.group()
+            char = token[0]
+            if char == '"':
+                if len(token) == 1:
+                    # No closing quote: the string goes on in the next chunk.
+                    self._in_string = True
+                    self._escaped = _escapes_next(text, match.end())
+                    break
+            elif char in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth <= 0:
+                    return match.end()
+        self._depth = depth
+        return -1
+
+
+def _escapes_next(text: str, start: int) -> bool:
+    """Whether ``text``, inside a JSON string from ``start`` on, ends with an open escape."""
+    backslashes = min(len(text) - len(text.rstrip("\\")), len(text) - start)
+    return backslashes % 2 == 1
+
+
+class _NDJSONParser(_Parser):
+    """One JSON value per line; blank lines are skipped."""
+
+    def __init__(self, max_item_size: int) -> None:
+        super().__init__(max_item_size)
+        # Pieces of the current line, joined once its newline arrives.
+        self._parts: list[str] = []
+        self._size = 0
+        self._line = 0
+
+    def feed(self, text: str) -> Iterator[Any]:
+        start = 0
+        while True:
+            newline = text.find("\n", start)
+            if newline < 0:
+                break
+            line = text[start:newline]
+            if self._parts:
+                self._parts.append(line)
+                line = "".join(self._parts)
+                self._parts = []
+                self._size = 0
+            yield from self._item(line)
+            start = newline + 1
+        if start < len(text):
+            self._parts.append(text[start:])
+            self._size += len(text) - start
+            self._check_size(self._size)
+
+    def close(self) -> Iterator[Any]:
+        yield from self._item("".join(self._parts))
+        self._parts = []
+        self._size = 0
+
+    def _item(self, line: str) -> Iterator[Any]:
+        self._line += 1
+        if line.strip(_WHITESPACE):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise FeedError(f"invalid JSON on line {self._line}: {exc}") from None
+
+
+class _Lines:
+    """Iterator the CSV reader pulls lines from; filled one record at a time."""
+
+    def __init__(self) -> None:
+        self.queue: deque[str] = deque()
+
+    def __iter__(self) -> _Lines:
+        return self
+
+    def __next__(self) -> str:
+        if not self.queue:
+            raise StopIteration
+        return self.queue.popleft()
+
+
+class _CSVParser(_Parser):
+    """Rows of a CSV file with a header row, as dicts keyed by column name.
+
+    A quoted field may span lines, so a record is handed to the reader once
+    a line ends with an even number of quote characters seen since the
+    record started.
+    """
+
+    def __init__(self, max_item_size: int) -> None:
+        super().__init__(max_item_size)
+        self._lines = _Lines()
+        self._reader = csv.reader(self._lines)
+        self._header: list[str] | None = None
+        # Pieces of the current line, joined once its newline arrives.
+        self._parts: list[str] = []
+        self._size = 0
+        self._quotes = 0
+        self._pending = 0
+
+    def feed(self, text: str) -> Iterator[Any]:
+        start = 0
+        while True:
+            newline = text.find("\n", start)
+            if newline < 0:
+                break
+            line = text[start : newline + 1]
+            if self._parts:
+                self._parts.append(line)
+                line = "".join(self._parts)
+                self._parts = []
+                self._size = 0
+            yield from self._line(line)
+            start = newline + 1
+        if start < len(text):
+            self._parts.append(text[start:])
+            self._size += len(text) - start
+        self._check_size(self._pending + self._size)
+
+    def close(self) -> Iterator[Any]:
+        if self._parts:
+            yield from self._line("".join(self._parts))
+            self._parts = []
+            self._size = 0
+        if self._lines.queue:
+            raise FeedError("feed ended inside a quoted CSV field")
+
+    def _line(self, line: str) -> Iterator[Any]:
+        self._lines.queue.append(line)
+        self._pending += len(line)
+        self._quotes += line.count('"')
+        if self._quotes % 2:
+            return
+        self._quotes = 0
+        self._pending = 0
+        try:
+            row = next(self._reader)
+        except csv.Error as exc:
+            raise FeedError(f"invalid CSV on line {self._reader.line_num}: {exc}") from None
+        if not row:
+            return
+        if self._header is None:
+            self._header = row
+            return
+        if len(row) != len(self._header):
+            raise FeedError(
+                f"CSV line {self._reader.line_num} has {len(row)} fields, "
+                f"expected {len(self._header)}"
+            )
+        yield dict(zip(self._header, row))
+
+
+_PARSERS: dict[str, type[_Parser]] = {
+    "json": _JSONArrayParser,
+    "ndjson": _NDJSONParser,
+    "csv": _CSVParser,
+}
+
+
+def _sniff(char: str) -> str:
+    return {"[": "json", "{": "ndjson"}.get(char, "csv")
+
+
+def iter_chunks(file: IO[bytes], size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read ``file`` in chunks of at most ``size`` bytes."""
+    while True:
+        chunk = file.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_items(
+    chunks: Iterable[bytes], format: str | None = None, *, max_item_size: int = MAX_ITEM_SIZE
+) -> Iterator[Any]:
+    """Decompress and parse a feed given as byte chunks, yielding its items."""
+    decoder = FeedDecoder(format, max_item_size=max_item_size)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Group ``items`` into lists of ``size``; the last may be shorter."""
+    if size < 1:
+        raise ValueError("size must be at least 1")
+    batch: list[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def feed_format(headers: Mapping[str, str]) -> str | None:
+    """The format named by a request's Content-Type, if any."""
+    media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+    return MEDIA_TYPES.get(media_type)
+
+
+def _close_after_write(spool: IO[bytes], writing: asyncio.Future[int]) -> None:
+    if not writing.cancelled():
+        writing.exception()  # retrieved; the receive that started it has failed
+    spool.close()
+
+
+class FeedIngestor:
+    """Receives pushed feeds and hands their items to ``handler`` in batches.
+
+    With a ``verifier``, a push must carry a valid signature of its body for
+    its ``X-Bluefly-Seller-Id``, as webhook deliveries do. Spool files are
+    created in ``spool_dir``, or the system temporary directory.
+    """
+
+    def __init__(
+        self,
+        handler: FeedHandler,
+        *,
+        batch_size: int = 500,
+        verifier: SignatureVerifier | None = None,
+        spool_dir: str | Path | None = None,
+        max_item_size: int = MAX_ITEM_SIZE,
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.handler = handler
+        self.batch_size = batch_size
+        self.verifier = verifier
+        self.spool_dir = spool_dir
+        self.max_item_size = max_item_size
+        self.stats = FeedStats()
+        self._feeds = 0
+        self._turn = asyncio.Lock()
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def receive(self, headers: Mapping[str, str], body: AsyncIterable[bytes]) -> int:
+        """Spool a pushed feed from its body chunks and queue it; return the ack status.
+
+        ``headers`` must have lower-cased names. The body is always read to
+        the end, so the connection can be reused. Chunks are hashed on the
+        event loop and written to the spool file in a worker thread, one write
+        at a time, while the next chunk is read and hashed.
+        """
+        seller_id = headers.get(HEADER_SELLER_ID, "")
+        self._feeds += 1
+        feed_id = headers.get(HEADER_EVENT_ID) or f"feed-{self._feeds}"
+        mac = None
+        if self.verifier is not None:
+            mac = self.verifier.begin(seller_id)
+        loop = asyncio.get_running_loop()
+        spool = await asyncio.to_thread(tempfile.TemporaryFile, dir=self.spool_dir)
+        writing: asyncio.Future[int] | None = None
+        try:
+            async for chunk in body:
+                if mac is not None:
+                    mac.update(chunk)
+                if writing is not None:
+                    # Shielded: cancelling a running write would not stop it.
+                    await asyncio.shield(writing)
+                writing = loop.run_in_executor(None, spool.write, chunk)
+            if writing is not None:
+                await asyncio.shield(writing)
+            spool.seek(0)
+        except BaseException:
+            if writing is None or writing.done():
+                spool.close()
+            else:
+                # The file may only be closed once the thread is done with it.
+                writing.add_done_callback(partial(_close_after_write, spool))
+            raise
+        if self.verifier is not None and (
+            mac is None or not self.verifier.verify_digest(mac, headers.get(HEADER_SIGNATURE))
+        ):
+            spool.close()
+            self.stats.rejected += 1
+            return 401
+        self.stats.received += 1
+        task = asyncio.create_task(
+            self._ingest(spool, feed_id, seller_id, feed_format(headers)),
+            name=f"bluefly-feed-{feed_id}",
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return 202
+
+    async def ingest(
+        self, file: IO[bytes], feed_id: str, seller_id: str = "", format: str | None = None
+    ) -> int:
+        """Parse ``file`` off the event loop and pass its batches to the handler.
+
+        Returns the number of items handled. Raises
+        :class:`~.errors.FeedError` if the feed is malformed; batches before
+        the error have been handled by then.
+        """
+        batches = batched(
+            iter_items(iter_chunks(file), format, max_item_size=self.max_item_size),
+            self.batch_size,
+        )
+        number = 0
+        items = 0
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                return items
+            await self.handler(FeedBatch(feed_id, seller_id, number, batch))
+            number += 1
+            items += len(batch)
+            self.stats.batches += 1
+            self.stats.items += len(batch)
+
+    async def stop(self, *, drain: bool = True) -> None:
+        """Wait for spooled feeds to be ingested, or abandon them if not ``drain``."""
+        tasks = list(self._tasks)
+        if not drain:
+            if tasks:
+                logger.warning("abandoning %d feeds not yet ingested", len(tasks))
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _ingest(
+        self, spool: IO[bytes], feed_id: str, seller_id: str, format: str | None
+    ) -> None:
+        async with self._turn:
+            with spool:
+                try:
+                    items = await self.ingest(spool, feed_id, seller_id, format)
+                except asyncio.CancelledError:
+                    raise
+                except FeedError as exc:
+                    self.stats.failed += 1
+                    logger.error("feed %s from %s is malformed: %s", feed_id, seller_id, exc)
+                    return
+                except Exception:
+                    self.stats.failed += 1
+                    logger.exception("feed handler failed for feed %s", feed_id)
+                    return
+        self.stats.ingested += 1
+        logger.info("ingested feed %s from %s: %d items", feed_id, seller_id, items)
@@ -0,0 +1,38 @@
+"""File helpers shared by the write-ahead log and the dead-letter store."""
+
+from __future__ import annotations
+
+import mmap
+import os
+from pathlib import Path
+
+
+class MappedFile:
+    """Read-only mmap of a file as a context manager, tolerating empty files."""
+
+    def __init__(self, path: Path) -> None:
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self.data: mmap.mmap | bytes = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+
+    def __enter__(self) -> mmap.mmap | bytes:
+        return self.data
+
+    def __exit__(self, *exc_info: object) -> None:
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # A caller still holds a view; the map is released with it.
+                pass
+        self._file.close()
+
+
+def write_all(fd: int, data: bytes) -> None:
+    """Write all of ``data`` to ``fd``, however many writes that takes."""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
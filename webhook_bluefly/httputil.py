@@ -0,0 +1,117 @@
+"""Minimal HTTP/1.1 helpers shared by the receiver transports and the API client."""
+
+from __future__ import annotations
+
+from http import HTTPStatus
+
+from .errors import HTTPProtocolError
+
+SERVER_NAME = b"webhook-bluefly"
+HEALTH_PATH = "/healthz"
+METRICS_PATH = "/metrics"
+PROFILE_PATH = "/debug/profile"
+INVENTORY_PATH = "/inventory"
+JSON_CONTENT_TYPE = "application/json"
+
+
+def reason_phrase(status: int) -> str:
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return "Unknown"
+
+
+def parse_head(head: bytes) -> tuple[str, str, str, dict[str, str]]:
+    """Parse a request head (request line plus headers, without the blank line).
+
+    Returns ``(method, target, version, headers)`` with lower-cased header
+    names. Repeated headers are joined with ``", "``.
+    """
+    try:
+        text = head.decode("latin-1")
+    except UnicodeDecodeError:  # pragma: no cover - latin-1 decodes everything
+        raise HTTPProtocolError(400, "undecodable request head") from None
+    lines = text.split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3:
+        raise HTTPProtocolError(400, "malformed request line")
+    method, target, version = parts
+    if version not in ("HTTP/1.1", "HTTP/1.0"):
+        raise HTTPProtocolError(505, "unsupported HTTP version")
+    try:
+        headers = parse_header_lines(lines[1:])
+    except ValueError:
+        raise HTTPProtocolError(400, "malformed header line") from None
+    return method, target, version, headers
+
+
+def parse_header_lines(lines: list[str]) -> dict[str, str]:
+    """Parse ``Name: value`` lines into a dict with lower-cased names.
+
+    Repeated headers are joined with ``", "``. Raises :class:`ValueError` on a
+    malformed line.
+    """
+    headers: dict[str, str] = {}
+    for line in lines:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep or not name or name[-1] in " \t":
+            raise ValueError(f"malformed header line {line!r}")
+        name = name.lower()
+        value = value.strip()
+        if name in headers:
+            headers[name] = f"{headers[name]}, {value}"
+        else:
+            headers[name] = value
+    return headers
+
+
+def content_length(headers: dict[str, str], max_body_size: int) -> int:
+    """Return the declared body length, enforcing ``max_body_size``."""
+    if "transfer-encoding" in headers:
+        raise HTTPProtocolError(501, "transfer-encoding is not supported")
+    raw = headers.get("content-length")
+    if raw is None:
+        return 0
+    # isdigit() alone accepts non-ASCII digits, which int() then refuses.
+    if not (raw.isascii() and raw.isdigit()):
+        raise HTTPProtocolError(400, "invalid content-length")
+    length = int(raw)
+    if length > max_body_size:
+        raise HTTPProtocolError(413, "request body too large")
+    return length
+
+
+def wants_keep_alive(version: str, headers: dict[str, str]) -> bool:
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        return "keep-alive" in connection
+    return "close" not in connection
+
+
+def encode_response(
+    status: int,
+    body: bytes = b"",
+    *,
+    content_type: str = "text/plain; charset=utf-8",
+    keep_alive: bool = True,
+    extra_headers: dict[str, str] | None = None,
+    head_only: bool = False,
+) -> bytes:
+    """Serialize a complete HTTP/1.1 response.
+
+    With ``head_only``, as for a HEAD request, the body's length is declared
+    but the body itself is left out.
+    """
+    lines = [
+        f"HTTP/1.1 {status} {reason_phrase(status)}",
+        f"Server: {SERVER_NAME.decode()}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: keep-alive" if keep_alive else "Connection: close",
+    ]
+    if extra_headers:
+        lines.extend(f"{name}: {value}" for name, value in extra_headers.items())
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+    return head if head_only else head + body
@@ -0,0 +1,358 @@
+"""Local, queryable copy of stock levels and prices from the webhook stream.
+
+Every Bluefly inventory webhook already carries a SKU's absolute quantity,
+warehouse, price and version, yet internal services ask the Bluefly API for
+the same numbers. :class:`InventoryIndex` keeps the latest of them for every
+SKU seen, so they can be answered locally in constant time, through
+:meth:`InventoryIndex.get` or the server's ``GET /inventory?sku=...``.
+
+State is held column-wise: quantities, prices, versions and warehouse ids
+each live in one :mod:`array` of machine values, indexed by a row number,
+and a dict maps each SKU to its row. Warehouse names are interned into a
+small table. A row costs 28 bytes of column data plus its dict entry and
+SKU string, against several hundred for a dict of small objects, and a
+lookup is one dict probe and four array reads.
+
+Events apply in the order they are accepted. An event whose ``version`` is
+lower than the SKU's stored version is stale and ignored, so an update that
+Bluefly redelivered late does not roll the SKU back. Events may carry only
+some of the fields, e.g. a price change without a quantity; only the fields
+present are updated.
+
+With a ``directory``, the index is written there as a snapshot every
+``snapshot_interval`` seconds and when the pipeline stops. A snapshot
+records the write-ahead log sequence number of the last event it contains,
+so on restart :meth:`InventoryIndex.restore` loads it and replays only the
+log records after that, however long the log is. Snapshot file layout::
+
+    SNAPSHOT_MAGIC | u64 seq | u32 rows | u32 warehouses | u32 crc32(body)
+    body: i64 quantity[rows] | f64 price[rows] | i64 version[rows] |
+          u32 warehouse[rows] | u32 sku length[rows] |
+          u32 warehouse name length[warehouses] | sku bytes | name bytes
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import struct
+import sys
+import zlib
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator, NamedTuple
+
+from .events import TOPIC_INVENTORY, WebhookEvent
+
+if TYPE_CHECKING:
+    from .wal import WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"BFINV\x00\x01\x00"
+SNAPSHOT_FILE = "inventory.snapshot"
+SNAPSHOT_HEADER = struct.Struct("<8sQIII")
+FIELDS = ("sku", "quantity", "warehouse", "price", "version")
+
+# Warehouse id of rows whose warehouse is not known yet.
+_NO_WAREHOUSE = 0
+# Typecodes of the quantity, price, version and warehouse columns.
+_COLUMN_TYPES = "qdqI"
+_LIMIT = 2**63
+
+
+class StockLevel(NamedTuple):
+    """What the index knows about one SKU; None where no event said yet."""
+
+    quantity: int | None
+    price: float | None
+    warehouse: str | None
+    version: int
+
+
+@dataclass
+class InventoryStats:
+    applied: int = 0
+    stale: int = 0
+    malformed: int = 0
+
+
+class InventoryIndex:
+    """Latest quantity, price, warehouse and version per SKU.
+
+    Quantities of SKUs that have only seen price events read as None; the
+    column stores -1 for them.
+    """
+
+    def __init__(
+        self, directory: str | Path | None = None, *, snapshot_interval: float = 60.0
+    ) -> None:
+        if snapshot_interval <= 0:
+            raise ValueError("snapshot_interval must be positive")
+        self.directory = Path(directory) if directory is not None else None
+        self.snapshot_interval = snapshot_interval
+        # Write-ahead log seq of the last event applied, and of the last
+        # event in the snapshot on disk.
+        self.seq = 0
+        self.saved_seq = 0
+        self.stats = InventoryStats()
+        self._rows: dict[str, int] = {}
+        self._skus: list[str] = []
+        self._quantity = array("q")
+        self._price = array("d")
+        self._version = array("q")
+        self._warehouse = array("I")
+        self._warehouse_ids: dict[str, int] = {"": _NO_WAREHOUSE}
+        self._warehouses: list[str] = [""]
+
+    def __len__(self) -> int:
+        return len(self._skus)
+
+    def __contains__(self, sku: str) -> bool:
+        return sku in self._rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._skus)
+
+    def get(self, sku: str) -> StockLevel | None:
+        """The stock level of ``sku``, or None if no event has mentioned it."""
+        row = self._rows.get(sku)
+        if row is None:
+            return None
+        quantity = self._quantity[row]
+        price = self._price[row]
+        return StockLevel(
+            quantity if quantity >= 0 else None,
+            price if price == price else None,
+            self._warehouses[self._warehouse[row]] or None,
+            self._version[row],
+        )
+
+    def apply(self, event: WebhookEvent) -> bool:
+        """Fold an inventory event into the index; False if it was stale or malformed.
+
+        Events of other topics are ignored. Only the ``data`` members the
+        index needs are read, without decoding the whole body.
+        """
+        if event.topic != TOPIC_INVENTORY:
+            return False
+        try:
+            data = event.data_fields(FIELDS)
+        except (ValueError, AttributeError):
+            data = {}
+        applied = self.update(
+            data.get("sku"),
+            quantity=data.get("quantity"),
+            price=data.get("price"),
+            warehouse=data.get("warehouse"),
+            version=data.get("version"),
+        )
+        if event.seq > self.seq:
+            self.seq = event.seq
+        return applied
+
+    def update(
+        self,
+        sku: Any,
+        *,
+        quantity: Any = None,
+        price: Any = None,
+        warehouse: Any = None,
+        version: Any = None,
+    ) -> bool:
+        """Set the given fields of ``sku`` unless ``version`` is older than the stored one."""
+        if (
+            not isinstance(sku, str)
+            or not sku
+            or not (quantity is None or _is_int(quantity) and quantity >= 0)
+            or not (price is None or _is_finite(price))
+            or not (warehouse is None or isinstance(warehouse, str))
+            or not (version is None or _is_int(version))
+        ):
+            self.stats.malformed += 1
+            return False
+        row = self._rows.get(sku)
+        if row is None:
+            row = self._append(sku)
+        elif version is not None and version < self._version[row]:
+            self.stats.stale += 1
+            return False
+        if quantity is not None:
+            self._quantity[row] = quantity
+        if price is not None:
+            self._price[row] = price
+        if warehouse is not None:
+            self._warehouse[row] = self._intern(warehouse)
+        if version is not None:
+            self._version[row] = version
+        self.stats.applied += 1
+        return True
+
+    def memory_estimate(self) -> int:
+        """Approximate bytes held by the index."""
+        columns = sum(column.itemsize * len(column) for column in self._columns())
+        strings = sum(sys.getsizeof(sku) for sku in self._skus)
+        return (
+            columns
+            + strings
+            + sys.getsizeof(self._rows)
+            + sys.getsizeof(self._skus)
+            + sum(sys.getsizeof(name) for name in self._warehouses)
+        )
+
+    def dumps(self) -> bytes:
+        """Serialize the index in the snapshot format."""
+        skus = [sku.encode() for sku in self._skus]
+        names = [name.encode() for name in self._warehouses]
+        body = b"".join(
+            [
+                *(column.tobytes() for column in self._columns()),
+                array("I", map(len, skus)).tobytes(),
+                array("I", map(len, names)).tobytes(),
+                *skus,
+                *names,
+            ]
+        )
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, self.seq, len(skus), len(names), zlib.crc32(body)
+        )
+        return header + body
+
+    def loads(self, data: bytes) -> None:
+        """Replace the contents of the index with a :meth:`dumps` snapshot."""
+        if len(data) < SNAPSHOT_HEADER.size:
+            raise ValueError("truncated inventory snapshot")
+        magic, seq, rows, count, crc = SNAPSHOT_HEADER.unpack_from(data)
+        body = memoryview(data)[SNAPSHOT_HEADER.size :]
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("not an inventory snapshot")
+        if zlib.crc32(body) != crc:
+            raise ValueError("inventory snapshot checksum mismatch")
+        pos = 0
+        columns = []
+        for typecode in _COLUMN_TYPES + "I":
+            column = array(typecode)
+            end = pos + column.itemsize * rows
+            column.frombytes(body[pos:end])
+            columns.append(column)
+            pos = end
+        name_lengths = array("I")
+        end = pos + name_lengths.itemsize * count
+        name_lengths.frombytes(body[pos:end])
+        pos = end
+        quantity, price, version, warehouse, sku_lengths = columns
+        skus = []
+        for length in sku_lengths:
+            skus.append(str(body[pos : pos + length], "utf-8"))
+            pos += length
+        names = []
+        for length in name_lengths:
+            names.append(str(body[pos : pos + length], "utf-8"))
+            pos += length
+        if pos != len(body) or not names or names[_NO_WAREHOUSE]:
+            raise ValueError("malformed inventory snapshot")
+        self.seq = seq
+        self._skus = skus
+        self._rows = {sku: row for row, sku in enumerate(skus)}
+        self._quantity, self._price, self._version, self._warehouse = (
+            quantity,
+            price,
+            version,
+            warehouse,
+        )
+        self._warehouses = names
+        self._warehouse_ids = {name: id_ for id_, name in enumerate(names)}
+
+    async def save(self) -> None:
+        """Write a snapshot to ``directory``, replacing the previous one.
+
+        The index is serialized on the calling thread, so the snapshot is
+        consistent, and written to disk on another.
+        """
+        if self.directory is None:
+            raise RuntimeError("inventory index has no snapshot directory")
+        seq = self.seq
+        data = self.dumps()
+        await asyncio.to_thread(self._write_snapshot, data)
+        self.saved_seq = seq
+
+    def load(self) -> bool:
+        """Load the snapshot in ``directory``; False if there is none."""
+        if self.directory is None:
+            return False
+        path = self.directory / SNAPSHOT_FILE
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return False
+        try:
+            self.loads(data)
+        except (ValueError, UnicodeDecodeError) as exc:
+            logger.warning("ignoring unreadable inventory snapshot %s: %s", path, exc)
+            return False
+        self.saved_seq = self.seq
+        return True
+
+    def restore(self, wal: WriteAheadLog) -> int:
+        """Load the last snapshot and apply the log records after it.
+
+        ``wal`` must be open. Returns the number of inventory events replayed.
+        """
+        if self.load():
+            logger.info("loaded inventory snapshot of %d SKUs at seq %d", len(self), self.seq)
+        replayed = 0
+        for seq, record in wal.replay(self.seq):
+            event = WebhookEvent.from_record(record, seq)
+            if event.topic == TOPIC_INVENTORY:
+                self.apply(event)
+                replayed += 1
+            self.seq = seq
+        return replayed
+
+    def _append(self, sku: str) -> int:
+        row = len(self._skus)
+        self._rows[sku] = row
+        self._skus.append(sku)
+        self._quantity.append(-1)
+        self._price.append(math.nan)
+        self._version.append(0)
+        self._warehouse.append(_NO_WAREHOUSE)
+        return row
+
+    def _intern(self, warehouse: str) -> int:
+        id_ = self._warehouse_ids.get(warehouse)
+        if id_ is None:
+            id_ = self._warehouse_ids[warehouse] = len(self._warehouses)
+            self._warehouses.append(warehouse)
+        return id_
+
+    def _columns(self) -> tuple[array, ...]:
+        return self._quantity, self._price, self._version, self._warehouse
+
+    def _write_snapshot(self, data: bytes) -> None:
+        assert self.directory is not None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / SNAPSHOT_FILE
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+def _is_int(value: Any) -> bool:
+    # Columns hold signed 64-bit integers.
+    return isinstance(value, int) and not isinstance(value, bool) and -_LIMIT <= value < _LIMIT
+
+
+def _is_finite(value: Any) -> bool:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:  # an integer too large for a float
+        return False
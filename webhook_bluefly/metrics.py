@@ -0,0 +1,337 @@
+"""Latency histograms and counters, exported in the Prometheus text format.
+
+:class:`MetricsRegistry` records how long each event spends in each stage of
+the pipeline, per event type:
+
+``receive``
+    from :meth:`~.pipeline.Pipeline.accept` being called until the ack status
+    is known, i.e. the ack latency; it includes ``verify`` and ``persist``
+``verify``
+    checking the delivery's signature
+``persist``
+    waiting for the event's write-ahead log record to be committed
+``dispatch``
+    waiting in the dispatcher queue until a worker picks the event up
+``handle``
+    running the handler, until a deferred result resolves
+
+Durations go into HDR-style histograms: :data:`SUB_BUCKET_BITS` bits of
+each value in microseconds are kept exactly and the rest only as a power of
+two, so every octave from 1 µs to an hour is split into 16 buckets and any
+recorded value is known to within about 6%. Recording is an index
+computation and two integer increments, with no allocation, and quantiles
+are exact up to that resolution no matter how the latency is distributed.
+
+The registry lives in anonymous shared memory. Create it before forking the
+receiver processes and call :meth:`MetricsRegistry.bind` in each with its
+worker slot: every slot then writes only its own block of counts, so
+recording takes no lock, and whichever process answers a scrape adds up the
+blocks of all of them. A worker restarted in the same slot carries on from
+its predecessor's counts, so exported counters never go backwards.
+"""
+
+from __future__ import annotations
+
+import logging
+import mmap
+import multiprocessing
+from bisect import bisect_right
+from typing import Iterator, Mapping
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("receive", "verify", "persist", "dispatch", "handle")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "webhook_bluefly"
+
+# Value bits kept exactly: 2**(SUB_BUCKET_BITS - 1) buckets per octave.
+SUB_BUCKET_BITS = 5
+_HALF = 1 << (SUB_BUCKET_BITS - 1)
+# Longer durations are recorded as this value, a little over 71 minutes.
+MAX_MICROS = (1 << 32) - 1
+# Event types beyond the registry's series capacity are recorded under this one.
+OVERFLOW_TYPE = "other"
+# Bytes per series or counter name in the shared directory.
+NAME_SIZE = 64
+# Registering a new series waits at most this long for the directory lock.
+LOCK_TIMEOUT = 1.0
+
+# Upper bounds, in seconds, of the exported Prometheus buckets.
+EXPORT_BOUNDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)  # fmt: skip
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def bucket_index(micros: int) -> int:
+    """Histogram bucket of a duration in whole microseconds."""
+    if micros < 2 * _HALF:
+        return micros
+    shift = micros.bit_length() - SUB_BUCKET_BITS
+    return shift * _HALF + (micros >> shift)
+
+
+def bucket_upper(index: int) -> int:
+    """Exclusive upper bound, in microseconds, of the values in bucket ``index``."""
+    if index < 2 * _HALF:
+        return index + 1
+    octave, sub = divmod(index, _HALF)
+    return (sub + _HALF + 1) << (octave - 1)
+
+
+BUCKETS = bucket_index(MAX_MICROS) + 1
+# Per series: bucket counts, then the sum of the values in microseconds.
+SERIES_CELLS = BUCKETS + 1
+_UPPER = [bucket_upper(index) for index in range(BUCKETS)]
+# Number of leading buckets that fall entirely within each exported bound.
+_EXPORT_CUTS = [bisect_right(_UPPER, round(bound * 1e6)) for bound in EXPORT_BOUNDS]
+
+
+class Histogram:
+    """A summed copy of one series, for quantiles and export."""
+
+    __slots__ = ("counts", "total_micros", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKETS
+        self.total_micros = 0
+        self.count = 0
+
+    def add(self, cells: memoryview | list[int]) -> None:
+        counts = self.counts
+        for index, value in enumerate(cells[:BUCKETS]):
+            if value:
+                counts[index] += value
+        self.total_micros += cells[BUCKETS]
+        self.count = sum(counts)
+
+    def quantile(self, q: float) -> float:
+        """The duration in seconds below which a fraction ``q`` of the values fall."""
+        if not self.count:
+            return 0.0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, value in enumerate(self.counts):
+            seen += value
+            if seen >= rank:
+                return _UPPER[index] / 1e6
+        return _UPPER[-1] / 1e6
+
+    def cumulative(self) -> list[int]:
+        """Counts at or below each of :data:`EXPORT_BOUNDS`."""
+        result = []
+        seen = start = 0
+        for cut in _EXPORT_CUTS:
+            seen += sum(self.counts[start:cut])
+            start = cut
+            result.append(seen)
+        return result
+
+
+class MetricsRegistry:
+    """Stage latency histograms and pipeline counters for ``workers`` processes.
+
+    ``max_series`` bounds the number of ``(stage, event type)`` series;
+    event types seen once it is reached are recorded as
+    :data:`OVERFLOW_TYPE`, so a sender inventing event types cannot grow
+    the registry.
+    """
+
+    def __init__(self, workers: int = 1, *, max_series: int = 256, max_counters: int = 64) -> None:
+        if workers < 1 or max_series <= len(STAGES) or max_counters < 1:
+            raise ValueError("workers must be >= 1 and max_series must exceed the stage count")
+        self.workers = workers
+        self.max_series = max_series
+        self.max_counters = max_counters
+        self._block = max_counters + max_series * SERIES_CELLS
+        directory = 16 + (max_series + max_counters) * NAME_SIZE
+        # Layout: series and counter name counts (u64) | series names | counter
+        # names | one block per worker of counters (u64) and series cells (u64).
+        self._map = mmap.mmap(-1, directory + workers * self._block * 8)
+        view = memoryview(self._map)
+        self._sizes = view[:16].cast("Q")
+        self._names = view[16:directory]
+        self._cells = view[directory:].cast("Q")
+        self._lock = multiprocessing.get_context("fork").Lock()
+        self._series: dict[tuple[str, str], int] = {}
+        # Series that found the directory full, recorded under OVERFLOW_TYPE.
+        self._overflowed: dict[tuple[str, str], int] = {}
+        self._counters: dict[str, int] = {}
+        self._baseline: dict[int, int] = {}
+        # Directory entries already read into _series and _counters.
+        self._synced = [0, 0]
+        self.worker = 0
+        self._base = 0
+        self._offset = max_counters
+        for stage in STAGES:
+            self._register_series(stage, OVERFLOW_TYPE)
+
+    def bind(self, worker: int) -> None:
+        """Record this process's measurements in the block of slot ``worker``.
+
+        Call it in each forked process before it records anything.
+        """
+        if not 0 <= worker < self.workers:
+            raise ValueError(f"worker must be in [0, {self.workers})")
+        self.worker = worker
+        self._base = worker * self._block
+        self._offset = self._base + self.max_counters
+        # Counters set by the previous process in this slot are added to, not replaced.
+        self._sync_names()
+        cells, base = self._cells, self._base
+        self._baseline = {index: cells[base + index] for index in self._counters.values()}
+
+    def observe(self, stage: str, event_type: str, seconds: float) -> None:
+        """Record that an event of ``event_type`` spent ``seconds`` in ``stage``."""
+        index = self._series.get((stage, event_type))
+        if index is None:
+            index = self._register_series(stage, event_type)
+        micros = int(seconds * 1e6)
+        if micros < 2 * _HALF:
+            if micros < 0:
+                micros = 0
+            bucket = micros
+        else:
+            if micros > MAX_MICROS:
+                micros = MAX_MICROS
+            shift = micros.bit_length() - SUB_BUCKET_BITS
+            bucket = shift * _HALF + (micros >> shift)
+        offset = self._offset + index * SERIES_CELLS
+        cells = self._cells
+        cells[offset + bucket] += 1
+        cells[offset + BUCKETS] += micros
+
+    def set_counters(self, values: Mapping[str, int]) -> None:
+        """Publish this process's running totals, e.g. the pipeline's stats."""
+        cells, base, counters = self._cells, self._base, self._counters
+        for name, value in values.items():
+            index = counters.get(name)
+            if index is None:
+                index = self._register_counter(name)
+                if index is None:
+                    continue
+            cells[base + index] = self._baseline.get(index, 0) + value
+
+    def histogram(self, stage: str, event_type: str | None = None) -> Histogram:
+        """Counts of ``stage`` summed over all workers, and over all types if None."""
+        self._sync_names()
+        result = Histogram()
+        for (series_stage, series_type), index in self._series.items():
+            if series_stage == stage and event_type in (None, series_type):
+                for cells in self._series_cells(index):
+                    result.add(cells)
+        return result
+
+    def counters(self) -> dict[str, int]:
+        """Counter totals over all workers."""
+        self._sync_names()
+        cells = self._cells
+        return {
+            name: sum(cells[worker * self._block + index] for worker in range(self.workers))
+            for name, index in self._counters.items()
+        }
+
+    def render(self) -> bytes:
+        """All metrics in the Prometheus text exposition format."""
+        self._sync_names()
+        lines = [
+            f"# HELP {PREFIX}_events_total Webhook deliveries by pipeline outcome.",
+            f"# TYPE {PREFIX}_events_total counter",
+        ]
+        for name, value in sorted(self.counters().items()):
+            lines.append(f'{PREFIX}_events_total{{outcome="{_escape(name)}"}} {value}')
+        histograms = []
+        for (stage, event_type), index in sorted(self._series.items()):
+            histogram = Histogram()
+            for cells in self._series_cells(index):
+                histogram.add(cells)
+            if histogram.count:
+                labels = f'stage="{_escape(stage)}",event_type="{_escape(event_type)}"'
+                histograms.append((labels, histogram))
+        name = f"{PREFIX}_stage_seconds"
+        lines.append(f"# HELP {name} Time events spent in each pipeline stage.")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            for bound, count in zip(EXPORT_BOUNDS, histogram.cumulative()):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.total_micros / 1e6}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        name = f"{PREFIX}_stage_quantile_seconds"
+        lines.append(f"# HELP {name} Stage latency quantiles, to within about 6%.")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, histogram in histograms:
+            for q in QUANTILES:
+                lines.append(f'{name}{{{labels},quantile="{q}"}} {histogram.quantile(q)}')
+        lines.append("")
+        return "\n".join(lines).encode()
+
+    def _series_cells(self, index: int) -> Iterator[list[int]]:
+        cells = self._cells
+        for worker in range(self.workers):
+            offset = worker * self._block + self.max_counters + index * SERIES_CELLS
+            yield cells[offset : offset + SERIES_CELLS].tolist()
+
+    def _register_series(self, stage: str, event_type: str) -> int:
+        index = self._overflowed.get((stage, event_type))
+        if index is not None:
+            return index
+        index = self._register(f"{stage}\t{event_type}", 0, self.max_series)
+        if index is None:
+            index = self._series.get((stage, OVERFLOW_TYPE))
+            if index is None:
+                raise ValueError(f"no room for metrics of stage {stage!r}")
+            self._overflowed[stage, event_type] = index
+            return index
+        self._series[stage, event_type] = index
+        return index
+
+    def _register_counter(self, name: str) -> int | None:
+        index = self._register(name, 1, self.max_counters)
+        if index is not None:
+            self._counters[name] = index
+        return index
+
+    def _register(self, name: str, kind: int, capacity: int) -> int | None:
+        """Find or add ``name`` in the shared directory; None if it is full."""
+        encoded = name.encode()
+        if len(encoded) > NAME_SIZE or b"\x00" in encoded:
+            return None
+        if not self._lock.acquire(timeout=LOCK_TIMEOUT):
+            logger.warning("metrics directory is locked, not registering %r", name)
+            return None
+        try:
+            self._sync_names()
+            known = self._series if kind == 0 else self._counters
+            key = tuple(name.split("\t", 1)) if kind == 0 else name
+            if key in known:
+                return known[key]  # type: ignore[index]
+            index = self._sizes[kind]
+            if index >= capacity:
+                return None
+            offset = (index if kind == 0 else self.max_series + index) * NAME_SIZE
+            self._names[offset : offset + len(encoded)] = encoded
+            self._sizes[kind] = index + 1
+            return index
+        finally:
+            self._lock.release()
+
+    def _sync_names(self) -> None:
+        """Pick up series and counters other processes have registered."""
+        names, sizes, synced = self._names, self._sizes, self._synced
+        for index in range(synced[0], sizes[0]):
+            stage, _, event_type = _read_name(names, index).partition("\t")
+            self._series[stage, event_type] = index
+        for index in range(synced[1], sizes[1]):
+            self._counters[_read_name(names, self.max_series + index)] = index
+        synced[0], synced[1] = sizes[0], sizes[1]
+
+
+def _read_name(names: memoryview, index: int) -> str:
+    raw = bytes(names[index * NAME_SIZE : (index + 1) * NAME_SIZE])
+    return raw.rstrip(b"\x00").decode()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
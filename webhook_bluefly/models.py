@@ -0,0 +1,316 @@
+"""Typed, slot-based views of Bluefly event payloads.
+
+Handlers that keep events around (order state, inventory snapshots, retry
+queues) pay heavily for the nested dicts ``json.loads`` produces. The models
+here declare each payload's schema as :class:`Field` attributes; every field
+is backed by its own ``__slots__`` entry and decoded from the raw mapping
+only on first access::
+
+    order = typed_event(event)      # an OrderEvent
+    for line in order.lines:        # only "lines" is converted
+        reserve(line.sku, line.quantity)
+
+A model holds on to the raw mapping until each of its fields has been read
+once, then drops it. :meth:`Record.materialize` decodes everything up front,
+which is what long-lived caches should call before retaining a model.
+Values of the wrong JSON type raise :class:`~.errors.EnvelopeError` when the
+field is decoded.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, ClassVar, Mapping
+
+from .errors import EnvelopeError
+from .events import TOPIC_INVENTORY, TOPIC_ORDER, TOPIC_PRODUCT, WebhookEvent, topic_of
+
+Converter = Callable[[Any, "Field"], Any]
+
+
+class Field:
+    """One schema field, read from ``key`` (default: the attribute name).
+
+    ``kind`` is ``str``, ``int``, ``float``, ``bool``, ``dict``, a
+    :class:`Record` subclass, a one-element list such as ``[OrderLine]`` for
+    arrays of records, or ``None`` to keep the JSON value as is. Missing and
+    ``null`` values decode to ``None``.
+    """
+
+    __slots__ = ("kind", "key", "name", "owner", "convert", "slot")
+
+    def __init__(self, kind: Any = None, *, key: str | None = None) -> None:
+        self.kind = kind
+        self.key = key
+        self.name = ""
+        self.owner = ""
+        self.convert: Converter | None = _converter(kind)
+        self.slot: Any = None
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+        self.owner = owner.__name__
+        if self.key is None:
+            self.key = name
+
+    def __get__(self, obj: Record | None, owner: type | None = None) -> Any:
+        if obj is None:
+            return self
+        try:
+            return self.slot.__get__(obj, owner)
+        except AttributeError:
+            return obj._decode(self)
+
+    def __set__(self, obj: Record, value: Any) -> None:
+        raise AttributeError(f"{self.owner}.{self.name} is read-only")
+
+    def invalid(self, value: Any, expected: str) -> EnvelopeError:
+        return EnvelopeError(
+            f"{self.owner}.{self.name}: expected {expected}, got {type(value).__name__}"
+        )
+
+
+def _scalar(kind: type, expected: str) -> Converter:
+    def convert(value: Any, field: Field) -> Any:
+        # bool is an int subclass, but a JSON true is never a quantity.
+        if type(value) is bool and kind is not bool:
+            raise field.invalid(value, expected)
+        if isinstance(value, kind):
+            return value
+        raise field.invalid(value, expected)
+
+    return convert
+
+
+def _number(value: Any, field: Field) -> float:
+    if type(value) is float:
+        return value
+    if type(value) is int:
+        return float(value)
+    raise field.invalid(value, "a number")
+
+
+def _record(kind: type[Record]) -> Converter:
+    def convert(value: Any, field: Field) -> Record:
+        if not isinstance(value, dict):
+            raise field.invalid(value, "an object")
+        return kind(value)
+
+    return convert
+
+
+def _records(kind: type[Record]) -> Converter:
+    def convert(value: Any, field: Field) -> list[Record]:
+        if not isinstance(value, list):
+            raise field.invalid(value, "an array")
+        items = []
+        for item in value:
+            if not isinstance(item, dict):
+                raise field.invalid(item, "an array of objects")
+            items.append(kind(item))
+        return items
+
+    return convert
+
+
+def _converter(kind: Any) -> Converter | None:
+    if kind is None:
+        return None
+    if kind is str:
+        return _scalar(str, "a string")
+    if kind is int:
+        return _scalar(int, "an integer")
+    if kind is bool:
+        return _scalar(bool, "a boolean")
+    if kind is dict:
+        return _scalar(dict, "an object")
+    if kind is float:
+        return _number
+    if isinstance(kind, list) and len(kind) == 1:
+        return _records(kind[0])
+    if isinstance(kind, type) and issubclass(kind, Record):
+        return _record(kind)
+    raise TypeError(f"unsupported field kind {kind!r}")
+
+
+class _Schema(type):
+    """Gives every :class:`Field` of a record class a private slot."""
+
+    def __new__(mcs, name: str, bases: tuple[type, ...], namespace: dict[str, Any]):
+        own = [(attr, value) for attr, value in namespace.items() if isinstance(value, Field)]
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple(
+            f"_{attr}" for attr, _field in own
+        )
+        cls = super().__new__(mcs, name, bases, namespace)
+        for attr, field in own:
+            field.slot = cls.__dict__[f"_{attr}"]
+        inherited = [field for base in reversed(cls.__mro__[1:]) for field in _own_fields(base)]
+        cls._fields = tuple(inherited) + tuple(field for _attr, field in own)
+        return cls
+
+
+def _own_fields(cls: type) -> list[Field]:
+    return [value for value in vars(cls).values() if isinstance(value, Field)]
+
+
+class Record(metaclass=_Schema):
+    """Base for schema-declared payload objects."""
+
+    __slots__ = ("_raw", "_pending")
+    _fields: ClassVar[tuple[Field, ...]] = ()
+
+    def __init__(self, raw: Mapping[str, Any]) -> None:
+        self._raw: Mapping[str, Any] | None = raw
+        self._pending = len(self._fields)
+
+    def _decode(self, field: Field) -> Any:
+        raw = self._raw
+        value = raw.get(field.key) if raw is not None else None
+        if value is not None and field.convert is not None:
+            value = field.convert(value, field)
+        field.slot.__set__(self, value)
+        self._pending -= 1
+        if self._pending <= 0:
+            self._raw = None
+        return value
+
+    def materialize(self) -> Record:
+        """Decode every field, recursively, and release the raw mapping."""
+        for field in self._fields:
+            value = field.__get__(self)
+            if isinstance(value, Record):
+                value.materialize()
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, Record):
+                        item.materialize()
+        return self
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the decoded fields as plain JSON-compatible values."""
+        result = {}
+        for field in self._fields:
+            value = field.__get__(self)
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, Record) else item for item in value]
+            result[field.key] = value
+        return result
+
+    def _repr_fields(self) -> str:
+        return ", ".join(f"{field.name}={field.__get__(self)!r}" for field in self._fields)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._repr_fields()})"
+
+
+class Address(Record):
+    __slots__ = ()
+
+    name = Field(str)
+    line1 = Field(str)
+    line2 = Field(str)
+    city = Field(str)
+    region = Field(str)
+    postal_code = Field(str)
+    country = Field(str)
+
+
+class OrderLine(Record):
+    __slots__ = ()
+
+    sku = Field(str)
+    quantity = Field(int)
+    unit_price = Field(float)
+    currency = Field(str)
+
+
+class ProductImage(Record):
+    __slots__ = ()
+
+    url = Field(str)
+    width = Field(int)
+    height = Field(int)
+
+
+class TypedEvent(Record):
+    """Envelope fields of a delivery plus its schema-declared ``data``."""
+
+    __slots__ = ("event_id", "event_type", "seller_id", "occurred_at", "received_at", "seq")
+
+    def __init__(self, event: WebhookEvent) -> None:
+        payload = event.payload(cache=False)
+        if not isinstance(payload, dict):
+            raise EnvelopeError("envelope must be a JSON object")
+        data = payload.get("data")
+        if not isinstance(data, dict):
+            raise EnvelopeError("envelope field 'data' must be an object")
+        super().__init__(data)
+        self.event_id = event.event_id
+        self.event_type = event.event_type
+        self.seller_id = event.seller_id
+        self.occurred_at: str | None = payload.get("occurred_at")
+        self.received_at = event.received_at
+        self.seq = event.seq
+
+    @property
+    def topic(self) -> str:
+        return topic_of(self.event_type)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.event_id!r}, {self._repr_fields()})"
+
+
+class OrderEvent(TypedEvent):
+    __slots__ = ()
+
+    order_id = Field(str)
+    status = Field(str)
+    sequence = Field(int)
+    lines = Field([OrderLine])
+    shipping_address = Field(Address)
+    total = Field(float)
+    currency = Field(str)
+    tracking_number = Field(str)
+
+
+class InventoryEvent(TypedEvent):
+    __slots__ = ()
+
+    sku = Field(str)
+    quantity = Field(int)
+    warehouse = Field(str)
+    price = Field(float)
+    version = Field(int)
+
+
+class ProductEvent(TypedEvent):
+    __slots__ = ()
+
+    sku = Field(str)
+    product_id = Field(str)
+    title = Field(str)
+    brand = Field(str)
+    description = Field(str)
+    attributes = Field(dict)
+    images = Field([ProductImage])
+
+
+MODELS: dict[str, type[TypedEvent]] = {
+    TOPIC_ORDER: OrderEvent,
+    TOPIC_INVENTORY: InventoryEvent,
+    TOPIC_PRODUCT: ProductEvent,
+}
+
+
+def typed_event(event: WebhookEvent) -> TypedEvent:
+    """Wrap ``event`` in the model for its topic.
+
+    The JSON body is parsed here unless the event already holds a parsed
+    payload; the parse is not cached on ``event``, so the model is the only
+    holder of the decoded data.
+    """
+    model = MODELS.get(event.topic)
+    if model is None:
+        raise EnvelopeError(f"no model for event type {event.event_type!r}")
+    return model(event)
@@ -0,0 +1,499 @@
+"""Compact per-order state folded from the order event stream.
+
+Handlers that need an order's current state, e.g. to tell whether a
+``shipped`` event is for an order that was already cancelled, used to ask
+the Bluefly API for it on every event. :class:`OrderStateStore` keeps that
+state locally instead: each order's ``created``, ``acknowledged``,
+``shipped``, ``cancelled`` and ``returned`` events are folded into one
+fixed-size record of status, sequence number, timestamps, total, currency
+and tracking number::
+
+    orders = OrderStateStore()
+
+    async def handle(event):
+        if event.topic == "order":
+            state = orders.apply(event)
+            if state is not None and state.status == "cancelled":
+                await release_stock(event)
+
+Bluefly does not deliver an order's events in order: retries and parallel
+delivery reorder them, and redeliveries repeat them. When events carry the
+order's ``sequence`` number, one at or below the stored number is stale and
+dropped, and one that skips ahead is buffered until the missing ones arrive.
+Buffered events are applied anyway after ``max_delay`` seconds, or once
+more than ``max_pending`` events are buffered, on the assumption that the
+missing ones were lost. An order's first event is applied at once if it is
+``created`` or has sequence 1. Events without a sequence number are
+ordered by their envelope ``occurred_at`` time: an event older than the
+order's last update is stale.
+
+The store is sized to keep months of orders in memory. Records live in
+columns of machine values with no Python object per order: order ids are
+kept in fixed :data:`KEY_WIDTH`-byte slots (longer ids by a hash of them)
+and found through an open-addressing hash table of row numbers, and
+tracking numbers in :data:`TRACKING_WIDTH`-byte slots. A record costs about
+120 bytes including its share of the table, so 90 days of 100,000 orders a
+day fit in around 1.1 GB; pass the expected number of orders as
+``capacity`` to avoid rebuilding the table as it grows. Orders not updated
+for ``retention`` seconds are dropped by a sweep that checks a few records
+per applied event; :meth:`OrderStateStore.expire` sweeps all of them.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import time
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, NamedTuple
+
+from .events import TOPIC_ORDER, WebhookEvent
+
+# Order states, by status code. Code 0 marks a free record; "unknown" is the
+# state of an order whose first event applied named no status.
+STATUSES = ("", "unknown", "created", "acknowledged", "shipped", "cancelled", "returned")
+FIELDS = ("order_id", "status", "sequence", "total", "currency", "tracking_number")
+KEY_WIDTH = 32
+TRACKING_WIDTH = 32
+
+_FREE = 0
+_UNKNOWN = 1
+_CREATED = 2
+_STATUS_CODES = {name: code for code, name in enumerate(STATUSES) if code > _UNKNOWN}
+_WANTED = {"occurred_at": None, "data": dict.fromkeys(FIELDS)}
+# Hash table entries: empty, deleted, or row + 1.
+_EMPTY = 0
+_DELETED = -1
+# Marks a slot whose value did not fit and is hashed or kept aside.
+_LONG = 0xFF
+# Records checked for expiry per applied event.
+_SWEEP = 4
+_MAX_SEQUENCE = 2**32 - 1
+
+
+class OrderState(NamedTuple):
+    """An order's state; ``sequence`` is 0 if its events carry none."""
+
+    status: str
+    sequence: int
+    created_at: float
+    updated_at: float
+    total: float | None
+    currency: str | None
+    tracking_number: str | None
+
+
+@dataclass
+class OrderStoreStats:
+    applied: int = 0
+    stale: int = 0
+    buffered: int = 0
+    # Buffered events applied although an earlier sequence number never came.
+    gaps: int = 0
+    expired: int = 0
+    malformed: int = 0
+
+
+@dataclass(slots=True)
+class _Update:
+    """The fields of one order event that the store keeps."""
+
+    sequence: int | None
+    status: int
+    timestamp: float
+    total: float | None
+    currency: str | None
+    tracking_number: str | None
+
+
+class OrderStateStore:
+    """Latest state per order, reconciled from out-of-order events.
+
+    ``clock`` returns the current Unix time and only drives retention and
+    ``max_delay``; order timestamps come from the events.
+    """
+
+    def __init__(
+        self,
+        *,
+        retention: float = 90 * 86400.0,
+        capacity: int = 1024,
+        max_delay: float = 60.0,
+        max_pending: int = 10_000,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        if retention <= 0 or capacity < 1 or max_delay < 0 or max_pending < 0:
+            raise ValueError(
+                "retention and capacity must be positive, max_delay and max_pending >= 0"
+            )
+        self.retention = retention
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.stats = OrderStoreStats()
+        self._clock = clock
+        self._count = 0
+        self._keys = bytearray()
+        self._status = array("B")
+        self._sequence = array("I")
+        self._created = array("d")
+        self._updated = array("d")
+        self._total = array("d")
+        self._currency = array("H")
+        self._tracking = bytearray()
+        self._free = array("i")
+        self._long_tracking: dict[int, str] = {}
+        self._currency_ids: dict[str, int] = {"": 0}
+        self._currencies: list[str] = [""]
+        self._table = array("i", bytes(4 * _table_size(capacity)))
+        # Occupied table entries, deleted ones included.
+        self._used = 0
+        self._cursor = 0
+        # Buffered events per order, with the time they are applied regardless.
+        self._pending: dict[bytes, tuple[float, list[_Update]]] = {}
+        self._pending_count = 0
+        self._deadlines: deque[tuple[float, bytes]] = deque()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, order_id: str) -> bool:
+        return self._find(_key(order_id)) >= 0
+
+    @property
+    def pending(self) -> int:
+        """Events buffered while waiting for an earlier sequence number."""
+        return self._pending_count
+
+    def get(self, order_id: str) -> OrderState | None:
+        """The state of ``order_id``, or None if no event for it has been applied."""
+        row = self._find(_key(order_id))
+        return self._state(row) if row >= 0 else None
+
+    def apply(self, event: WebhookEvent) -> OrderState | None:
+        """Fold an order event into its order's state and return the new state.
+
+        Returns None if the event was stale, malformed, of another topic, or
+        buffered to wait for an earlier one.
+        """
+        if event.topic != TOPIC_ORDER:
+            return None
+        now = self._clock()
+        if self._deadlines:
+            self._release_due(now)
+        self._sweep(now - self.retention, _SWEEP)
+        parsed = self._parse(event)
+        if parsed is None:
+            self.stats.malformed += 1
+            return None
+        key, update = parsed
+        row = self._find(key)
+        sequence = update.sequence
+        if sequence is None:
+            if row >= 0 and update.timestamp < self._updated[row]:
+                self.stats.stale += 1
+                return None
+        elif row >= 0:
+            if sequence <= self._sequence[row]:
+                self.stats.stale += 1
+                return None
+            if sequence > self._sequence[row] + 1:
+                self._buffer(key, update, now)
+                return None
+        elif sequence > 1 and update.status != _CREATED:
+            self._buffer(key, update, now)
+            return None
+        if row < 0:
+            row = self._insert(key, update.timestamp)
+        self._fold(row, update)
+        if key in self._pending:
+            self._drain(key, row, force=False)
+        return self._state(row)
+
+    def expire(self) -> int:
+        """Drop every order not updated within ``retention``; return how many."""
+        before = self.stats.expired
+        self._sweep(self._clock() - self.retention, len(self._status))
+        return self.stats.expired - before
+
+    def memory_estimate(self) -> int:
+        """Approximate bytes held by the records and the hash table."""
+        columns = (self._status, self._sequence, self._created, self._updated, self._total)
+        return (
+            len(self._keys)
+            + len(self._tracking)
+            + sum(column.itemsize * len(column) for column in columns)
+            + self._currency.itemsize * len(self._currency)
+            + self._table.itemsize * len(self._table)
+            + self._free.itemsize * len(self._free)
+        )
+
+    def _parse(self, event: WebhookEvent) -> tuple[bytes, _Update] | None:
+        try:
+            fields = event.fields(_WANTED)
+        except ValueError:
+            return None
+        data = fields.get("data")
+        if not isinstance(data, dict):
+            return None
+        order_id = data.get("order_id")
+        sequence = data.get("sequence")
+        total = data.get("total")
+        currency = data.get("currency")
+        tracking_number = data.get("tracking_number")
+        if (
+            not isinstance(order_id, str)
+            or not order_id
+            or not (sequence is None or _is_int(sequence) and 0 < sequence <= _MAX_SEQUENCE)
+            or not (total is None or _is_number(total) and math.isfinite(total))
+            or not (currency is None or isinstance(currency, str))
+            or not (tracking_number is None or isinstance(tracking_number, str))
+        ):
+            return None
+        status = _STATUS_CODES.get(event.event_type.partition(".")[2])
+        if status is None:
+            named = data.get("status")
+            status = _STATUS_CODES.get(named, 0) if isinstance(named, str) else 0
+        timestamp = _timestamp(fields.get("occurred_at"))
+        if timestamp is None:
+            timestamp = event.received_at
+        update = _Update(sequence, status, timestamp, total, currency, tracking_number)
+        return _key(order_id), update
+
+    def _fold(self, row: int, update: _Update) -> None:
+        if update.status:
+            self._status[row] = update.status
+            if update.status == _CREATED:
+                self._created[row] = update.timestamp
+        if update.sequence is not None:
+            self._sequence[row] = update.sequence
+        self._updated[row] = update.timestamp
+        if update.total is not None:
+            self._total[row] = update.total
+        if update.currency is not None:
+            self._currency[row] = self._intern(update.currency)
+        if update.tracking_number is not None:
+            self._set_tracking(row, update.tracking_number)
+        self.stats.applied += 1
+
+    def _state(self, row: int) -> OrderState:
+        total = self._total[row]
+        return OrderState(
+            STATUSES[self._status[row]],
+            self._sequence[row],
+            self._created[row],
+            self._updated[row],
+            total if total == total else None,
+            self._currencies[self._currency[row]] or None,
+            self._tracking_number(row),
+        )
+
+    def _buffer(self, key: bytes, update: _Update, now: float) -> None:
+        entry = self._pending.get(key)
+        if entry is None:
+            deadline = now + self.max_delay
+            entry = self._pending[key] = (deadline, [])
+            self._deadlines.append((deadline, key))
+        entry[1].append(update)
+        self._pending_count += 1
+        self.stats.buffered += 1
+        if self._pending_count > self.max_pending:
+            self._release_due(now)
+
+    def _release_due(self, now: float) -> None:
+        """Apply buffered events whose wait is over, oldest orders first."""
+        deadlines = self._deadlines
+        while deadlines and (deadlines[0][0] <= now or self._pending_count > self.max_pending):
+            deadline, key = deadlines.popleft()
+            entry = self._pending.get(key)
+            if entry is None or entry[0] != deadline:
+                # Drained since, and possibly buffering again under a later deadline.
+                continue
+            row = self._find(key)
+            if row < 0:
+                row = self._insert(key, min(update.timestamp for update in entry[1]))
+            self._drain(key, row, force=True)
+
+    def _drain(self, key: bytes, row: int, *, force: bool) -> None:
+        """Apply the buffered events of ``key`` that are next in sequence.
+
+        With ``force``, apply all of them in sequence order, skipping gaps.
+        """
+        deadline, waiting = self._pending.pop(key)
+        self._pending_count -= len(waiting)
+        waiting.sort(key=lambda update: update.sequence or 0)
+        for i, update in enumerate(waiting):
+            assert update.sequence is not None
+            stored = self._sequence[row]
+            if update.sequence <= stored:
+                self.stats.stale += 1
+                continue
+            if update.sequence > stored + 1:
+                if not force:
+                    rest = waiting[i:]
+                    self._pending[key] = (deadline, rest)
+                    self._pending_count += len(rest)
+                    return
+                self.stats.gaps += 1
+            self._fold(row, update)
+
+    def _find(self, key: bytes) -> int:
+        """Row of ``key``, or -1."""
+        table = self._table
+        mask = len(table) - 1
+        keys = self._keys
+        slot = hash(key) & mask
+        while True:
+            entry = table[slot]
+            if entry == _EMPTY:
+                return -1
+            if entry > 0:
+                start = (entry - 1) * KEY_WIDTH
+                if keys[start : start + KEY_WIDTH] == key:
+                    return entry - 1
+            slot = (slot + 1) & mask
+
+    def _insert(self, key: bytes, timestamp: float) -> int:
+        # Grow before the new row exists, so the rebuild does not place it too.
+        if 2 * (self._used + 1) > len(self._table):
+            self._rebuild(_table_size(self._count + 1))
+        if self._free:
+            row = self._free.pop()
+            start = row * KEY_WIDTH
+            self._keys[start : start + KEY_WIDTH] = key
+            self._status[row] = _UNKNOWN
+            self._sequence[row] = 0
+            self._created[row] = timestamp
+            self._updated[row] = timestamp
+            self._total[row] = math.nan
+            self._currency[row] = 0
+        else:
+            row = len(self._status)
+            self._keys += key
+            self._status.append(_UNKNOWN)
+            self._sequence.append(0)
+            self._created.append(timestamp)
+            self._updated.append(timestamp)
+            self._total.append(math.nan)
+            self._currency.append(0)
+            self._tracking += bytes(TRACKING_WIDTH)
+        self._count += 1
+        self._place(key, row)
+        return row
+
+    def _place(self, key: bytes, row: int) -> None:
+        table = self._table
+        mask = len(table) - 1
+        slot = hash(key) & mask
+        while table[slot] > 0:
+            slot = (slot + 1) & mask
+        if table[slot] == _EMPTY:
+            self._used += 1
+        table[slot] = row + 1
+
+    def _delete(self, row: int) -> None:
+        start = row * KEY_WIDTH
+        key = bytes(self._keys[start : start + KEY_WIDTH])
+        table = self._table
+        mask = len(table) - 1
+        slot = hash(key) & mask
+        while table[slot] != row + 1:
+            slot = (slot + 1) & mask
+        table[slot] = _DELETED
+        self._keys[start : start + KEY_WIDTH] = bytes(KEY_WIDTH)
+        self._set_tracking(row, None)
+        self._status[row] = _FREE
+        self._free.append(row)
+        self._count -= 1
+
+    def _rebuild(self, size: int) -> None:
+        """Re-hash every record into a table of ``size`` entries, dropping deleted ones."""
+        self._table = array("i", bytes(4 * size))
+        self._used = 0
+        keys = self._keys
+        status = self._status
+        for row in range(len(status)):
+            if status[row] != _FREE:
+                start = row * KEY_WIDTH
+                self._place(bytes(keys[start : start + KEY_WIDTH]), row)
+
+    def _sweep(self, cutoff: float, rows: int) -> None:
+        status = self._status
+        updated = self._updated
+        cursor = self._cursor
+        for _ in range(min(rows, len(status))):
+            if cursor >= len(status):
+                cursor = 0
+            if status[cursor] != _FREE and updated[cursor] < cutoff:
+                self._delete(cursor)
+                self.stats.expired += 1
+            cursor += 1
+        self._cursor = cursor
+
+    def _intern(self, currency: str) -> int:
+        id_ = self._currency_ids.get(currency)
+        if id_ is None:
+            if len(self._currencies) > 0xFFFF:
+                return 0
+            id_ = self._currency_ids[currency] = len(self._currencies)
+            self._currencies.append(currency)
+        return id_
+
+    def _set_tracking(self, row: int, tracking_number: str | None) -> None:
+        start = row * TRACKING_WIDTH
+        self._long_tracking.pop(row, None)
+        if tracking_number is None:
+            self._tracking[start] = 0
+            return
+        encoded = tracking_number.encode()
+        if len(encoded) < TRACKING_WIDTH and encoded:
+            self._tracking[start] = len(encoded)
+            self._tracking[start + 1 : start + 1 + len(encoded)] = encoded
+        else:
+            self._tracking[start] = _LONG
+            self._long_tracking[row] = tracking_number
+
+    def _tracking_number(self, row: int) -> str | None:
+        start = row * TRACKING_WIDTH
+        length = self._tracking[start]
+        if length == 0:
+            return None
+        if length == _LONG:
+            return self._long_tracking[row]
+        return self._tracking[start + 1 : start + 1 + length].decode()
+
+
+def _key(order_id: str) -> bytes:
+    """The fixed-width slot contents for ``order_id``: its length and bytes, or a hash."""
+    encoded = order_id.encode()
+    if len(encoded) < KEY_WIDTH:
+        return bytes((len(encoded),)) + encoded.ljust(KEY_WIDTH - 1, b"\0")
+    return bytes((_LONG,)) + hashlib.blake2b(encoded, digest_size=KEY_WIDTH - 1).digest()
+
+
+def _table_size(records: int) -> int:
+    """A power of two at least four times ``records``, so the table stays under half full."""
+    return 1 << max(3, (4 * records - 1).bit_length())
+
+
+def _timestamp(value: Any) -> float | None:
+    if not isinstance(value, str):
+        return None
+    try:
+        # fromisoformat only accepts a "Z" suffix from Python 3.11 on.
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,732 @@
+"""Transport-independent ingest core.
+
+:meth:`Pipeline.accept` is called by the HTTP transports for every webhook
+delivery. It decides the ack status and hands accepted events
+to a :class:`~.dispatch.Dispatcher`, so handler latency never delays the ack.
+The dispatcher's workers invoke the user handler, in order per order id or
+SKU.
+
+When a :class:`~.auth.SignatureVerifier` is configured, deliveries are
+authenticated before they are queued; with a :class:`~.dedup.DedupStore`,
+authenticated redeliveries are answered 200 and dropped. With a
+:class:`~.wal.WriteAheadLog`, the ack additionally waits until the event's
+record has been group-committed to disk. On start the pipeline rebuilds its
+state from the log: recently logged event ids are loaded into the dedup
+store and events logged after the last handled checkpoint are queued again,
+so handlers see every acked event at least once. After each checkpoint,
+log segments below it are deleted once they are older than the dedup TTL
+(and, with an inventory index, covered by its last snapshot). ``accept`` returns a plain status for
+everything decided on the spot and an awaitable only when work has to leave
+the event loop thread, such as hashing a large body.
+
+With a :class:`~.retry.RetryPolicy`, a failed handler run is retried after a
+jittered exponential backoff, scheduled on a timing wheel rather than a
+sleeping task per event. Retried events no longer keep their key's order,
+and the write-ahead log checkpoint does not pass them until their final
+attempt, so pending retries are replayed after a restart. Events that fail
+their final attempt go to the :class:`~.deadletter.DeadLetterStore`, if one
+is configured, and :meth:`Pipeline.redrive` feeds selected dead letters back
+through the dispatcher at a bounded rate once the cause has been fixed.
+
+With :class:`~.validation.Validators`, each event's payload is checked
+against its compiled schema in the dispatcher worker, after the ack; events
+that fail go to the :class:`~.validation.Quarantine` instead of the handler.
+
+With a :class:`~.metrics.MetricsRegistry`, the time each event spends in
+each stage is recorded per event type, and the counters in
+:attr:`Pipeline.stats` are published to it once per ``metrics_interval``
+and on every scrape. A :class:`~.tracing.Tracer` records the same stages as
+spans of a sampled subset of events. Without either, the only cost is a None
+check per stage. A delivery that fails signature verification is recorded
+under :data:`~.metrics.OVERFLOW_TYPE`, as its event type cannot be trusted.
+
+With an :class:`~.inventory.InventoryIndex`, every accepted inventory event
+is folded into the index as it is queued, ahead of the handler and in log
+order, so the index's last applied seq is an exact resume point. On start
+the index is restored from its snapshot and the log records after it, and
+while running it is snapshotted every ``snapshot_interval`` seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterable, Mapping
+
+from .auth import SignatureVerifier
+from .deadletter import DeadLetter, DeadLetterStore
+from .dedup import DedupStore, SharedDedupStore
+from .dispatch import Dispatcher, partition_key
+from .errors import EnvelopeError, ValidationError
+from .events import HEADER_SIGNATURE, TOPIC_INVENTORY, TOPICS, WebhookEvent, decode_event
+from .inventory import InventoryIndex
+from .metrics import OVERFLOW_TYPE, MetricsRegistry
+from .retry import RetryPolicy, RetryScheduler
+from .tracing import Tracer
+from .validation import Quarantine, Validators
+from .wal import WALError, WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+# A handler may return a future to signal that it finishes later, e.g. once a
+# batching sink has flushed; the event counts as handled when it resolves.
+Handler = Callable[[WebhookEvent], Awaitable["asyncio.Future[Any] | None"]]
+
+# Ack statuses returned by Pipeline.accept.
+DUPLICATE = 200
+ACCEPTED = 202
+BAD_REQUEST = 400
+UNAUTHORIZED = 401
+UNPROCESSABLE = 422
+OVERLOADED = 503
+
+# Submissions may run this many seconds ahead of the redrive rate before
+# pausing, so high rates are not limited by sleep granularity.
+_REDRIVE_SLACK = 0.01
+
+
+@dataclass
+class PipelineStats:
+    accepted: int = 0
+    rejected: int = 0
+    unauthorized: int = 0
+    duplicates: int = 0
+    overloaded: int = 0
+    persist_failed: int = 0
+    handled: int = 0
+    failed: int = 0
+    retried: int = 0
+    quarantined: int = 0
+    dead_lettered: int = 0
+    redriven: int = 0
+    replayed: int = 0
+
+
+@dataclass
+class RedriveStats:
+    """Outcome of one :meth:`Pipeline.redrive` call."""
+
+    submitted: int = 0
+    succeeded: int = 0
+    failed: int = 0
+
+
+@dataclass
+class _Redrive:
+    slots: asyncio.Semaphore
+    stats: RedriveStats = field(default_factory=RedriveStats)
+
+
+class _Watermark:
+    """Highest seq such that it and every earlier tracked seq are done.
+
+    Seqs must be tracked in increasing order; they may complete in any order.
+    """
+
+    def __init__(self, value: int = 0) -> None:
+        self.value = value
+        self._pending: deque[int] = deque()
+        self._done: set[int] = set()
+
+    def track(self, seq: int) -> None:
+        self._pending.append(seq)
+
+    def done(self, seq: int) -> None:
+        pending = self._pending
+        if pending and pending[0] == seq:
+            pending.popleft()
+            self.value = seq
+            done = self._done
+            while pending and pending[0] in done:
+                self.value = pending.popleft()
+                done.discard(self.value)
+        else:
+            self._done.add(seq)
+
+
+class Pipeline:
+    """Accepts webhook deliveries and feeds them to ``handler`` in the background.
+
+    ``queue_size`` bounds the number of accepted-but-unhandled events per
+    dispatcher group; once a partition is full, new deliveries for it are
+    answered with 503 so Bluefly backs off instead of timing out. ``workers``
+    is the number of partitions, or a mapping of topic to partition count
+    (see :class:`~.dispatch.Dispatcher`).
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        *,
+        queue_size: int = 10_000,
+        workers: int | Mapping[str, int] = 1,
+        key_func: Callable[[WebhookEvent], str] = partition_key,
+        topics: Iterable[str] = TOPICS,
+        verifier: SignatureVerifier | None = None,
+        dedup: DedupStore | SharedDedupStore | None = None,
+        wal: WriteAheadLog | None = None,
+        validators: Validators | None = None,
+        quarantine: Quarantine | None = None,
+        retry_policy: RetryPolicy | None = None,
+        dead_letters: DeadLetterStore | None = None,
+        metrics: MetricsRegistry | None = None,
+        tracer: Tracer | None = None,
+        inventory: InventoryIndex | None = None,
+        checkpoint_interval: float = 1.0,
+        metrics_interval: float = 1.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.handler = handler
+        self.dispatcher = Dispatcher(
+            self._run_handler, workers=workers, queue_size=queue_size, key_func=key_func
+        )
+        self.topics = frozenset(topics)
+        self.verifier = verifier
+        self.dedup = dedup
+        self.wal = wal
+        self.validators = validators
+        self.quarantine = quarantine if quarantine is not None else Quarantine()
+        self.retry_policy = retry_policy
+        self.retries: RetryScheduler[WebhookEvent] = RetryScheduler(self._redeliver)
+        self.dead_letters = dead_letters
+        self.metrics = metrics
+        self.tracer = tracer
+        self.inventory = inventory
+        self.checkpoint_interval = checkpoint_interval
+        self.metrics_interval = metrics_interval
+        self.stats = PipelineStats()
+        self._clock = clock
+        self._watermark = _Watermark()
+        self._deferred: set[asyncio.Future[Any]] = set()
+        # Redriven events in flight, by id(event), with their letter and run.
+        self._redriving: dict[int, tuple[DeadLetter, _Redrive]] = {}
+        # Set by stop(), so that redrives waiting on it give up.
+        self._stopping = asyncio.Event()
+        self._checkpointer: asyncio.Task[None] | None = None
+        self._publisher: asyncio.Task[None] | None = None
+        self._snapshotter: asyncio.Task[None] | None = None
+
+    def accept(self, headers: Mapping[str, str], body: bytes) -> int | Awaitable[int]:
+        """Validate and enqueue one delivery, returning the HTTP status to ack with.
+
+        ``headers`` must have lower-cased names. The result is either a status
+        or an awaitable resolving to one; callers must preserve the order of
+        responses on a connection themselves.
+        """
+        timed = self.metrics is not None or self.tracer is not None
+        started = time.perf_counter() if timed else 0.0
+        try:
+            event = decode_event(headers, body, self._clock())
+        except EnvelopeError as exc:
+            self.stats.rejected += 1
+            logger.debug("rejecting delivery: %s", exc)
+            return BAD_REQUEST
+        if event.topic not in self.topics:
+            self.stats.rejected += 1
+            return UNPROCESSABLE
+        if self.tracer is not None:
+            event.trace = self.tracer.start(event, started)
+        status = self._authenticate_and_admit(event, headers.get(HEADER_SIGNATURE))
+        if not timed:
+            return status
+        if isinstance(status, int):
+            self._acked(event, started, status)
+            return status
+        return self._timed_ack(status, event, started)
+
+    async def _timed_ack(self, status: Awaitable[int], event: WebhookEvent, started: float) -> int:
+        result = OVERLOADED
+        try:
+            result = await status
+            return result
+        finally:
+            self._acked(event, started, result)
+
+    def _acked(self, event: WebhookEvent, started: float, status: int) -> None:
+        trusted = status not in (BAD_REQUEST, UNAUTHORIZED)
+        self._observe("receive", event, started, trusted=trusted, status=status)
+        trace = event.trace
+        if trace is not None:
+            if status != ACCEPTED:
+                trace.close("dropped")
+            trace.acked(status)
+
+    def _authenticate_and_admit(
+        self, event: WebhookEvent, signature: str | None
+    ) -> int | Awaitable[int]:
+        verifier = self.verifier
+        if verifier is not None:
+            if verifier.needs_offload(event.body):
+                return self._verify_and_enqueue(event, signature)
+            started = time.perf_counter() if self._timed(event) else 0.0
+            valid = verifier.verify(event.seller_id, event.body, signature)
+            if started:
+                self._observe("verify", event, started, trusted=valid)
+            if not valid:
+                self.stats.unauthorized += 1
+                return UNAUTHORIZED
+            return self._admit_signed(event)
+        return self._admit(event)
+
+    async def _verify_and_enqueue(self, event: WebhookEvent, signature: str | None) -> int:
+        assert self.verifier is not None
+        started = time.perf_counter() if self._timed(event) else 0.0
+        valid = await self.verifier.verify_async(event.seller_id, event.body, signature)
+        if started:
+            self._observe("verify", event, started, trusted=valid)
+        if not valid:
+            self.stats.unauthorized += 1
+            return UNAUTHORIZED
+        status = self._admit_signed(event)
+        if not isinstance(status, int):
+            status = await status
+        return status
+
+    def _admit_signed(self, event: WebhookEvent) -> int | Awaitable[int]:
+        # The signature covers the body only, so a replayed body must not get
+        # past dedup or be routed elsewhere under different headers.
+        try:
+            event.check_envelope()
+        except EnvelopeError as exc:
+            self.stats.rejected += 1
+            logger.debug("rejecting delivery: %s", exc)
+            return BAD_REQUEST
+        return self._admit(event)
+
+    def _admit(self, event: WebhookEvent) -> int | Awaitable[int]:
+        dedup = self.dedup
+        if dedup is not None and dedup.check_and_add(event.event_id):
+            self.stats.duplicates += 1
+            return DUPLICATE
+        wal = self.wal
+        if wal is None:
+            return self._enqueue_or_release(event)
+        # Refuse before logging when the event's partition is already full.
+        if self.dispatcher.running and self.dispatcher.route(event).full():
+            self.stats.overloaded += 1
+            self._release(event)
+            return OVERLOADED
+        try:
+            committed = wal.append(event.to_record(), event.event_id.encode())
+        except WALError:
+            self.stats.persist_failed += 1
+            self._release(event)
+            return OVERLOADED
+        ack: asyncio.Future[int] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter() if self._timed(event) else 0.0
+        committed.add_done_callback(partial(self._on_durable, event, ack, started))
+        return ack
+
+    def _on_durable(
+        self,
+        event: WebhookEvent,
+        ack: asyncio.Future[int],
+        started: float,
+        committed: asyncio.Future[int],
+    ) -> None:
+        if started:
+            self._observe("persist", event, started)
+        if committed.cancelled() or committed.exception() is not None:
+            self.stats.persist_failed += 1
+            self._release(event)
+            status = OVERLOADED
+        else:
+            event.seq = committed.result()
+            status = self._enqueue_or_release(event)
+        if not ack.done():
+            ack.set_result(status)
+
+    def _enqueue_or_release(self, event: WebhookEvent) -> int:
+        status = self.enqueue(event)
+        if status != ACCEPTED:
+            self._release(event)
+        return status
+
+    def _release(self, event: WebhookEvent) -> None:
+        # The delivery is not acked, so let Bluefly's retry through.
+        if self.dedup is not None:
+            self.dedup.discard(event.event_id)
+
+    def enqueue(self, event: WebhookEvent) -> int:
+        """Queue an already-decoded event for handling."""
+        if self._timed(event):
+            event.queued_at = time.perf_counter()
+        if not self.dispatcher.submit(event):
+            self.stats.overloaded += 1
+            return OVERLOADED
+        if event.seq:
+            self._watermark.track(event.seq)
+        if self.inventory is not None and event.topic == TOPIC_INVENTORY:
+            self.inventory.apply(event)
+        self.stats.accepted += 1
+        return ACCEPTED
+
+    async def start(self) -> None:
+        if self.dispatcher.running:
+            return
+        self._stopping.clear()
+        await self.dispatcher.start()
+        await self.retries.start()
+        if self.wal is not None:
+            await self._recover(self.wal)
+            self._checkpointer = asyncio.create_task(
+                self._checkpoint_loop(self.wal), name="bluefly-checkpoint"
+            )
+        elif self.inventory is not None and self.inventory.load():
+            logger.info("loaded inventory snapshot of %d SKUs", len(self.inventory))
+        if self.inventory is not None and self.inventory.directory is not None:
+            self._snapshotter = asyncio.create_task(
+                self._snapshot_loop(self.inventory), name="bluefly-inventory"
+            )
+        if self.metrics is not None:
+            self._publisher = asyncio.create_task(
+                self._publish_loop(self.metrics), name="bluefly-metrics"
+            )
+
+    async def _recover(self, wal: WriteAheadLog) -> None:
+        """Open the log, reload dedup ids and re-queue unhandled events.
+
+        Replay finishes before :meth:`start` returns, so the receiver only
+        starts listening once older events are ahead of new ones in the queue.
+        The backlog is bounded by ``queue_size`` plus one checkpoint interval
+        of traffic, not by the size of the log.
+        """
+        await wal.open()
+        if self.inventory is not None:
+            replayed = self.inventory.restore(wal)
+            logger.info(
+                "restored inventory of %d SKUs, replaying %d logged events",
+                len(self.inventory),
+                replayed,
+            )
+        if self.dedup is not None:
+            since = self._clock() - self.dedup.ttl
+            loaded = self.dedup.preload(key.decode() for key in wal.recent_keys(since))
+            logger.info("loaded %d recent event ids into the dedup store", loaded)
+        self._watermark = _Watermark(wal.checkpoint)
+        for seq, record in wal.replay(wal.checkpoint):
+            event = WebhookEvent.from_record(record, seq)
+            self._watermark.track(seq)
+            self.stats.replayed += 1
+            await self.dispatcher.put(event)
+        if self.stats.replayed:
+            logger.info(
+                "re-queued %d unhandled events from the write-ahead log", self.stats.replayed
+            )
+
+    async def stop(self, *, drain: bool = True) -> None:
+        """Stop the consumers, first handling everything already queued if ``drain``."""
+        if not self.dispatcher.running:
+            return
+        self._stopping.set()
+        await self.retries.stop()
+        await self.dispatcher.stop(drain=drain)
+        # Nothing settles a redriven event from here on.
+        self._redriving.clear()
+        if self._publisher is not None:
+            self._publisher.cancel()
+            await asyncio.gather(self._publisher, return_exceptions=True)
+            self._publisher = None
+        if drain and self._deferred:
+            await asyncio.gather(*self._deferred, return_exceptions=True)
+        if self.retries:
+            logger.warning("stopping with %d events awaiting retry", len(self.retries))
+        if self._snapshotter is not None:
+            self._snapshotter.cancel()
+            await asyncio.gather(self._snapshotter, return_exceptions=True)
+            self._snapshotter = None
+            assert self.inventory is not None
+            await self.inventory.save()
+        if self.wal is not None:
+            if self._checkpointer is not None:
+                self._checkpointer.cancel()
+                await asyncio.gather(self._checkpointer, return_exceptions=True)
+                self._checkpointer = None
+            await self.wal.save_checkpoint(self._watermark.value)
+            await self.wal.close()
+        if self.tracer is not None:
+            self.tracer.close()
+
+    async def redrive(
+        self,
+        letters: Iterable[DeadLetter] | None = None,
+        *,
+        rate: float = 1000.0,
+        max_in_flight: int = 1000,
+    ) -> RedriveStats:
+        """Feed dead letters back through the dispatcher and wait for their outcome.
+
+        ``letters`` defaults to every dead letter; pass the result of
+        :meth:`~.deadletter.DeadLetterStore.select` to redrive a subset. At
+        most ``rate`` events per second are submitted and at most
+        ``max_in_flight`` are being handled at once, so a dependency that
+        just recovered is not flooded. Each event gets a fresh set of
+        retries; a letter is removed once its event is handled and replaced
+        by a new one if it fails again. If the pipeline stops meanwhile, the
+        redrive returns early with the outcomes settled so far.
+        """
+        if self.dead_letters is None:
+            raise RuntimeError("pipeline has no dead-letter store")
+        if not self.dispatcher.running:
+            raise RuntimeError("pipeline is not started")
+        if rate <= 0 or max_in_flight < 1:
+            raise ValueError("rate and max_in_flight must be positive")
+        store = self.dead_letters
+        run = _Redrive(asyncio.Semaphore(max_in_flight))
+        queued = {letter.id for letter, _ in self._redriving.values()}
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for letter in list(store if letters is None else letters):
+            if self._stopping.is_set():
+                break
+            if letter not in store or letter.id in queued:
+                continue
+            ahead = started + run.stats.submitted / rate - loop.time()
+            if ahead > _REDRIVE_SLACK and not await self._unless_stopping(asyncio.sleep(ahead)):
+                break
+            if not await self._acquire_slot(run):
+                break
+            if letter not in store:
+                run.slots.release()
+                continue
+            event = store.load(letter)
+            event.attempts = 0
+            event.seq = 0
+            # A letter kept in memory still holds the trace exported when it failed.
+            event.trace = None
+            self._redriving[id(event)] = (letter, run)
+            run.stats.submitted += 1
+            self.stats.redriven += 1
+            if not self.dispatcher.submit(event):
+                if not await self._unless_stopping(self.dispatcher.put(event)):
+                    break
+        # Every slot is free again once the submitted events have settled.
+        for _ in range(max_in_flight):
+            if not await self._acquire_slot(run):
+                break
+        if self._stopping.is_set():
+            logger.warning(
+                "pipeline stopped during a redrive: %d dead letters submitted, %d handled, "
+                "%d failed again",
+                run.stats.submitted,
+                run.stats.succeeded,
+                run.stats.failed,
+            )
+        else:
+            logger.info(
+                "redrove %d dead letters: %d handled, %d failed again",
+                run.stats.submitted,
+                run.stats.succeeded,
+                run.stats.failed,
+            )
+        return run.stats
+
+    async def _acquire_slot(self, run: _Redrive) -> bool:
+        if not run.slots.locked():
+            await run.slots.acquire()
+            return True
+        return await self._unless_stopping(run.slots.acquire())
+
+    async def _unless_stopping(self, waiting: Awaitable[Any]) -> bool:
+        """Await ``waiting`` unless the pipeline starts stopping first.
+
+        Returns whether ``waiting`` finished; if not, it has been cancelled.
+        """
+        task = asyncio.ensure_future(waiting)
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait((task, stopping), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopping.cancel()
+            if not task.done():
+                task.cancel()
+        if not task.done():
+            return False
+        task.result()
+        return True
+
+    def render_metrics(self) -> bytes:
+        """Publish the current stats and render the registry for a scrape."""
+        if self.metrics is None:
+            raise RuntimeError("pipeline has no metrics registry")
+        self.metrics.set_counters(vars(self.stats))
+        return self.metrics.render()
+
+    async def _publish_loop(self, metrics: MetricsRegistry) -> None:
+        # Other workers answer scrapes too, so keep this process's counters fresh.
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            metrics.set_counters(vars(self.stats))
+
+    def _timed(self, event: WebhookEvent) -> bool:
+        return self.metrics is not None or event.trace is not None
+
+    def _observe(
+        self,
+        stage: str,
+        event: WebhookEvent,
+        started: float,
+        *,
+        trusted: bool = True,
+        **attributes: Any,
+    ) -> None:
+        now = time.perf_counter()
+        if self.metrics is not None:
+            # The event type of a delivery that failed verification is the
+            # sender's invention; it must not take a series of its own.
+            event_type = event.event_type if trusted else OVERFLOW_TYPE
+            self.metrics.observe(stage, event_type, now - started)
+        if event.trace is not None:
+            event.trace.add(stage, started, now, **attributes)
+
+    async def _checkpoint_loop(self, wal: WriteAheadLog) -> None:
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await wal.save_checkpoint(self._watermark.value)
+                await wal.compact(self._replay_floor(), self._clock() - self._key_retention())
+            except OSError:
+                logger.exception("could not checkpoint or compact the write-ahead log")
+
+    def _replay_floor(self) -> int:
+        """Seq up to which no log records are needed for a restart."""
+        floor = self._watermark.value
+        inventory = self.inventory
+        if inventory is not None:
+            # Without snapshots the index is rebuilt from the whole log.
+            floor = min(floor, inventory.saved_seq if inventory.directory is not None else 0)
+        return floor
+
+    def _key_retention(self) -> float:
+        """Seconds logged event ids are needed for, to reload the dedup store."""
+        return self.dedup.ttl if self.dedup is not None else 0.0
+
+    async def _snapshot_loop(self, inventory: InventoryIndex) -> None:
+        while True:
+            await asyncio.sleep(inventory.snapshot_interval)
+            try:
+                await inventory.save()
+            except OSError:
+                logger.exception("could not save inventory snapshot")
+
+    async def _run_handler(self, event: WebhookEvent) -> None:
+        started = 0.0
+        if self._timed(event):
+            if event.queued_at:
+                self._observe("dispatch", event, event.queued_at)
+                event.queued_at = 0.0
+            started = time.perf_counter()
+        if self.validators is not None:
+            try:
+                self.validators.validate(event)
+            except ValidationError as exc:
+                self._quarantine(event, str(exc))
+                return
+        try:
+            result = await self.handler(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            if started:
+                self._observe(
+                    "handle", event, started, attempt=event.attempts + 1, error=type(exc).__name__
+                )
+            self._failed(event, exc)
+            return
+        if isinstance(result, asyncio.Future):
+            self._deferred.add(result)
+            result.add_done_callback(partial(self._on_deferred_done, event, started))
+        else:
+            if started:
+                self._observe("handle", event, started, attempt=event.attempts + 1)
+            self._handled(event, ok=True)
+
+    def _on_deferred_done(
+        self, event: WebhookEvent, started: float, result: asyncio.Future[Any]
+    ) -> None:
+        if started:
+            self._observe("handle", event, started, attempt=event.attempts + 1)
+        self._deferred.discard(result)
+        if result.cancelled():
+            self._failed(event, asyncio.CancelledError())
+        elif result.exception() is not None:
+            self._failed(event, result.exception())
+        else:
+            self._handled(event, ok=True)
+
+    def _failed(self, event: WebhookEvent, exc: BaseException) -> None:
+        event.attempts += 1
+        policy = self.retry_policy
+        if policy is not None and policy.will_retry(event.attempts):
+            delay = policy.delay(event.attempts)
+            logger.warning(
+                "handler failed for event %s (%s) on attempt %d, retrying in %.1fs: %r",
+                event.event_id,
+                event.event_type,
+                event.attempts,
+                delay,
+                exc,
+            )
+            self.stats.retried += 1
+            self.retries.schedule(delay, event)
+            return
+        logger.error(
+            "handler failed for event %s (%s)",
+            event.event_id,
+            event.event_type,
+            exc_info=(type(exc), exc, exc.__traceback__),
+        )
+        if self.dead_letters is not None:
+            self.dead_letters.add(event, exc)
+            self.stats.dead_lettered += 1
+        self._handled(event, ok=False)
+
+    def _redeliver(self, event: WebhookEvent) -> None:
+        if not self.dispatcher.running:
+            return
+        if self._timed(event):
+            event.queued_at = time.perf_counter()
+        if not self.dispatcher.submit(event):
+            # Partition still full; try again shortly without using up an attempt.
+            assert self.retry_policy is not None
+            self.retries.schedule(self.retry_policy.base_delay, event)
+
+    def _quarantine(self, event: WebhookEvent, reason: str) -> None:
+        logger.warning("quarantined event %s (%s): %s", event.event_id, event.event_type, reason)
+        self.stats.quarantined += 1
+        self.quarantine.add(event, reason)
+        if event.trace is not None:
+            event.trace.close("quarantined")
+        self._settle_redrive(event, ok=True)
+        if event.seq:
+            self._watermark.done(event.seq)
+
+    def _handled(self, event: WebhookEvent, *, ok: bool) -> None:
+        if ok:
+            self.stats.handled += 1
+        else:
+            self.stats.failed += 1
+        if event.trace is not None:
+            event.trace.close("handled" if ok else "failed")
+        if self._redriving:
+            self._settle_redrive(event, ok=ok)
+        if event.seq:
+            self._watermark.done(event.seq)
+
+    def _settle_redrive(self, event: WebhookEvent, *, ok: bool) -> None:
+        entry = self._redriving.pop(id(event), None)
+        if entry is None:
+            return
+        letter, run = entry
+        # On failure the event has already been dead-lettered again.
+        assert self.dead_letters is not None
+        self.dead_letters.remove(letter)
+        if ok:
+            run.stats.succeeded += 1
+        else:
+            run.stats.failed += 1
+        run.slots.release()
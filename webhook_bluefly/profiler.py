@@ -0,0 +1,132 @@
+"""In-process sampling profiler for a running receiver.
+
+Performance problems that only show up under production traffic are hard
+to reproduce, and containers often forbid attaching an external profiler.
+:class:`SamplingProfiler` runs inside the receiver instead: for the
+requested number of seconds a background thread periodically snapshots the
+stack of every other thread of the process (the event loop, the
+write-ahead log writer, signature-hashing and handler threads) with
+:func:`sys._current_frames` and counts identical stacks. The result is
+returned in the collapsed format read by ``flamegraph.pl``, speedscope and
+similar tools, one ``thread;outer;...;inner count`` line per stack.
+
+Taking a sample holds the GIL while the stacks are walked, which pauses
+the receiver for that long. The sampler measures each walk and sleeps at
+least long enough to keep that pause below ``max_overhead`` of wall time,
+lowering the sampling rate if stacks are deep or threads many. Only one
+profile runs at a time and its length is capped at ``max_seconds``.
+
+Under the pre-fork supervisor every worker is a separate process, so a
+profile covers the worker that happened to answer the request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType
+
+# Collapsed-stack lines are sorted by count; this many are kept at most.
+MAX_STACKS = 10_000
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads of this process on demand.
+
+    ``interval`` is the target time between samples; ``max_overhead`` the
+    largest fraction of wall time spent taking them.
+    """
+
+    def __init__(
+        self,
+        *,
+        interval: float = 0.005,
+        max_seconds: float = 60.0,
+        max_overhead: float = 0.05,
+    ) -> None:
+        if interval <= 0 or max_seconds <= 0 or not 0 < max_overhead < 1:
+            raise ValueError("interval and max_seconds must be > 0 and 0 < max_overhead < 1")
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.max_overhead = max_overhead
+        self.samples = 0
+        self._running = threading.Lock()
+        self._labels: dict[CodeType, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._running.locked()
+
+    async def profile(self, seconds: float, *, interval: float | None = None) -> str:
+        """Sample for ``seconds`` without blocking the event loop; return collapsed stacks.
+
+        Raises RuntimeError if a profile is already running.
+        """
+        counts = await asyncio.to_thread(self.sample, seconds, interval=interval)
+        return collapse(counts)
+
+    def sample(self, seconds: float, *, interval: float | None = None) -> Counter[str]:
+        """Sample the other threads for ``seconds`` and count their stacks."""
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("a profile is already running")
+        try:
+            return self._sample(min(seconds, self.max_seconds), interval or self.interval)
+        finally:
+            self._labels.clear()
+            self._running.release()
+
+    def _sample(self, seconds: float, interval: float) -> Counter[str]:
+        counts: Counter[str] = Counter()
+        me = threading.get_ident()
+        names: dict[int, str] = {}
+        label = self._label
+        clock = time.perf_counter
+        ratio = (1 - self.max_overhead) / self.max_overhead
+        self.samples = 0
+        deadline = clock() + seconds
+        while True:
+            started = clock()
+            if started >= deadline:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(label(frame.f_code))
+                    frame = frame.f_back  # type: ignore[assignment]
+                name = names.get(ident)
+                if name is None:
+                    name = names[ident] = _thread_name(ident)
+                stack.append(name)
+                stack.reverse()
+                counts[";".join(stack)] += 1
+            self.samples += 1
+            cost = clock() - started
+            time.sleep(max(interval - cost, cost * ratio))
+        return counts
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = os.path.basename(code.co_filename)
+            # Semicolons separate frames.
+            label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+
+def collapse(counts: Counter[str]) -> str:
+    """Render stack counts as collapsed-stack lines, most frequent first."""
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common(MAX_STACKS))
+
+
+def _thread_name(ident: int) -> str:
+    for thread in threading.enumerate():
+        if thread.ident == ident:
+            return thread.name.replace(";", ":")
+    return f"thread-{ident}"
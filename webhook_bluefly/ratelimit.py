@@ -0,0 +1,267 @@
+"""Token-bucket rate limiting for outbound Bluefly API calls.
+
+Bluefly enforces request quotas per seller account and endpoint. A call that
+exceeds one is answered 429 and must be backed off and resent, which delays
+order acknowledgments and shipment confirmations far more than waiting
+locally would. :class:`RateLimiter` therefore keeps calls within the quotas
+before they leave the process: each ``(seller, endpoint class)`` pair has a
+token bucket refilled at ``rate`` tokens per second and holding at most
+``burst`` tokens.
+
+Buckets are kept in the GCRA ("virtual scheduling") form: the only state
+per bucket is the theoretical arrival time ``tat`` of the next conforming
+call. A call reserves its slot by advancing ``tat`` by ``1 / rate`` and then
+sleeps until the slot comes due, so callers over the limit queue in arrival
+order instead of failing, and no call is ever woken only to find the bucket
+empty again. A 429 that slips through anyway pushes the bucket's ``tat``
+past its ``Retry-After``.
+
+One float per bucket also makes the state cheap to share: with
+:class:`SharedBucketState`, worker processes keep their buckets in a
+memory-mapped file, each slot guarded by its own ``fcntl`` record lock, so
+the quota is enforced for the whole host rather than once per process.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import mmap
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Mapping, Protocol
+
+from .errors import RateLimitError
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+SHARED_MAGIC = b"BFRATE\x00\x01"
+_SLOT = struct.Struct("<d")
+
+
+@dataclass(frozen=True)
+class Rate:
+    """``rate`` calls per second on average, with up to ``burst`` at once."""
+
+    rate: float
+    burst: float = 1.0
+
+    def __post_init__(self) -> None:
+        if self.rate <= 0 or self.burst < 1:
+            raise ValueError("rate must be > 0 and burst >= 1")
+
+
+# Conservative defaults; set these to the quotas of the seller accounts used.
+DEFAULT_LIMITS: Mapping[str, Rate] = {
+    "orders.write": Rate(5.0, burst=10),
+    "orders.read": Rate(10.0, burst=20),
+    "products.read": Rate(10.0, burst=20),
+    "inventory.read": Rate(10.0, burst=20),
+    "inventory.write": Rate(5.0, burst=10),
+}
+DEFAULT_RATE = Rate(5.0, burst=10)
+
+
+def endpoint_class(method: str, path: str) -> str:
+    """Classify a call as ``<resource>.read`` or ``<resource>.write``.
+
+    The resource is the first path segment after the API version, so
+    ``POST /v1/orders/BF-1/shipments`` is ``orders.write``.
+    """
+    segments = [segment for segment in path.split("/", 3) if segment]
+    if segments and segments[0][:1] == "v" and segments[0][1:].isdigit():
+        segments = segments[1:]
+    resource = segments[0] if segments else ""
+    access = "read" if method in ("GET", "HEAD", "OPTIONS") else "write"
+    return f"{resource}.{access}"
+
+
+class BucketState(Protocol):
+    def reserve(
+        self, key: str, now: float, interval: float, tolerance: float, max_wait: float | None
+    ) -> float | None:
+        """Reserve the next slot of ``key`` and return the seconds to wait for it.
+
+        Returns None without reserving if the wait would exceed ``max_wait``.
+        """
+
+    def penalize(self, key: str, until: float) -> None:
+        """Let no call for ``key`` conform before ``until``."""
+
+
+class LocalBucketState:
+    """Bucket state of one process."""
+
+    def __init__(self) -> None:
+        self._tat: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def reserve(
+        self, key: str, now: float, interval: float, tolerance: float, max_wait: float | None
+    ) -> float | None:
+        tat = max(self._tat.get(key, now), now)
+        wait = tat - tolerance - now
+        if wait <= 0:
+            wait = 0.0
+        elif max_wait is not None and wait > max_wait:
+            return None
+        self._tat[key] = tat + interval
+        return wait
+
+    def penalize(self, key: str, until: float) -> None:
+        if self._tat.get(key, 0.0) < until:
+            self._tat[key] = until
+
+
+class SharedBucketState:
+    """Bucket state shared by the processes that open the same ``path``.
+
+    Keys are hashed onto ``slots`` slots of a memory-mapped file; keys that
+    collide share a bucket, which only ever makes limiting stricter. Times
+    come from :func:`time.monotonic`, which is system-wide on Linux, so all
+    processes must run on the same host.
+    """
+
+    def __init__(self, path: str | Path, *, slots: int = 4096) -> None:
+        if fcntl is None:
+            raise RuntimeError("shared rate-limit state needs fcntl record locks")
+        self.path = Path(path)
+        self.slots = slots
+        size = len(SHARED_MAGIC) + slots * _SLOT.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                current = os.fstat(self._fd).st_size
+                if current == 0:
+                    os.ftruncate(self._fd, size)
+                    os.pwrite(self._fd, SHARED_MAGIC, 0)
+                elif current != size or os.pread(self._fd, len(SHARED_MAGIC), 0) != SHARED_MAGIC:
+                    raise ValueError(
+                        f"{self.path} is not a rate-limit state file with {slots} slots"
+                    )
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(self._fd, size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            self._map.close()
+            os.close(self._fd)
+            self._fd = -1
+
+    def reserve(
+        self, key: str, now: float, interval: float, tolerance: float, max_wait: float | None
+    ) -> float | None:
+        offset = self._offset(key)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _SLOT.size, offset)
+        try:
+            (tat,) = _SLOT.unpack_from(self._map, offset)
+            tat = max(tat, now)
+            wait = tat - tolerance - now
+            if wait <= 0:
+                wait = 0.0
+            elif max_wait is not None and wait > max_wait:
+                return None
+            _SLOT.pack_into(self._map, offset, tat + interval)
+            return wait
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, offset)
+
+    def penalize(self, key: str, until: float) -> None:
+        offset = self._offset(key)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _SLOT.size, offset)
+        try:
+            if _SLOT.unpack_from(self._map, offset)[0] < until:
+                _SLOT.pack_into(self._map, offset, until)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, offset)
+
+    def _offset(self, key: str) -> int:
+        # A stable hash, so every process maps a key to the same slot.
+        return len(SHARED_MAGIC) + (zlib.crc32(key.encode()) % self.slots) * _SLOT.size
+
+
+@dataclass
+class RateLimitStats:
+    calls: int = 0
+    delayed: int = 0
+    delayed_seconds: float = 0.0
+    rejected: int = 0
+    throttled: int = 0
+
+
+class RateLimiter:
+    """Per-seller, per-endpoint-class token buckets.
+
+    ``limits`` maps endpoint classes (see :func:`endpoint_class`) to their
+    :class:`Rate`; other classes use ``default``, or are not limited if it
+    is None. Calls over the limit wait for their turn; with ``max_wait``,
+    a call that would wait longer raises :class:`~.errors.RateLimitError`
+    instead.
+    """
+
+    def __init__(
+        self,
+        limits: Mapping[str, Rate] = DEFAULT_LIMITS,
+        *,
+        default: Rate | None = DEFAULT_RATE,
+        state: BucketState | None = None,
+        max_wait: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.limits = dict(limits)
+        self.default = default
+        self.state: BucketState = state if state is not None else LocalBucketState()
+        self.max_wait = max_wait
+        self.stats = RateLimitStats()
+        self._clock = clock
+
+    def delay(self, seller_id: str, endpoint: str) -> float:
+        """Reserve a call and return how long to wait before making it."""
+        limit = self.limits.get(endpoint, self.default)
+        self.stats.calls += 1
+        if limit is None:
+            return 0.0
+        interval = 1.0 / limit.rate
+        wait = self.state.reserve(
+            f"{seller_id}|{endpoint}",
+            self._clock(),
+            interval,
+            (limit.burst - 1) * interval,
+            self.max_wait,
+        )
+        if wait is None:
+            self.stats.rejected += 1
+            raise RateLimitError(
+                f"{endpoint} calls for seller {seller_id!r} would wait more than {self.max_wait}s"
+            )
+        if wait:
+            self.stats.delayed += 1
+            self.stats.delayed_seconds += wait
+        return wait
+
+    async def acquire(self, seller_id: str, endpoint: str) -> None:
+        """Wait until a call to ``endpoint`` for ``seller_id`` is within its limit."""
+        wait = self.delay(seller_id, endpoint)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def throttled(self, seller_id: str, endpoint: str, retry_after: float) -> None:
+        """Record a 429: hold further calls for ``retry_after`` seconds."""
+        self.stats.throttled += 1
+        limit = self.limits.get(endpoint, self.default)
+        # Empty the bucket as of then, so the burst allowance cannot skip the pause.
+        tolerance = (limit.burst - 1) / limit.rate if limit is not None else 0.0
+        self.state.penalize(f"{seller_id}|{endpoint}", self._clock() + retry_after + tolerance)
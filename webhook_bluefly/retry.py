@@ -0,0 +1,236 @@
+"""Backoff policy and timing-wheel scheduler for handler retries.
+
+When a handler fails, :class:`~.pipeline.Pipeline` reschedules the event
+after an exponentially growing, jittered delay (see :class:`RetryPolicy`).
+During a downstream outage that can mean millions of pending retries, so
+they are not parked as one sleeping task each: a single
+:class:`RetryScheduler` task drives a hierarchical :class:`TimingWheel`.
+
+The wheel has ``levels`` rings of ``slots`` buckets. Level 0 buckets are one
+``tick`` wide; each higher level's buckets span a full rotation of the level
+below. A timer goes into the lowest level whose range covers its delay, so
+inserting is O(1). Every tick empties one level-0 bucket; whenever a level
+completes a rotation, the next bucket of the level above is redistributed
+("cascaded") into the levels below. Each timer is moved at most once per
+level, so expiry is amortized O(1) as well. Cancelled timers are only
+flagged and skipped when their bucket comes due.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    The n-th retry waits a uniformly random time between 0 and
+    ``min(max_delay, base_delay * multiplier ** (n - 1))``, which spreads
+    the retries of events that failed together. ``max_attempts`` counts
+    every handler run, the first one included.
+    """
+
+    max_attempts: int = 8
+    base_delay: float = 1.0
+    max_delay: float = 300.0
+    multiplier: float = 2.0
+    seed: int | None = None
+
+    def __post_init__(self) -> None:
+        if self.max_attempts < 1:
+            raise ValueError("max_attempts must be >= 1")
+        self._random = random.Random(self.seed)
+
+    def will_retry(self, failures: int) -> bool:
+        """Whether an event whose handler has failed ``failures`` times runs again."""
+        return failures < self.max_attempts
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before the ``retry``-th retry (1-based)."""
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** (retry - 1))
+        return self._random.uniform(0.0, ceiling)
+
+
+class Timer(Generic[T]):
+    __slots__ = ("deadline", "item", "cancelled")
+
+    def __init__(self, deadline: int, item: T) -> None:
+        self.deadline = deadline
+        self.item = item
+        self.cancelled = False
+
+
+class TimingWheel(Generic[T]):
+    """Hierarchical timing wheel with ``tick``-second resolution.
+
+    ``slots`` must be a power of two. With the defaults (50 ms ticks, 256
+    slots, 4 levels) delays up to about seven years are placed directly;
+    longer ones wait in an overflow list that is re-examined once per
+    top-level rotation.
+    """
+
+    def __init__(
+        self,
+        tick: float = 0.05,
+        slots: int = 256,
+        levels: int = 4,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if tick <= 0 or slots < 2 or slots & (slots - 1) or levels < 1:
+            raise ValueError("tick must be > 0, slots a power of two >= 2 and levels >= 1")
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheels: list[list[list[Timer[T]]]] = [
+            [[] for _ in range(slots)] for _ in range(levels)
+        ]
+        self._overflow: list[Timer[T]] = []
+        self._clock = clock
+        self._origin = clock()
+        self._current = 0
+        self._live = 0
+
+    def __len__(self) -> int:
+        return self._live
+
+    def schedule(self, delay: float, item: T) -> Timer[T]:
+        """Fire ``item`` after ``delay`` seconds (rounded up to whole ticks)."""
+        ticks = max(1, -int(-delay // self.tick))
+        timer = Timer(self._current + ticks, item)
+        self._place(timer)
+        self._live += 1
+        return timer
+
+    def cancel(self, timer: Timer[T]) -> None:
+        if not timer.cancelled:
+            timer.cancelled = True
+            self._live -= 1
+
+    def advance(self, now: float | None = None) -> list[T]:
+        """Move the wheel up to ``now`` and return the items that came due."""
+        if now is None:
+            now = self._clock()
+        target = int((now - self._origin) / self.tick)
+        if not self._live:
+            # Nothing pending: jump ahead instead of walking empty buckets.
+            self._current = max(self._current, target)
+            return []
+        due: list[T] = []
+        mask = self._mask
+        wheel0 = self._wheels[0]
+        while self._current < target:
+            self._current = now_tick = self._current + 1
+            if not now_tick & mask:
+                self._cascade(now_tick)
+            index = now_tick & mask
+            bucket = wheel0[index]
+            if bucket:
+                wheel0[index] = []
+                for timer in bucket:
+                    if not timer.cancelled:
+                        timer.cancelled = True
+                        self._live -= 1
+                        due.append(timer.item)
+                if not self._live:
+                    self._current = max(self._current, target)
+                    break
+        return due
+
+    def _place(self, timer: Timer[T]) -> None:
+        delta = timer.deadline - self._current
+        bits = self._bits
+        for level in range(self.levels):
+            if delta < 1 << (bits * (level + 1)):
+                index = (timer.deadline >> (bits * level)) & self._mask
+                self._wheels[level][index].append(timer)
+                return
+        self._overflow.append(timer)
+
+    def _cascade(self, now_tick: int) -> None:
+        bits, mask = self._bits, self._mask
+        level = 1
+        # Cascade from the highest level that completed a rotation downwards,
+        # so timers can fall through several levels in one tick.
+        while level < self.levels and not (now_tick >> (bits * level)) & mask:
+            level += 1
+        if level == self.levels:
+            overflow, self._overflow = self._overflow, []
+            for timer in overflow:
+                if not timer.cancelled:
+                    self._place(timer)
+        for lower in range(min(level, self.levels - 1), 0, -1):
+            index = (now_tick >> (bits * lower)) & mask
+            bucket = self._wheels[lower][index]
+            if bucket:
+                self._wheels[lower][index] = []
+                for timer in bucket:
+                    if not timer.cancelled:
+                        self._place(timer)
+
+
+class RetryScheduler(Generic[T]):
+    """Runs ``callback(item)`` when each scheduled item comes due.
+
+    One task advances a :class:`TimingWheel` every ``tick`` while anything is
+    pending and sleeps otherwise.
+    """
+
+    def __init__(self, callback: Callable[[T], None], *, tick: float = 0.05) -> None:
+        self.callback = callback
+        self.wheel: TimingWheel[T] = TimingWheel(tick)
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def schedule(self, delay: float, item: T) -> Timer[T]:
+        if not self.wheel:
+            # Catch the wheel up on idle time before measuring the delay.
+            self.wheel.advance()
+        timer = self.wheel.schedule(delay, item)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return timer
+
+    def cancel(self, timer: Timer[T]) -> None:
+        self.wheel.cancel(timer)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="bluefly-retry")
+
+    async def stop(self) -> None:
+        """Stop firing; pending items stay in the wheel."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        wheel = self.wheel
+        while True:
+            if not wheel:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await asyncio.sleep(wheel.tick)
+            for item in wheel.advance():
+                try:
+                    self.callback(item)
+                except Exception:
+                    logger.exception("retry callback failed")
@@ -0,0 +1,218 @@
+"""Per-event-type handler routing with lazy handler imports.
+
+A routes file maps event types, or ``fnmatch`` patterns of them, to handlers
+given as ``module:function``::
+
+    {
+        "routes": {
+            "order.created": "myapp.orders:on_created",
+            "order.*": "myapp.orders:on_order",
+            "inventory.*": "myapp.stock:on_inventory"
+        },
+        "default": "myapp.hooks:on_other"
+    }
+
+:class:`Router` is a pipeline handler that runs the handler routed for each
+event's type. A handler module is imported only when the first event routed
+to it arrives, in a worker thread, so a freshly started receiver starts
+listening without importing every handler and its dependencies, and acks
+keep flowing while a heavy module loads. Events of the same handler that
+arrive meanwhile wait for the same import.
+
+:func:`load_routes` checks the file when it is loaded: every handler spec
+must be well formed and name a module that can be found, so a typo fails the
+start rather than the first matching event. Finding a module imports its
+parent packages, so checking costs time on every start. The result is
+therefore cached in compiled form under ``cache_dir``, keyed by a hash of
+the file's contents, and a restart with an unchanged file skips the checks.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fnmatch
+import hashlib
+import importlib
+import importlib.util
+import json
+import logging
+import marshal
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Mapping
+
+if TYPE_CHECKING:
+    from .events import WebhookEvent
+    from .pipeline import Handler
+
+logger = logging.getLogger(__name__)
+
+# Bump when the compiled form changes, so older cache files are ignored.
+CACHE_VERSION = 1
+
+
+def load_handler(spec: str) -> Handler:
+    """Import ``module:function`` and return the function."""
+    module_name, attr = _split_spec(spec)
+    target: Any = importlib.import_module(module_name)
+    for part in attr.split("."):
+        target = getattr(target, part)
+    if not callable(target):
+        raise TypeError(f"{spec} is not callable")
+    return target
+
+
+def _split_spec(spec: str) -> tuple[str, str]:
+    module_name, _, attr = spec.partition(":")
+    if not module_name or not attr:
+        raise ValueError(f"handler must be given as module:function, got {spec!r}")
+    return module_name, attr
+
+
+@dataclass(frozen=True)
+class CompiledRoutes:
+    """Routes in lookup order: exact event types, then patterns, then ``default``.
+
+    ``patterns`` holds ``(pattern, spec)`` pairs, most specific first.
+    """
+
+    exact: dict[str, str] = field(default_factory=dict)
+    patterns: tuple[tuple[str, str], ...] = ()
+    default: str | None = None
+
+    @classmethod
+    def compile(cls, routes: Mapping[str, str], default: str | None = None) -> CompiledRoutes:
+        exact: dict[str, str] = {}
+        patterns = []
+        for key, spec in routes.items():
+            _split_spec(spec)
+            if any(char in key for char in "*?["):
+                patterns.append((key, spec))
+            else:
+                exact[key] = spec
+        if default is not None:
+            _split_spec(default)
+        # A longer literal prefix is more specific: "order.ship*" before "order.*".
+        patterns.sort(key=lambda item: -len(re.split(r"[*?\[]", item[0], maxsplit=1)[0]))
+        return cls(exact, tuple(patterns), default)
+
+    def lookup(self, event_type: str) -> str | None:
+        """The handler spec for ``event_type``, or None if it is not routed."""
+        spec = self.exact.get(event_type)
+        if spec is not None:
+            return spec
+        for pattern, spec in self.patterns:
+            if fnmatch.fnmatchcase(event_type, pattern):
+                return spec
+        return self.default
+
+    def specs(self) -> set[str]:
+        specs = {*self.exact.values(), *(spec for _, spec in self.patterns)}
+        if self.default is not None:
+            specs.add(self.default)
+        return specs
+
+    def check(self) -> None:
+        """Raise ImportError if a routed module cannot be found."""
+        for spec in sorted(self.specs()):
+            module_name, _ = _split_spec(spec)
+            if importlib.util.find_spec(module_name) is None:
+                raise ImportError(f"no module named {module_name!r} for handler {spec}")
+
+    def dumps(self) -> bytes:
+        return marshal.dumps((CACHE_VERSION, self.exact, self.patterns, self.default))
+
+    @classmethod
+    def loads(cls, data: bytes) -> CompiledRoutes:
+        version, exact, patterns, default = marshal.loads(data)
+        if version != CACHE_VERSION:
+            raise ValueError(f"compiled routes version {version}, expected {CACHE_VERSION}")
+        return cls(exact, patterns, default)
+
+
+def load_routes(path: str | Path, *, cache_dir: str | Path | None = None) -> CompiledRoutes:
+    """Read, check and compile a routes file, reusing a cached compilation if possible."""
+    data = Path(path).read_bytes()
+    cached = None
+    if cache_dir is not None:
+        cached = Path(cache_dir) / f"routes-{hashlib.sha256(data).hexdigest()[:32]}.bin"
+        try:
+            return CompiledRoutes.loads(cached.read_bytes())
+        except FileNotFoundError:
+            pass
+        except (ValueError, EOFError, TypeError) as exc:
+            logger.warning("ignoring unreadable compiled routes %s: %s", cached, exc)
+    try:
+        config = json.loads(data)
+        routes = CompiledRoutes.compile(config.get("routes", {}), config.get("default"))
+    except (ValueError, AttributeError) as exc:
+        raise ValueError(f"invalid routes file {path}: {exc}") from None
+    routes.check()
+    if cached is not None:
+        try:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            partial = cached.with_suffix(f".{os.getpid()}.tmp")
+            partial.write_bytes(routes.dumps())
+            os.replace(partial, cached)
+        except OSError as exc:
+            logger.warning("could not cache compiled routes in %s: %s", cache_dir, exc)
+    return routes
+
+
+class Router:
+    """Pipeline handler that runs the handler routed for each event's type.
+
+    Events whose type has no route fail with :class:`LookupError`, so with
+    a retry policy and dead-letter store they end up dead-lettered.
+    """
+
+    def __init__(self, routes: CompiledRoutes) -> None:
+        self.routes = routes
+        # Resolved handlers by event type, and by spec once imported.
+        self._by_type: dict[str, Handler] = {}
+        self._loaded: dict[str, Handler] = {}
+        self._loading: dict[str, asyncio.Future[Handler]] = {}
+
+    @classmethod
+    def from_file(cls, path: str | Path, *, cache_dir: str | Path | None = None) -> Router:
+        return cls(load_routes(path, cache_dir=cache_dir))
+
+    async def __call__(self, event: WebhookEvent) -> Any:
+        handler = self._by_type.get(event.event_type)
+        if handler is None:
+            handler = await self._resolve(event.event_type)
+        return await handler(event)
+
+    def preload(self) -> None:
+        """Import every routed handler now, e.g. in a supervisor before forking."""
+        for spec in self.routes.specs():
+            if spec not in self._loaded:
+                self._loaded[spec] = load_handler(spec)
+
+    async def _resolve(self, event_type: str) -> Handler:
+        spec = self.routes.lookup(event_type)
+        if spec is None:
+            raise LookupError(f"no handler routed for event type {event_type!r}")
+        handler = self._loaded.get(spec)
+        if handler is None:
+            loading = self._loading.get(spec)
+            if loading is None:
+                loading = asyncio.ensure_future(self._import(spec))
+                self._loading[spec] = loading
+            handler = await asyncio.shield(loading)
+        self._by_type[event_type] = handler
+        return handler
+
+    async def _import(self, spec: str) -> Handler:
+        try:
+            handler = await asyncio.to_thread(load_handler, spec)
+        except Exception:
+            logger.exception("cannot load handler %s", spec)
+            raise
+        finally:
+            del self._loading[spec]
+        logger.info("loaded handler %s", spec)
+        self._loaded[spec] = handler
+        return handler
@@ -0,0 +1,393 @@
+"""asyncio HTTP receiver for Bluefly webhooks.
+
+The receiver acknowledges a delivery as soon as the :class:`~.pipeline.Pipeline`
+has accepted it; handlers run afterwards from the pipeline's in-process queue,
+so their latency never counts against Bluefly's delivery timeout.
+
+Example::
+
+    async def handle(event):
+        ...
+
+    run(handle, ServerConfig(port=8080))
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs
+
+from .errors import HTTPProtocolError
+from .fastpath import FastHTTPProtocol
+from .httputil import (
+    HEALTH_PATH,
+    INVENTORY_PATH,
+    JSON_CONTENT_TYPE,
+    METRICS_PATH,
+    PROFILE_PATH,
+    content_length,
+    encode_response,
+    parse_head,
+    wants_keep_alive,
+)
+from .auth import SignatureVerifier
+from .dedup import DedupStore, SharedDedupStore
+from .feeds import CHUNK_SIZE, FeedIngestor
+from .inventory import InventoryIndex
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from .pipeline import OVERLOADED, Handler, Pipeline
+from .profiler import SamplingProfiler
+from .tracing import Tracer
+from .validation import Validators
+from .wal import WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+MODES = ("stream", "fast")
+# SKUs answered by one /inventory request at most.
+MAX_INVENTORY_SKUS = 1000
+
+
+@dataclass
+class ServerConfig:
+    """Receiver settings.
+
+    ``mode`` selects the transport: ``"stream"`` serves requests through
+    :class:`Request`/:class:`Response` objects on asyncio streams, ``"fast"``
+    uses the raw-protocol parser in :mod:`webhook_bluefly.fastpath`.
+    ``workers`` is the number of dispatcher partitions within the process;
+    ``reuse_port`` lets several processes listen on the same port (see
+    :mod:`webhook_bluefly.supervisor`). Catalog feeds pushed to
+    ``feed_path`` are streamed rather than read whole, so they are limited
+    by ``max_feed_size`` instead of ``max_body_size``.
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 8080
+    path: str = "/webhooks/bluefly"
+    max_header_size: int = 16 * 1024
+    max_body_size: int = 8 * 1024 * 1024
+    feed_path: str = "/feeds/bluefly"
+    max_feed_size: int = 4 * 1024**3
+    keepalive_timeout: float = 75.0
+    backlog: int = 1024
+    queue_size: int = 10_000
+    workers: int = 1
+    mode: str = "stream"
+    reuse_port: bool = False
+
+    def __post_init__(self) -> None:
+        if self.mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {self.mode!r}")
+
+
+@dataclass(slots=True)
+class Request:
+    method: str
+    path: str
+    version: str
+    headers: dict[str, str]
+    body: bytes = b""
+    query: str = ""
+    # Set instead of ``body`` for requests whose body is read as it arrives.
+    stream: StreamedBody | None = None
+
+    @property
+    def keep_alive(self) -> bool:
+        return wants_keep_alive(self.version, self.headers)
+
+
+@dataclass(slots=True)
+class Response:
+    status: int
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def encode(self, keep_alive: bool, head_only: bool = False) -> bytes:
+        return encode_response(
+            self.status,
+            self.body,
+            content_type=self.content_type,
+            keep_alive=keep_alive,
+            extra_headers=self.headers,
+            head_only=head_only,
+        )
+
+
+class StreamedBody:
+    """Async iterator over a request body of known length, read chunk by chunk.
+
+    ``remaining`` is the number of body bytes not read yet; a connection
+    whose body was not read to the end cannot be reused.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, length: int, timeout: float) -> None:
+        self.remaining = length
+        self._reader = reader
+        self._timeout = timeout
+
+    def __aiter__(self) -> StreamedBody:
+        return self
+
+    async def __anext__(self) -> bytes:
+        if not self.remaining:
+            raise StopAsyncIteration
+        try:
+            chunk = await asyncio.wait_for(
+                self._reader.read(min(self.remaining, CHUNK_SIZE)), self._timeout
+            )
+        except asyncio.TimeoutError:
+            raise HTTPProtocolError(408, "request body timed out") from None
+        if not chunk:
+            raise HTTPProtocolError(400, "truncated request body")
+        self.remaining -= len(chunk)
+        return chunk
+
+
+async def read_request(reader: asyncio.StreamReader, config: ServerConfig) -> Request | None:
+    """Read one request from ``reader``; return ``None`` on a clean EOF.
+
+    The body of a POST to ``config.feed_path`` is not read; the request
+    carries a :class:`StreamedBody` over it instead.
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as exc:
+        if not exc.partial.strip():
+            return None
+        raise HTTPProtocolError(400, "truncated request head") from None
+    except asyncio.LimitOverrunError:
+        raise HTTPProtocolError(431, "request head too large") from None
+    method, target, version, headers = parse_head(head[:-4])
+    path, _, query = target.partition("?")
+    if method == "POST" and path == config.feed_path:
+        length = content_length(headers, config.max_feed_size)
+        stream = StreamedBody(reader, length, config.keepalive_timeout)
+        return Request(method, path, version, headers, query=query, stream=stream)
+    length = content_length(headers, config.max_body_size)
+    body = b""
+    if length:
+        try:
+            body = await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise HTTPProtocolError(400, "truncated request body") from None
+    return Request(method, path, version, headers, body, query)
+
+
+class WebhookServer:
+    """Receiver serving the webhook route and a health check.
+
+    With a :class:`~.metrics.MetricsRegistry`, ``GET /metrics`` also serves
+    its contents in the Prometheus text format. With a
+    :class:`~.profiler.SamplingProfiler`, ``GET /debug/profile?seconds=N``
+    profiles the process for N seconds and answers with collapsed stacks;
+    add ``&hz=H`` to sample H times per second. Only expose it to operators.
+    With an :class:`~.inventory.InventoryIndex`, ``GET /inventory?sku=A&sku=B``
+    answers a JSON object mapping each SKU to its stock level, or null.
+    With a :class:`~.feeds.FeedIngestor`, catalog feeds POSTed to
+    ``config.feed_path`` are streamed to it and acked with 202 once spooled.
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        config: ServerConfig | None = None,
+        *,
+        pipeline: Pipeline | None = None,
+        verifier: SignatureVerifier | None = None,
+        dedup: DedupStore | SharedDedupStore | None = None,
+        wal: WriteAheadLog | None = None,
+        validators: Validators | None = None,
+        metrics: MetricsRegistry | None = None,
+        tracer: Tracer | None = None,
+        profiler: SamplingProfiler | None = None,
+        inventory: InventoryIndex | None = None,
+        feeds: FeedIngestor | None = None,
+    ) -> None:
+        self.config = config or ServerConfig()
+        self.pipeline = pipeline or Pipeline(
+            handler,
+            queue_size=self.config.queue_size,
+            workers=self.config.workers,
+            verifier=verifier,
+            dedup=dedup,
+            wal=wal,
+            validators=validators,
+            metrics=metrics,
+            tracer=tracer,
+            inventory=inventory,
+        )
+        self.profiler = profiler
+        self.feeds = feeds
+        self._server: asyncio.AbstractServer | None = None
+
+    @property
+    def port(self) -> int:
+        """The bound port, useful when the server was started on port 0."""
+        if self._server is None or not self._server.sockets:
+            raise RuntimeError("server is not started")
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        config = self.config
+        await self.pipeline.start()
+        if config.mode == "fast":
+            loop = asyncio.get_running_loop()
+            self._server = await loop.create_server(
+                lambda: FastHTTPProtocol(self),
+                config.host,
+                config.port,
+                backlog=config.backlog,
+                reuse_port=config.reuse_port or None,
+            )
+        else:
+            self._server = await asyncio.start_server(
+                self._handle_connection,
+                config.host,
+                config.port,
+                limit=config.max_header_size,
+                backlog=config.backlog,
+                reuse_port=config.reuse_port or None,
+            )
+        logger.info(
+            "listening on %s:%d%s (%s mode)", config.host, self.port, config.path, config.mode
+        )
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        assert self._server is not None
+        await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self.feeds is not None:
+            await self.feeds.stop()
+        await self.pipeline.stop()
+
+    async def __aenter__(self) -> WebhookServer:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.stop()
+
+    async def handle(self, request: Request) -> Response:
+        """Route a parsed request to a response."""
+        if request.path == self.config.path:
+            if request.method != "POST":
+                return Response(405, headers={"Allow": "POST"})
+            status = self.pipeline.accept(request.headers, request.body)
+            if not isinstance(status, int):
+                status = await status
+            if status == OVERLOADED:
+                return Response(status, headers={"Retry-After": "1"})
+            return Response(status)
+        if request.path == self.config.feed_path and self.feeds is not None:
+            if request.method != "POST":
+                return Response(405, headers={"Allow": "POST"})
+            assert request.stream is not None
+            return Response(await self.feeds.receive(request.headers, request.stream))
+        if request.path == HEALTH_PATH and request.method in ("GET", "HEAD"):
+            return Response(200, b"ok\n")
+        if request.path == METRICS_PATH and request.method == "GET":
+            if self.pipeline.metrics is not None:
+                return Response(
+                    200, self.pipeline.render_metrics(), content_type=METRICS_CONTENT_TYPE
+                )
+        if request.path == PROFILE_PATH and request.method == "GET" and self.profiler:
+            status, body = await self.profile(request.query)
+            return Response(status, body)
+        if request.path == INVENTORY_PATH and request.method == "GET":
+            if self.pipeline.inventory is not None:
+                status, body = self.query_inventory(request.query)
+                return Response(status, body, content_type=JSON_CONTENT_TYPE)
+        return Response(404)
+
+    async def profile(self, query: str) -> tuple[int, bytes]:
+        """Run the profiler as asked by a ``/debug/profile`` query string."""
+        assert self.profiler is not None
+        params = parse_qs(query)
+        try:
+            seconds = float(params.get("seconds", ["10"])[0])
+            hz = float(params.get("hz", ["0"])[0])
+        except ValueError:
+            return 400, b"seconds and hz must be numbers\n"
+        if not 0 < seconds < math.inf or not 0 <= hz < math.inf:
+            return 400, b"seconds must be positive and hz non-negative\n"
+        try:
+            stacks = await self.profiler.profile(seconds, interval=1 / hz if hz else None)
+        except RuntimeError as exc:
+            return 409, f"{exc}\n".encode()
+        return 200, stacks.encode()
+
+    def query_inventory(self, query: str) -> tuple[int, bytes]:
+        """Look up the SKUs of an ``/inventory`` query string."""
+        assert self.pipeline.inventory is not None
+        skus = parse_qs(query).get("sku", [])
+        if not skus or len(skus) > MAX_INVENTORY_SKUS:
+            message = f"give between 1 and {MAX_INVENTORY_SKUS} sku parameters"
+            return 400, json.dumps({"error": message}).encode()
+        get = self.pipeline.inventory.get
+        levels = {}
+        for sku in skus:
+            level = get(sku)
+            levels[sku] = level._asdict() if level is not None else None
+        return 200, json.dumps(levels).encode()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        read_request(reader, self.config), self.config.keepalive_timeout
+                    )
+                except HTTPProtocolError as exc:
+                    writer.write(Response(exc.status, f"{exc}\n".encode()).encode(False))
+                    await writer.drain()
+                    return
+                except asyncio.TimeoutError:
+                    return
+                if request is None:
+                    return
+                keep_alive = request.keep_alive
+                try:
+                    response = await self.handle(request)
+                except HTTPProtocolError as exc:
+                    response = Response(exc.status, f"{exc}\n".encode())
+                if request.stream is not None and request.stream.remaining:
+                    keep_alive = False
+                writer.write(response.encode(keep_alive, request.method == "HEAD"))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def run(handler: Handler, config: ServerConfig | None = None) -> None:
+    """Run a :class:`WebhookServer` until interrupted."""
+
+    async def main() -> None:
+        server = WebhookServer(handler, config)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
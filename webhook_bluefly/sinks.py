@@ -0,0 +1,191 @@
+"""Handler-side sink stages.
+
+:class:`CoalescingSink` buffers events per key over a short window and hands
+downstream only the latest event per key, as one batch. Bluefly inventory
+webhooks arrive in bursts of many updates per SKU during catalog syncs;
+each carries the absolute quantity, so only the last one matters and
+writing the earlier ones downstream is wasted work::
+
+    inventory = CoalescingSink(write_stock_levels, window=0.25)
+
+    async def handle(event):
+        if event.topic == "inventory":
+            return await inventory(event)
+        ...
+
+The sink returns a future from ``__call__`` that resolves once the event
+has been written, or superseded by a later event for its key that will be.
+:class:`~.pipeline.Pipeline` treats such a future as deferred completion:
+the dispatcher worker moves on at once, while the event only counts as
+handled (and the write-ahead log checkpoint only passes it) after the flush.
+
+When a flush fails, only the events it actually sent fail, so only those are
+retried. Retries lose their key's order, so a sink given the pipeline's
+:class:`~.retry.RetryPolicy` remembers, per key, the failed events that will
+be retried. An event that is not one of them is new and supersedes them all;
+a retry that has been superseded in the meantime is resolved as handled
+without being written again, so a stale quantity never overwrites a newer
+one. Events the pipeline gives up on are never remembered.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from .dispatch import partition_key
+from .events import WebhookEvent
+from .retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[list[WebhookEvent]], Awaitable[None]]
+# A buffered event and the future returned for it.
+_Entry = tuple[WebhookEvent, "asyncio.Future[None]"]
+
+
+@dataclass
+class SinkStats:
+    received: int = 0
+    emitted: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    superseded: int = 0
+
+
+class CoalescingSink:
+    """Last-write-wins per key over ``window`` seconds.
+
+    Events for one key must reach the sink in order, which the key-partitioned
+    dispatcher guarantees when the sink uses the same key function. A batch is
+    flushed ``window`` seconds after its first event, or as soon as it holds
+    ``max_keys`` distinct keys. Flushes run one at a time, in order.
+    Pass the pipeline's ``retry_policy`` when it retries failed events;
+    each failed event it will retry is remembered until the retry arrives.
+    """
+
+    def __init__(
+        self,
+        downstream: BatchHandler,
+        *,
+        window: float = 0.25,
+        max_keys: int = 5_000,
+        key_func: Callable[[WebhookEvent], str] = partition_key,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        if window < 0 or max_keys < 1:
+            raise ValueError("window must be >= 0 and max_keys >= 1")
+        self.downstream = downstream
+        self.window = window
+        self.max_keys = max_keys
+        self.key_func = key_func
+        self.retry_policy = retry_policy
+        self.stats = SinkStats()
+        self._buffer: dict[str, _Entry] = {}
+        # Key -> failed events whose retry is still to come, by id(), each
+        # with whether a newer event for the key has arrived since.
+        self._failed: dict[str, dict[int, tuple[WebhookEvent, bool]]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._lock = asyncio.Lock()
+        self._flushes: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def __call__(self, event: WebhookEvent) -> asyncio.Future[None]:
+        key = self.key_func(event)
+        if key not in self._buffer and len(self._buffer) >= self.max_keys:
+            await self.flush()
+        loop = asyncio.get_running_loop()
+        done: asyncio.Future[None] = loop.create_future()
+        self.stats.received += 1
+        if self._stale(key, event):
+            self.stats.superseded += 1
+            done.set_result(None)
+            return done
+        if not self._buffer:
+            self._timer = loop.call_later(self.window, self._flush_soon)
+        previous = self._buffer.get(key)
+        if previous is not None:
+            self.stats.superseded += 1
+            _resolve(previous[1])
+        # Re-inserting keeps the key's first position: batches stay in
+        # first-seen order while the value is the latest event.
+        self._buffer[key] = event, done
+        if len(self._buffer) >= self.max_keys:
+            self._flush_soon()
+        return done
+
+    async def flush(self) -> None:
+        """Emit the current batch now and wait until it has been written."""
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._buffer = self._buffer, {}
+            if not batch:
+                return
+            events = [event for event, _ in batch.values()]
+            try:
+                await self.downstream(events)
+            except Exception as exc:
+                self.stats.failed_batches += 1
+                logger.exception("coalesced batch of %d events failed", len(events))
+                for key, (event, done) in batch.items():
+                    if key in self._buffer:
+                        # A newer event for the key arrived during the write.
+                        self.stats.superseded += 1
+                        _resolve(done)
+                    else:
+                        self._remember(key, event)
+                        if not done.done():
+                            done.set_exception(exc)
+            else:
+                self.stats.batches += 1
+                self.stats.emitted += len(events)
+                for _, done in batch.values():
+                    _resolve(done)
+
+    async def close(self) -> None:
+        """Flush whatever is buffered and wait for in-flight flushes."""
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _remember(self, key: str, event: WebhookEvent) -> None:
+        policy = self.retry_policy
+        # The pipeline counts this failure only once the future fails.
+        if policy is not None and policy.will_retry(event.attempts + 1):
+            self._failed.setdefault(key, {})[id(event)] = event, False
+
+    def _stale(self, key: str, event: WebhookEvent) -> bool:
+        """Whether ``event`` is a retry that must not be written any more."""
+        pending = self._failed.get(key)
+        if pending is None:
+            return False
+        entry = pending.pop(id(event), None)
+        if entry is not None:
+            stale = entry[1]
+        else:
+            # Not a retry: a newer event, which supersedes every failed one.
+            for ident, (failed, _) in pending.items():
+                pending[ident] = failed, True
+            stale = False
+        if not pending:
+            del self._failed[key]
+        return stale
+
+    def _flush_soon(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+
+def _resolve(done: asyncio.Future[None]) -> None:
+    if not done.done():
+        done.set_result(None)
@@ -0,0 +1,231 @@
+"""Pre-fork supervisor running one receiver process per core.
+
+One asyncio process is bound to a single core by the GIL. The supervisor
+forks ``workers`` copies of the receiver, each with its own event loop and
+its own listening socket bound to the same address with ``SO_REUSEPORT``, so
+the kernel spreads incoming connections across them without an external
+load balancer.
+
+Before forking, the supervisor binds (but does not listen on) a socket of
+its own to the address. That reserves the port and resolves port 0 to a
+concrete port, which the workers then all bind to. Only listening sockets
+receive connections, so the placeholder never takes traffic.
+
+Every worker is identified by its slot number, ``0`` to ``workers - 1``. A
+worker that exits is forked again in the same slot, so per-slot state such
+as a write-ahead log directory is picked up by its replacement. Workers that
+die soon after starting are restarted with exponential backoff, so a
+crashing handler does not turn into a fork loop. ``SIGTERM``, ``SIGINT`` and
+``SIGHUP`` are forwarded to the workers, which shut down gracefully. The
+supervisor exits once they are all gone.
+"""
+
+from __future__ import annotations
+
+import errno
+import logging
+import os
+import select
+import signal
+import socket
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# A worker that lived at least this long is considered healthy; its next
+# restart starts again from the minimum delay.
+STABLE_AFTER = 10.0
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+
+@dataclass
+class WorkerSlot:
+    index: int
+    pid: int = 0
+    started_at: float = 0.0
+    restarts: int = 0
+    restart_delay: float = 0.0
+    restart_at: float = 0.0
+
+
+class Supervisor:
+    """Forks ``workers`` processes that each call ``target(slot)`` and restarts them.
+
+    ``target`` runs in the child and returns its exit status. It is called
+    with the slot number and must create its event loop itself; the parent
+    never runs one, so nothing asyncio-related is inherited across the fork.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int], int],
+        workers: int,
+        *,
+        min_restart_delay: float = 0.5,
+        max_restart_delay: float = 30.0,
+        shutdown_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        self.target = target
+        self.slots = [WorkerSlot(i) for i in range(workers)]
+        self.min_restart_delay = min_restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self._clock = clock
+        self._stopping = 0.0
+        self._wakeup_r = self._wakeup_w = -1
+
+    def run(self) -> int:
+        """Start the workers and supervise them until told to stop."""
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        previous_fd = signal.set_wakeup_fd(self._wakeup_w)
+        previous = {sig: signal.signal(sig, self._on_stop) for sig in STOP_SIGNALS}
+        previous[signal.SIGCHLD] = signal.signal(signal.SIGCHLD, _ignore)
+        try:
+            for slot in self.slots:
+                self._spawn(slot)
+            while any(slot.pid for slot in self.slots) or not self._stopping:
+                self._wait(self._next_deadline())
+                self._reap()
+                if self._stopping:
+                    if self._clock() - self._stopping > self.shutdown_timeout:
+                        self._signal_all(signal.SIGKILL)
+                    continue
+                now = self._clock()
+                for slot in self.slots:
+                    if not slot.pid and slot.restart_at <= now:
+                        self._spawn(slot)
+        finally:
+            signal.set_wakeup_fd(previous_fd)
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+        logger.info("all workers stopped")
+        return 0
+
+    def _on_stop(self, signum: int, frame: object) -> None:
+        if not self._stopping:
+            logger.info("received %s, stopping workers", signal.Signals(signum).name)
+            self._stopping = self._clock()
+            self._signal_all(signal.SIGTERM)
+
+    def _signal_all(self, signum: int) -> None:
+        for slot in self.slots:
+            if slot.pid:
+                try:
+                    os.kill(slot.pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def _spawn(self, slot: WorkerSlot) -> None:
+        pid = os.fork()
+        if pid == 0:
+            os._exit(self._child(slot.index))
+        slot.pid = pid
+        slot.started_at = self._clock()
+        logger.info("started worker %d (pid %d)", slot.index, pid)
+
+    def _child(self, index: int) -> int:
+        status = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            for sig in (*STOP_SIGNALS, signal.SIGCHLD):
+                signal.signal(sig, signal.SIG_DFL)
+            # The supervisor forwards Ctrl-C as SIGTERM; don't act on it twice.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            status = self.target(index)
+        except BaseException:
+            logger.exception("worker %d crashed", index)
+        finally:
+            logging.shutdown()
+        return status
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for slot in self.slots:
+                if slot.pid == pid:
+                    self._exited(slot, status)
+                    break
+
+    def _exited(self, slot: WorkerSlot, status: int) -> None:
+        slot.pid = 0
+        code = os.waitstatus_to_exitcode(status)
+        if self._stopping:
+            logger.info("worker %d exited with status %d", slot.index, code)
+            return
+        now = self._clock()
+        if now - slot.started_at >= STABLE_AFTER:
+            slot.restart_delay = self.min_restart_delay
+        else:
+            slot.restart_delay = min(
+                self.max_restart_delay, max(self.min_restart_delay, slot.restart_delay * 2)
+            )
+        slot.restart_at = now + slot.restart_delay
+        slot.restarts += 1
+        logger.warning(
+            "worker %d exited with status %d, restarting in %.1fs",
+            slot.index,
+            code,
+            slot.restart_delay,
+        )
+
+    def _next_deadline(self) -> float | None:
+        if self._stopping:
+            return 1.0
+        pending = [slot.restart_at for slot in self.slots if not slot.pid]
+        if not pending:
+            return None
+        return max(0.0, min(pending) - self._clock())
+
+    def _wait(self, timeout: float | None) -> None:
+        # Signal handlers write to the wakeup pipe, so SIGCHLD ends the wait.
+        try:
+            select.select([self._wakeup_r], [], [], timeout)
+        except InterruptedError:
+            pass
+        try:
+            while os.read(self._wakeup_r, 512):
+                pass
+        except OSError as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+
+def reserve_port(host: str, port: int) -> socket.socket:
+    """Bind a non-listening ``SO_REUSEPORT`` socket to hold ``host:port`` for the workers.
+
+    Keep the returned socket open while workers run; ``getsockname()``
+    gives the port actually bound when ``port`` is 0.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("multiple workers need SO_REUSEPORT, which this platform lacks")
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)
+    family, kind, proto, _, address = infos[0]
+    sock = socket.socket(family, kind, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _ignore(signum: int, frame: object) -> None:
+    pass
@@ -0,0 +1,234 @@
+"""Sampled per-event tracing.
+
+A :class:`Tracer` picks a sample of deliveries as they arrive and follows
+each one through the pipeline, recording a span per stage it passes:
+``receive`` (until the ack), ``verify``, ``persist``, ``dispatch`` (the queue
+wait) and one ``handle`` span per handler attempt, all children of a root
+``webhook`` span that lasts until the event is handled, fails for good or is
+quarantined or dropped. Handlers add spans of their own with :func:`span`.
+A finished trace is passed to an exporter as a list of plain dicts.
+
+Events that are not sampled carry no trace, and every hook in the pipeline
+checks for one before reading the clock, so an unsampled event costs one
+random number and a pipeline without a tracer only a None check per stage.
+:func:`span` returns a shared do-nothing context manager for unsampled
+events.
+
+Sampling happens up front, before anything is known about the event.
+``sampler`` forces particular events into the sample, e.g. the orders of one
+seller being investigated, and ``min_duration`` keeps only sampled traces
+that took at least that long, so a modest sample rate still catches the
+slow ones without exporting every fast trace.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import random
+import socket
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Iterator, Protocol
+
+if TYPE_CHECKING:
+    from .events import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+Span = dict[str, Any]
+_NO_SPAN: ContextManager[None] = contextlib.nullcontext()
+
+
+class Exporter(Protocol):
+    def export(self, spans: list[Span]) -> None:
+        """Send the spans of one finished trace."""
+
+    def close(self) -> None:
+        ...
+
+
+class JSONLinesExporter:
+    """Appends spans to ``path``, one JSON object per line.
+
+    Each trace is written with a single ``write`` to a file opened for
+    appending, so worker processes can share one file.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def export(self, spans: list[Span]) -> None:
+        data = "".join(json.dumps(span, separators=(",", ":")) + "\n" for span in spans)
+        try:
+            os.write(self._fd, data.encode())
+        except OSError as exc:
+            logger.warning("could not write trace to %s: %s", self.path, exc)
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class UDPExporter:
+    """Sends each trace as one JSON array datagram to a collector at ``host:port``.
+
+    Sending never blocks; traces that cannot be sent are counted in
+    ``dropped``.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.address = (host, port)
+        self.dropped = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def export(self, spans: list[Span]) -> None:
+        try:
+            self._sock.sendto(json.dumps(spans, separators=(",", ":")).encode(), self.address)
+        except OSError:
+            self.dropped += 1
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+class Tracer:
+    """Samples events for tracing and exports their finished traces.
+
+    Each arriving event is traced if ``sampler`` returns True for it or,
+    failing that, with probability ``sample_rate``. Finished traces whose
+    root span is shorter than ``min_duration`` seconds are discarded.
+    """
+
+    def __init__(
+        self,
+        exporter: Exporter,
+        *,
+        sample_rate: float = 0.01,
+        sampler: Callable[[WebhookEvent], bool] | None = None,
+        min_duration: float = 0.0,
+    ) -> None:
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.sampler = sampler
+        self.min_duration = min_duration
+        self.exported = 0
+        self._random = random.random
+        # Spans are timed with perf_counter and exported as Unix times.
+        self._wall_offset = time.time() - time.perf_counter()
+
+    def start(self, event: WebhookEvent, started: float) -> Trace | None:
+        """Return a trace for ``event`` if it is sampled, starting at ``started``."""
+        sampler = self.sampler
+        if (sampler is None or not sampler(event)) and self._random() >= self.sample_rate:
+            return None
+        return Trace(self, event, started)
+
+    def close(self) -> None:
+        self.exporter.close()
+
+    def _export(self, trace: Trace) -> None:
+        if trace.root["duration"] < self.min_duration:
+            return
+        offset = self._wall_offset
+        for item in trace.spans:
+            item["start"] += offset
+        try:
+            self.exporter.export(trace.spans)
+        except Exception:
+            logger.exception("trace exporter failed")
+            return
+        self.exported += 1
+
+
+class Trace:
+    """The spans recorded so far for one event.
+
+    The trace is exported once the event's ack has been sent and its
+    outcome is known, whichever happens last.
+    """
+
+    __slots__ = ("tracer", "trace_id", "root", "spans", "_pending")
+
+    def __init__(self, tracer: Tracer, event: WebhookEvent, started: float) -> None:
+        self.tracer = tracer
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.root: Span = {
+            "trace_id": self.trace_id,
+            "span_id": f"{random.getrandbits(64):016x}",
+            "parent_id": None,
+            "name": "webhook",
+            "start": started,
+            "duration": 0.0,
+            "attributes": {
+                "event_id": event.event_id,
+                "event_type": event.event_type,
+                "seller_id": event.seller_id,
+            },
+        }
+        self.spans = [self.root]
+        # Ack and outcome still to come.
+        self._pending = 2
+
+    def add(self, name: str, start: float, end: float, **attributes: Any) -> None:
+        """Record a child span of the root from ``perf_counter`` times."""
+        self.spans.append(
+            {
+                "trace_id": self.trace_id,
+                "span_id": f"{random.getrandbits(64):016x}",
+                "parent_id": self.root["span_id"],
+                "name": name,
+                "start": start,
+                "duration": end - start,
+                "attributes": attributes,
+            }
+        )
+
+    def acked(self, status: int) -> None:
+        self.root["attributes"]["status"] = status
+        self._release()
+
+    def close(self, outcome: str) -> None:
+        """Record how the event ended."""
+        self.root["attributes"]["outcome"] = outcome
+        self._release()
+
+    def _release(self) -> None:
+        self._pending -= 1
+        if self._pending == 0:
+            root = self.root
+            root["duration"] = time.perf_counter() - root["start"]
+            self.tracer._export(self)
+
+
+def span(event: WebhookEvent, name: str, **attributes: Any) -> ContextManager[None]:
+    """Time a block of handler code as a span of ``event``'s trace, if it has one.
+
+    ::
+
+        with span(event, "erp.push", order_id=order.order_id):
+            await erp.push(order)
+    """
+    trace = event.trace
+    if trace is None:
+        return _NO_SPAN
+    return _span(trace, name, attributes)
+
+
+@contextlib.contextmanager
+def _span(trace: Trace, name: str, attributes: dict[str, Any]) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as exc:
+        attributes["error"] = type(exc).__name__
+        raise
+    finally:
+        trace.add(name, start, time.perf_counter(), **attributes)
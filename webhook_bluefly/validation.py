@@ -0,0 +1,419 @@
+"""Compiled payload validation and the quarantine for malformed events.
+
+Payload schemas are written in a small subset of JSON Schema (``type``,
+``required``, ``properties``, ``additionalProperties``, ``items``, ``enum``,
+``minimum``/``maximum``, ``minLength``/``maxLength`` and
+``minItems``/``maxItems``) and keyed by event type and schema version::
+
+    validators = Validators()
+    validators.register("order.created", 2, ORDER_CREATED_V2)
+
+Interpreting a schema per event walks dicts of keywords for every field.
+Instead :func:`compile_schema` turns each schema into the source of one
+straight-line Python function (``type(v) is str`` checks, direct ``dict.get``
+lookups, a plain loop per array) and :class:`Validators` compiles each
+``(event type, version)`` pair the first time it is seen. Later events of the
+same kind cost one dict lookup plus the generated checks.
+
+The version comes from the envelope's ``schema_version`` member and defaults
+to 1. A schema registered for ``"<topic>.*"`` covers every event type of the
+topic without one of its own.
+
+:class:`~.pipeline.Pipeline` validates each event in its dispatcher worker,
+after the ack and before the handler, and moves events that fail into a
+:class:`Quarantine` instead of handing them on.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Iterator, Mapping
+
+from .errors import ValidationError
+from .events import TOPIC_INVENTORY, TOPIC_ORDER, TOPIC_PRODUCT, WebhookEvent, topic_of
+
+logger = logging.getLogger(__name__)
+
+Schema = Mapping[str, Any]
+Validator = Callable[[Any], None]
+
+# Compiled validators kept per Validators instance; event types come from the
+# network, so the cache is reset rather than allowed to grow without bound.
+MAX_CACHED = 1024
+
+_MISSING = object()
+
+_TYPE_CHECKS = {
+    "object": "type({v}) is dict",
+    "array": "type({v}) is list",
+    "string": "type({v}) is str",
+    "integer": "type({v}) is int",
+    "number": "(type({v}) is int or type({v}) is float)",
+    "boolean": "type({v}) is bool",
+    "null": "{v} is None",
+}
+
+
+def _invalid(path: tuple[Any, ...], message: str) -> ValidationError:
+    text = ""
+    for part in path:
+        text += f"[{part}]" if isinstance(part, int) else (f".{part}" if text else part)
+    return ValidationError(message, text)
+
+
+class _Compiler:
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+        self.namespace: dict[str, Any] = {"_MISSING": _MISSING, "_invalid": _invalid}
+        self._names = 0
+
+    def name(self, prefix: str) -> str:
+        self._names += 1
+        return f"{prefix}{self._names}"
+
+    def const(self, value: Any) -> str:
+        name = self.name("c")
+        self.namespace[name] = value
+        return name
+
+    def emit(self, depth: int, line: str) -> None:
+        self.lines.append("    " * depth + line)
+
+    def fail(self, depth: int, path: list[str], message: str) -> None:
+        parts = "".join(f"{part}, " for part in path)
+        self.emit(depth, f"raise _invalid(({parts}), {message!r})")
+
+    def block(self, depth: int, header: str, body: Callable[[int], None]) -> None:
+        """Emit ``header`` and its body, or nothing if the body is empty."""
+        start = len(self.lines)
+        self.emit(depth, header)
+        body(depth + 1)
+        if len(self.lines) == start + 1:
+            del self.lines[start]
+
+    def node(self, schema: Schema, var: str, path: list[str], depth: int) -> None:
+        types = schema.get("type")
+        if isinstance(types, str):
+            types = [types]
+        if types:
+            unknown = set(types) - _TYPE_CHECKS.keys()
+            if unknown:
+                raise ValueError(f"unsupported schema type(s) {sorted(unknown)}")
+            check = " or ".join(_TYPE_CHECKS[kind].format(v=var) for kind in types)
+            self.emit(depth, f"if not ({check}):")
+            self.fail(depth + 1, path, f"expected {' or '.join(types)}")
+        if "enum" in schema:
+            allowed = self.const(tuple(schema["enum"]))
+            self.emit(depth, f"if {var} not in {allowed}:")
+            self.fail(depth + 1, path, f"must be one of {list(schema['enum'])}")
+        self._numeric(schema, var, path, depth, types)
+        self._string(schema, var, path, depth, types)
+        self._object(schema, var, path, depth, types)
+        self._array(schema, var, path, depth, types)
+
+    def _guarded(
+        self, depth: int, var: str, kind: str, types: list[str] | None, body: Callable[[int], None]
+    ) -> None:
+        # Skip the isinstance guard when the type check above already ensured it.
+        if types == [kind]:
+            body(depth)
+        else:
+            self.block(depth, f"if {_TYPE_CHECKS[kind].format(v=var)}:", body)
+
+    def _numeric(self, schema: Schema, var: str, path: list[str], depth, types) -> None:
+        bounds = [(key, schema[key]) for key in ("minimum", "maximum") if key in schema]
+        if not bounds:
+            return
+
+        def body(depth: int) -> None:
+            for key, bound in bounds:
+                op = "<" if key == "minimum" else ">"
+                self.emit(depth, f"if {var} {op} {bound!r}:")
+                self.fail(depth + 1, path, f"must be {'>=' if op == '<' else '<='} {bound}")
+
+        kind = "integer" if types == ["integer"] else "number"
+        self._guarded(depth, var, kind, types, body)
+
+    def _string(self, schema: Schema, var: str, path: list[str], depth, types) -> None:
+        self._lengths(schema, var, path, depth, types, "string", "minLength", "maxLength")
+
+    def _lengths(self, schema, var, path, depth, types, kind, low_key, high_key) -> None:
+        low, high = schema.get(low_key), schema.get(high_key)
+        if low is None and high is None:
+            return
+
+        def body(depth: int) -> None:
+            if low is not None:
+                self.emit(depth, f"if len({var}) < {int(low)}:")
+                self.fail(depth + 1, path, f"must have at least {low} {_unit(kind)}")
+            if high is not None:
+                self.emit(depth, f"if len({var}) > {int(high)}:")
+                self.fail(depth + 1, path, f"must have at most {high} {_unit(kind)}")
+
+        self._guarded(depth, var, kind, types, body)
+
+    def _object(self, schema: Schema, var: str, path: list[str], depth, types) -> None:
+        properties: Mapping[str, Schema] = schema.get("properties", {})
+        required = list(schema.get("required", ()))
+        closed = schema.get("additionalProperties", True) is False
+        if not (properties or required or closed):
+            return
+
+        def body(depth: int) -> None:
+            for key in required:
+                self.emit(depth, f"if {key!r} not in {var}:")
+                self.fail(depth + 1, path + [repr(key)], "is required")
+            for key, subschema in properties.items():
+                member, member_path = self.name("v"), path + [repr(key)]
+                if key in required:
+                    self.emit(depth, f"{member} = {var}[{key!r}]")
+                    self.node(subschema, member, member_path, depth)
+                    continue
+                self.emit(depth, f"{member} = {var}.get({key!r}, _MISSING)")
+                self.block(
+                    depth,
+                    f"if {member} is not _MISSING:",
+                    partial(self.node, subschema, member, member_path),
+                )
+            if closed:
+                known = self.const(frozenset(properties))
+                key_var = self.name("k")
+                self.emit(depth, f"for {key_var} in {var}:")
+                self.emit(depth + 1, f"if {key_var} not in {known}:")
+                self.fail(depth + 2, path + [key_var], "is not allowed")
+
+        self._guarded(depth, var, "object", types, body)
+
+    def _array(self, schema: Schema, var: str, path: list[str], depth, types) -> None:
+        items = schema.get("items")
+        self._lengths(schema, var, path, depth, types, "array", "minItems", "maxItems")
+        if not items:
+            return
+
+        def body(depth: int) -> None:
+            index, item = self.name("i"), self.name("v")
+            self.block(
+                depth,
+                f"for {index}, {item} in enumerate({var}):",
+                partial(self.node, items, item, path + [index]),
+            )
+
+        self._guarded(depth, var, "array", types, body)
+
+
+def _unit(kind: str) -> str:
+    return "characters" if kind == "string" else "items"
+
+
+def compile_schema(schema: Schema, name: str = "validate") -> Validator:
+    """Compile ``schema`` into a function that raises :class:`ValidationError`."""
+    compiler = _Compiler()
+    compiler.node(schema, "v0", [], 1)
+    source = "\n".join([f"def {name}(v0):", *compiler.lines, "    return None"])
+    code = compile(source, f"<schema {name}>", "exec")
+    exec(code, compiler.namespace)
+    validate = compiler.namespace[name]
+    validate.source = source
+    return validate
+
+
+_ORDER_LINE: Schema = {
+    "type": "object",
+    "required": ["sku", "quantity", "unit_price"],
+    "properties": {
+        "sku": {"type": "string", "minLength": 1},
+        "quantity": {"type": "integer", "minimum": 1},
+        "unit_price": {"type": "number", "minimum": 0},
+        "currency": {"type": "string", "minLength": 3, "maxLength": 3},
+    },
+}
+
+_ADDRESS: Schema = {
+    "type": "object",
+    "required": ["line1", "city", "country"],
+    "properties": {
+        key: {"type": ["string", "null"]}
+        for key in ("name", "line1", "line2", "city", "region", "postal_code", "country")
+    },
+}
+
+DEFAULT_SCHEMAS: dict[tuple[str, int], Schema] = {
+    ("order.created", 1): {
+        "type": "object",
+        "required": ["order_id", "status", "lines", "total"],
+        "properties": {
+            "order_id": {"type": "string", "minLength": 1},
+            "status": {"type": "string"},
+            "sequence": {"type": "integer", "minimum": 0},
+            "lines": {"type": "array", "minItems": 1, "items": _ORDER_LINE},
+            "shipping_address": _ADDRESS,
+            "total": {"type": "number", "minimum": 0},
+            "currency": {"type": "string", "minLength": 3, "maxLength": 3},
+        },
+    },
+    (f"{TOPIC_ORDER}.*", 1): {
+        "type": "object",
+        "required": ["order_id", "status"],
+        "properties": {
+            "order_id": {"type": "string", "minLength": 1},
+            "status": {"type": "string"},
+            "sequence": {"type": "integer", "minimum": 0},
+            "tracking_number": {"type": ["string", "null"]},
+        },
+    },
+    (f"{TOPIC_INVENTORY}.*", 1): {
+        "type": "object",
+        "required": ["sku", "quantity"],
+        "properties": {
+            "sku": {"type": "string", "minLength": 1},
+            "quantity": {"type": "integer", "minimum": 0},
+            "warehouse": {"type": "string"},
+            "price": {"type": "number", "minimum": 0},
+            "version": {"type": "integer"},
+        },
+    },
+    (f"{TOPIC_PRODUCT}.*", 1): {
+        "type": "object",
+        "required": ["sku"],
+        "properties": {
+            "sku": {"type": "string", "minLength": 1},
+            "product_id": {"type": "string"},
+            "title": {"type": "string"},
+            "brand": {"type": "string"},
+            "description": {"type": "string"},
+            "attributes": {"type": "object"},
+            "images": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "required": ["url"],
+                    "properties": {
+                        "url": {"type": "string", "minLength": 1},
+                        "width": {"type": "integer", "minimum": 0},
+                        "height": {"type": "integer", "minimum": 0},
+                    },
+                },
+            },
+        },
+    },
+}
+
+
+class Validators:
+    """Schemas by ``(event type, version)``, compiled on first use.
+
+    With ``strict`` (the default) an event with no matching schema fails
+    validation, so a new Bluefly schema version is quarantined rather than
+    handed to code written against the old one.
+    """
+
+    def __init__(
+        self, schemas: Mapping[tuple[str, int], Schema] | None = None, *, strict: bool = True
+    ) -> None:
+        self.strict = strict
+        self.compilations = 0
+        self._schemas = dict(DEFAULT_SCHEMAS if schemas is None else schemas)
+        self._compiled: dict[tuple[str, int], Validator | None] = {}
+
+    def register(self, event_type: str, version: int, schema: Schema) -> None:
+        """Add or replace the schema for ``event_type`` (or ``"<topic>.*"``)."""
+        compile_schema(schema)  # fail here rather than on the first event
+        self._schemas[(event_type, version)] = schema
+        self._compiled.clear()
+
+    def get(self, event_type: str, version: int = 1) -> Validator | None:
+        """Return the compiled validator for an event type and version, if any."""
+        key = (event_type, version)
+        try:
+            return self._compiled[key]
+        except KeyError:
+            pass
+        schema = self._schemas.get(key)
+        if schema is None:
+            schema = self._schemas.get((f"{topic_of(event_type)}.*", version))
+        validator = None
+        if schema is not None:
+            name = f"validate_{event_type.replace('.', '_').replace('*', 'any')}_v{version}"
+            validator = compile_schema(schema, name if name.isidentifier() else "validate")
+            self.compilations += 1
+        if len(self._compiled) >= MAX_CACHED:
+            self._compiled.clear()
+        self._compiled[key] = validator
+        return validator
+
+    def validate(self, event: WebhookEvent) -> None:
+        """Check ``event``'s ``data`` against its schema; raise :class:`ValidationError`.
+
+        The body is parsed here (and kept on the event for the handler).
+        """
+        try:
+            payload = event.payload()
+        except ValueError as exc:
+            raise ValidationError(f"body is not valid JSON: {exc}") from None
+        if type(payload) is not dict:
+            raise ValidationError("envelope must be a JSON object")
+        version = payload.get("schema_version", 1)
+        if type(version) is not int:
+            raise ValidationError("expected integer", "schema_version")
+        validator = self.get(event.event_type, version)
+        if validator is None:
+            if self.strict:
+                raise ValidationError(f"no schema for {event.event_type} version {version}")
+            return
+        validator(payload.get("data"))
+
+
+@dataclass(slots=True)
+class QuarantinedEvent:
+    event: WebhookEvent
+    reason: str
+    quarantined_at: float
+
+
+class Quarantine:
+    """Events that failed validation, kept for inspection and replay.
+
+    The most recent ``max_events`` are held in memory. With ``path``, each
+    event is also appended to that file as one JSON line, so nothing is lost
+    when the write-ahead log checkpoint moves past it.
+    """
+
+    def __init__(self, path: str | Path | None = None, *, max_events: int = 10_000) -> None:
+        self.path = Path(path) if path is not None else None
+        self.total = 0
+        self._events: deque[QuarantinedEvent] = deque(maxlen=max_events)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def __iter__(self) -> Iterator[QuarantinedEvent]:
+        return iter(self._events)
+
+    def add(self, event: WebhookEvent, reason: str) -> None:
+        entry = QuarantinedEvent(event, reason, time.time())
+        self._events.append(entry)
+        self.total += 1
+        if self.path is not None:
+            line = json.dumps(
+                {
+                    "event_id": event.event_id,
+                    "event_type": event.event_type,
+                    "seller_id": event.seller_id,
+                    "seq": event.seq,
+                    "received_at": event.received_at,
+                    "quarantined_at": entry.quarantined_at,
+                    "reason": reason,
+                    "body": event.body.decode("utf-8", "replace"),
+                }
+            )
+            try:
+                with open(self.path, "a", encoding="utf-8") as out:
+                    out.write(line + "\n")
+            except OSError:
+                logger.exception("could not write quarantined event %s", event.event_id)
@@ -0,0 +1,562 @@
+"""Segmented, checksummed append-only write-ahead log with group commit.
+
+Accepted events are appended here before they are acknowledged, so an acked
+Bluefly delivery survives a crash. Appends made within ``commit_window``
+seconds of each other are written and fsync'ed together; each caller gets a
+future that resolves once its record is durable. One fsync per batch instead
+of per request is what makes durable acks affordable at high rates.
+
+On-disk layout: the log directory holds segment files named
+``<first seq>.wal``. Each segment starts with :data:`SEGMENT_MAGIC`, followed
+by records::
+
+    u32 payload length | u32 crc32(seq + key + payload) | u64 seq |
+    u16 key length | key | payload
+
+The key is a short caller-chosen identifier (the pipeline uses the event id).
+Sequence numbers start at 1 and increase by one per record across segments.
+Once a segment reaches ``segment_size`` bytes it is sealed by appending a
+footer index::
+
+    per record: u32 offset | u16 key length | key
+    trailer:    u64 records end | u32 count | u32 crc32(index) |
+                f64 created at | f64 sealed at | FOOTER_MAGIC
+
+Recovery reads only the footer index of sealed segments and scans the
+records of the unsealed tail segment, both through ``mmap``, so restart time
+depends on the segment size rather than on total history. A ``checkpoint``
+file records the highest seq up to which every event has been handled;
+:meth:`WriteAheadLog.replay` starts from there. :meth:`WriteAheadLog.compact`
+deletes sealed segments once they are entirely below the checkpoint and
+old enough that their keys are no longer needed.
+
+All file I/O runs on a single dedicated thread, so writes never block the
+event loop and are applied in append order.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+from .errors import WebhookBlueflyError
+from .fileutil import MappedFile, write_all
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b"BFWAL\x00\x02\x00"
+SEGMENT_SUFFIX = ".wal"
+FOOTER_MAGIC = b"BFWALIDX"
+RECORD_HEADER = struct.Struct("<IIQH")
+INDEX_ENTRY = struct.Struct("<IH")
+FOOTER_TRAILER = struct.Struct("<QIIdd8s")
+CHECKPOINT_FILE = "checkpoint"
+# Footer offsets are 32-bit.
+MAX_SEGMENT_SIZE = 1 << 31
+_SEQ = struct.Struct("<Q")
+_datasync = getattr(os, "fdatasync", os.fsync)
+
+
+class WALError(WebhookBlueflyError):
+    """The write-ahead log could not be written or is unusable."""
+
+
+@dataclass
+class SegmentIndex:
+    """Footer index of a segment: where each record starts and its key.
+
+    The seq of entry ``i`` is ``first_seq + i``.
+    """
+
+    path: Path
+    first_seq: int
+    records_end: int
+    created_at: float
+    sealed_at: float
+    offsets: list[int] = field(default_factory=list)
+    keys: list[bytes] = field(default_factory=list)
+
+    @property
+    def last_seq(self) -> int:
+        return self.first_seq + len(self.offsets) - 1
+
+
+@dataclass
+class RecoveryStats:
+    """What :meth:`WriteAheadLog.open` had to do to resume the log."""
+
+    segments: int = 0
+    tail_records: int = 0
+    tail_bytes: int = 0
+    truncated_bytes: int = 0
+    seconds: float = 0.0
+
+
+def segment_name(first_seq: int) -> str:
+    return f"{first_seq:020d}{SEGMENT_SUFFIX}"
+
+
+def record_crc(seq: int, key: bytes | memoryview, payload: bytes | memoryview) -> int:
+    return zlib.crc32(payload, zlib.crc32(key, zlib.crc32(_SEQ.pack(seq))))
+
+
+def iter_records(
+    data: bytes | memoryview | mmap.mmap,
+    offset: int = len(SEGMENT_MAGIC),
+    end: int | None = None,
+) -> Iterator[tuple[int, int, memoryview, memoryview]]:
+    """Yield ``(offset, seq, key, payload)`` for each valid record in a segment image.
+
+    Iteration stops at ``end`` or at the first truncated or corrupt record;
+    the offset of that point is what a torn segment should be truncated to.
+    The yielded views borrow ``data`` and must not outlive it.
+    """
+    view = memoryview(data)
+    if end is None:
+        end = len(view)
+    header_size = RECORD_HEADER.size
+    while offset + header_size <= end:
+        length, crc, seq, key_length = RECORD_HEADER.unpack_from(view, offset)
+        key_start = offset + header_size
+        start = key_start + key_length
+        if start + length > end:
+            return
+        key = view[key_start:start]
+        payload = view[start : start + length]
+        if record_crc(seq, key, payload) != crc:
+            return
+        yield offset, seq, key, payload
+        offset = start + length
+
+
+def read_trailer(path: Path) -> tuple[int, int, int, float, float] | None:
+    """Read ``(records end, count, index crc, created at, sealed at)`` from a segment.
+
+    Only the trailer is read; the index it describes is not checked. Returns
+    None if the segment is not sealed.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(SEGMENT_MAGIC) + FOOTER_TRAILER.size:
+            return None
+        raw = os.pread(f.fileno(), FOOTER_TRAILER.size, size - FOOTER_TRAILER.size)
+    return _unpack_trailer(raw, size - FOOTER_TRAILER.size)
+
+
+def _unpack_trailer(
+    data: bytes | memoryview | mmap.mmap, trailer_at: int, offset: int = 0
+) -> tuple[int, int, int, float, float] | None:
+    records_end, count, index_crc, created_at, sealed_at, magic = FOOTER_TRAILER.unpack_from(
+        data, offset
+    )
+    if magic != FOOTER_MAGIC or records_end > trailer_at:
+        return None
+    return records_end, count, index_crc, created_at, sealed_at
+
+
+def read_footer(data: bytes | memoryview | mmap.mmap, path: Path) -> SegmentIndex | None:
+    """Parse the footer index of a sealed segment, or return None if it has none."""
+    size = len(data)
+    if size < len(SEGMENT_MAGIC) + FOOTER_TRAILER.size:
+        return None
+    trailer_at = size - FOOTER_TRAILER.size
+    trailer = _unpack_trailer(data, trailer_at, trailer_at)
+    if trailer is None:
+        return None
+    records_end, count, index_crc, created_at, sealed_at = trailer
+    view = memoryview(data)
+    if zlib.crc32(view[records_end:trailer_at]) != index_crc:
+        return None
+    index = SegmentIndex(path, int(path.stem), records_end, created_at, sealed_at)
+    offsets = index.offsets
+    keys = index.keys
+    pos = records_end
+    entry_size = INDEX_ENTRY.size
+    for _ in range(count):
+        offset, key_length = INDEX_ENTRY.unpack_from(view, pos)
+        pos += entry_size
+        offsets.append(offset)
+        keys.append(bytes(view[pos : pos + key_length]))
+        pos += key_length
+    return index
+
+
+def _encode_footer(index: SegmentIndex) -> bytes:
+    parts = []
+    for offset, key in zip(index.offsets, index.keys):
+        parts.append(INDEX_ENTRY.pack(offset, len(key)))
+        parts.append(key)
+    entries = b"".join(parts)
+    trailer = FOOTER_TRAILER.pack(
+        index.records_end,
+        len(index.offsets),
+        zlib.crc32(entries),
+        index.created_at,
+        index.sealed_at,
+        FOOTER_MAGIC,
+    )
+    return entries + trailer
+
+
+class WriteAheadLog:
+    """Durable append-only log; see the module docstring for the format."""
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        *,
+        segment_size: int = 64 * 1024 * 1024,
+        commit_window: float = 0.002,
+        max_batch_bytes: int = 4 * 1024 * 1024,
+        fsync: bool = True,
+    ) -> None:
+        if not 0 < segment_size <= MAX_SEGMENT_SIZE:
+            raise ValueError(f"segment_size must be in (0, {MAX_SEGMENT_SIZE}]")
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.commit_window = commit_window
+        self.max_batch_bytes = max_batch_bytes
+        self.fsync = fsync
+        self.last_seq = 0
+        self.checkpoint = 0
+        self.commits = 0
+        self.recovery = RecoveryStats()
+        self._executor: ThreadPoolExecutor | None = None
+        self._failed: BaseException | None = None
+        self._fd = -1
+        self._segment_bytes = 0
+        self._index: SegmentIndex | None = None
+        self._buffer = bytearray()
+        self._batch_index: list[tuple[int, bytes]] = []
+        self._waiters: list[tuple[asyncio.Future[int], int]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._committer: asyncio.Task[None] | None = None
+        self._closing = False
+
+    async def open(self) -> None:
+        """Open the log, truncating any torn tail left by a crash."""
+        if self._committer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bluefly-wal")
+        await loop.run_in_executor(self._executor, self._open_sync)
+        self._failed = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._committer = asyncio.create_task(self._commit_loop(), name="bluefly-wal-commit")
+
+    async def close(self) -> None:
+        """Commit everything appended so far and close the log."""
+        if self._committer is None:
+            return
+        self._closing = True
+        assert self._wakeup is not None
+        self._wakeup.set()
+        await self._committer
+        self._committer = None
+        loop = asyncio.get_running_loop()
+        assert self._executor is not None
+        await loop.run_in_executor(self._executor, self._close_sync)
+        self._executor.shutdown()
+        self._executor = None
+
+    def segments(self) -> list[Path]:
+        """Segment files in sequence order."""
+        return sorted(self.directory.glob("*" + SEGMENT_SUFFIX))
+
+    def append(self, payload: bytes, key: bytes = b"") -> asyncio.Future[int]:
+        """Append a record; the returned future resolves to its seq once durable."""
+        if self._committer is None or self._closing:
+            raise WALError("write-ahead log is not open")
+        if self._failed is not None:
+            raise WALError(f"write-ahead log failed earlier: {self._failed}")
+        self.last_seq += 1
+        seq = self.last_seq
+        buffer = self._buffer
+        self._batch_index.append((len(buffer), key))
+        buffer += RECORD_HEADER.pack(len(payload), record_crc(seq, key, payload), seq, len(key))
+        buffer += key
+        buffer += payload
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, seq))
+        assert self._wakeup is not None
+        self._wakeup.set()
+        return waiter
+
+    async def save_checkpoint(self, seq: int) -> None:
+        """Durably record that every event up to ``seq`` has been handled."""
+        if seq <= self.checkpoint:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._save_checkpoint_sync, seq)
+        self.checkpoint = seq
+
+    async def compact(self, before_seq: int, sealed_before: float) -> int:
+        """Delete sealed segments no longer needed; return how many were deleted.
+
+        A segment is deleted once all of its records are at or below both
+        ``before_seq`` and the checkpoint, and it was sealed before the
+        wall-clock time ``sealed_before``, so :meth:`recent_keys` no longer
+        reports its keys. Segments are deleted oldest first, only reading
+        their trailers.
+        """
+        if self._executor is None:
+            raise WALError("write-ahead log is not open")
+        floor = min(before_seq, self.checkpoint)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._compact_sync, floor, sealed_before)
+
+    def recent_keys(self, since: float) -> Iterator[bytes]:
+        """Keys of records in segments still written to at or after ``since``.
+
+        ``since`` is a wall-clock time. Segments are sealed in time order, so
+        sealed segments are checked newest first by their trailer alone, and
+        only the footer indexes of those sealed at or after ``since`` are
+        read; the cost follows the number of recent segments, not the length
+        of the log. Keys are yielded oldest first. Call before appending.
+        """
+        recent = []
+        for path in reversed(self.segments()):
+            if self._index is not None and path == self._index.path:
+                continue
+            trailer = read_trailer(path)
+            if trailer is None:
+                logger.warning("%s has no footer index; skipping its keys", path)
+                continue
+            if trailer[4] < since:
+                break
+            recent.append(path)
+        for path in reversed(recent):
+            with MappedFile(path) as data:
+                index = read_footer(data, path)
+            if index is None:
+                logger.warning("%s has a corrupt footer index; skipping its keys", path)
+            else:
+                yield from index.keys
+        if self._index is not None:
+            yield from self._index.keys
+
+    def replay(self, after_seq: int = 0) -> Iterator[tuple[int, bytes]]:
+        """Yield ``(seq, payload)`` for every durable record after ``after_seq``.
+
+        Segments that end at or before ``after_seq`` are skipped by name.
+        Call before appending.
+        """
+        paths = self.segments()
+        for i, path in enumerate(paths):
+            if i + 1 < len(paths) and int(paths[i + 1].stem) <= after_seq + 1:
+                continue
+            with MappedFile(path) as data:
+                index = read_footer(data, path)
+                end = index.records_end if index is not None else None
+                for _offset, seq, _key, payload in iter_records(data, end=end):
+                    if seq > after_seq:
+                        yield seq, bytes(payload)
+
+    async def _commit_loop(self) -> None:
+        assert self._wakeup is not None
+        loop = asyncio.get_running_loop()
+        wakeup = self._wakeup
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            if not self._buffer:
+                if self._closing:
+                    return
+                continue
+            if (
+                self.commit_window > 0
+                and len(self._buffer) < self.max_batch_bytes
+                and not self._closing
+            ):
+                # Let concurrent requests join this batch.
+                await asyncio.sleep(self.commit_window)
+            batch = bytes(self._buffer)
+            batch_index = self._batch_index
+            waiters = self._waiters
+            first_seq = waiters[0][1]
+            self._buffer = bytearray()
+            self._batch_index = []
+            self._waiters = []
+            try:
+                await loop.run_in_executor(
+                    self._executor, self._write_sync, batch, batch_index, first_seq
+                )
+            except Exception as exc:
+                # The segment may now end in a partial write; appending after
+                # it would hide later records from recovery, so stop here.
+                logger.exception("write-ahead log commit failed")
+                self._failed = exc
+                error = WALError(f"commit failed: {exc}")
+                # Records appended while this batch was being written fail too.
+                for waiter, _seq in waiters + self._waiters:
+                    if not waiter.done():
+                        waiter.set_exception(error)
+                self._buffer = bytearray()
+                self._batch_index = []
+                self._waiters = []
+            else:
+                self.commits += 1
+                for waiter, seq in waiters:
+                    if not waiter.done():
+                        waiter.set_result(seq)
+            if self._buffer or self._closing:
+                wakeup.set()
+
+    # -- executor-side helpers; only ever run on the WAL thread --
+
+    def _open_sync(self) -> None:
+        started = time.perf_counter()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.checkpoint = self._load_checkpoint()
+        segments = self.segments()
+        self.recovery = RecoveryStats(segments=len(segments))
+        if not segments:
+            self._start_segment(1)
+        else:
+            self._resume_segment(segments[-1])
+        self.recovery.seconds = time.perf_counter() - started
+        logger.info(
+            "write-ahead log at seq %d, checkpoint %d; scanned %d tail records in %.3fs",
+            self.last_seq,
+            self.checkpoint,
+            self.recovery.tail_records,
+            self.recovery.seconds,
+        )
+
+    def _resume_segment(self, path: Path) -> None:
+        first_seq = int(path.stem)
+        with MappedFile(path) as data:
+            if len(data) < len(SEGMENT_MAGIC):
+                # Crashed while creating the segment; nothing was acked in it.
+                path.unlink()
+                self._start_segment(first_seq)
+                return
+            if data[: len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+                raise WALError(f"{path} is not a write-ahead log segment")
+            sealed = read_footer(data, path)
+            if sealed is not None:
+                self.last_seq = sealed.last_seq
+                self._start_segment(self.last_seq + 1)
+                return
+            index = SegmentIndex(path, first_seq, 0, os.stat(path).st_mtime, 0.0)
+            end = len(SEGMENT_MAGIC)
+            for offset, _seq, key, payload in iter_records(data):
+                index.offsets.append(offset)
+                index.keys.append(bytes(key))
+                end = offset + RECORD_HEADER.size + len(key) + len(payload)
+            size = len(data)
+        self.recovery.tail_records = len(index.offsets)
+        self.recovery.tail_bytes = end
+        self.recovery.truncated_bytes = size - end
+        if end < size:
+            logger.warning("truncating torn tail of %s at offset %d", path, end)
+        self.last_seq = index.last_seq
+        self._index = index
+        self._fd = os.open(path, os.O_WRONLY)
+        os.ftruncate(self._fd, end)
+        os.lseek(self._fd, end, os.SEEK_SET)
+        self._segment_bytes = end
+
+    def _start_segment(self, first_seq: int) -> None:
+        path = self.directory / segment_name(first_seq)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        os.write(self._fd, SEGMENT_MAGIC)
+        self._segment_bytes = len(SEGMENT_MAGIC)
+        self._index = SegmentIndex(path, first_seq, 0, time.time(), 0.0)
+        if self.fsync:
+            os.fsync(self._fd)
+            _fsync_directory(self.directory)
+
+    def _seal_segment(self) -> None:
+        index = self._index
+        assert index is not None
+        index.records_end = self._segment_bytes
+        index.sealed_at = time.time()
+        write_all(self._fd, _encode_footer(index))
+        self._close_segment()
+
+    def _close_segment(self) -> None:
+        if self.fsync:
+            os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = -1
+        self._index = None
+
+    def _write_sync(
+        self, batch: bytes, batch_index: list[tuple[int, bytes]], first_seq: int
+    ) -> None:
+        if self._segment_bytes >= self.segment_size:
+            self._seal_segment()
+            self._start_segment(first_seq)
+        index = self._index
+        assert index is not None
+        base = self._segment_bytes
+        write_all(self._fd, batch)
+        self._segment_bytes += len(batch)
+        for offset, key in batch_index:
+            index.offsets.append(base + offset)
+            index.keys.append(key)
+        if self.fsync:
+            _datasync(self._fd)
+
+    def _compact_sync(self, floor: int, sealed_before: float) -> int:
+        paths = self.segments()
+        removed = 0
+        # The newest segment is the one being written.
+        for path, following in zip(paths, paths[1:]):
+            if int(following.stem) - 1 > floor:
+                break
+            trailer = read_trailer(path)
+            if trailer is None or trailer[4] >= sealed_before:
+                break
+            path.unlink()
+            removed += 1
+        if removed:
+            logger.info("deleted %d write-ahead log segments below seq %d", removed, floor)
+            if self.fsync:
+                _fsync_directory(self.directory)
+        return removed
+
+    def _close_sync(self) -> None:
+        # The open segment is left unsealed; the next open resumes it.
+        if self._fd >= 0:
+            self._close_segment()
+
+    def _load_checkpoint(self) -> int:
+        try:
+            return int((self.directory / CHECKPOINT_FILE).read_text().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            logger.warning("ignoring unreadable write-ahead log checkpoint")
+            return 0
+
+    def _save_checkpoint_sync(self, seq: int) -> None:
+        path = self.directory / CHECKPOINT_FILE
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            f.write(f"{seq}\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        if self.fsync:
+            _fsync_directory(self.directory)
+
+
+def _fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)